@@ -84,6 +84,81 @@ def _parse_watchfolder_priority(value, default=10):
     return priority, None
 
 
+def _parse_quiet_period(value, default=10):
+    """Valida quiet period watchfolder (secondi senza modifiche prima di acquisire un file)."""
+    if value is None:
+        return default, None
+    try:
+        quiet_period = int(value)
+    except (TypeError, ValueError):
+        return None, 'quiet_period deve essere un intero'
+    if quiet_period < 1 or quiet_period > 3600:
+        return None, 'quiet_period deve essere tra 1 e 3600 secondi'
+    return quiet_period, None
+
+
+def _parse_watch_backend(value):
+    """Valida backend di monitoraggio watchfolder locale (native | polling)."""
+    from models import WATCH_BACKEND_NATIVE, WATCH_BACKENDS
+
+    backend = (value or WATCH_BACKEND_NATIVE).strip()
+    if backend not in WATCH_BACKENDS:
+        return None, 'watch_backend deve essere native o polling'
+    return backend, None
+
+
+def _parse_poll_interval(value, default=10):
+    """Valida intervallo di scansione del backend polling (secondi)."""
+    if value is None:
+        return default, None
+    try:
+        poll_interval = int(value)
+    except (TypeError, ValueError):
+        return None, 'poll_interval deve essere un intero'
+    if poll_interval < 1 or poll_interval > 3600:
+        return None, 'poll_interval deve essere tra 1 e 3600 secondi'
+    return poll_interval, None
+
+
+def _parse_rate_limit(value):
+    """Valida limite banda in Mbit/s (None/0 = illimitato)."""
+    if value in (None, ''):
+        return None, None
+    try:
+        mbps = float(value)
+    except (TypeError, ValueError):
+        return None, 'limite banda deve essere un numero (Mbit/s)'
+    if mbps < 0:
+        return None, 'limite banda non può essere negativo'
+    return mbps or None, None
+
+
+RETRY_SETTING_LIMITS = {
+    'retry_max_attempts': (1, 20),
+    'retry_backoff_sec': (1, 86400),
+}
+
+
+def _parse_retry_settings(data):
+    """Valida politica di retry (vuoto = eredita da preset/env). Ritorna (valori, errore)."""
+    values = {}
+    for key, (minimum, maximum) in RETRY_SETTING_LIMITS.items():
+        if key not in data:
+            continue
+        value = data.get(key)
+        if value in (None, ''):
+            values[key] = None
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None, f'{key} deve essere un intero'
+        if value < minimum or value > maximum:
+            return None, f'{key} deve essere tra {minimum} e {maximum}'
+        values[key] = value
+    return values, None
+
+
 def _parse_operation_mode(watch_type, operation_mode):
     """Valida modalità operativa watchfolder."""
     from models import OPERATION_MODE_TRANSCODE, OPERATION_MODE_DOWNLOAD_ONLY
@@ -91,8 +166,8 @@ def _parse_operation_mode(watch_type, operation_mode):
     mode = (operation_mode or OPERATION_MODE_TRANSCODE).strip()
     if mode not in (OPERATION_MODE_TRANSCODE, OPERATION_MODE_DOWNLOAD_ONLY):
         return None, 'operation_mode non valido'
-    if mode == OPERATION_MODE_DOWNLOAD_ONLY and watch_type != 'ftp':
-        return None, 'Solo download disponibile solo per watchfolder FTP'
+    if mode == OPERATION_MODE_DOWNLOAD_ONLY and not is_remote_watch_type(watch_type):
+        return None, 'Solo download disponibile solo per watchfolder remoti (FTP/FTPS/SFTP)'
     return mode, None
 
 
@@ -106,8 +181,12 @@ def _job_preset_label(job):
 # Import workers after DB setup
 from job_actions import pause_job, cancel_job, requeue_job, resume_job
 from watchfolder_manager import WatchFolderManager
-from ftp_utils import DEFAULT_FTP_LOCAL_TEMP, test_ftp_connection
+from ftp_utils import DEFAULT_FTP_LOCAL_TEMP, is_remote_watch_type, test_ftp_connection
+from remote_sources import default_port_for
+from ftp_index import clear_watchfolder_index
+from bandwidth import bandwidth_manager, mbps_to_bytes
 from transcoder_worker import TranscoderWorker
+import queue_policy
 
 # Global managers
 watchfolder_manager = WatchFolderManager(get_db_session)
@@ -196,6 +275,8 @@ def public_status():
                 'output_size': job.output_size,
                 'input_duration': job.input_duration,
                 'output_duration': job.output_duration,
+                'bytes_transferred': job.bytes_transferred,
+                'transfer_rate': job.transfer_rate,
                 'operation': _job_preset_label(job),
             } for job in jobs],
             'workers': [{
@@ -274,8 +355,20 @@ def public_job_details(job_id):
             'output_size': job.output_size,
             'input_duration': job.input_duration,
             'output_duration': job.output_duration,
+            'bytes_transferred': job.bytes_transferred,
+            'transfer_rate': job.transfer_rate,
             'input_mediainfo': job.input_mediainfo,
             'output_mediainfo': job.output_mediainfo,
+            'dedup_source_job_id': job.dedup_source_job_id,
+            'cpu_seconds': job.cpu_seconds,
+            'peak_rss_mb': job.peak_rss_mb,
+            'recovery_count': job.recovery_count,
+            'attempt_count': job.attempt_count,
+            'first_attempt_at': job.first_attempt_at.isoformat() if job.first_attempt_at else None,
+            'next_attempt_at': job.next_attempt_at.isoformat() if job.next_attempt_at else None,
+            'failure_class': job.failure_class,
+            'suspended': job.suspended_pid is not None,
+            'checkpoint_sec': job.checkpoint_sec,
             'preset': _job_preset_label(job),
             'operation': _job_preset_label(job),
         })
@@ -304,10 +397,18 @@ def admin_get_watchfolders():
             'ftp_username': wf.ftp_username,
             'ftp_password': wf.ftp_password if wf.ftp_password else None,  # Non mostrare password
             'ftp_remote_path': wf.ftp_remote_path,
+            'sftp_host_key': wf.sftp_host_key,
             'ftp_local_temp': wf.ftp_local_temp,
+            'ftp_rate_limit_mbps': wf.ftp_rate_limit_mbps,
             'operation_mode': wf.operation_mode or 'transcode',
             'active': wf.active,
             'priority': wf.priority if wf.priority is not None else 10,
+            'quiet_period': wf.quiet_period if wf.quiet_period is not None else 10,
+            'watch_backend': wf.watch_backend or 'native',
+            'poll_interval': wf.poll_interval if wf.poll_interval is not None else 10,
+            'recursive': bool(wf.recursive),
+            'retry_max_attempts': wf.retry_max_attempts,
+            'retry_backoff_sec': wf.retry_backoff_sec,
             'status': wf.status,
             'preset_id': wf.preset_id,
             'created_at': wf.created_at.isoformat()
@@ -328,16 +429,38 @@ def admin_create_watchfolder():
         if err:
             return jsonify({'error': err}), 400
 
+        quiet_period, err = _parse_quiet_period(data.get('quiet_period', 10))
+        if err:
+            return jsonify({'error': err}), 400
+
+        rate_limit, err = _parse_rate_limit(data.get('ftp_rate_limit_mbps'))
+        if err:
+            return jsonify({'error': err}), 400
+
+        watch_backend, err = _parse_watch_backend(data.get('watch_backend'))
+        if err:
+            return jsonify({'error': err}), 400
+
+        poll_interval, err = _parse_poll_interval(data.get('poll_interval', 10))
+        if err:
+            return jsonify({'error': err}), 400
+
+        retry_settings, err = _parse_retry_settings(data)
+        if err:
+            return jsonify({'error': err}), 400
+
         watch_type = data.get('watch_type', 'local')
         will_be_active = data.get('active', True)
 
-        if watch_type == 'ftp' and will_be_active:
+        if is_remote_watch_type(watch_type) and will_be_active:
             ok, msg = test_ftp_connection(
                 data.get('ftp_host'),
                 data.get('ftp_username'),
                 data.get('ftp_password'),
-                data.get('ftp_port', 21),
+                data.get('ftp_port', default_port_for(watch_type)),
                 data.get('ftp_remote_path', '/'),
+                watch_type=watch_type,
+                host_key=data.get('sftp_host_key'),
             )
             if not ok:
                 return jsonify({'error': msg}), 400
@@ -353,16 +476,23 @@ def admin_create_watchfolder():
             archive_path=data.get('archive_path', ''),
             watch_type=watch_type,
             ftp_host=data.get('ftp_host'),
-            ftp_port=data.get('ftp_port', 21),
+            ftp_port=data.get('ftp_port', default_port_for(watch_type)),
             ftp_username=data.get('ftp_username'),
             ftp_password=data.get('ftp_password'),
             ftp_remote_path=data.get('ftp_remote_path', '/'),
+            sftp_host_key=(data.get('sftp_host_key') or '').strip() or None,
             ftp_local_temp=data.get('ftp_local_temp', DEFAULT_FTP_LOCAL_TEMP),
+            ftp_rate_limit_mbps=rate_limit,
             operation_mode=operation_mode,
             active=data.get('active', True),
             priority=priority,
+            quiet_period=quiet_period,
+            watch_backend=watch_backend,
+            poll_interval=poll_interval,
+            recursive=1 if data.get('recursive') and watch_type == 'local' else 0,
             preset_id=data.get('preset_id'),
-            status='idle'
+            status='idle',
+            **retry_settings,
         )
         db_session.add(watchfolder)
         db_session.commit()
@@ -397,11 +527,15 @@ def admin_update_watchfolder(watchfolder_id):
         watchfolder.archive_path = data.get('archive_path', watchfolder.archive_path)
         watchfolder.watch_type = data.get('watch_type', watchfolder.watch_type or 'local')
         watchfolder.ftp_host = data.get('ftp_host', watchfolder.ftp_host)
-        watchfolder.ftp_port = data.get('ftp_port', watchfolder.ftp_port or 21)
+        watchfolder.ftp_port = data.get(
+            'ftp_port', watchfolder.ftp_port or default_port_for(watchfolder.watch_type)
+        )
         watchfolder.ftp_username = data.get('ftp_username', watchfolder.ftp_username)
         if 'ftp_password' in data and data['ftp_password']:  # Aggiorna solo se fornita
             watchfolder.ftp_password = data['ftp_password']
         watchfolder.ftp_remote_path = data.get('ftp_remote_path', watchfolder.ftp_remote_path)
+        if 'sftp_host_key' in data:
+            watchfolder.sftp_host_key = (data.get('sftp_host_key') or '').strip() or None
         watchfolder.ftp_local_temp = data.get('ftp_local_temp', watchfolder.ftp_local_temp)
         if 'operation_mode' in data:
             operation_mode, err = _parse_operation_mode(
@@ -418,6 +552,40 @@ def admin_update_watchfolder(watchfolder_id):
             if err:
                 return jsonify({'error': err}), 400
             watchfolder.priority = priority
+
+        if 'quiet_period' in data:
+            quiet_period, err = _parse_quiet_period(data.get('quiet_period'))
+            if err:
+                return jsonify({'error': err}), 400
+            watchfolder.quiet_period = quiet_period
+
+        if 'watch_backend' in data:
+            watch_backend, err = _parse_watch_backend(data.get('watch_backend'))
+            if err:
+                return jsonify({'error': err}), 400
+            watchfolder.watch_backend = watch_backend
+
+        if 'poll_interval' in data:
+            poll_interval, err = _parse_poll_interval(data.get('poll_interval'))
+            if err:
+                return jsonify({'error': err}), 400
+            watchfolder.poll_interval = poll_interval
+
+        if 'recursive' in data:
+            watchfolder.recursive = 1 if data.get('recursive') and watchfolder.watch_type == 'local' else 0
+
+        retry_settings, err = _parse_retry_settings(data)
+        if err:
+            return jsonify({'error': err}), 400
+        for key, value in retry_settings.items():
+            setattr(watchfolder, key, value)
+
+        if 'ftp_rate_limit_mbps' in data:
+            rate_limit, err = _parse_rate_limit(data.get('ftp_rate_limit_mbps'))
+            if err:
+                return jsonify({'error': err}), 400
+            watchfolder.ftp_rate_limit_mbps = rate_limit
+            bandwidth_manager.set_watchfolder_limit(watchfolder.id, mbps_to_bytes(rate_limit))
         
         old_active = watchfolder.active
         watchfolder.active = data.get('active', watchfolder.active)
@@ -431,11 +599,12 @@ def admin_update_watchfolder(watchfolder_id):
                 'ftp_username',
                 'ftp_password',
                 'ftp_remote_path',
+                'sftp_host_key',
                 'operation_mode',
             )
         )
         if (
-            watchfolder.watch_type == 'ftp'
+            is_remote_watch_type(watchfolder.watch_type)
             and watchfolder.active
             and (not old_active or ftp_config_changed)
         ):
@@ -443,8 +612,10 @@ def admin_update_watchfolder(watchfolder_id):
                 watchfolder.ftp_host,
                 watchfolder.ftp_username,
                 watchfolder.ftp_password,
-                watchfolder.ftp_port or 21,
+                watchfolder.ftp_port or default_port_for(watchfolder.watch_type),
                 watchfolder.ftp_remote_path or '/',
+                watch_type=watchfolder.watch_type,
+                host_key=watchfolder.sftp_host_key,
             )
             if not ok:
                 return jsonify({'error': msg}), 400
@@ -479,6 +650,7 @@ def admin_delete_watchfolder(watchfolder_id):
             return jsonify({'error': 'Watchfolder non trovato'}), 404
         
         watchfolder_manager.stop_watchfolder(watchfolder_id)
+        clear_watchfolder_index(db_session, watchfolder_id)
         db_session.delete(watchfolder)
         db_session.commit()
         
@@ -489,6 +661,73 @@ def admin_delete_watchfolder(watchfolder_id):
     finally:
         db_session.close()
 
+@app.route('/api/admin/bandwidth', methods=['GET'])
+def admin_get_bandwidth():
+    """Limiti banda FTP correnti e throughput dei trasferimenti"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Non autorizzato'}), 401
+
+    result = bandwidth_manager.limits()
+    result.update(bandwidth_manager.transfers())
+    return jsonify(result)
+
+@app.route('/api/admin/bandwidth', methods=['PUT'])
+def admin_update_bandwidth():
+    """Aggiorna a runtime i limiti banda FTP (Mbit/s, 0 = illimitato)"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Non autorizzato'}), 401
+
+    data = request.json or {}
+    db_session = get_db_session()
+    try:
+        if 'global_mbps' in data:
+            rate_limit, err = _parse_rate_limit(data.get('global_mbps'))
+            if err:
+                return jsonify({'error': err}), 400
+            bandwidth_manager.set_global_limit(mbps_to_bytes(rate_limit))
+
+        for host, value in (data.get('hosts') or {}).items():
+            rate_limit, err = _parse_rate_limit(value)
+            if err:
+                return jsonify({'error': f'{host}: {err}'}), 400
+            bandwidth_manager.set_host_limit(host, mbps_to_bytes(rate_limit))
+
+        for watchfolder_id, value in (data.get('watchfolders') or {}).items():
+            rate_limit, err = _parse_rate_limit(value)
+            if err:
+                return jsonify({'error': f'watchfolder {watchfolder_id}: {err}'}), 400
+            watchfolder = db_session.query(WatchFolder).filter(
+                WatchFolder.id == int(watchfolder_id)
+            ).first()
+            if not watchfolder:
+                return jsonify({'error': f'Watchfolder {watchfolder_id} non trovato'}), 404
+            watchfolder.ftp_rate_limit_mbps = rate_limit
+            bandwidth_manager.set_watchfolder_limit(watchfolder.id, mbps_to_bytes(rate_limit))
+
+        db_session.commit()
+        return jsonify({'success': True, **bandwidth_manager.limits()})
+    except Exception as e:
+        db_session.rollback()
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db_session.close()
+
+@app.route('/api/admin/prefetch', methods=['GET'])
+def admin_get_prefetch():
+    """Metriche prefetch page cache (job partiti con sorgente già consigliato, per watchfolder) per tarare PREFETCH_LOOKAHEAD"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Non autorizzato'}), 401
+
+    return jsonify(transcoder_worker.prefetcher.stats())
+
+@app.route('/api/admin/scheduler', methods=['GET'])
+def admin_get_scheduler():
+    """Budget CPU/RAM del nodo, job ammessi e costi appresi per preset"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Non autorizzato'}), 401
+
+    return jsonify(dict(transcoder_worker.scheduler.usage(), queue_policy=queue_policy.default_policy().name))
+
 @app.route('/api/admin/presets', methods=['GET'])
 def admin_get_presets():
     """Lista preset"""
@@ -509,7 +748,9 @@ def admin_get_presets():
             'audio_sample_rate': p.audio_sample_rate,
             'audio_channels': p.audio_channels,
             'container': p.container,
-            'ffmpeg_params': p.ffmpeg_params
+            'ffmpeg_params': p.ffmpeg_params,
+            'retry_max_attempts': p.retry_max_attempts,
+            'retry_backoff_sec': p.retry_backoff_sec,
         } for p in presets])
     finally:
         db_session.close()
@@ -523,6 +764,10 @@ def admin_create_preset():
     data = request.json
     db_session = get_db_session()
     try:
+        retry_settings, err = _parse_retry_settings(data)
+        if err:
+            return jsonify({'error': err}), 400
+
         preset = TranscodePreset(
             name=data['name'],
             description=data.get('description', ''),
@@ -533,7 +778,8 @@ def admin_create_preset():
             audio_sample_rate=data.get('audio_sample_rate', '48000'),
             audio_channels=data.get('audio_channels', '2'),
             container=data.get('container', 'mxf'),
-            ffmpeg_params=data.get('ffmpeg_params', '')
+            ffmpeg_params=data.get('ffmpeg_params', ''),
+            **retry_settings,
         )
         db_session.add(preset)
         db_session.commit()
@@ -562,6 +808,12 @@ def admin_update_preset(preset_id):
                    'audio_channels', 'container', 'ffmpeg_params']:
             if key in data:
                 setattr(preset, key, data[key])
+
+        retry_settings, err = _parse_retry_settings(data)
+        if err:
+            return jsonify({'error': err}), 400
+        for key, value in retry_settings.items():
+            setattr(preset, key, value)
         
         db_session.commit()
         return jsonify({'success': True})
@@ -607,7 +859,8 @@ def admin_get_workers():
             'active': w.active,
             'status': w.status,
             'current_job_id': w.current_job_id,
-            'max_concurrent_jobs': w.max_concurrent_jobs
+            'max_concurrent_jobs': w.max_concurrent_jobs,
+            'node_name': w.node_name,
         } for w in workers])
     finally:
         db_session.close()
@@ -659,10 +912,12 @@ def admin_update_worker(worker_id):
         
         db_session.commit()
         
-        if worker.active and not old_active:
-            transcoder_worker.start_worker(worker.id)
-        elif not worker.active and old_active:
-            transcoder_worker.stop_worker(worker.id)
+        # I worker dei nodi headless girano nel proprio processo (worker_node.py)
+        if not worker.node_name:
+            if worker.active and not old_active:
+                transcoder_worker.start_worker(worker.id)
+            elif not worker.active and old_active:
+                transcoder_worker.stop_worker(worker.id)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -809,14 +1064,25 @@ if __name__ == '__main__':
     init_default_preset()
     seed_broadcast_presets()
     
-    # Avvia watchfolder attivi all'avvio
     db_session = get_db_session()
     try:
+        # Job e output parziali rimasti dall'esecuzione precedente, prima che i watcher
+        # creino nuovi job (i download solo-FTP hanno una lease di questo processo)
+        transcoder_worker.recover_orphaned_jobs()
+        transcoder_worker.cleanup_orphaned_outputs()
+        transcoder_worker.resubmit_pending_archives()
+        # Heartbeat delle lease anche senza worker locali: download dei watcher FTP
+        transcoder_worker.lease_keeper.start()
+        
+        # Avvia watchfolder attivi all'avvio
         active_watchfolders = db_session.query(WatchFolder).filter(WatchFolder.active == True).all()
         for wf in active_watchfolders:
             watchfolder_manager.start_watchfolder(wf.id)
         
-        active_workers = db_session.query(Worker).filter(Worker.active == True).all()
+        active_workers = db_session.query(Worker).filter(
+            Worker.active == True,
+            Worker.node_name.is_(None),
+        ).all()
         for w in active_workers:
             transcoder_worker.start_worker(w.id)
     finally:
@@ -0,0 +1,201 @@
+"""
+Archiviazione dei sorgenti dopo la transcodifica. Sullo stesso filesystem è un
+os.rename istantaneo; tra filesystem diversi la copia (reflink, copy_file_range o
+copia a blocchi) va a un mover in background con verifica checksum e retry, così
+il job si chiude subito invece di attendere la copia di un sorgente da decine di GB.
+"""
+
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+from content_fingerprint import full_hash, reflink
+from path_utils import PARTIAL_PREFIX, ensure_shared_directory
+
+logger = logging.getLogger('XDCAMTranscoder.Archiver')
+
+ARCHIVE_MOVER_WORKERS = int(os.getenv('ARCHIVE_MOVER_WORKERS', '1'))
+# Coda limitata: con troppe copie in attesa il worker che archivia aspetta
+ARCHIVE_MOVER_QUEUE = int(os.getenv('ARCHIVE_MOVER_QUEUE', '16'))
+ARCHIVE_RETRIES = int(os.getenv('ARCHIVE_RETRIES', '3'))
+ARCHIVE_RETRY_DELAY_SEC = float(os.getenv('ARCHIVE_RETRY_DELAY_SEC', '30'))
+# All'avvio si riarchiviano i sorgenti dei job completati negli ultimi N giorni ancora al loro posto
+ARCHIVE_RECOVERY_DAYS = int(os.getenv('ARCHIVE_RECOVERY_DAYS', '7'))
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+TEMP_PREFIX = f'{PARTIAL_PREFIX}mv-'
+
+
+def archive_destination(archive_dir, source_path):
+    """Path nell'archivio; se il nome esiste già aggiunge un timestamp."""
+    original_filename = os.path.basename(source_path)
+    destination_path = os.path.join(archive_dir, original_filename)
+    if os.path.exists(destination_path):
+        base_name, ext = os.path.splitext(original_filename)
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        destination_path = os.path.join(archive_dir, f"{base_name}_{timestamp}{ext}")
+    return destination_path
+
+
+def same_device(source_path, destination_dir):
+    return os.stat(source_path).st_dev == os.stat(destination_dir).st_dev
+
+
+def copy_file(source_path, destination_path):
+    """
+    Copia source in destination: reflink se il filesystem lo consente, altrimenti
+    copy_file_range (copia nel kernel, senza passare dallo spazio utente), con
+    fallback a read/write a blocchi grandi. Esegue fsync prima di tornare.
+    """
+    try:
+        reflink(source_path, destination_path)
+    except OSError:
+        with open(source_path, 'rb') as src, open(destination_path, 'wb') as dst:
+            size = os.fstat(src.fileno()).st_size
+            copied = 0
+            use_range = hasattr(os, 'copy_file_range')
+            while copied < size:
+                chunk = min(COPY_CHUNK_SIZE, size - copied)
+                written = 0
+                if use_range:
+                    try:
+                        written = os.copy_file_range(src.fileno(), dst.fileno(), chunk)
+                    except OSError:
+                        use_range = False
+                        src.seek(copied)
+                        dst.seek(copied)
+                if not use_range:
+                    data = src.read(chunk)
+                    dst.write(data)
+                    written = len(data)
+                if written == 0:
+                    break
+                copied += written
+            dst.flush()
+            os.fsync(dst.fileno())
+    else:
+        with open(destination_path, 'rb+') as dst:
+            os.fsync(dst.fileno())
+
+
+class ArchiveMover:
+    """
+    Sposta i sorgenti tra filesystem in background: copia su un nome temporaneo
+    nella cartella di archivio, verifica il checksum, rinomina e solo allora
+    rimuove l'originale. In caso di errore riprova fino a `retries` volte.
+    """
+
+    def __init__(
+        self,
+        workers=ARCHIVE_MOVER_WORKERS,
+        max_queue=ARCHIVE_MOVER_QUEUE,
+        retries=ARCHIVE_RETRIES,
+        retry_delay=ARCHIVE_RETRY_DELAY_SEC,
+    ):
+        self.workers = max(1, workers)
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'ArchiveMover-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, wait=True):
+        """Ferma i thread; con wait attende prima lo svuotamento della coda."""
+        if wait:
+            self._queue.join()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(self, source_path, destination_path, overwrite=False):
+        """Accoda uno spostamento; blocca se la coda è piena (backpressure)."""
+        self.start()
+        self._queue.put((source_path, destination_path, overwrite))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._process(*item)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, source_path, destination_path, overwrite=False):
+        attempt = 0
+        while True:
+            try:
+                destination_path = move_across_devices(source_path, destination_path, overwrite)
+                logger.info("File spostato: %s -> %s", source_path, destination_path)
+                return True
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries or not os.path.exists(source_path):
+                    logger.error("Spostamento fallito dopo %d tentativi %s: %s", attempt, source_path, e)
+                    return False
+                logger.warning(
+                    "Spostamento %s fallito (tentativo %d), nuovo tentativo tra %ss: %s",
+                    source_path, attempt, self.retry_delay, e,
+                )
+                if self._stop.wait(self.retry_delay):
+                    return False
+
+
+def move_across_devices(source_path, destination_path, overwrite=False):
+    """
+    Copia verificata su nome temporaneo, rename atomico, rimozione dell'originale.
+    Senza overwrite un nome già occupato riceve un timestamp. Ritorna la destinazione effettiva.
+    """
+    destination_dir = os.path.dirname(destination_path)
+    temp_path = os.path.join(
+        destination_dir, f"{TEMP_PREFIX}{os.getpid()}-{os.path.basename(destination_path)}"
+    )
+    try:
+        copy_file(source_path, temp_path)
+        if full_hash(source_path) != full_hash(temp_path):
+            raise IOError(f"checksum diverso dopo la copia di {source_path}")
+        if not overwrite and os.path.exists(destination_path):
+            # Nome occupato mentre la copia era in coda
+            destination_path = archive_destination(destination_dir, destination_path)
+        os.replace(temp_path, destination_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(source_path)
+    return destination_path
+
+
+def archive_file(source_path, archive_dir, mover):
+    """
+    Archivia source_path in archive_dir. Ritorna (destinazione, True se già spostato,
+    False se affidato al mover in background).
+    """
+    if not os.path.exists(archive_dir):
+        ensure_shared_directory(archive_dir)
+    destination_path = archive_destination(archive_dir, source_path)
+    if same_device(source_path, archive_dir):
+        os.rename(source_path, destination_path)
+        return destination_path, True
+    mover.submit(source_path, destination_path)
+    return destination_path, False
@@ -0,0 +1,214 @@
+"""Limitazione banda download FTP (token bucket globale, per host e per watchfolder)."""
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+def mbps_to_bytes(mbps):
+    """Mbit/s -> byte/s (0/None = illimitato)."""
+    try:
+        value = float(mbps or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, int(value * 1_000_000 / 8))
+
+
+def bytes_to_mbps(rate):
+    return round((rate or 0) * 8 / 1_000_000, 3)
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe in byte/s. rate=0 disattiva il limite.
+    I chunk più grandi del burst vanno "a debito": il chiamante attende il tempo necessario.
+    """
+
+    def __init__(self, rate=0, burst_seconds=1.0, clock=time.monotonic, sleep=time.sleep):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._sleep = sleep
+        self.burst_seconds = burst_seconds
+        self.rate = 0
+        self.tokens = 0.0
+        self._last = clock()
+        self.set_rate(rate)
+
+    @property
+    def capacity(self):
+        return self.rate * self.burst_seconds
+
+    def set_rate(self, rate):
+        """Modifica il limite a runtime (byte/s)."""
+        with self._lock:
+            self.rate = max(0, int(rate or 0))
+            self.tokens = min(self.tokens, self.capacity) if self.rate else 0.0
+            self._last = self._clock()
+
+    def reserve(self, nbytes):
+        """Preleva nbytes e ritorna i secondi di attesa necessari (0 se disponibili)."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def consume(self, nbytes):
+        wait = self.reserve(nbytes)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class Transfer:
+    """Statistiche di un singolo trasferimento (byte, durata, throughput effettivo)."""
+
+    def __init__(self, manager, transfer_id, watchfolder_id, host, name, total_size=0):
+        self.manager = manager
+        self.id = transfer_id
+        self.watchfolder_id = watchfolder_id
+        self.host = host
+        self.name = name
+        self.total_size = total_size or 0
+        self.bytes_transferred = 0
+        self.throttled_seconds = 0.0
+        self.started_at = datetime.utcnow()
+        self._started = time.monotonic()
+        self._finished = None
+
+    def throttle(self, nbytes):
+        """Da chiamare per ogni chunk ricevuto: conteggia e attende se oltre limite."""
+        self.bytes_transferred += nbytes
+        self.throttled_seconds += self.manager.throttle(self.host, self.watchfolder_id, nbytes)
+
+    @property
+    def elapsed(self):
+        end = self._finished if self._finished is not None else time.monotonic()
+        return max(0.0, end - self._started)
+
+    @property
+    def bytes_per_sec(self):
+        elapsed = self.elapsed
+        return int(self.bytes_transferred / elapsed) if elapsed > 0 else 0
+
+    def finish(self):
+        if self._finished is None:
+            self._finished = time.monotonic()
+            self.manager._finish_transfer(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'watchfolder_id': self.watchfolder_id,
+            'host': self.host,
+            'name': self.name,
+            'total_size': self.total_size,
+            'bytes_transferred': self.bytes_transferred,
+            'elapsed_sec': round(self.elapsed, 1),
+            'throughput_mbps': bytes_to_mbps(self.bytes_per_sec),
+            'throttled_sec': round(self.throttled_seconds, 1),
+            'started_at': self.started_at.isoformat(),
+            'active': self._finished is None,
+        }
+
+
+class BandwidthManager:
+    """Registro limiti e trasferimenti attivi, condiviso da tutti gli FTPWatcher."""
+
+    def __init__(self, global_rate=0, host_rates=None, recent_size=20):
+        self._lock = threading.Lock()
+        self.global_bucket = TokenBucket(global_rate)
+        self.host_buckets = {}  # host -> TokenBucket
+        self.watchfolder_buckets = {}  # watchfolder_id -> TokenBucket
+        self._transfers = {}
+        self._recent = deque(maxlen=recent_size)
+        self._ids = itertools.count(1)
+        for host, rate in (host_rates or {}).items():
+            self.set_host_limit(host, rate)
+
+    def _set_bucket(self, buckets, key, rate):
+        with self._lock:
+            if not rate:
+                buckets.pop(key, None)
+                return
+            bucket = buckets.get(key)
+            if bucket:
+                bucket.set_rate(rate)
+            else:
+                buckets[key] = TokenBucket(rate)
+
+    def set_global_limit(self, rate):
+        self.global_bucket.set_rate(rate)
+
+    def set_host_limit(self, host, rate):
+        self._set_bucket(self.host_buckets, (host or '').lower(), rate)
+
+    def set_watchfolder_limit(self, watchfolder_id, rate):
+        self._set_bucket(self.watchfolder_buckets, watchfolder_id, rate)
+
+    def throttle(self, host, watchfolder_id, nbytes):
+        """Applica tutti i limiti pertinenti; ritorna i secondi di attesa."""
+        with self._lock:
+            buckets = [
+                self.host_buckets.get((host or '').lower()),
+                self.watchfolder_buckets.get(watchfolder_id),
+            ]
+        waited = self.global_bucket.consume(nbytes)
+        for bucket in buckets:
+            if bucket:
+                waited += bucket.consume(nbytes)
+        return waited
+
+    def start_transfer(self, watchfolder_id, host, name, total_size=0):
+        transfer = Transfer(self, next(self._ids), watchfolder_id, host, name, total_size)
+        with self._lock:
+            self._transfers[transfer.id] = transfer
+        return transfer
+
+    def _finish_transfer(self, transfer):
+        with self._lock:
+            self._transfers.pop(transfer.id, None)
+            self._recent.appendleft(transfer)
+
+    def limits(self):
+        with self._lock:
+            return {
+                'global_mbps': bytes_to_mbps(self.global_bucket.rate),
+                'hosts': {h: bytes_to_mbps(b.rate) for h, b in self.host_buckets.items()},
+                'watchfolders': {
+                    wf_id: bytes_to_mbps(b.rate) for wf_id, b in self.watchfolder_buckets.items()
+                },
+            }
+
+    def transfers(self):
+        with self._lock:
+            active = list(self._transfers.values())
+            recent = list(self._recent)
+        return {
+            'active': [t.to_dict() for t in active],
+            'recent': [t.to_dict() for t in recent],
+        }
+
+
+def _parse_host_rates(value):
+    """FTP_RATE_LIMIT_HOSTS="host1=50,host2=20" (Mbit/s)."""
+    rates = {}
+    for item in (value or '').split(','):
+        host, sep, mbps = item.partition('=')
+        if sep and host.strip():
+            rates[host.strip()] = mbps_to_bytes(mbps.strip())
+    return rates
+
+
+bandwidth_manager = BandwidthManager(
+    global_rate=mbps_to_bytes(os.getenv('FTP_RATE_LIMIT_MBPS', '0')),
+    host_rates=_parse_host_rates(os.getenv('FTP_RATE_LIMIT_HOSTS', '')),
+)
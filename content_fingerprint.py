@@ -0,0 +1,130 @@
+"""
+Dedup per contenuto dei file in ingresso: impronta campionata (size + testa + coda)
+economica su ogni job, hash completo solo quando l'impronta coincide con quella di
+un job già completato con lo stesso preset.
+"""
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+
+from models import TranscodeJob, FileStatus
+from path_utils import PARTIAL_PREFIX
+
+logger = logging.getLogger('XDCAMTranscoder.Fingerprint')
+
+CONTENT_DEDUP_ENABLED = os.getenv('CONTENT_DEDUP', '0').strip().lower() in ('1', 'true', 'yes')
+# Byte letti all'inizio e alla fine del file per l'impronta campionata
+CONTENT_SAMPLE_BYTES = int(os.getenv('CONTENT_SAMPLE_BYTES', str(1024 * 1024)))
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# ioctl FICLONE (Linux): copia copy-on-write su btrfs/XFS, nessun byte duplicato
+FICLONE = 0x40049409
+
+
+def sampled_fingerprint(path, sample_bytes=CONTENT_SAMPLE_BYTES):
+    """
+    blake2b di size + primi e ultimi sample_bytes. File più piccoli di due campioni
+    sono letti per intero, quindi per loro l'impronta equivale all'hash completo.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        if size <= 2 * sample_bytes:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(sample_bytes))
+            f.seek(size - sample_bytes)
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def full_hash(path, block_size=HASH_BLOCK_SIZE):
+    """blake2b dell'intero file, letto a blocchi."""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_duplicate_output(session, job, fingerprint):
+    """
+    Job COMPLETED con lo stesso preset, la stessa impronta e un output ancora presente
+    e integro (size registrata). L'impronta campionata seleziona i candidati; il match
+    è confermato dall'hash completo, calcolato sul nuovo file solo alla prima collisione.
+    Ritorna (job sorgente, hash completo del nuovo file) oppure (None, hash o None).
+    """
+    candidates = (
+        session.query(TranscodeJob)
+        .filter(
+            TranscodeJob.input_fingerprint == fingerprint,
+            TranscodeJob.preset_id == job.preset_id,
+            TranscodeJob.status == FileStatus.COMPLETED,
+            TranscodeJob.id != job.id,
+        )
+        .order_by(TranscodeJob.completed_at.desc())
+        .all()
+    )
+    new_hash = None
+    for candidate in candidates:
+        if not candidate.input_hash or not candidate.output_path:
+            continue
+        try:
+            if os.path.getsize(candidate.output_path) != candidate.output_size:
+                continue
+        except OSError:
+            continue
+        if new_hash is None:
+            new_hash = full_hash(job.input_path)
+        if candidate.input_hash == new_hash:
+            return candidate, new_hash
+    return None, new_hash
+
+
+def reflink(source, destination):
+    """Clona source in destination (reflink). Solleva OSError se il filesystem non lo supporta."""
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def link_or_copy(source, destination, prefer_reflink=False):
+    """
+    Hardlink dell'output esistente (stesso filesystem), altrimenti copia. Con
+    prefer_reflink prova prima un clone copy-on-write: i due file restano
+    indipendenti se uno dei due viene poi modificato sul posto.
+    Passa da un nome temporaneo nascosto così la destinazione non è mai parziale.
+    """
+    temp_path = os.path.join(
+        os.path.dirname(destination), f"{PARTIAL_PREFIX}link-{os.getpid()}-{os.path.basename(destination)}"
+    )
+    cloned = False
+    if prefer_reflink:
+        try:
+            reflink(source, temp_path)
+            cloned = True
+        except OSError:
+            pass
+    if not cloned:
+        try:
+            os.link(source, temp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            shutil.copyfile(source, temp_path)
+    try:
+        os.replace(temp_path, destination)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,144 @@
+"""
+Budget di thread e affinità CPU per i processi FFmpeg concorrenti. Senza limiti ogni
+FFmpeg dimensiona i pool sul numero totale di core: con più job in parallelo si
+moltiplicano i thread, la cache viene contesa e i context switch esplodono.
+"""
+
+import glob
+import logging
+import os
+import threading
+
+logger = logging.getLogger('XDCAMTranscoder.Affinity')
+
+FFMPEG_THREAD_BUDGET = os.getenv('FFMPEG_THREAD_BUDGET', '0').strip().lower() in ('1', 'true', 'yes')
+FFMPEG_CPU_PINNING = os.getenv('FFMPEG_CPU_PINNING', '0').strip().lower() in ('1', 'true', 'yes')
+
+# Encoder con pool di thread proprio, configurato tramite i rispettivi -*-params
+_ENCODER_PARAM_OPTION = {
+    'libx265': ('-x265-params', 'pools'),
+}
+
+
+def available_cores():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def thread_budget(total_cores, slots):
+    """Thread per job: core del nodo divisi per gli slot attivi (almeno 1)."""
+    return max(1, int(total_cores) // max(1, int(slots)))
+
+
+def apply_thread_budget(cmd, threads, video_codec=None):
+    """
+    Inserisce -filter_threads (globale, subito dopo l'eseguibile) e -threads prima
+    dell'output; per x265 aggiunge pools=N a -x265-params. Le opzioni già presenti
+    nei parametri del preset hanno la precedenza e non vengono toccate.
+    """
+    cmd = list(cmd)
+    if '-filter_threads' not in cmd:
+        cmd[1:1] = ['-filter_threads', str(threads)]
+    if '-threads' not in cmd:
+        output_at = len(cmd) - 1
+        if len(cmd) >= 2 and cmd[-2] == '-y':
+            output_at -= 1
+        cmd[output_at:output_at] = ['-threads', str(threads)]
+
+    option = _ENCODER_PARAM_OPTION.get((video_codec or '').strip().lower())
+    if option:
+        flag, key = option
+        if flag in cmd:
+            index = cmd.index(flag) + 1
+            params = cmd[index]
+            if f'{key}=' not in params:
+                cmd[index] = f'{params}:{key}={threads}' if params else f'{key}={threads}'
+        else:
+            output_at = cmd.index('-threads') if '-threads' in cmd else len(cmd) - 1
+            cmd[output_at:output_at] = [flag, f'{key}={threads}']
+    return cmd
+
+
+def parse_cpulist(text):
+    """'0-3,8-11' -> [0, 1, 2, 3, 8, 9, 10, 11]"""
+    cores = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cores.extend(range(int(start), int(end) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+def numa_nodes(allowed=None):
+    """Core per nodo NUMA (da sysfs), limitati a quelli consentiti al processo."""
+    allowed = set(allowed if allowed is not None else available_cores())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        try:
+            with open(path) as f:
+                cores = [c for c in parse_cpulist(f.read()) if c in allowed]
+        except (OSError, ValueError):
+            continue
+        if cores:
+            nodes.append(cores)
+    return nodes or [sorted(allowed)]
+
+
+class CoreAllocator:
+    """
+    Assegna a ciascun job un insieme di core disgiunto da quelli degli altri job.
+    Preferisce core di un solo nodo NUMA (memoria locale); se nessun nodo ne ha
+    abbastanza liberi prende quelli del nodo più libero e completa dagli altri.
+    """
+
+    def __init__(self, nodes=None):
+        self.nodes = nodes or numa_nodes()
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    def allocate(self, count):
+        with self._lock:
+            free_by_node = [[c for c in node if c not in self._busy] for node in self.nodes]
+            if not any(free_by_node):
+                return []
+            fitting = [free for free in free_by_node if len(free) >= count]
+            if fitting:
+                # Best fit: il nodo con meno core liberi sufficienti
+                chosen = min(fitting, key=len)[:count]
+            else:
+                chosen = []
+                for free in sorted(free_by_node, key=len, reverse=True):
+                    chosen.extend(free[:count - len(chosen)])
+                    if len(chosen) >= count:
+                        break
+            self._busy.update(chosen)
+            return chosen
+
+    def release(self, cores):
+        with self._lock:
+            self._busy.difference_update(cores or ())
+
+
+def pin_process(pid, cores):
+    """Affinità del processo e dei thread già creati (i successivi la ereditano)."""
+    if not cores:
+        return False
+    tids = [pid]
+    try:
+        tids = [int(t) for t in os.listdir(f'/proc/{pid}/task')]
+    except OSError:
+        pass
+    pinned = False
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cores)
+            pinned = True
+        except (OSError, AttributeError) as e:
+            logger.debug("sched_setaffinity %s non riuscito: %s", tid, e)
+    return pinned
@@ -0,0 +1,174 @@
+"""
+Cache dei risultati di codifica: stesso sorgente (impronta + hash completo) e stesso
+comando FFmpeg effettivo producono lo stesso output, che viene riusato senza ricodificare.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from models import EncodeCacheEntry
+from content_fingerprint import full_hash, link_or_copy
+from path_utils import ensure_shared_directory
+
+logger = logging.getLogger('XDCAMTranscoder.EncodeCache')
+
+# Directory della cache (vuoto = cache disattivata). Meglio sullo stesso filesystem
+# degli output: inserimento e riuso diventano reflink/hardlink invece di copie.
+ENCODE_CACHE_DIR = os.getenv('ENCODE_CACHE_DIR', '').strip()
+ENCODE_CACHE_MAX_GB = float(os.getenv('ENCODE_CACHE_MAX_GB', '100'))
+ENCODE_CACHE_MAX_AGE_DAYS = float(os.getenv('ENCODE_CACHE_MAX_AGE_DAYS', '30'))
+
+INPUT_PLACEHOLDER = '{input}'
+OUTPUT_PLACEHOLDER = '{output}'
+
+
+def command_hash(argv, input_path, output_path):
+    """
+    sha256 dell'argv FFmpeg con i path di input e output sostituiti da segnaposto.
+    L'estensione dell'output resta nella chiave: senza -f è lei a scegliere il muxer.
+    """
+    output_ext = os.path.splitext(output_path)[1].lower()
+    normalized = []
+    for token in argv:
+        if token == input_path:
+            token = INPUT_PLACEHOLDER
+        elif token == output_path:
+            token = OUTPUT_PLACEHOLDER + output_ext
+        normalized.append(token)
+    payload = json.dumps(normalized, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class EncodeCache:
+    def __init__(
+        self,
+        cache_dir=ENCODE_CACHE_DIR,
+        max_bytes=int(ENCODE_CACHE_MAX_GB * 1024 ** 3),
+        max_age=timedelta(days=ENCODE_CACHE_MAX_AGE_DAYS),
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir)
+
+    def _entry_path(self, source_hash, cmd_hash, ext):
+        return os.path.join(self.cache_dir, cmd_hash[:2], f"{source_hash}_{cmd_hash}{ext}")
+
+    def _is_valid(self, entry, now):
+        if self.max_age and entry.last_used_at and now - entry.last_used_at > self.max_age:
+            return False
+        try:
+            return os.path.getsize(entry.cache_path) == entry.size
+        except OSError:
+            return False
+
+    def lookup(self, session, fingerprint, cmd_hash, input_path, source_hash=None):
+        """
+        Voce valida per (impronta, comando) confermata dall'hash completo del sorgente,
+        calcolato solo se c'è almeno un candidato. Ritorna (voce o None, hash sorgente o None).
+        """
+        now = datetime.utcnow()
+        candidates = (
+            session.query(EncodeCacheEntry)
+            .filter(
+                EncodeCacheEntry.source_fingerprint == fingerprint,
+                EncodeCacheEntry.command_hash == cmd_hash,
+            )
+            .all()
+        )
+        for entry in candidates:
+            if not self._is_valid(entry, now):
+                continue
+            if source_hash is None:
+                source_hash = full_hash(input_path)
+            if entry.source_hash == source_hash:
+                return entry, source_hash
+        return None, source_hash
+
+    def materialize(self, session, entry, destination):
+        """
+        Crea destination dalla voce (reflink, hardlink o copia) dopo aver verificato
+        il checksum: una voce corrotta viene rimossa e il job ricodifica.
+        """
+        if full_hash(entry.cache_path) != entry.checksum:
+            logger.warning("Voce cache corrotta, rimossa: %s", entry.cache_path)
+            self._remove(session, entry)
+            session.commit()
+            return False
+        link_or_copy(entry.cache_path, destination, prefer_reflink=True)
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_used_at = datetime.utcnow()
+        session.commit()
+        return True
+
+    def store(self, session, fingerprint, source_hash, cmd_hash, output_path):
+        """Inserisce (o rinnova) l'output appena prodotto, poi applica l'eviction."""
+        ext = os.path.splitext(output_path)[1].lower()
+        cache_path = self._entry_path(source_hash, cmd_hash, ext)
+        ensure_shared_directory(os.path.dirname(cache_path))
+        link_or_copy(output_path, cache_path, prefer_reflink=True)
+
+        entry = (
+            session.query(EncodeCacheEntry)
+            .filter(
+                EncodeCacheEntry.source_hash == source_hash,
+                EncodeCacheEntry.command_hash == cmd_hash,
+            )
+            .first()
+        )
+        if entry is None:
+            entry = EncodeCacheEntry(source_hash=source_hash, command_hash=cmd_hash, hits=0)
+            session.add(entry)
+        now = datetime.utcnow()
+        entry.source_fingerprint = fingerprint
+        entry.cache_path = cache_path
+        entry.size = os.path.getsize(cache_path)
+        entry.checksum = full_hash(cache_path)
+        entry.created_at = now
+        entry.last_used_at = now
+        session.commit()
+        self.evict(session, now=now)
+        return entry
+
+    def evict(self, session, now=None):
+        """
+        Rimuove le voci non usate da più di max_age e quelle con file mancante, poi le
+        meno usate di recente finché la dimensione totale rientra in max_bytes.
+        Ritorna il numero di voci rimosse.
+        """
+        now = now or datetime.utcnow()
+        entries = session.query(EncodeCacheEntry).order_by(EncodeCacheEntry.last_used_at.asc()).all()
+        removed = 0
+        kept = []
+        for entry in entries:
+            if self._is_valid(entry, now):
+                kept.append(entry)
+            else:
+                self._remove(session, entry)
+                removed += 1
+        total = sum(entry.size for entry in kept)
+        for entry in kept:
+            if not self.max_bytes or total <= self.max_bytes:
+                break
+            total -= entry.size
+            self._remove(session, entry)
+            removed += 1
+        if removed:
+            session.commit()
+            logger.info("Cache codifiche: rimosse %d voci, %d byte in uso", removed, total)
+        return removed
+
+    def _remove(self, session, entry):
+        try:
+            os.remove(entry.cache_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Rimozione voce cache fallita %s: %s", entry.cache_path, e)
+        session.delete(entry)
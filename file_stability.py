@@ -0,0 +1,146 @@
+"""Rilevamento stabilità file locali (copie SMB/NFS in corso) senza bloccare l'observer watchdog."""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('XDCAMTranscoder.Stability')
+
+# Secondi senza variazioni di size/mtime prima di considerare un upload completato
+# (watchfolder locali e indice FTP)
+DEFAULT_QUIET_PERIOD = 10
+MIN_QUIET_PERIOD = 1
+
+STABILITY_CHECK_SEC = float(os.getenv('WATCH_STABILITY_CHECK_SEC', '1'))
+# Debounce per cartella: durante una raffica di eventi nella stessa cartella
+# si controllano solo i file già fermi da quiet_period
+DIR_DEBOUNCE_SEC = float(os.getenv('WATCH_DIR_DEBOUNCE_SEC', '2'))
+
+
+class _Candidate:
+    __slots__ = ('size', 'mtime', 'changed_at')
+
+    def __init__(self, changed_at):
+        self.size = None
+        self.mtime = None
+        self.changed_at = changed_at
+
+
+class StabilityTracker:
+    """
+    Registra i file candidati (eventi created/modified/moved/closed) e li controlla
+    periodicamente su un thread dedicato: un file è stabile quando size e mtime non
+    cambiano da almeno quiet_period secondi. Per ogni file stabile chiama
+    on_stable(path, size, mtime) dal thread del tracker.
+    Con eventi recenti nella stessa cartella (entro dir_debounce) lo stat dei file
+    ancora attivi viene rimandato: una copia di centinaia di clip non genera
+    centinaia di stat a ogni controllo.
+    """
+
+    def __init__(
+        self,
+        on_stable,
+        quiet_period=DEFAULT_QUIET_PERIOD,
+        check_interval=STABILITY_CHECK_SEC,
+        dir_debounce=DIR_DEBOUNCE_SEC,
+        clock=time.monotonic,
+    ):
+        self.on_stable = on_stable
+        self.quiet_period = max(MIN_QUIET_PERIOD, quiet_period or 0)
+        self.check_interval = max(0.1, check_interval)
+        self.dir_debounce = max(0.0, dir_debounce)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._candidates = {}  # path -> _Candidate
+        self._dir_activity = {}  # directory -> ultimo evento
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def touch(self, path):
+        """Segnala attività sul file: il quiet period riparte da adesso. Non fa I/O."""
+        now = self._clock()
+        with self._lock:
+            candidate = self._candidates.get(path)
+            if candidate is None:
+                self._candidates[path] = _Candidate(now)
+            else:
+                candidate.changed_at = now
+            self._dir_activity[os.path.dirname(path)] = now
+
+    def discard(self, path):
+        with self._lock:
+            self._candidates.pop(path, None)
+
+    def pending(self):
+        with self._lock:
+            return list(self._candidates)
+
+    def check(self):
+        """Controlla size/mtime dei candidati; notifica e rimuove quelli stabili."""
+        now = self._clock()
+        with self._lock:
+            paths = [
+                path for path, candidate in self._candidates.items()
+                if not self._debounced(path, candidate, now)
+            ]
+            # Le cartelle senza più candidati non servono al debounce
+            active_dirs = {os.path.dirname(path) for path in self._candidates}
+            for directory in list(self._dir_activity):
+                if directory not in active_dirs:
+                    del self._dir_activity[directory]
+        stable = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.discard(path)
+                continue
+            now = self._clock()
+            with self._lock:
+                candidate = self._candidates.get(path)
+                if candidate is None:
+                    continue
+                if (st.st_size, st.st_mtime) != (candidate.size, candidate.mtime):
+                    if candidate.size is not None:
+                        candidate.changed_at = now
+                    candidate.size, candidate.mtime = st.st_size, st.st_mtime
+                    continue
+                if st.st_size == 0 or now - candidate.changed_at < self.quiet_period:
+                    continue
+                del self._candidates[path]
+            stable.append((path, st.st_size, st.st_mtime))
+
+        for path, size, mtime in stable:
+            try:
+                self.on_stable(path, size, mtime)
+            except Exception as e:
+                logger.error(f"Errore acquisizione file stabile {path}: {e}", exc_info=True)
+        return [path for path, _, _ in stable]
+
+    def _debounced(self, path, candidate, now):
+        """True se la cartella è in piena attività e il file non è fermo da quiet_period."""
+        last_dir_event = self._dir_activity.get(os.path.dirname(path))
+        if last_dir_event is None or now - last_dir_event >= self.dir_debounce:
+            return False
+        return now - candidate.changed_at < self.quiet_period
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Errore controllo stabilità file: {e}", exc_info=True)
@@ -0,0 +1,248 @@
+"""Indice persistente dei file remoti FTP (diff per poll senza scansione dei job)."""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import (
+    FTPFileIndex,
+    TranscodeJob,
+    FileStatus,
+    FTP_INDEX_PENDING,
+    FTP_INDEX_DONE,
+)
+from file_stability import DEFAULT_QUIET_PERIOD, MIN_QUIET_PERIOD
+from ftp_utils import job_blocks_ftp_redetection, parse_mlsd_modify
+
+logger = logging.getLogger('FTPWatcher')
+
+# SQLite limita il numero di parametri per statement: le IN vanno spezzate
+SQLITE_IN_CHUNK = 500
+
+
+def _chunks(items, size=SQLITE_IN_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_index_entries(session, watchfolder_id, name_keys):
+    """Ritorna {name_key: FTPFileIndex} solo per i nomi richiesti."""
+    entries = {}
+    for chunk in _chunks(name_keys):
+        rows = session.query(FTPFileIndex).filter(
+            FTPFileIndex.watchfolder_id == watchfolder_id,
+            FTPFileIndex.name_key.in_(chunk),
+        ).all()
+        for row in rows:
+            entries[row.name_key] = row
+    return entries
+
+
+def find_blocking_job_names(session, watchfolder_id, name_keys):
+    """
+    Nomi (lowercase) già coperti da un job esistente.
+    Usato solo per i file assenti dall'indice (es. primo avvio dopo l'aggiornamento).
+    """
+    blocked = set()
+    for chunk in _chunks(name_keys):
+        jobs = session.query(TranscodeJob).filter(
+            TranscodeJob.watchfolder_id == watchfolder_id,
+            func.lower(TranscodeJob.input_filename).in_(chunk),
+        ).all()
+        for job in jobs:
+            if job_blocks_ftp_redetection(job):
+                blocked.add(job.input_filename.lower())
+    return blocked
+
+
+def find_blocking_job_id(session, watchfolder_id, name):
+    """Id di un job che copre già il file (regola di job_blocks_ftp_redetection), o None."""
+    jobs = session.query(TranscodeJob).filter(
+        TranscodeJob.watchfolder_id == watchfolder_id,
+        func.lower(TranscodeJob.input_filename) == name.lower(),
+    ).order_by(TranscodeJob.id.desc()).all()
+    for job in jobs:
+        if job_blocks_ftp_redetection(job):
+            return job.id
+    return None
+
+
+def _release_redetectable(session, done_entries):
+    """
+    Rilascia le voci 'done' il cui job è fallito/annullato e il file locale non esiste più
+    (stessa regola di job_blocks_ftp_redetection). Ritorna le chiavi rilasciate.
+    """
+    job_ids = [e.job_id for e in done_entries if e.job_id]
+    if not job_ids:
+        return set()
+    released_job_ids = set()
+    for chunk in _chunks(job_ids):
+        jobs = session.query(TranscodeJob).filter(
+            TranscodeJob.id.in_(chunk),
+            TranscodeJob.status.in_([FileStatus.FAILED, FileStatus.CANCELLED]),
+        ).all()
+        for job in jobs:
+            if not job_blocks_ftp_redetection(job):
+                released_job_ids.add(job.id)
+    released = set()
+    for entry in done_entries:
+        if entry.job_id in released_job_ids:
+            released.add(entry.name_key)
+            session.delete(entry)
+    if released:
+        # flush prima di reinserire le stesse chiavi (vincolo unique)
+        session.flush()
+    return released
+
+
+def _initial_changed_at(file_info, now):
+    """
+    Istante dell'ultima modifica nota: il fact MLSD 'modify' (UTC) se disponibile,
+    altrimenti il momento della prima osservazione.
+    """
+    modified = parse_mlsd_modify(file_info.get('modify'))
+    if modified and modified <= now:
+        return modified
+    return now
+
+
+def _is_stable(entry, file_info, now, quiet_period):
+    """Size/mtime invariati e nessuna modifica da almeno quiet_period secondi."""
+    size = file_info['size']
+    if size <= 0:
+        return False
+    changed_at = entry.changed_at or entry.first_seen or now
+    return (now - changed_at).total_seconds() >= quiet_period
+
+
+def _has_changed(entry, file_info):
+    modify = file_info.get('modify') or None
+    if file_info['size'] != (entry.size or 0):
+        return True
+    return bool(modify and entry.mtime and modify != entry.mtime)
+
+
+def diff_remote_listing(session, watchfolder_id, files_by_key, quiet_period=DEFAULT_QUIET_PERIOD, now=None):
+    """
+    Aggiorna l'indice con il listing corrente e ritorna i file pronti per l'acquisizione.
+
+    files_by_key: {name_key: {'name', 'size', 'modify'}} già filtrato per estensione.
+    Un file è pronto quando size e 'modify' non cambiano da almeno quiet_period secondi
+    e restano invariati tra almeno due poll: un file nuovo con 'modify' MLSD già più
+    vecchio del quiet period è pronto al poll successivo, non al primo (l'orologio del
+    server può essere indietro rispetto a quello del nodo).
+    Il costo è proporzionale ai file presenti sul server, non allo storico dei job.
+    """
+    now = now or datetime.utcnow()
+    quiet_period = max(MIN_QUIET_PERIOD, quiet_period or 0)
+    keys = set(files_by_key)
+    entries = load_index_entries(session, watchfolder_id, keys)
+
+    released = _release_redetectable(
+        session,
+        [e for e in entries.values() if e.state == FTP_INDEX_DONE],
+    )
+    for key in released:
+        del entries[key]
+
+    new_keys = keys - set(entries)
+    blocked = find_blocking_job_names(session, watchfolder_id, new_keys) if new_keys else set()
+
+    ready = []
+    for key in new_keys:
+        info = files_by_key[key]
+        state = FTP_INDEX_DONE if key in blocked else FTP_INDEX_PENDING
+        entry = FTPFileIndex(
+            watchfolder_id=watchfolder_id,
+            name=info['name'],
+            name_key=key,
+            size=info['size'],
+            mtime=info.get('modify') or None,
+            state=state,
+            first_seen=now,
+            last_seen=now,
+            changed_at=_initial_changed_at(info, now),
+        )
+        session.add(entry)
+        if state != FTP_INDEX_PENDING:
+            continue
+        # Mai pronto alla prima osservazione: serve un poll con size/mtime invariati
+        logger.info(
+            f"File {info['name']} rilevato ({info['size']} bytes), "
+            f"attendo {quiet_period}s senza modifiche"
+        )
+
+    for key, entry in entries.items():
+        if entry.state != FTP_INDEX_PENDING:
+            continue
+        info = files_by_key[key]
+        if _has_changed(entry, info):
+            logger.info(
+                f"File {info['name']} in upload ({entry.size} -> {info['size']} bytes)"
+            )
+            entry.changed_at = now
+        elif _is_stable(entry, info, now, quiet_period):
+            ready.append(info)
+        entry.size = info['size']
+        entry.mtime = info.get('modify') or entry.mtime
+        entry.last_seen = now
+
+    # Upload interrotti: le voci pending non più presenti sul server vanno rimosse
+    vanished = [
+        row for row in session.query(FTPFileIndex).filter(
+            FTPFileIndex.watchfolder_id == watchfolder_id,
+            FTPFileIndex.state == FTP_INDEX_PENDING,
+        ).all()
+        if row.name_key not in keys
+    ]
+    for row in vanished:
+        session.delete(row)
+
+    session.commit()
+    return ready
+
+
+def count_pending_entries(session, watchfolder_id):
+    """Numero di file visti ma non ancora stabili (upload in corso)."""
+    return session.query(FTPFileIndex).filter(
+        FTPFileIndex.watchfolder_id == watchfolder_id,
+        FTPFileIndex.state == FTP_INDEX_PENDING,
+    ).count()
+
+
+def mark_index_done(session, watchfolder_id, name, job_id=None):
+    """Segna un file come acquisito (non verrà più rilevato finché resta sul server)."""
+    entry = session.query(FTPFileIndex).filter(
+        FTPFileIndex.watchfolder_id == watchfolder_id,
+        FTPFileIndex.name_key == name.lower(),
+    ).first()
+    if not entry:
+        entry = FTPFileIndex(watchfolder_id=watchfolder_id, name=name, name_key=name.lower())
+        session.add(entry)
+    entry.state = FTP_INDEX_DONE
+    entry.job_id = job_id
+    entry.last_seen = datetime.utcnow()
+    session.commit()
+
+
+def defer_index_entry(session, watchfolder_id, name, now=None):
+    """
+    Acquisizione non riuscita senza job (download interrotto, file locale ancora in
+    copia, file vuoto): la voce resta pending e il file torna pronto dopo un altro
+    quiet period.
+    """
+    session.query(FTPFileIndex).filter(
+        FTPFileIndex.watchfolder_id == watchfolder_id,
+        FTPFileIndex.name_key == name.lower(),
+        FTPFileIndex.state == FTP_INDEX_PENDING,
+    ).update({FTPFileIndex.changed_at: now or datetime.utcnow()}, synchronize_session=False)
+    session.commit()
+
+
+def clear_watchfolder_index(session, watchfolder_id):
+    """Elimina l'indice di un watchfolder (es. cancellazione watchfolder)."""
+    session.query(FTPFileIndex).filter(
+        FTPFileIndex.watchfolder_id == watchfolder_id
+    ).delete(synchronize_session=False)
@@ -2,9 +2,10 @@
 
 import os
 import ftplib
+from datetime import datetime
 from ftputil.error import FTPError, PermanentError, TemporaryError
 
-from models import FileStatus, OPERATION_MODE_DOWNLOAD_ONLY
+from models import FileStatus, OPERATION_MODE_DOWNLOAD_ONLY, REMOTE_WATCH_TYPES
 
 DEFAULT_FTP_LOCAL_TEMP = '/var/lib/xdtranscode/ftp_temp'
 
@@ -28,16 +29,33 @@ FTP_EXCEPTIONS = (
 )
 
 
-def ftp_session_factory(timeout_sec=30):
-    """Factory sessione ftplib con timeout e modalità passiva."""
+def ftp_session_factory(timeout_sec=30, tls=False):
+    """
+    Factory sessione ftplib con timeout e modalità passiva.
+    Con tls=True usa FTP_TLS esplicito (AUTH TLS) e protegge il canale dati (PROT P).
+    """
+    base_class = ftplib.FTP_TLS if tls else ftplib.FTP
 
-    class Session(ftplib.FTP):
+    class Session(base_class):
         def __init__(self, host, user, password, port=21):
             super().__init__()
             self.connect(host, port, timeout=timeout_sec)
             self.login(user, password)
+            if tls:
+                self.prot_p()
             self.set_pasv(True)
 
+        if tls:
+            def ntransfercmd(self, cmd, rest=None):
+                # Molti server (es. vsftpd require_ssl_reuse) esigono il riuso della
+                # sessione TLS del canale di controllo anche sul canale dati
+                conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+                if self._prot_p:
+                    conn = self.context.wrap_socket(
+                        conn, server_hostname=self.host, session=self.sock.session
+                    )
+                return conn, size
+
     return Session
 
 
@@ -59,42 +77,69 @@ def chdir_ftp(ftp, remote_path):
             ftp.chdir(part)
 
 
-def test_ftp_connection(host, username, password, port=21, remote_path='/', timeout=30):
+def test_ftp_connection(
+    host, username, password, port=21, remote_path='/', timeout=30, watch_type='ftp', host_key=None
+):
     """
-    Verifica connessione FTP.
-    Ritorna (ok: bool, message: str).
+    Verifica connessione alla sorgente remota (FTP, FTPS o SFTP; per SFTP anche la
+    chiave host). Ritorna (ok: bool, message: str).
     """
-    import ftputil
+    from remote_sources import REMOTE_SOURCES, FTPSource
 
     if not host or not username:
         return False, 'Host e username FTP obbligatori'
 
+    label = (watch_type or 'ftp').upper()
+    source_cls = REMOTE_SOURCES.get(watch_type or 'ftp', FTPSource)
+    extra = {'host_key': host_key or None} if watch_type == 'sftp' else {}
     try:
-        session_cls = ftp_session_factory(timeout)
-        with ftputil.FTPHost(
+        with source_cls(
             host,
             username,
             password or '',
-            port=port or 21,
-            session_factory=session_cls,
-        ) as ftp:
-            chdir_ftp(ftp, remote_path)
-        return True, 'Connessione FTP riuscita'
+            port=port or None,
+            remote_path=remote_path,
+            timeout=timeout,
+            **extra,
+        ):
+            pass
+        return True, f'Connessione {label} riuscita'
     except PermanentError as e:
         msg = str(e).strip()
         if '530' in msg or 'login' in msg.lower():
-            return False, f'Login FTP fallito: {msg}'
-        return False, f'Errore FTP permanente: {msg}'
+            return False, f'Login {label} fallito: {msg}'
+        return False, f'Errore {label} permanente: {msg}'
     except FTP_EXCEPTIONS as e:
-        return False, f'Errore connessione FTP: {type(e).__name__}: {e}'
+        return False, f'Errore connessione {label}: {type(e).__name__}: {e}'
     except Exception as e:
-        return False, f'Errore connessione FTP: {type(e).__name__}: {e}'
+        return False, f'Errore connessione {label}: {type(e).__name__}: {e}'
+
+
+def is_remote_watch_type(watch_type):
+    """True per i watchfolder remoti gestiti da FTPWatcher (ftp, ftps, sftp)."""
+    return (watch_type or 'local') in REMOTE_WATCH_TYPES
+
+
+def parse_mlsd_modify(value):
+    """Converte il fact MLSD 'modify' (YYYYMMDDHHMMSS[.sss], UTC) in datetime naive UTC."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        base = datetime.strptime(value[:14], '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    if len(value) > 15 and value[14] == '.':
+        fraction = value[15:21]
+        if fraction.isdigit():
+            base = base.replace(microsecond=int(fraction.ljust(6, '0')))
+    return base
 
 
 def is_download_only_watchfolder(watchfolder):
-    """True se il watchfolder FTP è in modalità solo download."""
+    """True se il watchfolder remoto (FTP/FTPS/SFTP) è in modalità solo download."""
     return (
-        (watchfolder.watch_type or 'local') == 'ftp'
+        is_remote_watch_type(watchfolder.watch_type)
         and (watchfolder.operation_mode or 'transcode') == OPERATION_MODE_DOWNLOAD_ONLY
     )
 
@@ -114,24 +159,32 @@ def job_blocks_ftp_redetection(job):
     return False
 
 
-def download_with_progress(ftp, remote_name, local_path, total_size=0, progress_callback=None):
-    """Scarica un file FTP aggiornando il progresso via callback(percent)."""
+def download_with_progress(
+    source, remote_name, local_path, total_size=0, progress_callback=None, transfer=None
+):
+    """
+    Scarica un file da una sorgente remota (remote_sources.RemoteSource) notificando callback(percent, bytes_received) a ogni chunk.
+    percent è None se la dimensione remota non è nota. La frequenza di scrittura su DB
+    è responsabilità del chiamante (vedi progress_writer.CoalescingProgressWriter).
+    Se `transfer` (bandwidth.Transfer) è fornito, ogni chunk passa dal rate limiter.
+    Ritorna i byte ricevuti.
+    """
     bytes_received = 0
-    last_reported = -1
 
     def callback(chunk):
-        nonlocal bytes_received, last_reported
+        nonlocal bytes_received
         bytes_received += len(chunk)
+        if transfer is not None:
+            transfer.throttle(len(chunk))
         if not progress_callback:
             return
         if total_size and total_size > 0:
             percent = min(99, int(bytes_received * 100 / total_size))
         else:
-            percent = min(99, bytes_received // (1024 * 1024))
-        if percent > last_reported:
-            last_reported = percent
-            progress_callback(percent)
+            percent = None
+        progress_callback(percent, bytes_received)
 
-    ftp.download(remote_name, local_path, callback=callback)
+    source.download(remote_name, local_path, callback=callback, total_size=total_size)
     if progress_callback:
-        progress_callback(100)
+        progress_callback(100, bytes_received)
+    return bytes_received
@@ -2,19 +2,28 @@ import os
 import time
 import threading
 import logging
-from datetime import datetime
-import ftputil
+from datetime import datetime, timedelta
 from models import WatchFolder, TranscodeJob, FileStatus
+from bandwidth import bandwidth_manager, mbps_to_bytes, bytes_to_mbps
+from file_stability import DEFAULT_QUIET_PERIOD
+from ftp_index import (
+    count_pending_entries,
+    defer_index_entry,
+    diff_remote_listing,
+    find_blocking_job_id,
+    mark_index_done,
+)
+from job_enqueue import DEDUPE_BY_FILENAME, build_output_filename, enqueue_jobs, find_active_keys
+from job_lease import LEASE_TTL_SEC, process_owner
 from path_utils import ensure_shared_directory, ensure_shared_file
+from progress_writer import CoalescingProgressWriter
+from remote_sources import open_remote_source
 from ftp_utils import (
     DEFAULT_FTP_LOCAL_TEMP,
     FTP_EXCEPTIONS,
     VIDEO_EXTENSIONS,
-    chdir_ftp,
     download_with_progress,
-    ftp_session_factory,
     is_download_only_watchfolder,
-    job_blocks_ftp_redetection,
 )
 
 logging.basicConfig(
@@ -27,28 +36,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger('FTPWatcher')
 
+# Intervalli di poll (secondi): breve con upload in corso, backoff esponenziale se idle/errore
+FTP_POLL_MIN_SEC = float(os.getenv('FTP_POLL_MIN_SEC', '3'))
+FTP_POLL_IDLE_SEC = float(os.getenv('FTP_POLL_IDLE_SEC', '30'))
+FTP_POLL_MAX_SEC = float(os.getenv('FTP_POLL_MAX_SEC', '300'))
+
+
+class AdaptivePollInterval:
+    """Calcola l'attesa tra due poll in base all'attività osservata."""
+
+    def __init__(self, min_sec=FTP_POLL_MIN_SEC, idle_sec=FTP_POLL_IDLE_SEC, max_sec=FTP_POLL_MAX_SEC):
+        self.min_sec = min_sec
+        self.idle_sec = max(idle_sec, min_sec)
+        self.max_sec = max(max_sec, self.idle_sec)
+        self.idle_streak = 0
+        self.error_streak = 0
+        self.current = self.min_sec
+
+    def on_activity(self):
+        """Upload in corso o file appena acquisiti: poll ravvicinati."""
+        self.idle_streak = 0
+        self.error_streak = 0
+        self.current = self.min_sec
+        return self.current
+
+    def on_idle(self):
+        self.error_streak = 0
+        self.current = min(self.max_sec, self.idle_sec * (2 ** self.idle_streak))
+        self.idle_streak += 1
+        return self.current
+
+    def on_error(self):
+        self.idle_streak = 0
+        self.current = min(self.max_sec, self.idle_sec * (2 ** self.error_streak))
+        self.error_streak += 1
+        return self.current
+
 
 class FTPWatcher:
-    def __init__(self, watchfolder_id, db_session_factory):
+    def __init__(self, watchfolder_id, db_session_factory, progress_writer=None):
         self.watchfolder_id = watchfolder_id
         self.db_session_factory = db_session_factory
+        # Writer condiviso tra i watcher (WatchFolderManager), altrimenti dedicato
+        self.progress_writer = progress_writer or CoalescingProgressWriter(db_session_factory)
         self.running = False
         self.thread = None
         self.allowed_extensions = list(VIDEO_EXTENSIONS)
-        self.known_files = set()
-        self.pending_files = {}
         self.last_error = None
+        self.poll_interval = AdaptivePollInterval()
+        self._wakeup = threading.Event()
 
     def start(self):
         if self.running:
             return
 
         self.running = True
+        self._wakeup.clear()
         self.thread = threading.Thread(target=self._watch_loop, daemon=True)
         self.thread.start()
 
     def stop(self):
         self.running = False
+        self._wakeup.set()
         if self.thread:
             self.thread.join(timeout=5)
 
@@ -79,14 +128,19 @@ class FTPWatcher:
             )
             logger.info(f"FTP Host: {watchfolder.ftp_host}:{watchfolder.ftp_port}")
             logger.info(f"FTP Remote Path: {watchfolder.ftp_remote_path}")
+            bandwidth_manager.set_watchfolder_limit(
+                self.watchfolder_id, mbps_to_bytes(watchfolder.ftp_rate_limit_mbps)
+            )
         finally:
             db_session.close()
 
         while self.running:
             try:
-                self._check_ftp_files()
+                if self._check_ftp_files():
+                    delay = self.poll_interval.on_activity()
+                else:
+                    delay = self.poll_interval.on_idle()
                 self.last_error = None
-                time.sleep(30)
             except FTP_EXCEPTIONS as e:
                 self.last_error = str(e)
                 error_msg = (
@@ -95,7 +149,7 @@ class FTPWatcher:
                 )
                 logger.error(error_msg, exc_info=True)
                 self._set_watchfolder_status('error')
-                time.sleep(30)
+                delay = self.poll_interval.on_error()
             except Exception as e:
                 self.last_error = str(e)
                 error_msg = (
@@ -104,9 +158,12 @@ class FTPWatcher:
                 )
                 logger.error(error_msg, exc_info=True)
                 self._set_watchfolder_status('error')
-                time.sleep(30)
+                delay = self.poll_interval.on_error()
+            # Attesa interrompibile da stop()
+            self._wakeup.wait(delay)
 
     def _check_ftp_files(self):
+        """Esegue un poll. Ritorna True se ci sono upload in corso o file appena acquisiti."""
         db_session = self.db_session_factory()
         try:
             watchfolder = db_session.query(WatchFolder).filter(
@@ -114,144 +171,84 @@ class FTPWatcher:
             ).first()
 
             if not watchfolder or not watchfolder.active:
-                return
+                return False
 
             logger.info(
                 f"FTP check: connessione a {watchfolder.ftp_host}:{watchfolder.ftp_port}..."
             )
 
-            ftp_password = watchfolder.ftp_password or ''
-            session_cls = ftp_session_factory(30)
-            with ftputil.FTPHost(
-                watchfolder.ftp_host,
-                watchfolder.ftp_username,
-                ftp_password,
-                port=watchfolder.ftp_port or 21,
-                session_factory=session_cls,
-            ) as ftp:
-                ftp.timeout = 60
-                logger.info(f"FTP connesso a {watchfolder.ftp_host}")
+            with open_remote_source(watchfolder) as source:
+                logger.info(f"Connesso a {watchfolder.ftp_host} ({type(source).__name__})")
 
                 remote_path = watchfolder.ftp_remote_path or '/'
-                chdir_ftp(ftp, remote_path)
                 self._set_watchfolder_status('monitoring')
 
-                files_info = []
-                try:
-                    try:
-                        files = ftp.listdir(ftp.curdir)
-                    except Exception:
-                        files = ftp.listdir('.')
-                    for filename in files:
-                        if filename in ('.', '..') or '/' in filename:
-                            continue
-                        try:
-                            if ftp.path.isfile(filename):
-                                size = ftp.path.getsize(filename)
-                                files_info.append({'name': filename, 'size': size, 'modify': ''})
-                        except Exception:
-                            files_info.append({'name': filename, 'size': 0, 'modify': ''})
-                except Exception as listdir_err:
-                    logger.info(f"listdir fallito ({listdir_err}), provo mlsd")
-                    try:
-                        for item in ftp.mlsd(ftp.curdir):
-                            name, facts = item
-                            if name in ('.', '..'):
-                                continue
-                            ftype = (facts.get('type') or '').lower()
-                            if ftype in ('dir', 'cdir', 'pdir'):
-                                continue
-                            if ftype == 'file' or not ftype:
-                                try:
-                                    sz = facts.get('size', 0)
-                                    size = int(sz) if sz else 0
-                                except (TypeError, ValueError):
-                                    size = 0
-                                files_info.append({
-                                    'name': name,
-                                    'size': size,
-                                    'modify': facts.get('modify', ''),
-                                })
-                    except Exception as mlsd_err:
-                        logger.error(f"Anche mlsd fallito: {mlsd_err}")
-                        raise
+                files_info = source.list()
 
                 logger.info(
                     f"FTP watchfolder {self.watchfolder_id}: "
                     f"trovati {len(files_info)} file in {remote_path}"
                 )
 
-                existing_filenames_lower = set()
-                check_db_session = self.db_session_factory()
-                try:
-                    existing_jobs = check_db_session.query(TranscodeJob).filter(
-                        TranscodeJob.watchfolder_id == self.watchfolder_id
-                    ).all()
-                    existing_filenames_lower = {
-                        job.input_filename.lower()
-                        for job in existing_jobs
-                        if job_blocks_ftp_redetection(job)
-                    }
-                finally:
-                    check_db_session.close()
-
+                files_by_key = {}
                 for file_info in files_info:
-                    if not self.running:
-                        break
-
                     filename = file_info['name']
+                    if '/' in filename:
+                        continue
+                    file_ext = os.path.splitext(filename)[1].lower()
+                    if file_ext not in self.allowed_extensions:
+                        continue
                     file_size = file_info.get('size', 0)
                     if isinstance(file_size, str):
                         try:
                             file_size = int(file_size)
                         except (TypeError, ValueError):
                             file_size = 0
+                    files_by_key[filename.lower()] = {
+                        'name': filename,
+                        'size': file_size or 0,
+                        'modify': file_info.get('modify', ''),
+                    }
 
-                    file_ext = os.path.splitext(filename)[1].lower()
-                    if file_ext not in self.allowed_extensions:
-                        continue
+                index_session = self.db_session_factory()
+                try:
+                    ready_files = diff_remote_listing(
+                        index_session,
+                        self.watchfolder_id,
+                        files_by_key,
+                        quiet_period=watchfolder.quiet_period or DEFAULT_QUIET_PERIOD,
+                    )
+                    uploading = count_pending_entries(index_session, self.watchfolder_id)
+                finally:
+                    index_session.close()
 
-                    filename_lower = filename.lower()
-                    if (
-                        filename_lower in self.known_files
-                        or filename_lower in existing_filenames_lower
-                    ):
-                        if filename_lower not in self.known_files:
-                            self.known_files.add(filename_lower)
-                        if filename_lower in self.pending_files:
-                            del self.pending_files[filename_lower]
-                        continue
+                for file_info in ready_files:
+                    if not self.running:
+                        break
 
-                    if '/' in filename:
-                        continue
-                    try:
-                        if not ftp.path.isfile(filename):
-                            continue
-                    except Exception:
+                    filename = file_info['name']
+                    file_size = file_info['size']
+                    if source.stat(filename) is None:
                         continue
 
-                    if filename_lower in self.pending_files:
-                        prev_size = self.pending_files[filename_lower]
-                        if file_size == prev_size and file_size > 0:
-                            del self.pending_files[filename_lower]
-                            logger.info(
-                                f"Nuovo file rilevato su FTP (size stabile): "
-                                f"{filename} ({file_size} bytes)"
-                            )
-                            self._process_ftp_file(watchfolder, ftp, filename, file_size)
-                            self.known_files.add(filename_lower)
+                    logger.info(
+                        f"Nuovo file rilevato su FTP (size stabile): "
+                        f"{filename} ({file_size} bytes)"
+                    )
+                    job_id = self._process_ftp_file(watchfolder, source, filename, file_size)
+                    index_session = self.db_session_factory()
+                    try:
+                        if job_id is None:
+                            # Nessun job creato: forse ne esiste già uno attivo per il file
+                            job_id = find_blocking_job_id(index_session, self.watchfolder_id, filename)
+                        if job_id is None:
+                            defer_index_entry(index_session, self.watchfolder_id, filename)
                         else:
-                            self.pending_files[filename_lower] = file_size
-                            logger.info(
-                                f"File {filename} in upload "
-                                f"({prev_size} -> {file_size} bytes), prossimo check tra 30s"
-                            )
-                    else:
-                        self.pending_files[filename_lower] = file_size
-                        logger.info(
-                            f"File {filename} rilevato ({file_size} bytes), "
-                            f"attendo verifica size tra 30s"
-                        )
+                            mark_index_done(index_session, self.watchfolder_id, filename, job_id)
+                    finally:
+                        index_session.close()
+
+                return bool(ready_files) or uploading > 0
 
         finally:
             db_session.close()
@@ -270,72 +267,87 @@ class FTPWatcher:
         finally:
             db_session.close()
 
-    def _process_ftp_file(self, watchfolder, ftp, filename, file_size_remote=0):
+    def _log_transfer(self, transfer):
+        logger.info(
+            f"Trasferimento {transfer.name}: {transfer.bytes_transferred} bytes in "
+            f"{transfer.elapsed:.1f}s ({bytes_to_mbps(transfer.bytes_per_sec)} Mbit/s, "
+            f"attesa limite banda {transfer.throttled_seconds:.1f}s)"
+        )
+
+    def _process_ftp_file(self, watchfolder, source, filename, file_size_remote=0):
+        """Acquisisce un file FTP stabile. Ritorna l'id del job creato (o None)."""
         if is_download_only_watchfolder(watchfolder):
-            self._process_ftp_download_only(watchfolder, ftp, filename, file_size_remote)
-        else:
-            self._process_ftp_transcode(watchfolder, ftp, filename, file_size_remote)
+            return self._process_ftp_download_only(watchfolder, source, filename, file_size_remote)
+        return self._process_ftp_transcode(watchfolder, source, filename, file_size_remote)
 
-    def _process_ftp_download_only(self, watchfolder, ftp, filename, file_size_remote=0):
+    def _process_ftp_download_only(self, watchfolder, source, filename, file_size_remote=0):
         db_session = self.db_session_factory()
         job_id = None
         local_file_path = None
         try:
-            existing = db_session.query(TranscodeJob).filter(
-                TranscodeJob.input_filename == filename,
-                TranscodeJob.watchfolder_id == self.watchfolder_id,
-                TranscodeJob.status.in_([
-                    FileStatus.PENDING,
-                    FileStatus.PROCESSING,
-                    FileStatus.PAUSED,
-                ]),
-            ).first()
-            if existing:
-                return
-
             output_dir = watchfolder.output_path or watchfolder.ftp_local_temp or DEFAULT_FTP_LOCAL_TEMP
             ensure_shared_directory(output_dir)
             local_file_path = os.path.join(output_dir, filename)
 
-            job = TranscodeJob(
-                watchfolder_id=self.watchfolder_id,
-                preset_id=None,
-                input_filename=filename,
-                input_path=local_file_path,
-                output_path=local_file_path,
-                status=FileStatus.PROCESSING,
-                progress=0,
-                input_size=file_size_remote or None,
-                started_at=datetime.utcnow(),
+            # Dedup per nome nel watchfolder e creazione job nella stessa transazione.
+            # Lease del processo web: rinnovata dal suo LeaseKeeper finché il download è vivo
+            now = datetime.utcnow()
+            inserted, _ = enqueue_jobs(
+                db_session,
+                [{
+                    'watchfolder_id': self.watchfolder_id,
+                    'preset_id': None,
+                    'input_filename': filename,
+                    'input_path': local_file_path,
+                    'output_path': local_file_path,
+                    'status': FileStatus.PROCESSING,
+                    'input_size': file_size_remote or None,
+                    'started_at': now,
+                    'lease_owner': process_owner(),
+                    'heartbeat_at': now,
+                    'lease_expires_at': now + timedelta(seconds=LEASE_TTL_SEC),
+                }],
+                dedupe_by=DEDUPE_BY_FILENAME,
+                return_ids=True,
             )
-            db_session.add(job)
-            db_session.commit()
-            job_id = job.id
+            if not inserted:
+                return
+            job_id = inserted[0]['id']
             db_session.close()
             db_session = None
 
             logger.info(f"Download-only job {job_id}: scarico {filename} in {local_file_path}")
 
-            last_progress = -1
-
-            def on_progress(percent):
-                nonlocal last_progress
-                if percent - last_progress < 5 and percent < 100:
-                    return
-                last_progress = percent
-                self._update_job_fields(job_id, progress=percent)
-
-            download_with_progress(
-                ftp,
-                filename,
-                local_file_path,
-                file_size_remote,
-                on_progress,
+            transfer = bandwidth_manager.start_transfer(
+                self.watchfolder_id, watchfolder.ftp_host, filename, file_size_remote
             )
 
+            def on_progress(percent, bytes_received):
+                fields = {
+                    'bytes_transferred': bytes_received,
+                    'transfer_rate': transfer.bytes_per_sec,
+                }
+                if percent is not None:
+                    fields['progress'] = percent
+                self.progress_writer.update(job_id, **fields)
+
+            try:
+                download_with_progress(
+                    source,
+                    filename,
+                    local_file_path,
+                    file_size_remote,
+                    on_progress,
+                    transfer,
+                )
+            finally:
+                transfer.finish()
+                self.progress_writer.flush(job_id)
+            self._log_transfer(transfer)
+
             job = self._update_job_fields(job_id)
             if not job:
-                return
+                return job_id
             if job.status in (FileStatus.CANCELLED, FileStatus.PAUSED):
                 if os.path.exists(local_file_path):
                     try:
@@ -343,7 +355,7 @@ class FTPWatcher:
                     except OSError:
                         pass
                 logger.info(f"Download job {job_id} interrotto (stato {job.status.value})")
-                return
+                return job_id
 
             if not os.path.exists(local_file_path):
                 self._update_job_fields(
@@ -352,7 +364,7 @@ class FTPWatcher:
                     error_message='File locale non trovato dopo il download',
                     completed_at=datetime.utcnow(),
                 )
-                return
+                return job_id
 
             file_size = os.path.getsize(local_file_path)
             if file_size == 0:
@@ -363,7 +375,7 @@ class FTPWatcher:
                     error_message='File scaricato vuoto',
                     completed_at=datetime.utcnow(),
                 )
-                return
+                return job_id
 
             self._update_job_fields(
                 job_id,
@@ -371,6 +383,8 @@ class FTPWatcher:
                 progress=100,
                 input_size=file_size,
                 output_size=file_size,
+                bytes_transferred=transfer.bytes_transferred,
+                transfer_rate=transfer.bytes_per_sec,
                 completed_at=datetime.utcnow(),
             )
             ensure_shared_file(local_file_path)
@@ -396,21 +410,15 @@ class FTPWatcher:
         finally:
             if db_session is not None:
                 db_session.close()
+        return job_id
 
-    def _process_ftp_transcode(self, watchfolder, ftp, filename, file_size_remote=0):
+    def _process_ftp_transcode(self, watchfolder, source, filename, file_size_remote=0):
         db_session = self.db_session_factory()
         try:
-            existing = db_session.query(TranscodeJob).filter(
-                TranscodeJob.input_filename == filename,
-                TranscodeJob.watchfolder_id == self.watchfolder_id,
-                TranscodeJob.status.in_([
-                    FileStatus.PENDING,
-                    FileStatus.PROCESSING,
-                    FileStatus.PAUSED,
-                ]),
-            ).first()
-
-            if existing:
+            # Nessun download se il file ha già un job attivo
+            if find_active_keys(
+                db_session, [filename], DEDUPE_BY_FILENAME, self.watchfolder_id
+            ):
                 return
 
             local_temp = watchfolder.ftp_local_temp or DEFAULT_FTP_LOCAL_TEMP
@@ -428,7 +436,16 @@ class FTPWatcher:
 
             try:
                 logger.info(f"Download file {filename} da FTP a {local_file_path}")
-                ftp.download(filename, local_file_path)
+                transfer = bandwidth_manager.start_transfer(
+                    self.watchfolder_id, watchfolder.ftp_host, filename, file_size_remote
+                )
+                try:
+                    download_with_progress(
+                        source, filename, local_file_path, file_size_remote, None, transfer
+                    )
+                finally:
+                    transfer.finish()
+                self._log_transfer(transfer)
                 file_size = os.path.getsize(local_file_path)
                 ensure_shared_file(local_file_path)
                 logger.info(f"Download completato: {filename} ({file_size} bytes)")
@@ -449,30 +466,29 @@ class FTPWatcher:
             output_dir = watchfolder.output_path if watchfolder.output_path else local_temp
             ensure_shared_directory(output_dir)
 
-            base_name = os.path.splitext(filename)[0]
-            container = watchfolder.preset.container if watchfolder.preset else 'mxf'
-            preset_name = (
-                watchfolder.preset.name.lower().replace(' ', '_')
-                if watchfolder.preset
-                else 'default'
-            )
-            output_filename = f"{base_name}_{preset_name}.{container}"
-            output_path = os.path.join(output_dir, output_filename)
-
-            job = TranscodeJob(
-                watchfolder_id=self.watchfolder_id,
-                preset_id=watchfolder.preset_id,
-                input_filename=filename,
-                input_path=local_file_path,
-                output_path=output_path,
-                status=FileStatus.PENDING,
-                input_size=file_size,
+            output_path = os.path.join(
+                output_dir, build_output_filename(watchfolder.preset, filename)
             )
 
-            db_session.add(job)
-            db_session.commit()
+            inserted, _ = enqueue_jobs(
+                db_session,
+                [{
+                    'watchfolder_id': self.watchfolder_id,
+                    'preset_id': watchfolder.preset_id,
+                    'input_filename': filename,
+                    'input_path': local_file_path,
+                    'output_path': output_path,
+                    'input_size': file_size,
+                }],
+                dedupe_by=DEDUPE_BY_FILENAME,
+                return_ids=True,
+            )
+            if not inserted:
+                return
 
-            logger.info(f"File FTP {filename} scaricato e job {job.id} creato")
+            job_id = inserted[0]['id']
+            logger.info(f"File FTP {filename} scaricato e job {job_id} creato")
+            return job_id
 
         except Exception as e:
             db_session.rollback()
@@ -0,0 +1,245 @@
+"""
+Staging dei sorgenti su disco scratch locale. Con input e output su NAS, FFmpeg fa
+molte letture piccole e casuali via SMB/NFS; copiare prima il sorgente con letture
+sequenziali grandi (mentre il job precedente codifica) e codificare dal disco locale
+recupera buona parte del throughput. Budget di spazio con eviction LRU.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from output_publish import ORPHAN_TEMP_MIN_AGE_SEC
+from path_utils import PARTIAL_PREFIX, ensure_shared_directory
+
+logger = logging.getLogger('XDCAMTranscoder.Staging')
+
+# Directory scratch locale (vuoto = staging disattivato)
+INPUT_STAGING_DIR = os.getenv('INPUT_STAGING_DIR', '').strip()
+INPUT_STAGING_MAX_GB = float(os.getenv('INPUT_STAGING_MAX_GB', '200'))
+INPUT_STAGING_BLOCK_MB = int(os.getenv('INPUT_STAGING_BLOCK_MB', '16'))
+# Spazio libero da lasciare comunque sul volume scratch (output in codifica, altro)
+INPUT_STAGING_RESERVE_GB = float(os.getenv('INPUT_STAGING_RESERVE_GB', '20'))
+
+# Nomi generati da _begin/_copy: "<sha1[:12]>-<nome>" ed eventuale prefisso del parziale
+_STAGED_NAME = re.compile(r'^(?:' + re.escape(PARTIAL_PREFIX) + r')?[0-9a-f]{12}-')
+
+
+class _StagedInput:
+    __slots__ = ('path', 'size', 'source_mtime', 'ready', 'failed', 'in_use', 'last_used')
+
+    def __init__(self, path, size, source_mtime):
+        self.path = path
+        self.size = size
+        self.source_mtime = source_mtime
+        self.ready = threading.Event()
+        self.failed = False
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class InputStager:
+    """
+    Copie locali dei sorgenti, indicizzate per path sorgente (un job riaccodato
+    riusa la copia se size e mtime del sorgente non sono cambiati).
+    prefetch() copia in background; acquire() restituisce il path da passare a
+    FFmpeg, attendendo un prefetch in corso o copiando al momento; release() rende
+    la copia evictable. Se il file non entra nel budget si codifica dal path originale.
+    """
+
+    def __init__(
+        self,
+        staging_dir=INPUT_STAGING_DIR,
+        max_bytes=int(INPUT_STAGING_MAX_GB * 1024 ** 3),
+        block_size=INPUT_STAGING_BLOCK_MB * 1024 * 1024,
+        reserve_bytes=int(INPUT_STAGING_RESERVE_GB * 1024 ** 3),
+        leftover_min_age_sec=ORPHAN_TEMP_MIN_AGE_SEC,
+    ):
+        self.staging_dir = staging_dir
+        self.max_bytes = max_bytes
+        self.block_size = max(1024 * 1024, block_size)
+        self.reserve_bytes = reserve_bytes
+        self.leftover_min_age_sec = leftover_min_age_sec
+        self._entries = OrderedDict()  # input_path -> _StagedInput, ordine LRU
+        self._lock = threading.Lock()
+        self._prefetcher = None
+        self._prepared = False
+
+    @property
+    def enabled(self):
+        return bool(self.staging_dir)
+
+    def used_bytes(self):
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def prefetch(self, input_path):
+        """Accoda la copia di un sorgente che verrà codificato a breve."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='InputPrefetch')
+        self._prefetcher.submit(self._prefetch, input_path)
+
+    def acquire(self, input_path):
+        """Path locale del sorgente (copiandolo se serve) oppure input_path come fallback."""
+        if not self.enabled:
+            return input_path
+        try:
+            entry, owner = self._begin(input_path)
+        except OSError as e:
+            logger.warning("Staging non disponibile per %s: %s", input_path, e)
+            return input_path
+        if entry is None:
+            return input_path
+        if owner:
+            self._copy(entry, input_path)
+        else:
+            entry.ready.wait()
+        with self._lock:
+            if entry.failed or self._entries.get(input_path) is not entry:
+                return input_path
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+        return entry.path
+
+    def release(self, input_path):
+        with self._lock:
+            entry = self._entries.get(input_path)
+            if entry and entry.in_use:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def shutdown(self):
+        if self._prefetcher:
+            self._prefetcher.shutdown(wait=False)
+            self._prefetcher = None
+
+    def _prepare(self):
+        """
+        Prima volta: crea la directory e scarta le copie di un'esecuzione precedente.
+        Solo i file con la nostra nomenclatura e fermi da leftover_min_age_sec: la
+        directory può essere condivisa con altro (OUTPUT_SCRATCH_DIR, altri processi).
+        """
+        ensure_shared_directory(self.staging_dir)
+        cutoff = time.time() - self.leftover_min_age_sec
+        for name in os.listdir(self.staging_dir):
+            if not _STAGED_NAME.match(name):
+                continue
+            path = os.path.join(self.staging_dir, name)
+            try:
+                st = os.stat(path)
+                if os.path.isfile(path) and st.st_mtime <= cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+        self._prepared = True
+
+    def _prefetch(self, input_path):
+        try:
+            entry, owner = self._begin(input_path)
+            if owner:
+                self._copy(entry, input_path)
+        except Exception as e:
+            logger.warning("Prefetch fallito per %s: %s", input_path, e)
+
+    def _begin(self, input_path):
+        """
+        Ritorna (voce, True se il chiamante deve copiare) oppure (None, False) se il
+        file non entra nel budget.
+        """
+        st = os.stat(input_path)
+        with self._lock:
+            if not self._prepared:
+                self._prepare()
+            entry = self._entries.get(input_path)
+            if entry is not None:
+                if not entry.failed and (entry.size, entry.source_mtime) == (st.st_size, st.st_mtime):
+                    self._entries.move_to_end(input_path)
+                    return entry, False
+                if entry.in_use or not entry.ready.is_set():
+                    # Sorgente cambiato mentre la vecchia copia è in uso: niente staging
+                    return None, False
+                self._drop(input_path, entry)
+            if not self._reserve(st.st_size):
+                logger.info("Staging saltato per %s: budget scratch insufficiente", input_path)
+                return None, False
+            key = hashlib.sha1(input_path.encode('utf-8')).hexdigest()[:12]
+            name = f"{key}-{os.path.basename(input_path)}"
+            entry = _StagedInput(os.path.join(self.staging_dir, name), st.st_size, st.st_mtime)
+            self._entries[input_path] = entry
+            return entry, True
+
+    def _reserve(self, size):
+        """Libera copie inattive (LRU) finché size entra nel budget e nello spazio libero."""
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        while True:
+            used = sum(entry.size for entry in self._entries.values())
+            # Le copie in corso occuperanno ancora spazio (stima per eccesso: size intera)
+            in_flight = sum(entry.size for entry in self._entries.values() if not entry.ready.is_set())
+            free = shutil.disk_usage(self.staging_dir).free
+            fits_budget = not self.max_bytes or used + size <= self.max_bytes
+            fits_disk = free - in_flight - size >= self.reserve_bytes
+            if fits_budget and fits_disk:
+                return True
+            victim = next(
+                (
+                    (path, entry) for path, entry in self._entries.items()
+                    if entry.in_use == 0 and entry.ready.is_set()
+                ),
+                None,
+            )
+            if victim is None:
+                return False
+            self._drop(*victim)
+
+    def _drop(self, input_path, entry):
+        self._entries.pop(input_path, None)
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Rimozione copia scratch fallita %s: %s", entry.path, e)
+
+    def _copy(self, entry, input_path):
+        """Copia sequenziale a blocchi grandi su nome temporaneo, poi rename."""
+        temp_path = os.path.join(self.staging_dir, PARTIAL_PREFIX + os.path.basename(entry.path))
+        start = time.monotonic()
+        try:
+            with open(input_path, 'rb', buffering=0) as src, open(temp_path, 'wb') as dst:
+                try:
+                    os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except (AttributeError, OSError):
+                    pass
+                while True:
+                    block = src.read(self.block_size)
+                    if not block:
+                        break
+                    dst.write(block)
+            os.replace(temp_path, entry.path)
+            elapsed = max(time.monotonic() - start, 1e-6)
+            logger.info(
+                "Staging %s: %.1f MB in %.1fs (%.0f MB/s)",
+                input_path, entry.size / 1e6, elapsed, entry.size / 1e6 / elapsed,
+            )
+        except OSError as e:
+            logger.warning("Staging fallito per %s: %s", input_path, e)
+            entry.failed = True
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            with self._lock:
+                if self._entries.get(input_path) is entry:
+                    self._entries.pop(input_path)
+        finally:
+            entry.ready.set()
@@ -3,7 +3,9 @@
 import os
 from datetime import datetime
 
+from job_suspend import head_segment_path
 from models import TranscodeJob, FileStatus
+from output_publish import remove_quietly, temp_output_path
 
 
 REQUEUEABLE = frozenset({
@@ -26,14 +28,17 @@ CANCELLABLE = frozenset({
 
 def _clear_worker_assignment(job):
     job.worker_id = None
+    job.lease_owner = None
+    job.lease_expires_at = None
 
 
 def _remove_partial_output(job):
-    if job.output_path and os.path.exists(job.output_path):
-        try:
-            os.remove(job.output_path)
-        except OSError:
-            pass
+    # FFmpeg scrive su un temporaneo nascosto: output_path contiene solo output completi
+    if job.output_path and job.id:
+        remove_quietly(temp_output_path(job.output_path, job.id))
+        remove_quietly(head_segment_path(job.output_path, job.id))
+    # Un FFmpeg sospeso (suspended_pid) viene terminato dal processo worker che lo tiene
+    job.checkpoint_sec = None
 
 
 def pause_job(job):
@@ -41,7 +46,9 @@ def pause_job(job):
     if job.status not in PAUSABLE:
         raise ValueError(f'Job non mettibile in pausa (stato: {job.status.value})')
     job.status = FileStatus.PAUSED
-    _clear_worker_assignment(job)
+    if not job.suspended_pid:
+        # Sospeso e ripreso ma non ancora riassegnato: il processo che lo tiene resta
+        _clear_worker_assignment(job)
     job.completed_at = None
 
 
@@ -53,7 +60,7 @@ def cancel_job(job):
     job.status = FileStatus.CANCELLED
     _clear_worker_assignment(job)
     job.completed_at = datetime.utcnow()
-    if was_active or job.progress:
+    if was_active or job.progress or job.checkpoint_sec:
         _remove_partial_output(job)
 
 
@@ -68,7 +75,7 @@ def requeue_job(job):
 
     _remove_partial_output(job)
     job.status = FileStatus.PENDING
-    job.worker_id = None
+    _clear_worker_assignment(job)
     job.progress = 0
     job.error_message = None
     job.started_at = None
@@ -76,10 +83,27 @@ def requeue_job(job):
     job.output_size = None
     job.output_duration = None
     job.output_mediainfo = None
+    job.recovery_count = 0
+    job.attempt_count = 0
+    job.first_attempt_at = None
+    job.next_attempt_at = None
+    job.failure_class = None
+    # Il sorgente può essere stato sostituito: impronta e hash vanno ricalcolati
+    job.input_fingerprint = None
+    job.input_hash = None
 
 
 def resume_job(job):
-    """Riprende un job in pausa (ricomincia la transcodifica da capo)."""
+    """
+    Riprende un job in pausa: FFmpeg sospeso continua dal punto in cui era, un parziale
+    con checkpoint riparte da lì, altrimenti la transcodifica ricomincia da capo.
+    """
     if job.status != FileStatus.PAUSED:
         raise ValueError(f'Solo i job in pausa possono essere ripresi (stato: {job.status.value})')
+    if job.suspended_pid or job.checkpoint_sec:
+        # lease_owner resta: solo il processo che tiene FFmpeg fermo può riprenderlo
+        job.status = FileStatus.PENDING
+        job.error_message = None
+        job.completed_at = None
+        return
     requeue_job(job)
@@ -0,0 +1,89 @@
+"""Inserimento job a blocchi: dedup set-based contro i job attivi e una sola transazione."""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import TranscodeJob, FileStatus
+from ftp_index import SQLITE_IN_CHUNK
+from local_scan import batches
+
+# Un job in questi stati blocca un nuovo job per lo stesso file
+ACTIVE_JOB_STATUSES = (FileStatus.PENDING, FileStatus.PROCESSING, FileStatus.PAUSED)
+
+DEDUPE_BY_PATH = 'input_path'  # stesso file locale, qualsiasi watchfolder
+DEDUPE_BY_FILENAME = 'input_filename'  # stesso nome nello stesso watchfolder (FTP)
+
+
+def build_output_filename(preset, input_filename):
+    """<nome>_<preset>.<container> come per tutti i job di transcodifica."""
+    base_name = os.path.splitext(input_filename)[0]
+    container = preset.container if preset else 'mxf'
+    preset_name = preset.name.lower().replace(' ', '_') if preset else 'default'
+    return f"{base_name}_{preset_name}.{container}"
+
+
+def find_active_keys(session, keys, dedupe_by=DEDUPE_BY_PATH, watchfolder_id=None):
+    """
+    Chiavi (input_path o input_filename) che hanno già un job attivo.
+    Una IN per blocco di SQLITE_IN_CHUNK chiavi invece di una query per file.
+    """
+    column = getattr(TranscodeJob, dedupe_by)
+    found = set()
+    for chunk in batches(list(keys), SQLITE_IN_CHUNK):
+        query = session.query(column).filter(
+            column.in_(chunk),
+            TranscodeJob.status.in_(ACTIVE_JOB_STATUSES),
+        )
+        if dedupe_by == DEDUPE_BY_FILENAME:
+            query = query.filter(TranscodeJob.watchfolder_id == watchfolder_id)
+        found.update(value for (value,) in query.all())
+    return found
+
+
+def enqueue_jobs(session, rows, dedupe_by=DEDUPE_BY_PATH, return_ids=False):
+    """
+    Inserisce i job descritti da `rows` (dict con i valori delle colonne di
+    TranscodeJob) scartando i duplicati nel blocco e quelli con un job attivo.
+    Tutte le righe nuove vanno in un solo INSERT executemany e un solo commit.
+    Ritorna (righe inserite, chiavi già coperte da un job attivo); con return_ids
+    ogni riga riceve 'id' (RETURNING, una riga per statement su SQLite: usarlo
+    solo per inserimenti singoli come quelli FTP).
+    """
+    unique = {}
+    for row in rows:
+        unique.setdefault(row[dedupe_by], row)
+    if not unique:
+        return [], set()
+
+    watchfolder_ids = {row.get('watchfolder_id') for row in unique.values()}
+    if dedupe_by == DEDUPE_BY_FILENAME and len(watchfolder_ids) != 1:
+        raise ValueError('dedup per nome file richiede job di un solo watchfolder')
+
+    existing = find_active_keys(
+        session, unique, dedupe_by=dedupe_by, watchfolder_id=next(iter(watchfolder_ids))
+    )
+    now = datetime.utcnow()
+    new_rows = []
+    for key, row in unique.items():
+        if key in existing:
+            continue
+        row = dict(row)
+        row.setdefault('status', FileStatus.PENDING)
+        row.setdefault('progress', 0)
+        row.setdefault('created_at', now)
+        new_rows.append(row)
+
+    if new_rows and return_ids:
+        result = session.execute(
+            insert(TranscodeJob).returning(TranscodeJob.id, sort_by_parameter_order=True),
+            new_rows,
+        )
+        for row, job_id in zip(new_rows, result.scalars().all()):
+            row['id'] = job_id
+    elif new_rows:
+        # executemany senza oggetti ORM: nessun refresh/SELECT dopo il commit
+        session.execute(insert(TranscodeJob), new_rows)
+    session.commit()
+    return new_rows, existing
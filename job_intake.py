@@ -0,0 +1,87 @@
+"""Pool condiviso che crea i job dei watchfolder locali a blocchi (più file per transazione)."""
+
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger('XDCAMTranscoder.Intake')
+
+INTAKE_WORKERS = int(os.getenv('WATCH_INTAKE_WORKERS', '2'))
+INTAKE_BATCH_SIZE = int(os.getenv('WATCH_INTAKE_BATCH', '200'))
+# Coda limitata: con migliaia di file in arrivo chi accoda attende (backpressure)
+INTAKE_MAX_QUEUE = int(os.getenv('WATCH_INTAKE_QUEUE', '10000'))
+
+
+class JobIntake:
+    """
+    Riceve i file stabili da tutti i WatchFolderHandler e li passa a un numero
+    limitato di worker: ogni worker preleva fino a batch_size file, li raggruppa per
+    handler e chiama handler.acquire(files) una volta per gruppo (una transazione).
+    """
+
+    def __init__(
+        self,
+        workers=INTAKE_WORKERS,
+        batch_size=INTAKE_BATCH_SIZE,
+        max_queue=INTAKE_MAX_QUEUE,
+    ):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'JobIntake-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(self, handler, files):
+        """Accoda [(path, size, mtime)] per l'handler; blocca se la coda è piena."""
+        for file_info in files:
+            self._queue.put((handler, file_info))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def drain_once(self, block=True, timeout=0.5):
+        """Preleva ed elabora un blocco. Ritorna il numero di file elaborati."""
+        try:
+            first = self._queue.get(block=block, timeout=timeout if block else None)
+        except queue.Empty:
+            return 0
+        items = [first]
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        groups = {}
+        for handler, file_info in items:
+            groups.setdefault(handler, []).append(file_info)
+        for handler, files in groups.items():
+            try:
+                handler.acquire(files)
+            except Exception as e:
+                logger.error(
+                    f"Errore creazione job watchfolder {handler.watchfolder_id}: {e}", exc_info=True
+                )
+        for _ in items:
+            self._queue.task_done()
+        return len(items)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.drain_once()
@@ -0,0 +1,131 @@
+"""
+Lease dei job sulla coda condivisa: più processi worker (anche su nodi diversi, stesso
+database) si contendono i job PENDING con un UPDATE condizionale, quindi al più uno
+vince. Chi esegue un job rinnova periodicamente heartbeat e scadenza; se un nodo muore
+la lease scade e qualunque altro processo rimette il job in coda (job_recovery).
+"""
+
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from models import FileStatus, TranscodeJob
+
+logger = logging.getLogger('XDCAMTranscoder.Lease')
+
+NODE_NAME = os.getenv('NODE_NAME', '').strip() or socket.gethostname()
+# Durata della lease senza heartbeat; il rinnovo avviene ogni LEASE_HEARTBEAT_SEC
+LEASE_TTL_SEC = int(os.getenv('LEASE_TTL_SEC', '60'))
+LEASE_HEARTBEAT_SEC = int(os.getenv('LEASE_HEARTBEAT_SEC', '15'))
+
+
+def process_owner(node=NODE_NAME):
+    """Identità del processo che detiene le lease: nodo e pid."""
+    return f'{node}:{os.getpid()}'
+
+
+def claim_job(session, job_id, owner, worker_id=None, ttl=LEASE_TTL_SEC, now=None):
+    """
+    Assegna il job solo se è ancora PENDING e libero (compare-and-set nel database)
+    e conta il tentativo. Ritorna True se la lease è di `owner`.
+    """
+    now = now or datetime.utcnow()
+    claimed = (
+        session.query(TranscodeJob)
+        .filter(
+            TranscodeJob.id == job_id,
+            TranscodeJob.status == FileStatus.PENDING,
+            TranscodeJob.worker_id.is_(None),
+        )
+        .update(
+            {
+                TranscodeJob.status: FileStatus.PROCESSING,
+                TranscodeJob.worker_id: worker_id,
+                TranscodeJob.started_at: now,
+                TranscodeJob.lease_owner: owner,
+                TranscodeJob.heartbeat_at: now,
+                TranscodeJob.lease_expires_at: now + timedelta(seconds=ttl),
+                TranscodeJob.attempt_count: func.coalesce(TranscodeJob.attempt_count, 0) + 1,
+                TranscodeJob.first_attempt_at: func.coalesce(TranscodeJob.first_attempt_at, now),
+                TranscodeJob.next_attempt_at: None,
+            },
+            synchronize_session=False,
+        )
+    )
+    session.commit()
+    return claimed == 1
+
+
+def renew_leases(session, owner, ttl=LEASE_TTL_SEC, now=None):
+    """Heartbeat di tutti i job in esecuzione o sospesi di `owner` con un solo UPDATE. Ritorna quanti."""
+    now = now or datetime.utcnow()
+    renewed = (
+        session.query(TranscodeJob)
+        .filter(
+            TranscodeJob.lease_owner == owner,
+            or_(TranscodeJob.status == FileStatus.PROCESSING, TranscodeJob.suspended_pid.isnot(None)),
+        )
+        .update(
+            {
+                TranscodeJob.heartbeat_at: now,
+                TranscodeJob.lease_expires_at: now + timedelta(seconds=ttl),
+            },
+            synchronize_session=False,
+        )
+    )
+    session.commit()
+    return renewed
+
+
+def release_lease(job):
+    """Il job non è più in esecuzione: niente scadenza da sorvegliare (owner resta come storico)."""
+    job.lease_expires_at = None
+
+
+class LeaseKeeper:
+    """
+    Thread di heartbeat del processo: rinnova le lease di `owner`, poi chiama
+    recover(session) (watchdog dei job orfani, anche di altri nodi).
+    """
+
+    def __init__(self, session_factory, owner, ttl=LEASE_TTL_SEC, interval=LEASE_HEARTBEAT_SEC, recover=None):
+        self.session_factory = session_factory
+        self.owner = owner
+        self.recover = recover
+        self.ttl = ttl
+        self.interval = max(1, min(interval, ttl // 2 or 1))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='LeaseKeeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+
+    def tick(self):
+        session = self.session_factory()
+        try:
+            renew_leases(session, self.owner, self.ttl)
+            if self.recover:
+                self.recover(session)
+        except Exception as e:
+            session.rollback()
+            logger.warning("Heartbeat lease non riuscito (%s): %s", self.owner, e)
+        finally:
+            session.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
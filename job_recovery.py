@@ -0,0 +1,143 @@
+"""
+Recupero dei job rimasti PROCESSING senza un processo che li esegua (servizio
+terminato durante la codifica, nodo morto, thread slot caduto). Il passaggio gira
+all'avvio, prima dei worker, e poi periodicamente insieme all'heartbeat delle lease:
+rimuove l'output parziale e rimette il job in coda, fino a RECOVERY_MAX_RETRIES volte.
+
+Orfano è un job PROCESSING:
+- senza lease (assegnato prima delle lease) e non in esecuzione in questo processo
+- con lease scaduta
+- con lease di un processo di questo nodo che non esiste più
+- con lease di questo processo ma non in esecuzione in nessuno slot
+I job solo download sono eseguiti dai watcher FTP del processo web, non dagli slot:
+orfani solo con lease scaduta, senza lease o di un processo morto. Non vanno in
+coda (nessuno slot li esegue) ma in FAILED, così il watcher li riscarica.
+Le query filtrano per stato (indice su status): il costo dipende dai job in
+esecuzione, non dalla dimensione della tabella.
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import FileStatus, TranscodeJob, WatchFolder
+from output_publish import remove_quietly, temp_output_path
+
+logger = logging.getLogger('XDCAMTranscoder.Recovery')
+
+RECOVERY_MAX_RETRIES = int(os.getenv('RECOVERY_MAX_RETRIES', '3'))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _owner_is_dead(lease_owner, node, own_owner):
+    """Lease di un altro processo dello stesso nodo: verificabile con il pid."""
+    if not lease_owner or lease_owner == own_owner:
+        return False
+    owner_node, _, pid = lease_owner.rpartition(':')
+    if owner_node != node or not pid.isdigit():
+        return False
+    return not _pid_alive(int(pid))
+
+
+def find_orphaned_jobs(session, owner, active_job_ids=(), now=None):
+    """Job PROCESSING orfani secondo le regole del modulo, come coppie (job, solo_download)."""
+    now = now or datetime.utcnow()
+    node = owner.rpartition(':')[0]
+    active = set(active_job_ids)
+    orphans = []
+    rows = (
+        session.query(TranscodeJob, func.coalesce(WatchFolder.operation_mode, 'transcode') == 'download_only')
+        .outerjoin(WatchFolder, TranscodeJob.watchfolder_id == WatchFolder.id)
+        .filter(TranscodeJob.status == FileStatus.PROCESSING)
+    )
+    for job, download_only in rows:
+        if job.id in active:
+            continue
+        if (
+            job.lease_expires_at is None
+            or job.lease_expires_at < now
+            or (job.lease_owner == owner and not download_only)
+            or _owner_is_dead(job.lease_owner, node, owner)
+        ):
+            orphans.append((job, bool(download_only)))
+    return orphans
+
+
+def recover_orphaned_jobs(session, owner, active_job_ids=(), now=None, max_retries=RECOVERY_MAX_RETRIES):
+    """
+    Rimette in coda (o chiude come FAILED oltre max_retries) i job orfani.
+    Ritorna {'requeued': [id], 'failed': [id]}.
+    """
+    now = now or datetime.utcnow()
+    result = {'requeued': [], 'failed': []}
+    for job, download_only in find_orphaned_jobs(session, owner, active_job_ids, now):
+        job_id = job.id
+        lease_owner, lease_expires_at, output_path = job.lease_owner, job.lease_expires_at, job.output_path
+        recoveries = (job.recovery_count or 0) + 1
+        if download_only:
+            values = {
+                TranscodeJob.status: FileStatus.FAILED,
+                TranscodeJob.completed_at: now,
+                TranscodeJob.error_message: 'Download interrotto (processo terminato)',
+            }
+            outcome = 'failed'
+        elif recoveries > max_retries:
+            values = {
+                TranscodeJob.status: FileStatus.FAILED,
+                TranscodeJob.completed_at: now,
+                TranscodeJob.error_message: f'Codifica interrotta {recoveries} volte (processo terminato)',
+            }
+            outcome = 'failed'
+        else:
+            values = {
+                TranscodeJob.status: FileStatus.PENDING,
+                TranscodeJob.progress: 0,
+                TranscodeJob.started_at: None,
+            }
+            outcome = 'requeued'
+        values.update({
+            TranscodeJob.worker_id: None,
+            TranscodeJob.lease_owner: None,
+            TranscodeJob.lease_expires_at: None,
+            TranscodeJob.recovery_count: recoveries,
+        })
+        # Stessa lease letta sopra: un heartbeat o un'azione utente nel frattempo vince
+        updated = (
+            session.query(TranscodeJob)
+            .filter(
+                TranscodeJob.id == job_id,
+                TranscodeJob.status == FileStatus.PROCESSING,
+                _same_value(TranscodeJob.lease_owner, lease_owner),
+                _same_value(TranscodeJob.lease_expires_at, lease_expires_at),
+            )
+            .update(values, synchronize_session=False)
+        )
+        session.commit()
+        if not updated:
+            continue
+        if download_only and output_path:
+            # File locale scaricato solo in parte
+            remove_quietly(output_path)
+        elif output_path:
+            remove_quietly(temp_output_path(output_path, job_id))
+        result[outcome].append(job_id)
+    if result['requeued'] or result['failed']:
+        logger.warning(
+            "Job orfani recuperati: riaccodati %s, falliti %s", result['requeued'], result['failed']
+        )
+    return result
+
+
+def _same_value(column, value):
+    return column.is_(None) if value is None else column == value
@@ -0,0 +1,132 @@
+"""
+Nuovi tentativi automatici per i job falliti per cause transitorie (NAS non
+raggiungibile, file temporaneamente assente, processo ucciso), con backoff
+esponenziale. Gli errori permanenti (sorgente corrotto, parametri FFmpeg errati,
+permessi) vanno subito in FAILED. Politica per watchfolder, poi preset, poi env.
+"""
+
+import logging
+import os
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from models import FileStatus
+
+logger = logging.getLogger('XDCAMTranscoder.Retry')
+
+# Tentativi totali (il primo compreso): 1 = nessun nuovo tentativo
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '3'))
+RETRY_BACKOFF_SEC = int(os.getenv('RETRY_BACKOFF_SEC', '60'))
+RETRY_BACKOFF_MAX_SEC = int(os.getenv('RETRY_BACKOFF_MAX_SEC', '3600'))
+# Variazione casuale del ritardo: i job falliti insieme non ripartono insieme
+RETRY_JITTER = 0.2
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+RetryPolicy = namedtuple('RetryPolicy', 'max_attempts backoff_sec')
+
+# Controllati in ordine: il primo che compare nello stderr decide
+PERMANENT_PATTERNS = (
+    'permission denied',
+    'invalid data found',
+    'unknown encoder',
+    'unknown decoder',
+    'encoder not found',
+    'unrecognized option',
+    'option not found',
+    'no such filter',
+    'error parsing',
+    'invalid argument',
+    'does not contain any stream',
+    'matches no streams',
+)
+TRANSIENT_PATTERNS = (
+    'input/output error',
+    'stale file handle',
+    'no such file or directory',
+    'cannot open',
+    'resource temporarily unavailable',
+    'device or resource busy',
+    'connection reset',
+    'connection refused',
+    'timed out',
+    'broken pipe',
+    'no space left on device',
+    'cannot allocate memory',
+)
+
+
+def classify_failure(returncode, stderr):
+    """'transient' o 'permanent' dal codice di uscita FFmpeg e dallo stderr."""
+    text = (stderr or '').lower()
+    for pattern in PERMANENT_PATTERNS:
+        if pattern in text:
+            return PERMANENT
+    for pattern in TRANSIENT_PATTERNS:
+        if pattern in text:
+            return TRANSIENT
+    if returncode is not None and returncode < 0:
+        # Ucciso da un segnale non richiesto (OOM killer, arresto del nodo)
+        return TRANSIENT
+    if returncode == 0:
+        # Uscita regolare ma output assente: tipicamente il filesystem di destinazione
+        return TRANSIENT
+    return PERMANENT
+
+
+def retry_policy(job):
+    """Valori della watchfolder, altrimenti del preset, altrimenti RETRY_* da env."""
+    max_attempts = backoff_sec = None
+    for source in (job.watchfolder, job.preset):
+        if source is None:
+            continue
+        if max_attempts is None:
+            max_attempts = source.retry_max_attempts
+        if backoff_sec is None:
+            backoff_sec = source.retry_backoff_sec
+    return RetryPolicy(
+        max_attempts if max_attempts is not None else RETRY_MAX_ATTEMPTS,
+        backoff_sec if backoff_sec is not None else RETRY_BACKOFF_SEC,
+    )
+
+
+def backoff_delay(attempt, base_sec, max_sec=RETRY_BACKOFF_MAX_SEC, jitter=RETRY_JITTER):
+    """Ritardo dopo il tentativo `attempt` (1-based): base * 2^(attempt-1), con tetto e jitter."""
+    delay = min(max_sec, base_sec * (2 ** max(0, attempt - 1)))
+    if jitter:
+        delay *= 1 + random.uniform(-jitter, jitter)
+    return max(0.0, delay)
+
+
+def fail_or_retry(job, message, failure_class, now=None):
+    """
+    Chiude il tentativo corrente: se transitorio e con tentativi residui il job torna
+    PENDING con next_attempt_at nel futuro, altrimenti FAILED. Ritorna True se riprova.
+    """
+    now = now or datetime.utcnow()
+    policy = retry_policy(job)
+    attempts = job.attempt_count or 1
+    job.failure_class = failure_class
+    job.worker_id = None
+    job.lease_owner = None
+    job.lease_expires_at = None
+    if failure_class == TRANSIENT and attempts < policy.max_attempts:
+        retry_at = now + timedelta(seconds=backoff_delay(attempts, policy.backoff_sec))
+        job.status = FileStatus.PENDING
+        job.next_attempt_at = retry_at
+        job.progress = 0
+        job.started_at = None
+        job.completed_at = None
+        job.error_message = (
+            f"{message} (tentativo {attempts}/{policy.max_attempts}, "
+            f"nuovo tentativo alle {retry_at.strftime('%H:%M:%S')} UTC)"
+        )
+        logger.warning("Job %s: errore transitorio, nuovo tentativo alle %s: %s", job.id, retry_at, message)
+        return True
+    job.status = FileStatus.FAILED
+    job.next_attempt_at = None
+    job.completed_at = now
+    job.error_message = message if attempts <= 1 else f"{message} (dopo {attempts} tentativi)"
+    return False
@@ -0,0 +1,270 @@
+"""
+Avvio isolato dei processi FFmpeg: limiti di memoria e CPU per job, niceness e classe
+di I/O dalla priorità della watchfolder, consumo misurato da os.wait4. Un sorgente
+patologico non deve poter esaurire la RAM del nodo (e con essa interfaccia web e
+altri encode).
+
+Con JOB_CGROUP_ROOT (directory cgroup v2 delegata al servizio, es. systemd
+Delegate=yes) ogni job ha un proprio sotto-gruppo con memory.max / cpu.max e
+l'OOM killer colpisce solo quel FFmpeg. Altrimenti si usano le rlimit del processo:
+RLIMIT_DATA (memoria privata allocata, più larga dell'RSS) e RLIMIT_CPU.
+
+Tutti i limiti sono applicati dopo lo spawn (prlimit, cgroup.procs, setpriority):
+preexec_fn non è sicuro con i thread slot del worker.
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import threading
+
+logger = logging.getLogger('XDCAMTranscoder.Runner')
+
+# 0 = nessun limite
+JOB_MEMORY_LIMIT_MB = int(os.getenv('JOB_MEMORY_LIMIT_MB', '0'))
+# Core equivalenti concessi a ogni job (cpu.max, solo cgroup)
+JOB_CPU_LIMIT = float(os.getenv('JOB_CPU_LIMIT', '0'))
+# Tempo CPU massimo per job (RLIMIT_CPU), oltre il quale FFmpeg viene fermato
+JOB_CPU_TIME_LIMIT_SEC = int(os.getenv('JOB_CPU_TIME_LIMIT_SEC', '0'))
+JOB_CGROUP_ROOT = os.getenv('JOB_CGROUP_ROOT', '').strip()
+# Niceness e ionice best-effort derivati dalla priority della watchfolder
+JOB_NICE_BY_PRIORITY = os.getenv('JOB_NICE_BY_PRIORITY', '1').strip().lower() in ('1', 'true', 'yes')
+
+CPU_PERIOD_USEC = 100000
+# Margine tra soft (SIGXCPU, uscita ordinata di FFmpeg) e hard limit (SIGKILL)
+CPU_TIME_GRACE_SEC = 10
+
+
+def niceness_for_priority(priority):
+    """Priority watchfolder (più basso = più urgente) -> (nice 0-19, livello ionice best-effort 0-7)."""
+    nice = min(19, max(0, int(priority) // 2))
+    return nice, min(7, nice * 8 // 20)
+
+
+def set_io_priority(pid, level):
+    """Classe best-effort (2) al livello indicato tramite ionice(1), se presente."""
+    try:
+        result = subprocess.run(
+            ['ionice', '-c', '2', '-n', str(level), '-p', str(pid)],
+            capture_output=True, timeout=5,
+        )
+        return result.returncode == 0
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug("ionice su %s non riuscito: %s", pid, e)
+        return False
+
+
+def cgroup_usable(root):
+    """La directory è un cgroup v2 scrivibile con il controller memory disponibile."""
+    if not root or not os.path.isdir(root) or not os.access(root, os.W_OK):
+        return False
+    try:
+        with open(os.path.join(root, 'cgroup.controllers')) as f:
+            return 'memory' in f.read().split()
+    except OSError:
+        return False
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(str(value))
+
+
+def _read_events(path):
+    try:
+        with open(path) as f:
+            return {key: int(value) for key, value in (line.split() for line in f if line.strip())}
+    except (OSError, ValueError):
+        return {}
+
+
+class JobRunner:
+    """Avvia i job FFmpeg con i limiti configurati; un'istanza per processo worker."""
+
+    def __init__(
+        self,
+        memory_limit_mb=JOB_MEMORY_LIMIT_MB,
+        cpu_limit=JOB_CPU_LIMIT,
+        cpu_time_limit_sec=JOB_CPU_TIME_LIMIT_SEC,
+        cgroup_root=JOB_CGROUP_ROOT,
+        nice_by_priority=JOB_NICE_BY_PRIORITY,
+    ):
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_limit = cpu_limit
+        self.cpu_time_limit_sec = cpu_time_limit_sec
+        self.nice_by_priority = nice_by_priority
+        self.cgroup_root = cgroup_root if cgroup_usable(cgroup_root) else None
+        if cgroup_root and not self.cgroup_root:
+            logger.warning("JOB_CGROUP_ROOT %s non utilizzabile (cgroup v2 delegato?): uso rlimit", cgroup_root)
+        if self.cgroup_root:
+            try:
+                # Abilita i controller per i sotto-gruppi dei job (già attivi: nessun effetto)
+                _write(os.path.join(self.cgroup_root, 'cgroup.subtree_control'), '+memory +cpu')
+            except OSError as e:
+                logger.debug("subtree_control su %s: %s", self.cgroup_root, e)
+
+    def start(self, cmd, job_id, priority=None, **popen_kwargs):
+        """Popen + limiti + priorità. Le eccezioni di Popen passano al chiamante."""
+        process = subprocess.Popen(cmd, **popen_kwargs)
+        running = RunningJob(
+            process, memory_limit_mb=self.memory_limit_mb, cpu_time_limit_sec=self.cpu_time_limit_sec
+        )
+        if self.cgroup_root and (self.memory_limit_mb or self.cpu_limit):
+            running.cgroup = self._enter_cgroup(process.pid, job_id)
+        if not running.cgroup and self.memory_limit_mb:
+            self._set_rlimit(process.pid, 'RLIMIT_DATA', self.memory_limit_mb * 1024 * 1024)
+        if self.cpu_time_limit_sec:
+            self._set_rlimit(
+                process.pid, 'RLIMIT_CPU', self.cpu_time_limit_sec, self.cpu_time_limit_sec + CPU_TIME_GRACE_SEC
+            )
+        if self.nice_by_priority and priority is not None:
+            nice, io_level = niceness_for_priority(priority)
+            try:
+                os.setpriority(os.PRIO_PROCESS, process.pid, nice)
+            except (OSError, AttributeError) as e:
+                logger.debug("setpriority su %s non riuscito: %s", process.pid, e)
+            set_io_priority(process.pid, io_level)
+        return running
+
+    def _enter_cgroup(self, pid, job_id):
+        path = os.path.join(self.cgroup_root, f'job-{job_id}')
+        try:
+            if os.path.isdir(path):
+                # Residuo di un tentativo precedente del processo terminato
+                os.rmdir(path)
+            os.mkdir(path)
+            if self.memory_limit_mb:
+                _write(os.path.join(path, 'memory.max'), self.memory_limit_mb * 1024 * 1024)
+                if os.path.exists(os.path.join(path, 'memory.swap.max')):
+                    _write(os.path.join(path, 'memory.swap.max'), 0)
+            if self.cpu_limit:
+                _write(os.path.join(path, 'cpu.max'), f'{int(self.cpu_limit * CPU_PERIOD_USEC)} {CPU_PERIOD_USEC}')
+            _write(os.path.join(path, 'cgroup.procs'), pid)
+            return path
+        except OSError as e:
+            logger.warning("cgroup %s non creato (%s): uso rlimit per il job %s", path, e, job_id)
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            return None
+
+    @staticmethod
+    def _set_rlimit(pid, name, soft, hard=None):
+        try:
+            import resource
+
+            resource.prlimit(pid, getattr(resource, name), (soft, hard if hard is not None else soft))
+        except (ImportError, AttributeError, OSError, ValueError) as e:
+            logger.debug("%s su %s non applicato: %s", name, pid, e)
+
+
+class RunningJob:
+    """
+    Popen di un job con raccolta tramite os.wait4: dopo l'uscita espone cpu_seconds e
+    peak_rss_mb del figlio (rusage) e l'eventuale limite superato. Interfaccia di Popen
+    per quanto serve al worker (poll, terminate, stderr, communicate).
+    """
+
+    def __init__(self, process, memory_limit_mb=0, cpu_time_limit_sec=0):
+        self.process = process
+        self.pid = process.pid
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_time_limit_sec = cpu_time_limit_sec
+        self.cgroup = None  # sotto-gruppo cgroup v2 del job (None = rlimit)
+        self.rusage = None
+        self.oom_killed = False
+        self._cgroup_released = False
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    @property
+    def stderr(self):
+        return self.process.stderr
+
+    @property
+    def cpu_seconds(self):
+        if self.rusage is None:
+            return None
+        return round(self.rusage.ru_utime + self.rusage.ru_stime, 2)
+
+    @property
+    def peak_rss_mb(self):
+        if self.rusage is None:
+            return None
+        # ru_maxrss in KiB su Linux
+        return self.rusage.ru_maxrss // 1024
+
+    def poll(self):
+        if self.process.returncode is None:
+            self._wait(os.WNOHANG)
+        return self.process.returncode
+
+    def wait(self):
+        if self.process.returncode is None:
+            self._wait(0)
+        return self.process.returncode
+
+    def send_signal(self, sig):
+        if self.process.returncode is None:
+            self.process.send_signal(sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self):
+        """Legge stdout/stderr fino alla chiusura, poi raccoglie il figlio con wait4."""
+        stdout_parts = []
+        reader = None
+        if self.process.stdout:
+            reader = threading.Thread(target=lambda: stdout_parts.append(self.process.stdout.read()), daemon=True)
+            reader.start()
+        stderr = self.process.stderr.read() if self.process.stderr else None
+        self.wait()
+        if reader:
+            reader.join()
+        for pipe in (self.process.stdout, self.process.stderr):
+            if pipe:
+                pipe.close()
+        return (stdout_parts[0] if stdout_parts else None), stderr
+
+    def limit_exceeded(self, stderr=''):
+        """Messaggio se il job è stato fermato da un limite di memoria o CPU, altrimenti None."""
+        if self.oom_killed:
+            return f"Limite memoria superato ({self.memory_limit_mb} MB): FFmpeg terminato"
+        if self.memory_limit_mb and not self.cgroup and 'cannot allocate memory' in (stderr or '').lower():
+            return f"Limite memoria superato ({self.memory_limit_mb} MB): allocazione rifiutata"
+        if self.cpu_time_limit_sec and (self.cpu_seconds or 0) >= self.cpu_time_limit_sec:
+            return f"Limite tempo CPU superato ({self.cpu_time_limit_sec} s)"
+        return None
+
+    def _wait(self, flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, flags)
+        except ChildProcessError:
+            # Già raccolto altrove: resta solo il codice di uscita
+            self.process.wait()
+            self._release_cgroup()
+            return
+        if pid == 0:
+            return
+        self.process.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        self._release_cgroup()
+
+    def _release_cgroup(self):
+        if not self.cgroup or self._cgroup_released:
+            return
+        self._cgroup_released = True
+        events = _read_events(os.path.join(self.cgroup, 'memory.events'))
+        self.oom_killed = events.get('oom_kill', 0) > 0
+        try:
+            os.rmdir(self.cgroup)
+        except OSError as e:
+            logger.debug("rimozione cgroup %s: %s", self.cgroup, e)
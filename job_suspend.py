@@ -0,0 +1,267 @@
+"""
+Pausa reale dei job in esecuzione: FFmpeg viene fermato sul posto (SIGSTOP), lo slot
+del worker torna libero e alla ripresa il processo continua (SIGCONT) dal punto in cui
+era. Il job sospeso resta del processo worker che lo ha fermato (lease_owner +
+suspended_pid) e solo quel processo lo riprende.
+
+Se nel frattempo FFmpeg è morto (OOM killer, riavvio del servizio) si riparte da un
+checkpoint: il parziale viene tagliato a checkpoint_sec (copia, senza ricodifica), la
+parte restante viene codificata con -ss e i due segmenti sono uniti con il demuxer
+concat. Per codec long-GOP il punto di unione può non cadere su un keyframe del
+parziale: meglio di ricominciare da zero, ma non bit-identico a una codifica continua.
+"""
+
+import logging
+import os
+import signal
+import subprocess
+from datetime import datetime, timedelta
+
+from job_recovery import _owner_is_dead
+from models import FileStatus, TranscodeJob
+from output_publish import remove_quietly, temp_output_path
+
+logger = logging.getLogger('XDCAMTranscoder.Suspend')
+
+# suspend = SIGSTOP/SIGCONT; restart = termina e riparte da zero (comportamento precedente)
+JOB_PAUSE_MODE = os.getenv('JOB_PAUSE_MODE', 'suspend').strip().lower()
+# Secondi scartati prima dell'ultimo progresso: dati ancora nei buffer di FFmpeg
+CHECKPOINT_MARGIN_SEC = float(os.getenv('CHECKPOINT_MARGIN_SEC', '5'))
+# Tolleranza sulla durata del segmento tagliato rispetto al checkpoint
+SEGMENT_TOLERANCE_SEC = 0.5
+SEGMENT_TIMEOUT_SEC = 3600
+
+
+def suspend_enabled():
+    return JOB_PAUSE_MODE == 'suspend' and hasattr(signal, 'SIGSTOP')
+
+
+def checkpoint_for(progress_sec, margin=CHECKPOINT_MARGIN_SEC):
+    """Punto del sorgente da cui riprendere se il processo sospeso muore (None = da capo)."""
+    if not progress_sec or progress_sec <= margin:
+        return None
+    return round(progress_sec - margin, 3)
+
+
+def head_segment_path(output_path, job_id):
+    """Segmento già codificato fino al checkpoint (nascosto, accanto al temporaneo)."""
+    return temp_output_path(output_path, f'{job_id}-head')
+
+
+def seek_input(cmd, seconds):
+    """Comando FFmpeg che codifica il sorgente da `seconds` (-ss prima del primo -i)."""
+    cmd = list(cmd)
+    index = cmd.index('-i')
+    cmd[index:index] = ['-ss', f'{seconds:.3f}']
+    return cmd
+
+
+def trim_command(source, destination, seconds):
+    return [
+        'ffmpeg', '-y', '-v', 'error', '-i', source, '-t', f'{seconds:.3f}',
+        '-map', '0', '-c', 'copy', destination,
+    ]
+
+
+def concat_command(list_path, destination):
+    return [
+        'ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-map', '0', '-c', 'copy', destination,
+    ]
+
+
+def _run(cmd):
+    try:
+        result = subprocess.run(
+            cmd, capture_output=True, text=True, timeout=SEGMENT_TIMEOUT_SEC, errors='replace'
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("FFmpeg segmenti non avviato: %s", e)
+        return False
+    if result.returncode != 0:
+        logger.warning("FFmpeg segmenti fallito (%s): %s", result.returncode, result.stderr.strip()[-500:])
+    return result.returncode == 0
+
+
+def trim_segment(source, destination, seconds):
+    """Copia i primi `seconds` di un parziale (anche non finalizzato) in un file valido."""
+    return _run(trim_command(source, destination, seconds)) and os.path.exists(destination)
+
+
+def join_segments(first, second, destination):
+    """Unisce due segmenti con stessi parametri di codifica (concat demuxer, copia)."""
+    list_path = f'{destination}.concat.txt'
+    try:
+        with open(list_path, 'w') as f:
+            for path in (first, second):
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        return _run(concat_command(list_path, destination)) and os.path.exists(destination)
+    finally:
+        remove_quietly(list_path)
+
+
+def _process_state(pid):
+    """Stato del processo da /proc/<pid>/stat (T = fermato da SIGSTOP), None se assente."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Il nome del comando tra parentesi può contenere spazi
+            return f.read().rsplit(')', 1)[1].split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def _is_suspended_ffmpeg(pid, temp_path=None):
+    """FFmpeg fermo con SIGSTOP che scrive temp_path: il pid non è stato riusato."""
+    if _process_state(pid) != 'T':
+        return False
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            args = f.read().split(b'\0')
+    except OSError:
+        return False
+    if b'ffmpeg' not in args[0]:
+        return False
+    return temp_path is None or os.fsencode(temp_path) in args
+
+
+def kill_stopped_ffmpeg(pid, temp_path=None):
+    """Termina un FFmpeg sospeso rimasto senza processo worker (solo sullo stesso nodo)."""
+    if not pid or not _is_suspended_ffmpeg(pid, temp_path):
+        return False
+    try:
+        os.kill(pid, signal.SIGKILL)
+        return True
+    except OSError:
+        return False
+
+
+def release_abandoned_suspensions(session, owner, parked_job_ids=(), now=None):
+    """
+    Job sospesi il cui processo worker non c'è più (lease scaduta, pid morto sullo stesso
+    nodo, o di questo processo ma non più parcheggiati): libera suspended_pid e lease, lo
+    stato resta. Alla ripresa il job riparte dal checkpoint. Ritorna gli id rilasciati.
+    """
+    now = now or datetime.utcnow()
+    node = owner.rpartition(':')[0]
+    parked = set(parked_job_ids)
+    released = []
+    jobs = session.query(TranscodeJob).filter(TranscodeJob.suspended_pid.isnot(None)).all()
+    for job in jobs:
+        if job.lease_owner == owner and job.id in parked:
+            continue
+        if not (
+            job.lease_owner is None
+            or job.lease_owner == owner
+            or job.lease_expires_at is None
+            or job.lease_expires_at < now
+            or _owner_is_dead(job.lease_owner, node, owner)
+        ):
+            continue
+        if (job.lease_owner or '').rpartition(':')[0] == node and job.output_path:
+            kill_stopped_ffmpeg(job.suspended_pid, temp_output_path(job.output_path, job.id))
+        updated = (
+            session.query(TranscodeJob)
+            .filter(TranscodeJob.id == job.id, TranscodeJob.suspended_pid == job.suspended_pid)
+            .update(
+                {
+                    TranscodeJob.suspended_pid: None,
+                    TranscodeJob.worker_id: None,
+                    TranscodeJob.lease_owner: None,
+                    TranscodeJob.lease_expires_at: None,
+                },
+                synchronize_session=False,
+            )
+        )
+        session.commit()
+        if updated:
+            released.append(job.id)
+    if released:
+        logger.warning("Job sospesi senza processo worker, ripresa da checkpoint: %s", released)
+    return released
+
+
+def park_job(session, job_id, owner, pid, checkpoint_sec, ttl, now=None):
+    """Registra la sospensione se il job è ancora PAUSED (compare-and-set). True se registrata."""
+    now = now or datetime.utcnow()
+    updated = (
+        session.query(TranscodeJob)
+        .filter(
+            TranscodeJob.id == job_id,
+            TranscodeJob.status == FileStatus.PAUSED,
+            TranscodeJob.suspended_pid.is_(None),
+        )
+        .update(
+            {
+                TranscodeJob.suspended_pid: pid,
+                TranscodeJob.checkpoint_sec: checkpoint_sec,
+                TranscodeJob.worker_id: None,
+                TranscodeJob.lease_owner: owner,
+                TranscodeJob.heartbeat_at: now,
+                TranscodeJob.lease_expires_at: now + timedelta(seconds=ttl),
+            },
+            synchronize_session=False,
+        )
+    )
+    session.commit()
+    return updated == 1
+
+
+def claim_resumed_job(session, job_id, owner, pid, worker_id, ttl, now=None):
+    """Job sospeso di `owner` ripreso dall'utente (PENDING): torna PROCESSING. True se assegnato."""
+    now = now or datetime.utcnow()
+    updated = (
+        session.query(TranscodeJob)
+        .filter(
+            TranscodeJob.id == job_id,
+            TranscodeJob.status == FileStatus.PENDING,
+            TranscodeJob.suspended_pid == pid,
+            TranscodeJob.lease_owner == owner,
+        )
+        .update(
+            {
+                TranscodeJob.status: FileStatus.PROCESSING,
+                TranscodeJob.suspended_pid: None,
+                TranscodeJob.checkpoint_sec: None,
+                TranscodeJob.worker_id: worker_id,
+                TranscodeJob.heartbeat_at: now,
+                TranscodeJob.lease_expires_at: now + timedelta(seconds=ttl),
+            },
+            synchronize_session=False,
+        )
+    )
+    session.commit()
+    return updated == 1
+
+
+def unpark_job(session, job_id, pid):
+    """Il processo sospeso non c'è più: il job resta nel suo stato, senza pid né lease."""
+    session.query(TranscodeJob).filter(
+        TranscodeJob.id == job_id, TranscodeJob.suspended_pid == pid
+    ).update(
+        {
+            TranscodeJob.suspended_pid: None,
+            TranscodeJob.worker_id: None,
+            TranscodeJob.lease_owner: None,
+            TranscodeJob.lease_expires_at: None,
+        },
+        synchronize_session=False,
+    )
+    session.commit()
+
+
+class EncodeRun:
+    """Stato di una codifica in corso o sospesa, necessario per portarla a termine."""
+
+    def __init__(
+        self, process, temp_path, cache_key=None, staged_source=None, threads=None, seek_sec=None, head_path=None
+    ):
+        self.process = process
+        self.temp_path = temp_path
+        self.cache_key = cache_key
+        self.staged_source = staged_source
+        self.threads = threads
+        self.seek_sec = seek_sec  # secondi del sorgente già in head_path (ripresa da checkpoint)
+        self.head_path = head_path
+        self.pinned_cores = None
+        self.progress_sec = None  # secondi del sorgente codificati (ultimo time= di FFmpeg)
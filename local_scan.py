@@ -0,0 +1,95 @@
+"""Scansione di riconciliazione dei watchfolder locali (file arrivati a servizio fermo)."""
+
+import os
+
+from models import TranscodeJob
+from ftp_utils import VIDEO_EXTENSIONS
+from path_utils import PARTIAL_PREFIX
+
+# File elaborati per batch prima di cedere il controllo agli altri thread
+RECONCILE_BATCH_SIZE = int(os.getenv('WATCH_RECONCILE_BATCH', '500'))
+# Rescan periodico dei watchfolder locali (secondi, 0 = solo all'avvio)
+WATCH_RESCAN_SEC = int(os.getenv('WATCH_RESCAN_SEC', '0'))
+# Riconciliazioni eseguite in parallelo (thread condivisi tra tutti i watchfolder)
+WATCH_SCAN_WORKERS = int(os.getenv('WATCH_SCAN_WORKERS', '2'))
+
+
+def iter_file_entries(path, recursive=False):
+    """
+    Percorre `path` con os.scandir (iterativo, senza seguire symlink) e produce
+    (path relativo, DirEntry) per ogni file regolare. Le sottocartelle illeggibili
+    vengono saltate; se `path` stesso non è leggibile l'OSError si propaga.
+    """
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        directory = os.path.join(path, relative) if relative else path
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            if not relative:
+                raise
+            continue
+        with it:
+            for entry in it:
+                name = os.path.join(relative, entry.name) if relative else entry.name
+                try:
+                    # is_dir/is_file usano d_type: nessuna syscall aggiuntiva
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        pending.append(name)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                except OSError:
+                    continue
+                yield name, entry
+
+
+def scan_video_files(path, extensions=VIDEO_EXTENSIONS, recursive=False):
+    """
+    Elenca i file video regolari di `path` (e sottocartelle se recursive):
+    [(path relativo, path completo, size, mtime)]. I dati di stat arrivano da DirEntry.
+    """
+    files = []
+    try:
+        for name, entry in iter_file_entries(path, recursive):
+            if os.path.splitext(entry.name)[1].lower() not in extensions:
+                continue
+            if entry.name.startswith(PARTIAL_PREFIX):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files.append((name, entry.path, st.st_size, st.st_mtime))
+    except FileNotFoundError:
+        return []
+    return files
+
+
+def find_known_files(session, watchfolder_id):
+    """
+    (nomi, path) dei file che hanno già un job nel watchfolder (qualsiasi stato),
+    con una sola query filtrata su watchfolder_id (indice ix_jobs_watchfolder_filename).
+    """
+    rows = session.query(TranscodeJob.input_filename, TranscodeJob.input_path).filter(
+        TranscodeJob.watchfolder_id == watchfolder_id
+    ).all()
+    return {name for name, _ in rows}, {path for _, path in rows}
+
+
+def find_unknown_files(session, watchfolder_id, path, extensions=VIDEO_EXTENSIONS, recursive=False):
+    """
+    File presenti in `path` senza alcun job associato. Nei watchfolder ricorsivi
+    il confronto è per path completo (lo stesso nome può ripetersi tra sottocartelle).
+    """
+    known_names, known_paths = find_known_files(session, watchfolder_id)
+    files = scan_video_files(path, extensions, recursive)
+    if recursive:
+        return [f for f in files if f[1] not in known_paths]
+    return [f for f in files if f[0] not in known_names]
+
+
+def batches(items, size=RECONCILE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -11,6 +11,19 @@ load_dotenv()
 
 DB_PATH = os.getenv('DB_PATH', 'xdcam_transcoder.db')
 
+INDEXES = [
+    # Lookup job per watchfolder/nome file senza scansione completa della tabella
+    "CREATE INDEX IF NOT EXISTS ix_jobs_watchfolder_filename ON jobs (watchfolder_id, input_filename)",
+    # Nomi file FTP confrontati in minuscolo (indice sull'espressione usata dalla query)
+    "CREATE INDEX IF NOT EXISTS ix_jobs_watchfolder_filename_lower ON jobs (watchfolder_id, lower(input_filename))",
+    # Dedup job attivi per path sorgente (inserimento a blocchi)
+    "CREATE INDEX IF NOT EXISTS ix_jobs_input_path ON jobs (input_path)",
+    # Candidati dedup per contenuto: stessa impronta e stesso preset
+    "CREATE INDEX IF NOT EXISTS ix_jobs_fingerprint_preset ON jobs (input_fingerprint, preset_id)",
+    # Finestre di coda per watchfolder (politiche QUEUE_POLICY) e conteggi per stato
+    "CREATE INDEX IF NOT EXISTS ix_jobs_status_watchfolder_created ON jobs (status, watchfolder_id, created_at)",
+]
+
 def migrate_database():
     """Aggiunge le colonne mancanti al database"""
     
@@ -49,6 +62,9 @@ def migrate_database():
         if 'ftp_remote_path' not in columns:
             migrations.append("ALTER TABLE watchfolders ADD COLUMN ftp_remote_path VARCHAR(512)")
         
+        if 'sftp_host_key' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN sftp_host_key VARCHAR(128)")
+
         if 'ftp_local_temp' not in columns:
             migrations.append("ALTER TABLE watchfolders ADD COLUMN ftp_local_temp VARCHAR(512)")
 
@@ -60,6 +76,27 @@ def migrate_database():
                 "ALTER TABLE watchfolders ADD COLUMN operation_mode VARCHAR(20) DEFAULT 'transcode'"
             )
         
+        if 'ftp_rate_limit_mbps' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN ftp_rate_limit_mbps FLOAT")
+
+        if 'quiet_period' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN quiet_period INTEGER DEFAULT 10")
+
+        if 'watch_backend' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN watch_backend VARCHAR(20) DEFAULT 'native'")
+
+        if 'poll_interval' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN poll_interval INTEGER DEFAULT 10")
+
+        if 'recursive' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN recursive INTEGER DEFAULT 0")
+
+        if 'retry_max_attempts' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN retry_max_attempts INTEGER")
+
+        if 'retry_backoff_sec' not in columns:
+            migrations.append("ALTER TABLE watchfolders ADD COLUMN retry_backoff_sec INTEGER")
+        
         # Migrazioni tabella jobs (mediainfo)
         cursor.execute("PRAGMA table_info(jobs)")
         job_columns = [row[1] for row in cursor.fetchall()]
@@ -67,11 +104,69 @@ def migrate_database():
             migrations.append("ALTER TABLE jobs ADD COLUMN input_mediainfo TEXT")
         if 'output_mediainfo' not in job_columns:
             migrations.append("ALTER TABLE jobs ADD COLUMN output_mediainfo TEXT")
+        if 'bytes_transferred' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN bytes_transferred INTEGER")
+        if 'transfer_rate' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN transfer_rate INTEGER")
+        if 'cpu_seconds' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN cpu_seconds FLOAT")
+        if 'peak_rss_mb' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN peak_rss_mb INTEGER")
+        if 'input_fingerprint' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN input_fingerprint VARCHAR(64)")
+        if 'input_hash' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN input_hash VARCHAR(64)")
+        if 'dedup_source_job_id' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN dedup_source_job_id INTEGER")
+        if 'lease_owner' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN lease_owner VARCHAR(128)")
+        if 'heartbeat_at' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN heartbeat_at DATETIME")
+        if 'lease_expires_at' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN lease_expires_at DATETIME")
+        if 'recovery_count' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN recovery_count INTEGER DEFAULT 0")
+        if 'attempt_count' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN attempt_count INTEGER DEFAULT 0")
+        if 'first_attempt_at' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN first_attempt_at DATETIME")
+        if 'next_attempt_at' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN next_attempt_at DATETIME")
+        if 'failure_class' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN failure_class VARCHAR(20)")
+        if 'suspended_pid' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN suspended_pid INTEGER")
+        if 'checkpoint_sec' not in job_columns:
+            migrations.append("ALTER TABLE jobs ADD COLUMN checkpoint_sec FLOAT")
+        
+        # Migrazioni tabella presets (politica di retry)
+        cursor.execute("PRAGMA table_info(presets)")
+        preset_columns = [row[1] for row in cursor.fetchall()]
+        if preset_columns and 'retry_max_attempts' not in preset_columns:
+            migrations.append("ALTER TABLE presets ADD COLUMN retry_max_attempts INTEGER")
+        if preset_columns and 'retry_backoff_sec' not in preset_columns:
+            migrations.append("ALTER TABLE presets ADD COLUMN retry_backoff_sec INTEGER")
+        
+        # Migrazioni tabella workers (nodi headless)
+        cursor.execute("PRAGMA table_info(workers)")
+        worker_columns = [row[1] for row in cursor.fetchall()]
+        if worker_columns and 'node_name' not in worker_columns:
+            migrations.append("ALTER TABLE workers ADD COLUMN node_name VARCHAR(255)")
+        
+        # Migrazioni indice file FTP (tabella creata da create_all se assente)
+        cursor.execute("PRAGMA table_info(ftp_file_index)")
+        index_columns = [row[1] for row in cursor.fetchall()]
+        if index_columns and 'changed_at' not in index_columns:
+            migrations.append("ALTER TABLE ftp_file_index ADD COLUMN changed_at DATETIME")
         
         # Esegui migrazioni
         for migration in migrations:
             print(f"Eseguendo: {migration}")
             cursor.execute(migration)
+
+        # Indici (idempotenti, non conteggiati come colonne)
+        for index_sql in INDEXES:
+            cursor.execute(index_sql)
         
         conn.commit()
         
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Float, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Float, Text, Index, UniqueConstraint, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -17,6 +17,21 @@ class FileStatus(enum.Enum):
 OPERATION_MODE_TRANSCODE = 'transcode'
 OPERATION_MODE_DOWNLOAD_ONLY = 'download_only'
 
+WATCH_TYPE_LOCAL = 'local'
+WATCH_TYPE_FTP = 'ftp'
+WATCH_TYPE_FTPS = 'ftps'  # FTP con TLS esplicito
+WATCH_TYPE_SFTP = 'sftp'
+REMOTE_WATCH_TYPES = (WATCH_TYPE_FTP, WATCH_TYPE_FTPS, WATCH_TYPE_SFTP)
+
+# Backend di monitoraggio watchfolder locali
+WATCH_BACKEND_NATIVE = 'native'  # inotify/eventi del sistema operativo
+WATCH_BACKEND_POLLING = 'polling'  # scansione periodica (mount NFS/SMB)
+WATCH_BACKENDS = (WATCH_BACKEND_NATIVE, WATCH_BACKEND_POLLING)
+
+# Stati indice file remoti FTP
+FTP_INDEX_PENDING = 'pending'  # visto sul server, in attesa di size stabile
+FTP_INDEX_DONE = 'done'  # già acquisito (job creato o bloccato da job esistente)
+
 class WatchFolder(Base):
     __tablename__ = 'watchfolders'
     
@@ -25,16 +40,24 @@ class WatchFolder(Base):
     path = Column(String(512), nullable=False)
     output_path = Column(String(512))
     archive_path = Column(String(512))  # Cartella per archiviare file originali dopo transcodifica
-    watch_type = Column(String(20), default='local')  # 'local' o 'ftp'
+    watch_type = Column(String(20), default='local')  # 'local', 'ftp', 'ftps' o 'sftp'
     ftp_host = Column(String(255))  # Host FTP
     ftp_port = Column(Integer, default=21)  # Porta FTP
     ftp_username = Column(String(255))  # Username FTP
     ftp_password = Column(String(255))  # Password FTP (in produzione usare encryption)
     ftp_remote_path = Column(String(512))  # Path remoto sul server FTP
+    sftp_host_key = Column(String(128))  # Fingerprint SHA256 della chiave host SFTP (vuoto = known_hosts)
     ftp_local_temp = Column(String(512))  # Directory locale temporanea per download
+    ftp_rate_limit_mbps = Column(Float)  # Limite banda download (Mbit/s, vuoto/0 = illimitato)
     operation_mode = Column(String(20), default=OPERATION_MODE_TRANSCODE)  # transcode | download_only (solo FTP)
     active = Column(Integer, default=1)  # 1 = active, 0 = inactive
     priority = Column(Integer, default=10, nullable=False)  # più basso = priorità più alta
+    quiet_period = Column(Integer, default=10)  # secondi senza modifiche prima di acquisire un file
+    watch_backend = Column(String(20), default=WATCH_BACKEND_NATIVE)  # native | polling (solo local)
+    poll_interval = Column(Integer, default=10)  # secondi tra due scansioni (backend polling)
+    recursive = Column(Integer, default=0)  # 1 = monitora anche le sottocartelle (solo local)
+    retry_max_attempts = Column(Integer)  # tentativi totali per errori transitori (NULL = preset/env)
+    retry_backoff_sec = Column(Integer)  # ritardo base del backoff esponenziale (NULL = preset/env)
     status = Column(String(50), default='idle')  # idle, monitoring, error
     preset_id = Column(Integer, ForeignKey('presets.id'))
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -56,6 +79,8 @@ class TranscodePreset(Base):
     audio_channels = Column(String(10), default='2')
     container = Column(String(20), default='mxf')
     ffmpeg_params = Column(Text)  # Parametri aggiuntivi FFmpeg
+    retry_max_attempts = Column(Integer)  # tentativi totali per errori transitori (NULL = env)
+    retry_backoff_sec = Column(Integer)  # ritardo base del backoff esponenziale (NULL = env)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     watchfolders = relationship("WatchFolder", back_populates="preset")
@@ -70,12 +95,21 @@ class Worker(Base):
     status = Column(String(50), default='idle')  # idle, running, error
     current_job_id = Column(Integer, ForeignKey('jobs.id'), nullable=True)
     max_concurrent_jobs = Column(Integer, default=1)
+    node_name = Column(String(255))  # nodo headless (worker_node.py) che lo esegue; NULL = processo web
     created_at = Column(DateTime, default=datetime.utcnow)
     
     current_job = relationship("TranscodeJob", foreign_keys=[current_job_id])
 
 class TranscodeJob(Base):
     __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_watchfolder_filename', 'watchfolder_id', 'input_filename'),
+        # Confronto case-insensitive dei nomi FTP (lower(input_filename))
+        Index('ix_jobs_watchfolder_filename_lower', 'watchfolder_id', text('lower(input_filename)')),
+        Index('ix_jobs_input_path', 'input_path'),
+        Index('ix_jobs_fingerprint_preset', 'input_fingerprint', 'preset_id'),
+        Index('ix_jobs_status_watchfolder_created', 'status', 'watchfolder_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     watchfolder_id = Column(Integer, ForeignKey('watchfolders.id'))
@@ -93,6 +127,27 @@ class TranscodeJob(Base):
     output_size = Column(Integer)  # bytes
     input_duration = Column(Float)  # seconds
     output_duration = Column(Float)  # seconds
+    bytes_transferred = Column(Integer)  # byte scaricati (job FTP)
+    transfer_rate = Column(Integer)  # throughput download (byte/s)
+    cpu_seconds = Column(Float)  # tempo CPU FFmpeg (user+system)
+    peak_rss_mb = Column(Integer)  # picco memoria residente FFmpeg
+    
+    input_fingerprint = Column(String(64))  # impronta campionata size+testa+coda (dedup contenuto)
+    input_hash = Column(String(64))  # hash completo del sorgente, salvato a job completato
+    dedup_source_job_id = Column(Integer, nullable=True)  # job il cui output è stato riusato
+    
+    lease_owner = Column(String(128))  # processo che esegue/ha eseguito il job (nodo:pid)
+    heartbeat_at = Column(DateTime)  # ultimo rinnovo della lease
+    lease_expires_at = Column(DateTime)  # oltre questa data il job è recuperabile da altri nodi
+    recovery_count = Column(Integer, default=0)  # volte rimesso in coda dopo un'interruzione
+    
+    attempt_count = Column(Integer, default=0)  # tentativi di esecuzione (incrementato a ogni claim)
+    first_attempt_at = Column(DateTime)  # inizio del primo tentativo
+    next_attempt_at = Column(DateTime)  # job PENDING in backoff: non assegnabile prima di questa data
+    failure_class = Column(String(20))  # transient | permanent (ultimo errore)
+    
+    suspended_pid = Column(Integer)  # FFmpeg fermato con SIGSTOP (del processo in lease_owner)
+    checkpoint_sec = Column(Float)  # secondi del sorgente già nel parziale: ripresa a segmenti
     
     input_mediainfo = Column(Text)   # output mediainfo file in ingresso
     output_mediainfo = Column(Text)  # output mediainfo file in uscita
@@ -107,3 +162,42 @@ class TranscodeJob(Base):
     preset = relationship("TranscodePreset", back_populates="jobs")
     worker = relationship("Worker", foreign_keys=[worker_id])
 
+
+class FTPFileIndex(Base):
+    """Indice persistente dei file visti su un watchfolder FTP (sopravvive ai riavvii)."""
+    __tablename__ = 'ftp_file_index'
+    __table_args__ = (
+        UniqueConstraint('watchfolder_id', 'name_key', name='uq_ftp_file_index_wf_name'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    watchfolder_id = Column(Integer, ForeignKey('watchfolders.id'), nullable=False)
+    name = Column(String(512), nullable=False)
+    name_key = Column(String(512), nullable=False)  # nome lowercase (confronto case-insensitive)
+    size = Column(Integer, default=0)
+    mtime = Column(String(32))  # fact MLSD 'modify' (YYYYMMDDHHMMSS[.sss])
+    state = Column(String(20), default=FTP_INDEX_PENDING, nullable=False)
+    job_id = Column(Integer, ForeignKey('jobs.id'), nullable=True)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+    changed_at = Column(DateTime)  # ultima variazione osservata di size/mtime
+
+
+class EncodeCacheEntry(Base):
+    """Output già codificato, riusabile per stesso sorgente e stesso comando FFmpeg effettivo."""
+    __tablename__ = 'encode_cache'
+    __table_args__ = (
+        UniqueConstraint('source_hash', 'command_hash', name='uq_encode_cache_source_command'),
+        Index('ix_encode_cache_lookup', 'source_fingerprint', 'command_hash'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    source_fingerprint = Column(String(64), nullable=False)  # impronta campionata del sorgente
+    source_hash = Column(String(64), nullable=False)  # hash completo del sorgente
+    command_hash = Column(String(64), nullable=False)  # sha256 dell'argv FFmpeg senza path
+    cache_path = Column(String(512), nullable=False)  # copia/link dell'output nella cache
+    size = Column(Integer, nullable=False)
+    checksum = Column(String(64), nullable=False)  # hash completo dell'output
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
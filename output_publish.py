@@ -0,0 +1,109 @@
+"""
+Pubblicazione atomica degli output: FFmpeg scrive su un file nascosto nella stessa
+cartella (o su un volume scratch veloce), poi fsync e rename sul nome finale. Chi
+osserva la cartella di output non vede mai un MXF parziale.
+"""
+
+import logging
+import os
+import time
+
+from archiver import same_device
+from path_utils import PARTIAL_PREFIX, ensure_shared_directory
+
+logger = logging.getLogger('XDCAMTranscoder.Publish')
+
+# Volume scratch per la scrittura degli output (vuoto = cartella di destinazione)
+OUTPUT_SCRATCH_DIR = os.getenv('OUTPUT_SCRATCH_DIR', '').strip()
+# Età minima dei temporanei rimossi all'avvio nelle cartelle condivise: più giovani
+# possono essere scritture in corso di altri nodi (codifiche, copie del mover)
+ORPHAN_TEMP_MIN_AGE_SEC = int(os.getenv('ORPHAN_TEMP_MIN_AGE_SEC', '3600'))
+
+
+def temp_output_path(output_path, job_id, scratch_dir=None):
+    """
+    Nome temporaneo nascosto per l'output del job. L'estensione resta in fondo
+    perché FFmpeg sceglie il muxer da lì.
+    """
+    if scratch_dir is None:
+        scratch_dir = OUTPUT_SCRATCH_DIR
+    directory = scratch_dir or os.path.dirname(output_path)
+    return os.path.join(directory, f"{PARTIAL_PREFIX}{job_id}-{os.path.basename(output_path)}")
+
+
+def temp_job_id(filename):
+    """Id del job dal nome di un temporaneo di output (None per altri temporanei)."""
+    if not filename.startswith(PARTIAL_PREFIX):
+        return None
+    job_id = filename[len(PARTIAL_PREFIX):].partition('-')[0]
+    return int(job_id) if job_id.isdigit() else None
+
+
+def fsync_path(path):
+    """fsync di un file o di una directory (rende durevole un rename)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Rimozione file temporaneo fallita %s: %s", path, e)
+
+
+def publish_output(temp_path, output_path, mover):
+    """
+    Porta temp_path su output_path. Stesso filesystem: fsync + rename atomico
+    (ritorna True). Scratch su un altro device: lo spostamento verificato va al
+    mover in background (ritorna False); il file compare comunque in un colpo solo.
+    """
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        ensure_shared_directory(output_dir)
+    fsync_path(temp_path)
+    if same_device(temp_path, output_dir or '.'):
+        os.replace(temp_path, output_path)
+        fsync_path(output_dir or '.')
+        return True
+    mover.submit(temp_path, output_path, overwrite=True)
+    return False
+
+
+def cleanup_orphaned_temps(directories, prefix=PARTIAL_PREFIX, keep=(), min_age_sec=0, now=None):
+    """
+    Rimuove i temporanei lasciati da un'esecuzione interrotta (output parziali,
+    copie in background mai completate). Da chiamare all'avvio, prima dei worker.
+    keep: path da non toccare (output in scrittura su altri nodi).
+    min_age_sec: solo file non modificati da almeno tanti secondi.
+    Ritorna il numero di file rimossi.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    cutoff = (now or time.time()) - min_age_sec
+    removed = 0
+    for directory in set(d for d in directories if d):
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if os.path.abspath(entry.path) in keep:
+                        continue
+                    if not entry.name.startswith(prefix) or not entry.is_file(follow_symlinks=False):
+                        continue
+                    if min_age_sec:
+                        try:
+                            if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                                continue
+                        except OSError:
+                            continue
+                    remove_quietly(entry.path)
+                    removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info("Rimossi %d file temporanei orfani", removed)
+    return removed
@@ -0,0 +1,124 @@
+"""
+Prefetch nella page cache dei sorgenti dei prossimi job: mentre un worker codifica,
+posix_fadvise(WILLNEED) sull'inizio dei file dei prossimi K job in coda, così i primi
+minuti di ogni codifica non partono da letture a freddo. Budget di memoria totale e
+conteggio per watchfolder dei job partiti con il sorgente già consigliato, per tarare
+K sul tipo di storage. WILLNEED è solo un suggerimento: il conteggio dice che il
+prefetch è stato chiesto in tempo, non che le pagine fossero davvero in cache.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('XDCAMTranscoder.Prefetch')
+
+# Job in coda da precaricare (0 = disattivato)
+PREFETCH_LOOKAHEAD = int(os.getenv('PREFETCH_LOOKAHEAD', '2'))
+PREFETCH_BUDGET_MB = int(os.getenv('PREFETCH_BUDGET_MB', '2048'))
+# Byte iniziali di ogni file da precaricare
+PREFETCH_WINDOW_MB = int(os.getenv('PREFETCH_WINDOW_MB', '512'))
+
+MB = 1024 * 1024
+
+
+class PageCachePrefetcher:
+    def __init__(
+        self,
+        lookahead=PREFETCH_LOOKAHEAD,
+        budget_bytes=PREFETCH_BUDGET_MB * MB,
+        window_bytes=PREFETCH_WINDOW_MB * MB,
+    ):
+        self.lookahead = max(0, lookahead)
+        self.budget_bytes = max(0, budget_bytes)
+        self.window_bytes = max(MB, window_bytes)
+        self._advised = OrderedDict()  # path -> byte richiesti, in ordine di coda
+        self._lock = threading.Lock()
+        self._executor = None
+        self._starts = {}  # watchfolder_id -> [consigliati prima della partenza, non consigliati]
+        self._advised_total = 0
+
+    @property
+    def enabled(self):
+        return self.lookahead > 0 and self.budget_bytes > 0 and hasattr(os, 'posix_fadvise')
+
+    def advise(self, paths):
+        """
+        Precarica (in background) i primi `lookahead` path nell'ordine di coda.
+        I file già consigliati non vengono ripetuti; quelli usciti dalla finestra
+        liberano budget.
+        """
+        if not self.enabled:
+            return
+        wanted = list(OrderedDict.fromkeys(p for p in paths if p))[:self.lookahead]
+        plan = []
+        with self._lock:
+            for path in list(self._advised):
+                if path not in wanted:
+                    del self._advised[path]
+            used = sum(self._advised.values())
+            for path in wanted:
+                if path in self._advised:
+                    continue
+                room = self.budget_bytes - used
+                if room <= 0:
+                    break
+                length = min(self.window_bytes, room)
+                self._advised[path] = length
+                used += length
+                plan.append((path, length))
+            if plan and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PageCachePrefetch')
+        for path, length in plan:
+            self._executor.submit(self._fadvise, path, length)
+
+    def record_start(self, path, watchfolder_id=None):
+        """Un job parte: True se il suo sorgente era nella finestra consigliata (WILLNEED)."""
+        with self._lock:
+            advised = self._advised.pop(path, None) is not None
+            counters = self._starts.setdefault(watchfolder_id, [0, 0])
+            counters[0 if advised else 1] += 1
+        return advised
+
+    def stats(self):
+        with self._lock:
+            advised = sum(c[0] for c in self._starts.values())
+            not_advised = sum(c[1] for c in self._starts.values())
+            total = advised + not_advised
+            return {
+                'enabled': self.enabled,
+                'lookahead': self.lookahead,
+                'budget_bytes': self.budget_bytes,
+                'window_bytes': self.window_bytes,
+                'outstanding_bytes': sum(self._advised.values()),
+                'advised_bytes_total': self._advised_total,
+                'advised_before_start': advised,
+                'not_advised': not_advised,
+                'advised_rate': round(advised / total, 3) if total else None,
+                'by_watchfolder': {
+                    str(wf_id): {'advised_before_start': c[0], 'not_advised': c[1]}
+                    for wf_id, c in self._starts.items()
+                },
+            }
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _fadvise(self, path, length):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            logger.debug("Prefetch saltato %s: %s", path, e)
+            return
+        try:
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+            with self._lock:
+                self._advised_total += length
+        except OSError as e:
+            logger.debug("posix_fadvise non riuscito su %s: %s", path, e)
+        finally:
+            os.close(fd)
@@ -4,6 +4,9 @@ import os
 
 SHARED_DIR_MODE = 0o2775
 SHARED_FILE_MODE = 0o664
+# Prefisso dei file nascosti scritti prima della pubblicazione con rename
+# (output in codifica, copie in corso): i watchfolder li ignorano
+PARTIAL_PREFIX = '.xdpart-'
 
 
 def configure_shared_umask():
@@ -30,3 +33,16 @@ def ensure_shared_file(path):
         os.chmod(path, SHARED_FILE_MODE)
     except OSError:
         pass
+
+
+def mirrored_directory(base_dir, source_root, file_path):
+    """
+    Directory di `base_dir` che rispecchia la sottocartella di `file_path` rispetto
+    a `source_root` (watchfolder ricorsivi). Fuori da source_root ritorna base_dir.
+    """
+    if not base_dir or not source_root:
+        return base_dir
+    relative = os.path.relpath(os.path.dirname(file_path), source_root)
+    if relative == os.curdir or relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return base_dir
+    return os.path.join(base_dir, relative)
@@ -0,0 +1,177 @@
+"""
+Observer a polling per watchfolder su mount di rete (NFS/SMB), dove inotify non vede
+le modifiche fatte da altri client. Ogni passata è una os.scandir della cartella
+(o dell'albero) confrontata con lo snapshot precedente {nome: (inode, size, mtime)} in O(entry).
+"""
+
+import logging
+import os
+import threading
+import time
+
+from local_scan import iter_file_entries
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+logger = logging.getLogger('XDCAMTranscoder.Polling')
+
+DEFAULT_POLL_INTERVAL = int(os.getenv('WATCH_POLL_SEC', '10'))
+MIN_POLL_INTERVAL = 1
+
+
+def snapshot_directory(path, recursive=False):
+    """{path relativo: (inode, size, mtime)} dei file regolari in `path`."""
+    snapshot = {}
+    for name, entry in iter_file_entries(path, recursive):
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        snapshot[name] = (st.st_ino, st.st_size, st.st_mtime)
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """
+    Confronta due snapshot e ritorna (created, modified, moved, deleted):
+    liste di path relativi, moved come [(vecchio, nuovo)] riconosciuti dallo stesso inode.
+    """
+    created, modified, moved = [], [], []
+    # Inode dei soli nomi scomparsi: candidati a rinomina
+    removed_by_inode = {
+        sig[0]: name for name, sig in old.items() if name not in new
+    }
+    for name, sig in new.items():
+        previous = old.get(name)
+        if previous is None:
+            src = removed_by_inode.pop(sig[0], None)
+            if src is not None:
+                moved.append((src, name))
+            else:
+                created.append(name)
+        elif previous != sig:
+            modified.append(name)
+    deleted = list(removed_by_inode.values())
+    return created, modified, moved, deleted
+
+
+class _PollingWatch:
+    __slots__ = ('handler', 'path', 'recursive', 'interval', 'snapshot', 'next_due')
+
+    def __init__(self, handler, path, recursive, interval, snapshot, next_due):
+        self.handler = handler
+        self.path = path
+        self.recursive = recursive
+        self.interval = interval
+        self.snapshot = snapshot
+        self.next_due = next_due
+
+
+class ScandirPollingObserver:
+    """
+    Stessa interfaccia usata di watchdog.Observer (schedule/unschedule/remove_handler_for_watch/
+    start/stop/join):
+    gli eventi generati passano da handler.dispatch come quelli nativi.
+    Un solo thread serve tutti i watch, ciascuno con il proprio intervallo.
+    Lo snapshot iniziale è preso in schedule (i file esistenti li gestisce la riconciliazione).
+    Con recursive=True lo snapshot copre tutto l'albero (nessun watch per cartella).
+    """
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL, clock=time.monotonic):
+        self.interval = max(MIN_POLL_INTERVAL, interval or DEFAULT_POLL_INTERVAL)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._watches = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, event_handler, path, recursive=False, interval=None):
+        interval = max(MIN_POLL_INTERVAL, interval or self.interval)
+        watch = _PollingWatch(
+            event_handler,
+            path,
+            recursive,
+            interval,
+            snapshot_directory(path, recursive),
+            self._clock() + interval,
+        )
+        with self._lock:
+            self._watches.append(watch)
+        self._wakeup.set()
+        return watch
+
+    def unschedule(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def remove_handler_for_watch(self, event_handler, watch):
+        """Come in watchdog; qui ogni watch ha un solo handler, quindi il watch cade con lui."""
+        if watch.handler is event_handler:
+            self.unschedule(watch)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def poll_once(self, force=True):
+        """Esegue le passate scadute (tutte con force). Ritorna i secondi al prossimo watch."""
+        now = self._clock()
+        with self._lock:
+            watches = list(self._watches)
+        for watch in watches:
+            if not force and watch.next_due > now:
+                continue
+            watch.next_due = now + watch.interval
+            try:
+                new = snapshot_directory(watch.path, watch.recursive)
+            except OSError as e:
+                logger.warning(f"Polling {watch.path} fallito: {e}")
+                continue
+            old, watch.snapshot = watch.snapshot, new
+            self._dispatch(watch.handler, watch.path, *diff_snapshots(old or {}, new))
+        with self._lock:
+            if not self._watches:
+                return self.interval
+            return max(0.0, min(w.next_due for w in self._watches) - self._clock())
+
+    def _dispatch(self, handler, path, created, modified, moved, deleted):
+        def full(name):
+            return os.path.join(path, name)
+
+        for name in created:
+            handler.dispatch(FileCreatedEvent(full(name)))
+        for name in modified:
+            handler.dispatch(FileModifiedEvent(full(name)))
+        for src, dest in moved:
+            handler.dispatch(FileMovedEvent(full(src), full(dest)))
+        for name in deleted:
+            handler.dispatch(FileDeletedEvent(full(name)))
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            # Risvegliato in anticipo da schedule() per ricalcolare la prossima scadenza
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                delay = self.poll_once(force=False)
+            except Exception as e:
+                logger.error(f"Errore polling watchfolder: {e}", exc_info=True)
+                delay = self.interval
@@ -0,0 +1,78 @@
+"""Scrittura coalescente del progresso job (un UPDATE per job a intervalli di tempo)."""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import update
+
+from models import TranscodeJob
+
+logger = logging.getLogger('XDCAMTranscoder.Progress')
+
+DEFAULT_FLUSH_INTERVAL = 1.0  # secondi
+
+
+class CoalescingProgressWriter:
+    """
+    Accumula gli aggiornamenti di progresso in memoria e li scrive al massimo
+    ogni flush_interval secondi: per ogni job solo l'ultimo valore, un UPDATE
+    senza SELECT/refresh, tutti i job nella stessa transazione.
+    Condivisibile tra più thread (es. download FTP paralleli).
+    """
+
+    def __init__(self, db_session_factory, flush_interval=DEFAULT_FLUSH_INTERVAL, clock=time.monotonic):
+        self.db_session_factory = db_session_factory
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # job_id -> {campo: valore}
+        self._last_flush = clock()
+
+    def update(self, job_id, **fields):
+        """Registra i valori correnti; scrive solo se è trascorso l'intervallo."""
+        with self._lock:
+            self._pending.setdefault(job_id, {}).update(fields)
+            due = self._clock() - self._last_flush >= self.flush_interval
+        if due:
+            # Se un altro thread sta già scrivendo, i valori restano per il prossimo flush
+            self.flush(blocking=False)
+
+    def flush(self, job_id=None, blocking=True):
+        """Scrive subito gli aggiornamenti pendenti (tutti o di un solo job)."""
+        if not self._flush_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            with self._lock:
+                if job_id is None:
+                    batch, self._pending = self._pending, {}
+                    self._last_flush = self._clock()
+                else:
+                    fields = self._pending.pop(job_id, None)
+                    batch = {job_id: fields} if fields else {}
+            if not batch:
+                return 0
+            db_session = self.db_session_factory()
+            try:
+                for pending_job_id, fields in batch.items():
+                    db_session.execute(
+                        update(TranscodeJob)
+                        .where(TranscodeJob.id == pending_job_id)
+                        .values(**fields)
+                    )
+                db_session.commit()
+            except Exception as e:
+                db_session.rollback()
+                logger.warning("Scrittura progresso fallita (%d job): %s", len(batch), e)
+                return 0
+            finally:
+                db_session.close()
+            return len(batch)
+        finally:
+            self._flush_lock.release()
+
+    def discard(self, job_id):
+        """Scarta gli aggiornamenti pendenti di un job (es. prima di scriverne lo stato finale)."""
+        with self._lock:
+            self._pending.pop(job_id, None)
@@ -0,0 +1,235 @@
+"""
+Politiche di ordinamento della coda job. 'priority' è l'ordinamento storico (priority
+watchfolder, poi FIFO); le altre riordinano una finestra dei job PENDING più vecchi di
+ogni watchfolder:
+- aging: la priority migliora di un livello ogni QUEUE_AGING_SEC di attesa
+- fair_share: slot ripartiti tra watchfolder con peso inverso alla priority
+- sjf: prima i job con durata attesa minore (durata/dimensione sorgente e velocità
+  storica del preset); oltre QUEUE_SJF_MAX_WAIT_SEC di attesa si torna al FIFO
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import FileStatus, TranscodeJob
+
+logger = logging.getLogger('XDCAMTranscoder.QueuePolicy')
+
+FALLBACK_JOB_PRIORITY = 999
+
+QUEUE_POLICY = os.getenv('QUEUE_POLICY', 'priority').strip().lower()
+# Job PENDING più vecchi per watchfolder valutati dalle politiche diverse da 'priority'
+QUEUE_POLICY_WINDOW = int(os.getenv('QUEUE_POLICY_WINDOW', '200'))
+QUEUE_AGING_SEC = int(os.getenv('QUEUE_AGING_SEC', '600'))
+QUEUE_SJF_MAX_WAIT_SEC = int(os.getenv('QUEUE_SJF_MAX_WAIT_SEC', '7200'))
+# Stime SJF per preset senza storico
+QUEUE_SJF_DEFAULT_BPS = 20 * 1024 * 1024
+QUEUE_SJF_DEFAULT_SEC = 600
+SPEED_REFRESH_SEC = 60
+SPEED_SAMPLES = 20
+
+# realtime: secondi di media per secondo di codifica; bytes_per_sec: byte sorgente al secondo
+PresetSpeed = namedtuple('PresetSpeed', 'realtime bytes_per_sec')
+# running_by_watchfolder: job PROCESSING per watchfolder_id; speeds: preset_id -> PresetSpeed
+QueueContext = namedtuple('QueueContext', 'now running_by_watchfolder speeds')
+
+
+def job_priority(job):
+    watchfolder = job.watchfolder
+    if watchfolder is None or watchfolder.priority is None:
+        return FALLBACK_JOB_PRIORITY
+    return watchfolder.priority
+
+
+def _created(job):
+    return job.created_at or datetime.min
+
+
+def _waited(job, now):
+    return (now - job.created_at).total_seconds() if job.created_at else 0
+
+
+class PriorityPolicy:
+    """Ordinamento storico; in produzione lo esegue direttamente la query SQL."""
+
+    name = 'priority'
+    needs_running = False
+    needs_speeds = False
+
+    def order(self, jobs, context):
+        return sorted(jobs, key=lambda job: (job_priority(job), _created(job)))
+
+
+class AgingPolicy(PriorityPolicy):
+    name = 'aging'
+
+    def __init__(self, aging_sec=QUEUE_AGING_SEC):
+        self.aging_sec = max(1, aging_sec)
+
+    def order(self, jobs, context):
+        return sorted(jobs, key=lambda job: (
+            job_priority(job) - _waited(job, context.now) / self.aging_sec,
+            _created(job),
+        ))
+
+
+class FairSharePolicy(PriorityPolicy):
+    """
+    Ogni watchfolder riceve slot in proporzione a 1/priority: il prossimo job è il più
+    vecchio della watchfolder con (job in esecuzione + 1) * priority minore.
+    """
+
+    name = 'fair_share'
+    needs_running = True
+
+    def order(self, jobs, context):
+        queues = defaultdict(deque)
+        priorities = {}
+        for job in sorted(jobs, key=_created):
+            queues[job.watchfolder_id].append(job)
+            priorities[job.watchfolder_id] = max(1, job_priority(job))
+        served = defaultdict(int, context.running_by_watchfolder)
+        ordered = []
+        while queues:
+            wf_id = min(queues, key=lambda wf: ((served[wf] + 1) * priorities[wf], _created(queues[wf][0])))
+            ordered.append(queues[wf_id].popleft())
+            served[wf_id] += 1
+            if not queues[wf_id]:
+                del queues[wf_id]
+        return ordered
+
+
+class ShortestJobPolicy(PriorityPolicy):
+    name = 'sjf'
+    needs_speeds = True
+
+    def __init__(self, max_wait=QUEUE_SJF_MAX_WAIT_SEC):
+        self.max_wait = max_wait
+
+    def order(self, jobs, context):
+        def key(job):
+            if _waited(job, context.now) > self.max_wait:
+                # Attesa oltre soglia: i job lunghi non restano indietro per sempre
+                return (0, 0, _created(job))
+            return (1, expected_seconds(job, context.speeds), _created(job))
+        return sorted(jobs, key=key)
+
+
+def expected_seconds(job, speeds):
+    """Durata di codifica attesa: durata media o dimensione / velocità storica del preset."""
+    speed = speeds.get(job.preset_id)
+    if speed:
+        if job.input_duration and speed.realtime:
+            return job.input_duration / speed.realtime
+        if job.input_size and speed.bytes_per_sec:
+            return job.input_size / speed.bytes_per_sec
+    if job.input_size:
+        return job.input_size / QUEUE_SJF_DEFAULT_BPS
+    return QUEUE_SJF_DEFAULT_SEC
+
+
+class PresetSpeedModel:
+    """Mediana di velocità (realtime e byte/s) degli ultimi job completati per preset."""
+
+    def __init__(self, refresh_sec=SPEED_REFRESH_SEC, samples=SPEED_SAMPLES, clock=time.monotonic):
+        self.refresh_sec = refresh_sec
+        self.samples = samples
+        self._clock = clock
+        self._speeds = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def speeds(self, session):
+        with self._lock:
+            now = self._clock()
+            if self._refreshed_at is None or now - self._refreshed_at >= self.refresh_sec:
+                self._refreshed_at = now
+                try:
+                    self._speeds = self._learn(session)
+                except Exception as e:
+                    logger.warning("Aggiornamento velocità preset non riuscito: %s", e)
+            return dict(self._speeds)
+
+    def _learn(self, session):
+        rows = (
+            session.query(
+                TranscodeJob.preset_id,
+                TranscodeJob.input_duration,
+                TranscodeJob.input_size,
+                TranscodeJob.started_at,
+                TranscodeJob.completed_at,
+            )
+            .filter(
+                TranscodeJob.status == FileStatus.COMPLETED,
+                TranscodeJob.started_at.isnot(None),
+                TranscodeJob.completed_at.isnot(None),
+            )
+            .order_by(TranscodeJob.completed_at.desc())
+            .limit(self.samples * 50)
+            .all()
+        )
+        per_preset = defaultdict(lambda: ([], []))
+        for preset_id, duration, size, started_at, completed_at in rows:
+            realtime, throughput = per_preset[preset_id]
+            wall = (completed_at - started_at).total_seconds()
+            if wall <= 0:
+                continue
+            if duration and len(realtime) < self.samples:
+                realtime.append(duration / wall)
+            if size and len(throughput) < self.samples:
+                throughput.append(size / wall)
+        return {
+            preset_id: PresetSpeed(
+                statistics.median(realtime) if realtime else None,
+                statistics.median(throughput) if throughput else None,
+            )
+            for preset_id, (realtime, throughput) in per_preset.items()
+            if realtime or throughput
+        }
+
+
+POLICIES = {
+    PriorityPolicy.name: PriorityPolicy,
+    AgingPolicy.name: AgingPolicy,
+    FairSharePolicy.name: FairSharePolicy,
+    ShortestJobPolicy.name: ShortestJobPolicy,
+}
+
+_speed_model = PresetSpeedModel()
+_default_policy = None
+
+
+def get_policy(name):
+    try:
+        return POLICIES[name]()
+    except KeyError:
+        logger.warning("QUEUE_POLICY '%s' sconosciuta, uso 'priority'", name)
+        return PriorityPolicy()
+
+
+def default_policy():
+    """Politica configurata per il deployment (QUEUE_POLICY)."""
+    global _default_policy
+    if _default_policy is None:
+        _default_policy = get_policy(QUEUE_POLICY)
+    return _default_policy
+
+
+def build_context(session, policy, now=None):
+    running = {}
+    if policy.needs_running:
+        running = dict(
+            session.query(TranscodeJob.watchfolder_id, func.count(TranscodeJob.id))
+            .filter(TranscodeJob.status == FileStatus.PROCESSING)
+            .group_by(TranscodeJob.watchfolder_id)
+            .all()
+        )
+    speeds = _speed_model.speeds(session) if policy.needs_speeds else {}
+    return QueueContext(now or datetime.utcnow(), running, speeds)
@@ -0,0 +1,471 @@
+"""
+Sorgenti remote per i watchfolder (FTP, FTPS esplicito, SFTP) dietro un'interfaccia comune:
+list, stat, open_stream, download_range e download (con letture parallele per range).
+"""
+
+import base64
+import hashlib
+import os
+import stat as stat_module
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import ftputil
+
+from ftp_utils import chdir_ftp, ftp_session_factory
+from models import WATCH_TYPE_FTP, WATCH_TYPE_FTPS, WATCH_TYPE_SFTP
+
+DEFAULT_PORTS = {
+    WATCH_TYPE_FTP: 21,
+    WATCH_TYPE_FTPS: 21,
+    WATCH_TYPE_SFTP: 22,
+}
+
+# Buffer di lettura e parallelismo (letture per range su connessioni/handle separati)
+REMOTE_BLOCK_SIZE = int(os.getenv('REMOTE_BLOCK_SIZE', str(1024 * 1024)))
+REMOTE_PARALLEL_STREAMS = int(os.getenv('REMOTE_PARALLEL_STREAMS', '4'))
+REMOTE_PARALLEL_MIN_SIZE = int(os.getenv('REMOTE_PARALLEL_MIN_SIZE', str(256 * 1024 * 1024)))
+REMOTE_TIMEOUT_SEC = int(os.getenv('REMOTE_TIMEOUT_SEC', '30'))
+# known_hosts per le chiavi host SFTP (oltre a quelli di sistema) se il watchfolder
+# non ha una fingerprint propria
+SFTP_KNOWN_HOSTS = os.getenv('SFTP_KNOWN_HOSTS', '').strip()
+SYSTEM_KNOWN_HOSTS = ('/etc/ssh/ssh_known_hosts', os.path.expanduser('~/.ssh/known_hosts'))
+
+
+class HostKeyError(Exception):
+    """Chiave host SFTP assente dai known_hosts o diversa da quella attesa."""
+
+
+def default_port_for(watch_type):
+    return DEFAULT_PORTS.get(watch_type or WATCH_TYPE_FTP, 21)
+
+
+def split_ranges(size, streams):
+    """Divide [0, size) in al più `streams` range contigui: [(offset, length)]."""
+    streams = max(1, min(streams, size)) if size > 0 else 1
+    base, extra = divmod(size, streams)
+    ranges = []
+    offset = 0
+    for i in range(streams):
+        length = base + (1 if i < extra else 0)
+        if length:
+            ranges.append((offset, length))
+        offset += length
+    return ranges
+
+
+def _format_modify(timestamp):
+    """epoch -> formato fact MLSD 'modify' (YYYYMMDDHHMMSS, UTC)."""
+    if not timestamp:
+        return ''
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y%m%d%H%M%S')
+
+
+def host_key_fingerprint(key):
+    """Fingerprint SHA256 di una chiave paramiko, nel formato di ssh-keygen -l."""
+    digest = hashlib.sha256(key.asbytes()).digest()
+    return 'SHA256:' + base64.b64encode(digest).decode('ascii').rstrip('=')
+
+
+def known_host_keys(host, port, paths=None):
+    """{tipo chiave: bytes} dai file known_hosts per host (o [host]:porta se non 22)."""
+    import paramiko
+
+    if paths is None:
+        paths = [SFTP_KNOWN_HOSTS] + list(SYSTEM_KNOWN_HOSTS)
+    name = host if port in (None, 22) else f'[{host}]:{port}'
+    keys = {}
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            entries = paramiko.HostKeys(path).lookup(name) or {}
+        except (IOError, paramiko.SSHException):
+            continue
+        for key_type in entries.keys():
+            keys.setdefault(key_type, entries[key_type].asbytes())
+    return keys
+
+
+def verify_host_key(host, key, fingerprint=None, known_keys=None):
+    """
+    Chiave presentata dal server: deve avere la fingerprint configurata sul watchfolder
+    oppure comparire nei known_hosts. Altrimenti HostKeyError (connessione rifiutata).
+    """
+    presented = host_key_fingerprint(key)
+    if fingerprint:
+        expected = fingerprint.strip()
+        if not expected.startswith('SHA256:'):
+            expected = 'SHA256:' + expected
+        if presented.rstrip('=') != expected.rstrip('='):
+            raise HostKeyError(f'Chiave host di {host} diversa da quella attesa ({presented})')
+        return
+    known = known_keys.get(key.get_name()) if known_keys else None
+    if known is None:
+        raise HostKeyError(f'Chiave host di {host} sconosciuta ({presented}): aggiungerla a known_hosts')
+    if known != key.asbytes():
+        raise HostKeyError(f'Chiave host di {host} diversa da quella in known_hosts ({presented})')
+
+
+class RemoteSource:
+    """
+    Interfaccia comune delle sorgenti remote. Va usata come context manager:
+    la connessione è aperta in __enter__ e la directory corrente è remote_path.
+    """
+
+    def __init__(
+        self,
+        host,
+        username,
+        password='',
+        port=None,
+        remote_path='/',
+        timeout=REMOTE_TIMEOUT_SEC,
+        block_size=REMOTE_BLOCK_SIZE,
+        parallel_streams=REMOTE_PARALLEL_STREAMS,
+        parallel_min_size=REMOTE_PARALLEL_MIN_SIZE,
+    ):
+        self.host = host
+        self.username = username
+        self.password = password or ''
+        self.port = port
+        self.remote_path = remote_path or '/'
+        self.timeout = timeout
+        self.block_size = max(64 * 1024, block_size)
+        self.parallel_streams = max(1, parallel_streams)
+        self.parallel_min_size = parallel_min_size
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def connect(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def list(self):
+        """File nella directory corrente: [{'name', 'size', 'modify'}]."""
+        raise NotImplementedError
+
+    def stat(self, name):
+        """{'name', 'size', 'modify'} se `name` è un file regolare, altrimenti None."""
+        raise NotImplementedError
+
+    def open_stream(self, name, offset=0):
+        """File-like binario posizionato a `offset` (da chiudere a cura del chiamante)."""
+        raise NotImplementedError
+
+    def download_range(self, name, offset, length, sink):
+        """Legge `length` byte da `offset` passando ogni blocco a sink(chunk)."""
+        stream = self.open_stream(name, offset)
+        try:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(self.block_size, remaining))
+                if not chunk:
+                    raise IOError(
+                        f"{name}: EOF inatteso a offset {offset + length - remaining}"
+                    )
+                remaining -= len(chunk)
+                sink(chunk)
+        finally:
+            stream.close()
+
+    def download(self, name, local_path, callback=None, total_size=0):
+        """
+        Scarica `name` in `local_path` chiamando callback(chunk) per ogni blocco.
+        Sopra parallel_min_size usa più range in parallelo scritti con pwrite.
+        """
+        size = total_size
+        if not size:
+            info = self.stat(name)
+            size = info['size'] if info else 0
+        streams = self.parallel_streams if size >= self.parallel_min_size else 1
+        if streams <= 1 or size <= 0:
+            self._download_sequential(name, local_path, callback)
+        else:
+            self._download_parallel(name, local_path, size, streams, callback)
+
+    def _download_sequential(self, name, local_path, callback):
+        stream = self.open_stream(name)
+        try:
+            with open(local_path, 'wb', buffering=self.block_size) as target:
+                while True:
+                    chunk = stream.read(self.block_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    if callback:
+                        callback(chunk)
+        finally:
+            stream.close()
+
+    def _download_parallel(self, name, local_path, size, streams, callback):
+        callback_lock = threading.Lock()
+        with open(local_path, 'wb') as target:
+            target.truncate(size)
+            fd = target.fileno()
+
+            def make_sink(offset):
+                position = offset
+
+                def sink(chunk):
+                    nonlocal position
+                    os.pwrite(fd, chunk, position)
+                    position += len(chunk)
+                    if callback:
+                        with callback_lock:
+                            callback(chunk)
+                return sink
+
+            ranges = split_ranges(size, streams)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [
+                    pool.submit(self.download_range, name, offset, length, make_sink(offset))
+                    for offset, length in ranges
+                ]
+                for future in futures:
+                    future.result()
+
+
+class FTPSource(RemoteSource):
+    """FTP in chiaro via ftputil (ogni stream aperto usa una sessione figlia dedicata)."""
+
+    tls = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._host = None
+        self._open_lock = threading.Lock()
+
+    def connect(self):
+        session_cls = ftp_session_factory(self.timeout, tls=self.tls)
+        self._host = ftputil.FTPHost(
+            self.host,
+            self.username,
+            self.password,
+            port=self.port or default_port_for(WATCH_TYPE_FTP),
+            session_factory=session_cls,
+        )
+        try:
+            chdir_ftp(self._host, self.remote_path)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._host is not None:
+            try:
+                self._host.close()
+            finally:
+                self._host = None
+
+    def list(self):
+        try:
+            return self._list_mlsd()
+        except Exception:
+            return self._list_listdir()
+
+    def _list_mlsd(self):
+        # ftputil non espone MLSD: si usa la sessione ftplib sottostante (già nella cwd remota)
+        session = getattr(self._host, '_session', self._host)
+        files_info = []
+        for name, facts in session.mlsd():
+            if name in ('.', '..'):
+                continue
+            ftype = (facts.get('type') or '').lower()
+            if ftype in ('dir', 'cdir', 'pdir'):
+                continue
+            if ftype == 'file' or not ftype:
+                try:
+                    sz = facts.get('size', 0)
+                    size = int(sz) if sz else 0
+                except (TypeError, ValueError):
+                    size = 0
+                files_info.append({
+                    'name': name,
+                    'size': size,
+                    'modify': facts.get('modify', ''),
+                })
+        return files_info
+
+    def _list_listdir(self):
+        files_info = []
+        try:
+            files = self._host.listdir(self._host.curdir)
+        except Exception:
+            files = self._host.listdir('.')
+        for filename in files:
+            if filename in ('.', '..') or '/' in filename:
+                continue
+            try:
+                if self._host.path.isfile(filename):
+                    size = self._host.path.getsize(filename)
+                    files_info.append({'name': filename, 'size': size, 'modify': ''})
+            except Exception:
+                files_info.append({'name': filename, 'size': 0, 'modify': ''})
+        return files_info
+
+    def stat(self, name):
+        try:
+            if not self._host.path.isfile(name):
+                return None
+            st = self._host.stat(name)
+        except Exception:
+            return None
+        return {'name': name, 'size': st.st_size, 'modify': _format_modify(st.st_mtime)}
+
+    def open_stream(self, name, offset=0):
+        # L'apertura crea/riusa sessioni figlie di ftputil: va serializzata tra i thread
+        with self._open_lock:
+            return self._host.open(name, 'rb', rest=offset or None)
+
+
+class FTPSSource(FTPSource):
+    """FTP con TLS esplicito (AUTH TLS) e canale dati protetto (PROT P)."""
+
+    tls = True
+
+
+class SFTPSource(RemoteSource):
+    """
+    SFTP via paramiko (dipendenza opzionale). Le letture usano richieste in pipeline
+    (prefetch/readv); client_factory permette di iniettare un client compatibile
+    con paramiko.SFTPClient (es. server locale nei test).
+    """
+
+    def __init__(self, *args, client_factory=None, host_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client_factory = client_factory
+        self.host_key = host_key  # fingerprint SHA256 attesa (None = known_hosts)
+        self._client = None
+        self._transport = None
+
+    def connect(self):
+        if self.client_factory:
+            self._client = self.client_factory()
+        else:
+            try:
+                import paramiko
+            except ImportError as e:
+                raise RuntimeError('SFTP richiede il pacchetto paramiko (pip install paramiko)') from e
+            port = self.port or default_port_for(WATCH_TYPE_SFTP)
+            self._transport = paramiko.Transport((self.host, port))
+            self._transport.banner_timeout = self.timeout
+            try:
+                # Chiave host verificata prima di inviare le credenziali
+                self._transport.start_client(timeout=self.timeout)
+                verify_host_key(
+                    self.host,
+                    self._transport.get_remote_server_key(),
+                    self.host_key,
+                    None if self.host_key else known_host_keys(self.host, port),
+                )
+                self._transport.auth_password(self.username, self.password)
+            except BaseException:
+                self.close()
+                raise
+            self._client = paramiko.SFTPClient.from_transport(
+                self._transport,
+                window_size=max(self.block_size * 8, 2 ** 21),
+                max_packet_size=32768,
+            )
+            self._client.get_channel().settimeout(self.timeout)
+        try:
+            if self.remote_path and self.remote_path != '/':
+                self._client.chdir(self.remote_path)
+            else:
+                self._client.chdir('/')
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            if self._client is not None:
+                self._client.close()
+        finally:
+            self._client = None
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+
+    def _entry(self, name, attrs):
+        return {
+            'name': name,
+            'size': attrs.st_size or 0,
+            'modify': _format_modify(attrs.st_mtime),
+        }
+
+    def list(self):
+        files_info = []
+        for attrs in self._client.listdir_attr('.'):
+            if attrs.filename in ('.', '..'):
+                continue
+            if attrs.st_mode is not None and not stat_module.S_ISREG(attrs.st_mode):
+                continue
+            files_info.append(self._entry(attrs.filename, attrs))
+        return files_info
+
+    def stat(self, name):
+        try:
+            attrs = self._client.stat(name)
+        except (IOError, OSError):
+            return None
+        if attrs.st_mode is not None and not stat_module.S_ISREG(attrs.st_mode):
+            return None
+        return self._entry(name, attrs)
+
+    def open_stream(self, name, offset=0):
+        stream = self._client.open(name, 'rb', bufsize=self.block_size)
+        if offset:
+            stream.seek(offset)
+        # Richieste di lettura in pipeline fino a fine file
+        stream.prefetch()
+        return stream
+
+    def download_range(self, name, offset, length, sink):
+        stream = self._client.open(name, 'rb', bufsize=self.block_size)
+        try:
+            chunks = []
+            position = offset
+            end = offset + length
+            while position < end:
+                size = min(self.block_size, end - position)
+                chunks.append((position, size))
+                position += size
+            # readv invia tutte le richieste in pipeline e restituisce i blocchi in ordine
+            for data in stream.readv(chunks):
+                sink(data)
+        finally:
+            stream.close()
+
+
+REMOTE_SOURCES = {
+    WATCH_TYPE_FTP: FTPSource,
+    WATCH_TYPE_FTPS: FTPSSource,
+    WATCH_TYPE_SFTP: SFTPSource,
+}
+
+
+def open_remote_source(watchfolder, **kwargs):
+    """Crea (senza connettere) la sorgente remota adatta al watch_type del watchfolder."""
+    watch_type = watchfolder.watch_type or WATCH_TYPE_FTP
+    source_cls = REMOTE_SOURCES.get(watch_type, FTPSource)
+    if watch_type == WATCH_TYPE_SFTP:
+        kwargs.setdefault('host_key', watchfolder.sftp_host_key)
+    return source_cls(
+        watchfolder.ftp_host,
+        watchfolder.ftp_username,
+        watchfolder.ftp_password or '',
+        port=watchfolder.ftp_port or default_port_for(watch_type),
+        remote_path=watchfolder.ftp_remote_path or '/',
+        **kwargs,
+    )
@@ -0,0 +1,198 @@
+"""
+Ammissione dei job per costo stimato: ogni preset ha un costo (core CPU, RAM) appreso
+dai job completati (cpu_seconds / durata, picco RSS) o stimato dal codec; i job entrano
+finché il budget CPU/RAM del nodo lo consente e quelli piccoli riempiono i buchi
+attorno ai grandi (backfill), senza far attendere all'infinito il primo della coda.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from models import FileStatus, TranscodeJob
+
+logger = logging.getLogger('XDCAMTranscoder.Scheduler')
+
+
+def _physical_ram_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 16384
+
+
+RESOURCE_SCHEDULER_ENABLED = os.getenv('RESOURCE_SCHEDULER', '0').strip().lower() in ('1', 'true', 'yes')
+SCHED_CPU_CORES = float(os.getenv('SCHED_CPU_CORES', str(os.cpu_count() or 1)))
+SCHED_RAM_MB = int(os.getenv('SCHED_RAM_MB', str(int(_physical_ram_mb() * 0.8))))
+# Job in coda valutati per il backfill
+SCHED_LOOKAHEAD = int(os.getenv('SCHED_LOOKAHEAD', '10'))
+# Oltre questa attesa il primo job in coda non viene più scavalcato
+SCHED_HEAD_MAX_WAIT_SEC = int(os.getenv('SCHED_HEAD_MAX_WAIT_SEC', '900'))
+SCHED_REFRESH_SEC = 60
+SCHED_SAMPLES = 20
+
+JobCost = namedtuple('JobCost', 'cpu ram_mb')
+
+# Stime iniziali per codec video, finché il preset non ha job misurati
+DEFAULT_CODEC_COSTS = {
+    'libvvenc': JobCost(12.0, 8192),
+    'libx265': JobCost(8.0, 4096),
+    'libx264': JobCost(4.0, 1536),
+    'prores_ks': JobCost(4.0, 2048),
+    'prores': JobCost(4.0, 2048),
+    'dnxhd': JobCost(3.0, 1536),
+    'mpeg2video': JobCost(2.0, 1024),
+    'copy': JobCost(0.5, 256),
+}
+DEFAULT_COST = JobCost(2.0, 1024)
+
+
+def default_cost(preset):
+    codec = ((preset.video_codec if preset else '') or '').strip().lower()
+    return DEFAULT_CODEC_COSTS.get(codec, DEFAULT_COST)
+
+
+class PresetCostModel:
+    """
+    Costo per preset: mediana di cpu_seconds / durata e massimo del picco RSS degli
+    ultimi SCHED_SAMPLES job completati con misure; ricalcolato ogni refresh_sec.
+    """
+
+    def __init__(self, session_factory, refresh_sec=SCHED_REFRESH_SEC, samples=SCHED_SAMPLES, clock=time.monotonic):
+        self.session_factory = session_factory
+        self.refresh_sec = refresh_sec
+        self.samples = samples
+        self._clock = clock
+        self._learned = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def estimate(self, preset):
+        with self._lock:
+            now = self._clock()
+            if self._refreshed_at is None or now - self._refreshed_at >= self.refresh_sec:
+                self._refreshed_at = now
+                try:
+                    self._learned = self._learn()
+                except Exception as e:
+                    logger.warning("Aggiornamento costi preset non riuscito: %s", e)
+            learned = self._learned.get(preset.id) if preset else None
+        return learned or default_cost(preset)
+
+    def learned(self):
+        with self._lock:
+            return dict(self._learned)
+
+    def _learn(self):
+        session = self.session_factory()
+        try:
+            rows = (
+                session.query(
+                    TranscodeJob.preset_id,
+                    TranscodeJob.cpu_seconds,
+                    TranscodeJob.peak_rss_mb,
+                    TranscodeJob.started_at,
+                    TranscodeJob.completed_at,
+                )
+                .filter(
+                    TranscodeJob.status == FileStatus.COMPLETED,
+                    TranscodeJob.cpu_seconds.isnot(None),
+                    TranscodeJob.started_at.isnot(None),
+                    TranscodeJob.completed_at.isnot(None),
+                )
+                .order_by(TranscodeJob.completed_at.desc())
+                .limit(self.samples * 50)
+                .all()
+            )
+        finally:
+            session.close()
+
+        per_preset = {}
+        for preset_id, cpu_seconds, peak_rss_mb, started_at, completed_at in rows:
+            samples = per_preset.setdefault(preset_id, [])
+            if len(samples) >= self.samples:
+                continue
+            wall = (completed_at - started_at).total_seconds()
+            if wall <= 0:
+                continue
+            samples.append((cpu_seconds / wall, peak_rss_mb or 0))
+        return {
+            preset_id: JobCost(
+                round(max(0.1, statistics.median(cpu for cpu, _ in samples)), 2),
+                # Margine sul picco osservato: input diversi, stesso preset
+                int(max(rss for _, rss in samples) * 1.2) or DEFAULT_COST.ram_mb,
+            )
+            for preset_id, samples in per_preset.items()
+            if samples
+        }
+
+
+class ResourceScheduler:
+    """
+    Budget CPU/RAM del nodo condiviso da tutti gli slot worker. admit() sceglie tra
+    i primi job in coda il primo che entra nel budget; un job da solo è sempre
+    ammesso (anche se costa più del budget) per non bloccare la coda.
+    """
+
+    def __init__(
+        self,
+        cost_model,
+        cpu_budget=SCHED_CPU_CORES,
+        ram_budget_mb=SCHED_RAM_MB,
+        head_max_wait=SCHED_HEAD_MAX_WAIT_SEC,
+        enabled=RESOURCE_SCHEDULER_ENABLED,
+    ):
+        self.cost_model = cost_model
+        self.cpu_budget = cpu_budget
+        self.ram_budget_mb = ram_budget_mb
+        self.head_max_wait = head_max_wait
+        self.enabled = enabled
+        self._running = {}  # job_id -> JobCost
+        self._lock = threading.Lock()
+
+    def admit(self, candidates, now=None):
+        """
+        candidates: job PENDING nell'ordine della coda. Ritorna il job ammesso (con
+        risorse riservate fino a release) oppure None.
+        """
+        now = now or datetime.utcnow()
+        with self._lock:
+            for index, job in enumerate(candidates):
+                cost = self.cost_model.estimate(job.preset)
+                if self._fits(cost):
+                    self._running[job.id] = cost
+                    return job
+                if index == 0 and job.created_at and (now - job.created_at).total_seconds() > self.head_max_wait:
+                    # Il primo attende da troppo: niente backfill, le risorse si liberano per lui
+                    return None
+            return None
+
+    def release(self, job_id):
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def usage(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'cpu_budget': self.cpu_budget,
+                'ram_budget_mb': self.ram_budget_mb,
+                'cpu_used': round(sum(c.cpu for c in self._running.values()), 2),
+                'ram_used_mb': sum(c.ram_mb for c in self._running.values()),
+                'running': {str(job_id): c._asdict() for job_id, c in self._running.items()},
+                'learned_costs': {
+                    str(preset_id): c._asdict() for preset_id, c in self.cost_model.learned().items()
+                },
+            }
+
+    def _fits(self, cost):
+        if not self._running:
+            return True
+        cpu_used = sum(c.cpu for c in self._running.values())
+        ram_used = sum(c.ram_mb for c in self._running.values())
+        return cpu_used + cost.cpu <= self.cpu_budget and ram_used + cost.ram_mb <= self.ram_budget_mb
+
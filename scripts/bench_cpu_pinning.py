@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark FFmpeg concorrenti: throughput aggregato (frame/s) con budget di thread
+per job, senza e con pinning su core disgiunti. Come baseline anche il caso in cui
+ogni FFmpeg usa tutti i core (comportamento di default).
+
+Uso:
+  source .venv/bin/activate
+  python scripts/bench_cpu_pinning.py --jobs 4 [--codec libx264] [--frames 1500]
+
+Sorgente sintetica (lavfi testsrc2) e output su null: misura solo CPU, non I/O.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Permette l'esecuzione da /scripts mantenendo import dal project root
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from cpu_affinity import (  # noqa: E402
+    CoreAllocator,
+    apply_thread_budget,
+    available_cores,
+    pin_process,
+    thread_budget,
+)
+
+
+def _command(codec: str, frames: int, size: str):
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25",
+        "-frames:v", str(frames), "-c:v", codec, "-f", "null",
+        "-y", "-",
+    ]
+
+
+def run(label: str, jobs: int, codec: str, frames: int, size: str, budget: bool, pinning: bool) -> float:
+    cores = available_cores()
+    threads = thread_budget(len(cores), jobs)
+    allocator = CoreAllocator() if pinning else None
+    processes = []
+    start = time.perf_counter()
+    for _ in range(jobs):
+        cmd = _command(codec, frames, size)
+        if budget:
+            cmd = apply_thread_budget(cmd, threads, codec)
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if allocator:
+            pin_process(process.pid, allocator.allocate(threads))
+        processes.append(process)
+    failed = 0
+    for process in processes:
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            failed += 1
+            print(f"  ffmpeg terminato con {process.returncode}: {stderr.decode(errors='replace').strip()[:200]}")
+    elapsed = time.perf_counter() - start
+    fps = jobs * frames / elapsed
+    print(f"  {label:<12}: {elapsed:8.2f} s  {fps:10.1f} frame/s aggregati" + (f"  ({failed} falliti)" if failed else ""))
+    return fps
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=4, help="FFmpeg concorrenti")
+    parser.add_argument("--codec", default="libx264")
+    parser.add_argument("--frames", type=int, default=1500)
+    parser.add_argument("--size", default="1920x1080")
+    args = parser.parse_args()
+
+    cores = available_cores()
+    print(f"Core disponibili: {len(cores)}, job: {args.jobs}, "
+          f"thread per job: {thread_budget(len(cores), args.jobs)}, codec: {args.codec}")
+    try:
+        default = run("tutti i core", args.jobs, args.codec, args.frames, args.size, budget=False, pinning=False)
+    except FileNotFoundError:
+        print("ffmpeg non trovato nel PATH")
+        return 1
+    budget = run("budget", args.jobs, args.codec, args.frames, args.size, budget=True, pinning=False)
+    pinned = run("budget+pin", args.jobs, args.codec, args.frames, args.size, budget=True, pinning=True)
+    print(f"  budget/default     : {budget / default:8.2f}x")
+    print(f"  budget+pin/default : {pinned / default:8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
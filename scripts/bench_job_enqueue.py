@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark creazione job: percorso per-file (lookup watchfolder + query duplicati
++ commit per ogni file) contro enqueue_jobs (dedup set-based + una transazione).
+
+Uso:
+  source .venv/bin/activate
+  python scripts/bench_job_enqueue.py --files 5000 [--db /mnt/data/bench.db]
+
+Senza --db usa un database SQLite temporaneo su disco (i commit fanno fsync reali).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Permette l'esecuzione da /scripts mantenendo import dal project root
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from models import Base, FileStatus, TranscodeJob, WatchFolder  # noqa: E402
+from job_enqueue import ACTIVE_JOB_STATUSES, enqueue_jobs  # noqa: E402
+
+
+def _setup(db_path: str, watchfolder_id: int):
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    session.add(WatchFolder(id=watchfolder_id, name=f"bench{watchfolder_id}", path="/in", active=1))
+    session.commit()
+    session.close()
+    return engine, Session
+
+
+def _rows(watchfolder_id: int, files: int):
+    return [
+        {
+            "watchfolder_id": watchfolder_id,
+            "input_filename": f"clip_{i:06d}.mxf",
+            "input_path": f"/in/{watchfolder_id}/clip_{i:06d}.mxf",
+            "output_path": f"/out/clip_{i:06d}_default.mxf",
+            "input_size": 1024,
+        }
+        for i in range(files)
+    ]
+
+
+def per_file(Session, rows) -> None:
+    """Riproduce il vecchio process_file: 3 statement e un commit per file."""
+    for row in rows:
+        session = Session()
+        try:
+            session.query(WatchFolder).filter(WatchFolder.id == row["watchfolder_id"]).first()
+            existing = session.query(TranscodeJob).filter(
+                TranscodeJob.input_path == row["input_path"],
+                TranscodeJob.status.in_(ACTIVE_JOB_STATUSES),
+            ).first()
+            if existing:
+                continue
+            session.add(TranscodeJob(status=FileStatus.PENDING, **row))
+            session.commit()
+        finally:
+            session.close()
+
+
+def bulk(Session, rows) -> None:
+    session = Session()
+    try:
+        session.query(WatchFolder).filter(WatchFolder.id == rows[0]["watchfolder_id"]).first()
+        enqueue_jobs(session, rows)
+    finally:
+        session.close()
+
+
+def _measure(label: str, fn, Session, rows) -> float:
+    start = time.perf_counter()
+    fn(Session, rows)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<10}: {elapsed:8.2f} s  {len(rows) / elapsed:10.0f} file/s")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--db", help="Path database SQLite di prova (viene sovrascritto)")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.db:
+        db_path = args.db
+        if os.path.exists(db_path):
+            os.remove(db_path)
+    else:
+        tmpdir = tempfile.TemporaryDirectory(prefix="xdcam_bench_")
+        db_path = os.path.join(tmpdir.name, "bench.db")
+
+    try:
+        engine, Session = _setup(db_path, 1)
+        print(f"Job da creare: {args.files} (SQLite {db_path})")
+        slow = _measure("per-file", per_file, Session, _rows(1, args.files))
+        session = Session()
+        session.add(WatchFolder(id=2, name="bench2", path="/in", active=1))
+        session.commit()
+        session.close()
+        fast = _measure("bulk", bulk, Session, _rows(2, args.files))
+        # Secondo passaggio: tutti duplicati, nessun insert
+        _measure("bulk dup", bulk, Session, _rows(2, args.files))
+        print(f"  speedup   : {slow / fast:8.1f}x")
+        engine.dispose()
+    finally:
+        if tmpdir:
+            tmpdir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark del backend polling: snapshot scandir + diff su una cartella con molti file,
+confrontato con DirectorySnapshot/DirectorySnapshotDiff di watchdog (PollingObserver).
+
+Uso:
+  source .venv/bin/activate
+  python scripts/bench_polling_scan.py --entries 50000 [--dir /mnt/nfs/bench]
+
+Senza --dir crea i file in una cartella temporanea (rimossa al termine).
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from watchdog.utils.dirsnapshot import DirectorySnapshot, DirectorySnapshotDiff
+
+# Permette l'esecuzione da /scripts mantenendo import dal project root
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from polling_observer import diff_snapshots, snapshot_directory  # noqa: E402
+
+
+def _populate(path: str, entries: int) -> None:
+    for i in range(entries):
+        with open(os.path.join(path, f"clip_{i:06d}.mxf"), "wb") as f:
+            f.write(b"x")
+
+
+def _best_of(fn, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(path: str, entries: int, rounds: int) -> None:
+    base = snapshot_directory(path)
+    # Simula una passata con qualche variazione: 1 nuovo, 1 modificato, 1 rinominato
+    with open(os.path.join(path, "new_clip.mxf"), "wb") as f:
+        f.write(b"new")
+    with open(os.path.join(path, "clip_000001.mxf"), "ab") as f:
+        f.write(b"more")
+    os.rename(os.path.join(path, "clip_000002.mxf"), os.path.join(path, "renamed.mxf"))
+
+    scan = _best_of(lambda: snapshot_directory(path), rounds)
+    current = snapshot_directory(path)
+    diff = _best_of(lambda: diff_snapshots(base, current), rounds)
+    created, modified, moved, deleted = diff_snapshots(base, current)
+
+    wd_base = DirectorySnapshot(path, recursive=False)
+    wd_scan = _best_of(lambda: DirectorySnapshot(path, recursive=False), rounds)
+    wd_current = DirectorySnapshot(path, recursive=False)
+    wd_diff = _best_of(lambda: DirectorySnapshotDiff(wd_base, wd_current), rounds)
+
+    print(f"Entry: {len(current)}  (best of {rounds})")
+    print(f"  scandir snapshot : {scan * 1000:8.1f} ms")
+    print(f"  scandir diff     : {diff * 1000:8.1f} ms  "
+          f"(created={len(created)} modified={len(modified)} moved={len(moved)} deleted={len(deleted)})")
+    print(f"  watchdog snapshot: {wd_scan * 1000:8.1f} ms")
+    print(f"  watchdog diff    : {wd_diff * 1000:8.1f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--dir", help="Cartella (vuota) in cui creare i file, es. su mount NFS/SMB")
+    args = parser.parse_args()
+
+    path = args.dir or tempfile.mkdtemp(prefix="xdcam_bench_")
+    try:
+        os.makedirs(path, exist_ok=True)
+        _populate(path, args.entries)
+        run(path, args.entries, args.rounds)
+    finally:
+        if args.dir:
+            for name in os.listdir(path):
+                if name.startswith("clip_") or name in ("new_clip.mxf", "renamed.mxf"):
+                    os.remove(os.path.join(path, name))
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Simulazione delle politiche di coda (QUEUE_POLICY): turnaround medio e p95 (arrivo ->
+fine codifica), totale e per watchfolder, su un carico sintetico riproducibile:
+- news   (priority 1):  clip brevi frequenti
+- promo  (priority 10): clip medie
+- archive(priority 20): master lunghi, pochi
+
+La durata reale di ogni codifica si scosta dalla stima SJF (rumore lognormale).
+
+Uso:
+  python scripts/bench_queue_policies.py [--slots 4] [--hours 8] [--seed 1]
+"""
+
+import argparse
+import heapq
+import random
+import statistics
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+# Permette l'esecuzione da /scripts mantenendo import dal project root
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from queue_policy import POLICIES, PresetSpeed, QueueContext, expected_seconds  # noqa: E402
+
+START = datetime(2024, 1, 1)
+# Codifica a 2x realtime, sorgenti XDCAM 50 Mbit/s
+BYTES_PER_MEDIA_SEC = 50_000_000 // 8
+SPEEDS = {1: PresetSpeed(None, 2 * BYTES_PER_MEDIA_SEC)}
+
+# nome, priority, arrivi/ora, durata media (s) min-max
+WORKLOAD = (
+    ('news', 1, 40, (20, 120)),
+    ('promo', 10, 10, (120, 900)),
+    ('archive', 20, 2, (3600, 10800)),
+)
+
+
+def _workload(hours: float, seed: int):
+    rng = random.Random(seed)
+    jobs = []
+    for wf_id, (name, priority, per_hour, (low, high)) in enumerate(WORKLOAD, start=1):
+        watchfolder = SimpleNamespace(id=wf_id, name=name, priority=priority)
+        t = 0.0
+        while True:
+            t += rng.expovariate(per_hour / 3600)
+            if t > hours * 3600:
+                break
+            media = rng.uniform(low, high)
+            job = SimpleNamespace(
+                id=len(jobs) + 1,
+                watchfolder=watchfolder,
+                watchfolder_id=wf_id,
+                preset_id=1,
+                input_duration=None,
+                input_size=int(media * BYTES_PER_MEDIA_SEC),
+                created_at=START + timedelta(seconds=t),
+            )
+            job.actual = expected_seconds(job, SPEEDS) * rng.lognormvariate(0, 0.25)
+            jobs.append(job)
+    return sorted(jobs, key=lambda j: j.created_at)
+
+
+def simulate(policy, jobs, slots: int):
+    """Simulazione a eventi: a ogni arrivo/fine job gli slot liberi prendono il primo della politica."""
+    arrivals = list(jobs)
+    pending = []
+    running = []  # heap (fine, id, job)
+    turnaround = {}
+    now = START
+    while arrivals or pending or running:
+        next_arrival = arrivals[0].created_at if arrivals else None
+        next_finish = running[0][0] if running else None
+        if next_finish and (not next_arrival or next_finish <= next_arrival):
+            now, _, job = heapq.heappop(running)
+            turnaround[job.id] = (job, (now - job.created_at).total_seconds())
+        else:
+            now = next_arrival
+            pending.append(arrivals.pop(0))
+        while pending and len(running) < slots:
+            counts = {}
+            for _, _, job in running:
+                counts[job.watchfolder_id] = counts.get(job.watchfolder_id, 0) + 1
+            job = policy.order(pending, QueueContext(now, counts, SPEEDS))[0]
+            pending.remove(job)
+            heapq.heappush(running, (now + timedelta(seconds=job.actual), job.id, job))
+    return turnaround
+
+
+def _p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--hours", type=float, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    jobs = _workload(args.hours, args.seed)
+    print(f"Job: {len(jobs)} in {args.hours:g} h, slot: {args.slots}")
+    header = f"  {'politica':<11} {'media':>9} {'p95':>9}"
+    for name, *_ in WORKLOAD:
+        header += f" {name + ' media':>14} {name + ' p95':>12}"
+    print(header + "   (minuti)")
+    for name, policy_class in POLICIES.items():
+        results = simulate(policy_class(), jobs, args.slots)
+        times = [t for _, t in results.values()]
+        row = f"  {name:<11} {statistics.mean(times) / 60:9.1f} {_p95(times) / 60:9.1f}"
+        for wf_id in range(1, len(WORKLOAD) + 1):
+            wf_times = [t for job, t in results.values() if job.watchfolder_id == wf_id]
+            row += f" {statistics.mean(wf_times) / 60:14.1f} {_p95(wf_times) / 60:12.1f}"
+        print(row)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
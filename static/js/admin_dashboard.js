@@ -60,10 +60,11 @@ async function loadWatchfolders() {
 
         sorted.forEach(wf => {
             const row = document.createElement('tr');
-            const watchTypeLabel = wf.watch_type === 'ftp'
-                ? (wf.operation_mode === 'download_only' ? 'FTP (solo download)' : 'FTP')
+            const remoteLabel = (wf.watch_type || '').toUpperCase();
+            const watchTypeLabel = isRemoteWatchType(wf.watch_type)
+                ? (wf.operation_mode === 'download_only' ? `${remoteLabel} (solo download)` : remoteLabel)
                 : 'Locale';
-            const pathDisplay = wf.watch_type === 'ftp' 
+            const pathDisplay = isRemoteWatchType(wf.watch_type) 
                 ? `${escapeHtml(wf.ftp_host || '')}${wf.ftp_remote_path ? ':' + escapeHtml(wf.ftp_remote_path) : ''}`
                 : escapeHtml(wf.path);
             
@@ -129,10 +130,15 @@ async function editWatchfolder(id) {
             document.getElementById('watchfolder-ftp-username').value = wf.ftp_username || '';
             document.getElementById('watchfolder-ftp-password').value = ''; // Non mostrare password esistente
             document.getElementById('watchfolder-ftp-remote-path').value = wf.ftp_remote_path || '/';
+            document.getElementById('watchfolder-sftp-host-key').value = wf.sftp_host_key || '';
             document.getElementById('watchfolder-ftp-local-temp').value = wf.ftp_local_temp || '/tmp/xdcam_ftp';
             document.getElementById('watchfolder-operation-mode').value = wf.operation_mode || 'transcode';
             document.getElementById('watchfolder-preset-id').value = wf.preset_id || '';
             document.getElementById('watchfolder-priority').value = wf.priority ?? 10;
+            document.getElementById('watchfolder-quiet-period').value = wf.quiet_period ?? 10;
+            document.getElementById('watchfolder-watch-backend').value = wf.watch_backend || 'native';
+            document.getElementById('watchfolder-poll-interval').value = wf.poll_interval ?? 10;
+            document.getElementById('watchfolder-recursive').checked = !!wf.recursive;
             document.getElementById('watchfolder-active').checked = wf.active;
         }
     } else {
@@ -145,9 +151,13 @@ async function editWatchfolder(id) {
         document.getElementById('watchfolder-active').checked = true;
         document.getElementById('watchfolder-ftp-port').value = 21;
         document.getElementById('watchfolder-ftp-remote-path').value = '/';
+        document.getElementById('watchfolder-sftp-host-key').value = '';
         document.getElementById('watchfolder-ftp-local-temp').value = '/tmp/xdcam_ftp';
         document.getElementById('watchfolder-operation-mode').value = 'transcode';
         document.getElementById('watchfolder-priority').value = 10;
+        document.getElementById('watchfolder-quiet-period').value = 10;
+        document.getElementById('watchfolder-watch-backend').value = 'native';
+        document.getElementById('watchfolder-poll-interval').value = 10;
         toggleWatchfolderType();
         toggleWatchfolderOperationMode();
     }
@@ -167,12 +177,19 @@ document.getElementById('watchfolder-form').addEventListener('submit', async (e)
         output_path: document.getElementById('watchfolder-output-path').value,
         archive_path: document.getElementById('watchfolder-archive-path').value,
         priority: parseInt(document.getElementById('watchfolder-priority').value, 10) || 10,
+        quiet_period: parseInt(document.getElementById('watchfolder-quiet-period').value, 10) || 10,
         preset_id: document.getElementById('watchfolder-preset-id').value || null,
         active: document.getElementById('watchfolder-active').checked
     };
+
+    if (watchType === 'local') {
+        data.watch_backend = document.getElementById('watchfolder-watch-backend').value;
+        data.poll_interval = parseInt(document.getElementById('watchfolder-poll-interval').value, 10) || 10;
+        data.recursive = document.getElementById('watchfolder-recursive').checked;
+    }
     
-    // Aggiungi campi FTP se tipo FTP
-    if (watchType === 'ftp') {
+    // Aggiungi campi FTP se tipo remoto (FTP/FTPS/SFTP)
+    if (isRemoteWatchType(watchType)) {
         data.ftp_host = document.getElementById('watchfolder-ftp-host').value;
         data.ftp_port = parseInt(document.getElementById('watchfolder-ftp-port').value) || 21;
         data.ftp_username = document.getElementById('watchfolder-ftp-username').value;
@@ -181,6 +198,9 @@ document.getElementById('watchfolder-form').addEventListener('submit', async (e)
             data.ftp_password = password;
         }
         data.ftp_remote_path = document.getElementById('watchfolder-ftp-remote-path').value || '/';
+        if (watchType === 'sftp') {
+            data.sftp_host_key = document.getElementById('watchfolder-sftp-host-key').value.trim();
+        }
         data.ftp_local_temp = document.getElementById('watchfolder-ftp-local-temp').value || '/tmp/xdcam_ftp';
         data.operation_mode = document.getElementById('watchfolder-operation-mode').value || 'transcode';
         if (data.operation_mode === 'download_only') {
@@ -556,13 +576,26 @@ document.addEventListener('DOMContentLoaded', () => {
     }, 5000);
 });
 
+const REMOTE_WATCH_TYPES = ['ftp', 'ftps', 'sftp'];
+
+function isRemoteWatchType(watchType) {
+    return REMOTE_WATCH_TYPES.includes(watchType);
+}
+
 function toggleWatchfolderType() {
     const watchType = document.getElementById('watchfolder-type').value;
     const localFields = document.getElementById('local-fields');
     const ftpFields = document.getElementById('ftp-fields');
     const pathInput = document.getElementById('watchfolder-path');
+    const portInput = document.getElementById('watchfolder-ftp-port');
     
-    if (watchType === 'ftp') {
+    if (isRemoteWatchType(watchType)) {
+        // Porta di default coerente con il protocollo
+        if (watchType === 'sftp' && portInput.value === '21') {
+            portInput.value = '22';
+        } else if (watchType !== 'sftp' && portInput.value === '22') {
+            portInput.value = '21';
+        }
         localFields.style.display = 'none';
         ftpFields.style.display = 'block';
         pathInput.removeAttribute('required');
@@ -579,7 +612,7 @@ function toggleWatchfolderOperationMode() {
     const watchType = document.getElementById('watchfolder-type').value;
     const operationMode = document.getElementById('watchfolder-operation-mode').value;
     const presetGroup = document.getElementById('watchfolder-preset-group');
-    if (watchType !== 'ftp') {
+    if (!isRemoteWatchType(watchType)) {
         presetGroup.style.display = 'block';
         return;
     }
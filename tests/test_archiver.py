@@ -0,0 +1,85 @@
+"""Test archiviazione sorgenti: rename sullo stesso filesystem, mover in background altrove."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import archiver
+from archiver import ArchiveMover, archive_file, copy_file
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class TestArchiver(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmp, 'archive')
+        self.source = _write(os.path.join(self.tmp, 'clip.mxf'), os.urandom(300 * 1024))
+        with open(self.source, 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_same_device_is_renamed_synchronously(self):
+        mover = mock.Mock()
+        destination, moved = archive_file(self.source, self.archive, mover)
+        self.assertTrue(moved)
+        mover.submit.assert_not_called()
+        self.assertEqual(destination, os.path.join(self.archive, 'clip.mxf'))
+        self.assertEqual(self._read(destination), self.data)
+        self.assertFalse(os.path.exists(self.source))
+
+    def test_cross_device_is_copied_in_background_with_retry(self):
+        mover = ArchiveMover(workers=1, retries=2, retry_delay=0)
+        real_copy = archiver.copy_file
+        calls = []
+
+        def flaky_copy(src, dst):
+            calls.append(dst)
+            if len(calls) == 1:
+                _write(dst, b'partial')
+                raise OSError('connessione NAS persa')
+            real_copy(src, dst)
+
+        with mock.patch('archiver.same_device', return_value=False), \
+                mock.patch('archiver.copy_file', side_effect=flaky_copy):
+            destination, moved = archive_file(self.source, self.archive, mover)
+            self.assertFalse(moved)
+            mover.stop(wait=True)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self._read(destination), self.data)
+        self.assertFalse(os.path.exists(self.source))
+        # Nessun temporaneo rimasto nell'archivio
+        self.assertEqual(os.listdir(self.archive), ['clip.mxf'])
+
+    def test_checksum_mismatch_keeps_source(self):
+        mover = ArchiveMover(workers=1, retries=0, retry_delay=0)
+        with mock.patch('archiver.same_device', return_value=False), \
+                mock.patch('archiver.copy_file', side_effect=lambda src, dst: _write(dst, b'corrupt')):
+            archive_file(self.source, self.archive, mover)
+            mover.stop(wait=True)
+        self.assertEqual(self._read(self.source), self.data)
+        self.assertEqual(os.listdir(self.archive), [])
+
+    def test_copy_without_reflink(self):
+        destination = os.path.join(self.tmp, 'copy.mxf')
+        with mock.patch('archiver.COPY_CHUNK_SIZE', 64 * 1024), \
+                mock.patch('archiver.reflink', side_effect=OSError('EOPNOTSUPP')):
+            copy_file(self.source, destination)
+        self.assertEqual(self._read(destination), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
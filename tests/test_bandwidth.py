@@ -0,0 +1,84 @@
+import unittest
+
+from bandwidth import BandwidthManager, TokenBucket, mbps_to_bytes, bytes_to_mbps
+from ftp_utils import download_with_progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_unlimited_never_waits(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(bucket.consume(10 ** 9), 0)
+
+    def test_rate_limits_sustained_throughput(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1000, burst_seconds=1.0, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            bucket.consume(500)
+        # 5000 byte a 1000 B/s partendo da bucket vuoto: circa 5 s
+        self.assertAlmostEqual(clock.now, 5.0, places=3)
+
+    def test_set_rate_at_runtime(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1000, clock=clock, sleep=clock.sleep)
+        bucket.set_rate(0)
+        self.assertEqual(bucket.consume(10 ** 6), 0)
+        bucket.set_rate(2000)
+        self.assertAlmostEqual(bucket.consume(1000), 0.5, places=3)
+
+
+class TestBandwidthManager(unittest.TestCase):
+    def test_limits_roundtrip_in_mbps(self):
+        manager = BandwidthManager(global_rate=mbps_to_bytes(100))
+        manager.set_host_limit('FTP.Example.com', mbps_to_bytes(20))
+        manager.set_watchfolder_limit(3, mbps_to_bytes(5))
+        limits = manager.limits()
+        self.assertEqual(limits['global_mbps'], 100)
+        self.assertEqual(limits['hosts'], {'ftp.example.com': 20})
+        self.assertEqual(limits['watchfolders'], {3: 5})
+
+        manager.set_watchfolder_limit(3, 0)
+        self.assertEqual(manager.limits()['watchfolders'], {})
+
+    def test_transfer_reports_throughput_and_moves_to_recent(self):
+        manager = BandwidthManager()
+        transfer = manager.start_transfer(1, 'host', 'clip.mxf', 100)
+        transfer.throttle(60)
+        transfer.throttle(40)
+        self.assertEqual(len(manager.transfers()['active']), 1)
+        transfer.finish()
+        stats = manager.transfers()
+        self.assertEqual(stats['active'], [])
+        self.assertEqual(stats['recent'][0]['bytes_transferred'], 100)
+
+    def test_download_with_progress_throttles_each_chunk(self):
+        manager = BandwidthManager()
+        transfer = manager.start_transfer(1, 'host', 'clip.mxf', 300)
+
+        class FakeFTP:
+            def download(self, source, target, callback=None, **kwargs):
+                for _ in range(3):
+                    callback(b'x' * 100)
+
+        received = download_with_progress(FakeFTP(), 'clip.mxf', '/dev/null', 300, None, transfer)
+        self.assertEqual(received, 300)
+        self.assertEqual(transfer.bytes_transferred, 300)
+
+    def test_bytes_to_mbps(self):
+        self.assertEqual(bytes_to_mbps(mbps_to_bytes(12.5)), 12.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
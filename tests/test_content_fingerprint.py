@@ -0,0 +1,142 @@
+"""Test dedup per contenuto: impronta campionata, conferma con hash completo, riuso output."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import content_fingerprint
+from content_fingerprint import full_hash, link_or_copy, sampled_fingerprint
+from models import Base, FileStatus, TranscodeJob, TranscodePreset
+from transcoder_worker import TranscoderWorker
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_sample_collision_is_resolved_by_full_hash(self):
+        head, tail = b'h' * 64, b't' * 64
+        a = _write(os.path.join(self.tmp, 'a.mxf'), head + b'A' * 256 + tail)
+        b = _write(os.path.join(self.tmp, 'b.mxf'), head + b'B' * 256 + tail)
+        c = _write(os.path.join(self.tmp, 'c.mxf'), head + b'A' * 257 + tail)
+        # Il centro non è campionato: stessa impronta, hash completi diversi
+        self.assertEqual(sampled_fingerprint(a, 64), sampled_fingerprint(b, 64))
+        self.assertNotEqual(full_hash(a), full_hash(b))
+        # La size fa parte dell'impronta
+        self.assertNotEqual(sampled_fingerprint(a, 64), sampled_fingerprint(c, 64))
+
+    def test_link_or_copy_falls_back_to_copy(self):
+        source = _write(os.path.join(self.tmp, 'out.mxf'), b'encoded')
+        linked = os.path.join(self.tmp, 'linked.mxf')
+        link_or_copy(source, linked)
+        self.assertEqual(os.stat(linked).st_ino, os.stat(source).st_ino)
+
+        copied = os.path.join(self.tmp, 'copied.mxf')
+        with mock.patch('content_fingerprint.os.link', side_effect=OSError(18, 'EXDEV')):
+            link_or_copy(source, copied)
+        self.assertNotEqual(os.stat(copied).st_ino, os.stat(source).st_ino)
+        with open(copied, 'rb') as f:
+            self.assertEqual(f.read(), b'encoded')
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['copied.mxf', 'linked.mxf', 'out.mxf'])
+
+
+class TestWorkerDedup(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        session = self.Session()
+        preset = TranscodePreset(name='TEST', container='mxf')
+        session.add(preset)
+        session.commit()
+        self.preset_id = preset.id
+
+        self.content = b'clip' * 1000
+        first = _write(os.path.join(self.tmp, 'ftp_clip.mxf'), self.content)
+        self.first_output = _write(os.path.join(self.tmp, 'ftp_clip_test.mxf'), b'encoded output')
+        session.add(TranscodeJob(
+            preset_id=self.preset_id,
+            input_filename='ftp_clip.mxf',
+            input_path=first,
+            output_path=self.first_output,
+            output_size=len(b'encoded output'),
+            input_fingerprint=sampled_fingerprint(first),
+            input_hash=full_hash(first),
+            status=FileStatus.COMPLETED,
+            completed_at=datetime.utcnow(),
+        ))
+        session.commit()
+        session.close()
+        self.worker = TranscoderWorker(self.Session)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _run(self, data, preset_id=None):
+        path = _write(os.path.join(self.tmp, 'renamed.mxf'), data)
+        session = self.Session()
+        job = TranscodeJob(
+            preset_id=preset_id or self.preset_id,
+            input_filename='renamed.mxf',
+            input_path=path,
+            output_path=os.path.join(self.tmp, 'renamed_test.mxf'),
+            status=FileStatus.PROCESSING,
+        )
+        session.add(job)
+        session.commit()
+        job_id = job.id
+        session.close()
+
+        with mock.patch.object(content_fingerprint, 'CONTENT_DEDUP_ENABLED', True), \
+                mock.patch('transcoder_worker.subprocess.Popen', side_effect=OSError('ffmpeg')) as popen, \
+                mock.patch.object(TranscoderWorker, '_get_mediainfo', return_value=None):
+            self.worker._process_job(job_id)
+
+        session = self.Session()
+        try:
+            return session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first(), popen
+        finally:
+            session.close()
+
+    def test_identical_source_reuses_completed_output(self):
+        job, popen = self._run(self.content)
+        popen.assert_not_called()
+        self.assertEqual(job.status, FileStatus.COMPLETED)
+        self.assertEqual(job.dedup_source_job_id, 1)
+        self.assertEqual(job.output_size, len(b'encoded output'))
+        self.assertEqual(os.stat(job.output_path).st_ino, os.stat(self.first_output).st_ino)
+
+    def test_different_content_or_preset_is_transcoded(self):
+        job, popen = self._run(self.content[:-1] + b'X')
+        popen.assert_called_once()
+        self.assertIsNone(job.dedup_source_job_id)
+
+        session = self.Session()
+        other = TranscodePreset(name='OTHER', container='mxf')
+        session.add(other)
+        session.commit()
+        other_id = other.id
+        session.close()
+        job, popen = self._run(self.content, preset_id=other_id)
+        popen.assert_called_once()
+        self.assertFalse(os.path.exists(job.output_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
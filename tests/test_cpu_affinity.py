@@ -0,0 +1,84 @@
+"""Test budget thread FFmpeg e assegnazione core disgiunti per nodo NUMA."""
+
+import os
+import unittest
+
+from cpu_affinity import CoreAllocator, apply_thread_budget, parse_cpulist, pin_process, thread_budget
+from transcoder_worker import TranscoderWorker
+
+
+class TestThreadBudget(unittest.TestCase):
+    def test_budget_per_slot(self):
+        self.assertEqual(thread_budget(16, 4), 4)
+        self.assertEqual(thread_budget(16, 3), 5)
+        self.assertEqual(thread_budget(2, 8), 1)
+        self.assertEqual(thread_budget(8, 0), 8)
+
+    def test_options_inserted_before_output(self):
+        cmd = ['ffmpeg', '-i', 'in.mxf', '-c:v', 'libx264', '-y', 'out.mp4']
+        self.assertEqual(
+            apply_thread_budget(cmd, 4, 'libx264'),
+            ['ffmpeg', '-filter_threads', '4', '-i', 'in.mxf', '-c:v', 'libx264',
+             '-threads', '4', '-y', 'out.mp4'],
+        )
+
+    def test_x265_pools_merged_into_existing_params(self):
+        cmd = ['ffmpeg', '-i', 'in', '-c:v', 'libx265', '-x265-params', 'crf=20', '-y', 'out']
+        result = apply_thread_budget(cmd, 3, 'libx265')
+        self.assertEqual(result[result.index('-x265-params') + 1], 'crf=20:pools=3')
+
+        cmd = ['ffmpeg', '-i', 'in', '-c:v', 'libx265', '-y', 'out']
+        result = apply_thread_budget(cmd, 3, 'libx265')
+        self.assertEqual(result[result.index('-x265-params') + 1], 'pools=3')
+
+    def test_preset_threads_take_precedence(self):
+        cmd = ['ffmpeg', '-i', 'in', '-threads', '2', '-x265-params', 'pools=1', '-y', 'out']
+        result = apply_thread_budget(cmd, 8, 'libx265')
+        self.assertEqual(result.count('-threads'), 1)
+        self.assertEqual(result[result.index('-threads') + 1], '2')
+        self.assertEqual(result[result.index('-x265-params') + 1], 'pools=1')
+
+
+class TestCoreAllocator(unittest.TestCase):
+    def test_parse_cpulist(self):
+        self.assertEqual(parse_cpulist('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+
+    def test_disjoint_sets_prefer_single_node(self):
+        allocator = CoreAllocator(nodes=[[0, 1, 2, 3], [4, 5, 6, 7]])
+        first = allocator.allocate(3)
+        second = allocator.allocate(3)
+        self.assertEqual(first, [0, 1, 2])
+        # Nel nodo 0 resta un solo core: il secondo job va tutto sul nodo 1
+        self.assertEqual(second, [4, 5, 6])
+        # Nessun nodo con 2 core liberi: si completa dagli altri nodi
+        self.assertEqual(sorted(allocator.allocate(2)), [3, 7])
+        self.assertEqual(allocator.allocate(1), [])
+
+        allocator.release(first)
+        self.assertEqual(allocator.allocate(2), [0, 1])
+
+
+@unittest.skipUnless(hasattr(os, 'sched_setaffinity'), 'richiede sched_setaffinity')
+class TestPinProcess(unittest.TestCase):
+    def test_pins_current_process(self):
+        original = os.sched_getaffinity(0)
+        core = min(original)
+        try:
+            self.assertTrue(pin_process(os.getpid(), [core]))
+            self.assertEqual(os.sched_getaffinity(0), {core})
+        finally:
+            for tid in os.listdir(f'/proc/{os.getpid()}/task'):
+                os.sched_setaffinity(int(tid), original)
+
+
+class TestWorkerBudget(unittest.TestCase):
+    def test_budget_counts_running_slots(self):
+        worker = TranscoderWorker(lambda: None)
+        worker.worker_threads = {1: [object(), object()], 2: [object()]}
+        worker.running = {1: True, 2: False}
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.assertEqual(worker._ffmpeg_thread_budget(), max(1, cores // 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Test cache codifiche: chiave comando, riuso output, eviction per età e dimensione."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from content_fingerprint import full_hash, sampled_fingerprint
+from encode_cache import EncodeCache, command_hash
+from models import Base, EncodeCacheEntry, FileStatus, TranscodeJob, TranscodePreset
+from transcoder_worker import TranscoderWorker
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class TestCommandHash(unittest.TestCase):
+    def test_paths_are_ignored_but_container_is_not(self):
+        a = command_hash(['ffmpeg', '-i', '/in/a.mxf', '-c:v', 'mpeg2video', '-y', '/out/a.mxf'],
+                         '/in/a.mxf', '/out/a.mxf')
+        b = command_hash(['ffmpeg', '-i', '/ftp/b.mxf', '-c:v', 'mpeg2video', '-y', '/out2/b.mxf'],
+                         '/ftp/b.mxf', '/out2/b.mxf')
+        mov = command_hash(['ffmpeg', '-i', '/in/a.mxf', '-c:v', 'mpeg2video', '-y', '/out/a.mov'],
+                           '/in/a.mxf', '/out/a.mov')
+        other = command_hash(['ffmpeg', '-i', '/in/a.mxf', '-c:v', 'libx264', '-y', '/out/a.mxf'],
+                             '/in/a.mxf', '/out/a.mxf')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, mov)
+        self.assertNotEqual(a, other)
+
+
+class TestEncodeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = EncodeCache(cache_dir=os.path.join(self.tmp, 'cache'), max_bytes=0,
+                                 max_age=timedelta(days=30))
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _store(self, name, data, cmd='c' * 64):
+        source = _write(os.path.join(self.tmp, f'{name}.mxf'), name.encode() * 10)
+        output = _write(os.path.join(self.tmp, f'{name}_out.mxf'), data)
+        return source, self.cache.store(
+            self.session, sampled_fingerprint(source), full_hash(source), cmd, output
+        )
+
+    def test_store_lookup_materialize(self):
+        source, entry = self._store('clip', b'encoded')
+        found, source_hash = self.cache.lookup(self.session, sampled_fingerprint(source), 'c' * 64, source)
+        self.assertEqual(found.id, entry.id)
+        self.assertEqual(source_hash, full_hash(source))
+
+        destination = os.path.join(self.tmp, 'again.mxf')
+        self.assertTrue(self.cache.materialize(self.session, found, destination))
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), b'encoded')
+        self.assertEqual(found.hits, 1)
+
+        missing, _ = self.cache.lookup(self.session, sampled_fingerprint(source), 'd' * 64, source)
+        self.assertIsNone(missing)
+
+    def test_corrupted_entry_is_dropped(self):
+        source, entry = self._store('clip', b'encoded')
+        # Stessa size, contenuto diverso: solo il checksum se ne accorge
+        os.remove(entry.cache_path)
+        _write(entry.cache_path, b'ENCODED')
+        self.assertFalse(self.cache.materialize(self.session, entry, os.path.join(self.tmp, 'x.mxf')))
+        self.assertEqual(self.session.query(EncodeCacheEntry).count(), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'x.mxf')))
+
+    def test_eviction_by_age_and_total_size(self):
+        _, old = self._store('old', b'o' * 100)
+        _, mid = self._store('mid', b'm' * 100)
+        _, new = self._store('new', b'n' * 100)
+        now = datetime.utcnow()
+        old.last_used_at = now - timedelta(days=31)
+        mid.last_used_at = now - timedelta(days=2)
+        self.session.commit()
+        old_path, mid_path = old.cache_path, mid.cache_path
+
+        self.cache.max_bytes = 150
+        self.assertEqual(self.cache.evict(self.session, now=now), 2)
+        remaining = self.session.query(EncodeCacheEntry).all()
+        self.assertEqual([e.id for e in remaining], [new.id])
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(mid_path))
+
+
+class TestWorkerEncodeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.cache = EncodeCache(cache_dir=os.path.join(self.tmp, 'cache'))
+        self.worker = TranscoderWorker(self.Session, encode_cache=self.cache)
+
+        session = self.Session()
+        preset = TranscodePreset(name='TEST', container='mxf')
+        session.add(preset)
+        session.commit()
+        self.source = _write(os.path.join(self.tmp, 'clip.mxf'), b'source' * 100)
+        job = TranscodeJob(
+            preset_id=preset.id,
+            input_filename='clip.mxf',
+            input_path=self.source,
+            output_path=os.path.join(self.tmp, 'clip_test.mxf'),
+            status=FileStatus.PROCESSING,
+        )
+        session.add(job)
+        session.commit()
+        self.job_id = job.id
+
+        # Output di una codifica precedente con lo stesso comando effettivo
+        previous = _write(os.path.join(self.tmp, 'previous.mxf'), b'encoded output')
+        cmd = self.worker._build_ffmpeg_command(job)
+        self.cache.store(
+            session, sampled_fingerprint(self.source), full_hash(self.source),
+            command_hash(cmd, job.input_path, job.output_path), previous,
+        )
+        session.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_repeat_job_is_served_from_cache(self):
+        with mock.patch('transcoder_worker.subprocess.Popen', side_effect=OSError('ffmpeg')) as popen, \
+                mock.patch.object(TranscoderWorker, '_get_mediainfo', return_value=None), \
+                mock.patch.object(TranscoderWorker, '_get_video_duration', return_value=12.0):
+            self.worker._process_job(self.job_id)
+        popen.assert_not_called()
+
+        session = self.Session()
+        try:
+            job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+            entry = session.query(EncodeCacheEntry).one()
+        finally:
+            session.close()
+        self.assertEqual(job.status, FileStatus.COMPLETED)
+        self.assertEqual(job.output_size, len(b'encoded output'))
+        self.assertEqual(job.output_duration, 12.0)
+        self.assertEqual(entry.hits, 1)
+        with open(job.output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'encoded output')
+
+
+if __name__ == '__main__':
+    unittest.main()
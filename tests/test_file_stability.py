@@ -0,0 +1,125 @@
+"""Test rilevamento stabilità file locali (watchfolder)."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from file_stability import StabilityTracker
+from watchfolder_manager import WatchFolderHandler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStabilityTracker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'clip.mxf')
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 100)
+        self.clock = FakeClock()
+        self.stable = []
+        self.tracker = StabilityTracker(
+            lambda path, size, mtime: self.stable.append((path, size)),
+            quiet_period=5,
+            dir_debounce=0,
+            clock=self.clock,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_enqueues_only_after_quiet_period(self):
+        self.tracker.touch(self.path)
+        self.assertEqual(self.tracker.check(), [])
+        self.clock.now = 4
+        self.assertEqual(self.tracker.check(), [])
+        self.clock.now = 5
+        self.assertEqual(self.tracker.check(), [self.path])
+        self.assertEqual(self.stable, [(self.path, 100)])
+        self.assertEqual(self.tracker.pending(), [])
+
+    def test_growing_file_restarts_quiet_period(self):
+        self.tracker.touch(self.path)
+        self.tracker.check()
+        self.clock.now = 4
+        with open(self.path, 'ab') as f:
+            f.write(b'y' * 50)
+        self.tracker.check()
+        self.clock.now = 8
+        self.assertEqual(self.tracker.check(), [])
+        self.clock.now = 9
+        self.assertEqual(self.tracker.check(), [self.path])
+        self.assertEqual(self.stable, [(self.path, 150)])
+
+    def test_write_event_restarts_quiet_period(self):
+        self.tracker.touch(self.path)
+        self.tracker.check()
+        self.clock.now = 4
+        self.tracker.touch(self.path)
+        self.clock.now = 6
+        self.assertEqual(self.tracker.check(), [])
+
+    def test_busy_directory_defers_stat_of_active_files(self):
+        tracker = StabilityTracker(
+            lambda *args: None, quiet_period=5, dir_debounce=2, clock=self.clock
+        )
+        other = os.path.join(self.tmp, 'other.mxf')
+        tracker.touch(self.path)
+        tracker.check()
+        self.assertIsNone(tracker._candidates[self.path].size)
+        # Raffica continua nella cartella: il file fermo da quiet_period viene comunque controllato
+        for now in (1, 2, 3, 4, 5):
+            self.clock.now = now
+            tracker.touch(other)
+            tracker.check()
+        self.assertEqual(tracker._candidates[self.path].size, 100)
+        self.assertIsNone(tracker._candidates[other].size)
+
+    def test_removed_file_is_dropped(self):
+        self.tracker.touch(self.path)
+        os.remove(self.path)
+        self.assertEqual(self.tracker.check(), [])
+        self.assertEqual(self.tracker.pending(), [])
+
+
+class TestWatchFolderHandlerEvents(unittest.TestCase):
+    def setUp(self):
+        self.handler = WatchFolderHandler(1, MagicMock(), quiet_period=5)
+        self.handler.process_files = MagicMock(side_effect=lambda paths: set(paths))
+
+    def test_events_do_not_block_dispatch_thread(self):
+        start = time.monotonic()
+        for i in range(50):
+            self.handler.on_created(
+                SimpleNamespace(is_directory=False, src_path=f'/drop/clip{i}.mxf')
+            )
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(len(self.handler.stability.pending()), 50)
+        self.handler.process_files.assert_not_called()
+
+    def test_moved_tracks_destination_and_ignores_other_extensions(self):
+        self.handler.on_created(SimpleNamespace(is_directory=False, src_path='/drop/clip.part'))
+        self.handler.on_moved(
+            SimpleNamespace(is_directory=False, src_path='/drop/clip.part', dest_path='/drop/clip.mxf')
+        )
+        self.assertEqual(self.handler.stability.pending(), ['/drop/clip.mxf'])
+
+    def test_unchanged_file_is_not_enqueued_twice(self):
+        self.handler._on_file_stable('/drop/clip.mxf', 100, 1.0)
+        self.handler._on_file_stable('/drop/clip.mxf', 100, 1.0)
+        self.handler._on_file_stable('/drop/clip.mxf', 200, 2.0)
+        self.assertEqual(self.handler.process_files.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
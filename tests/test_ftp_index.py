@@ -0,0 +1,178 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import (
+    Base,
+    WatchFolder,
+    TranscodeJob,
+    FileStatus,
+    FTPFileIndex,
+    FTP_INDEX_DONE,
+    FTP_INDEX_PENDING,
+)
+from ftp_index import defer_index_entry, diff_remote_listing, find_blocking_job_id, mark_index_done
+
+
+def _listing(*files, modify=''):
+    return {name.lower(): {'name': name, 'size': size, 'modify': modify} for name, size in files}
+
+
+class TestFTPFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = self.Session()
+        wf = WatchFolder(name="FTP", path="", watch_type="ftp")
+        self.session.add(wf)
+        self.session.commit()
+        self.wf_id = wf.id
+
+    def tearDown(self):
+        self.session.close()
+
+    def _state(self, name):
+        row = self.session.query(FTPFileIndex).filter(
+            FTPFileIndex.watchfolder_id == self.wf_id,
+            FTPFileIndex.name_key == name.lower(),
+        ).first()
+        return row.state if row else None
+
+    def test_file_ready_after_quiet_period(self):
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        ready = diff_remote_listing(self.session, self.wf_id, _listing(("clip.mxf", 100)), 10, now=t0)
+        self.assertEqual(ready, [])
+        self.assertEqual(self._state("clip.mxf"), FTP_INDEX_PENDING)
+
+        t1 = t0 + timedelta(seconds=5)
+        ready = diff_remote_listing(self.session, self.wf_id, _listing(("clip.mxf", 200)), 10, now=t1)
+        self.assertEqual(ready, [])
+
+        ready = diff_remote_listing(
+            self.session, self.wf_id, _listing(("clip.mxf", 200)), 10, now=t1 + timedelta(seconds=5)
+        )
+        self.assertEqual(ready, [])
+
+        ready = diff_remote_listing(
+            self.session, self.wf_id, _listing(("clip.mxf", 200)), 10, now=t1 + timedelta(seconds=10)
+        )
+        self.assertEqual([f['name'] for f in ready], ["clip.mxf"])
+
+    def test_old_mlsd_modify_ready_on_second_unchanged_poll(self):
+        now = datetime(2026, 1, 1, 12, 0, 0)
+        listing = _listing(("done.mov", 500), modify="20260101115900")
+        self.assertEqual(diff_remote_listing(self.session, self.wf_id, listing, 10, now=now), [])
+        ready = diff_remote_listing(self.session, self.wf_id, listing, 10, now=now + timedelta(seconds=3))
+        self.assertEqual([f['name'] for f in ready], ["done.mov"])
+
+    def test_server_clock_behind_does_not_accept_growing_file(self):
+        # Orologio del server indietro di un'ora: 'modify' sembra vecchio ma l'upload è in corso
+        now = datetime(2026, 1, 1, 12, 0, 0)
+        first = _listing(("live.mxf", 100), modify="20260101110000")
+        self.assertEqual(diff_remote_listing(self.session, self.wf_id, first, 10, now=now), [])
+        growing = _listing(("live.mxf", 400), modify="20260101110003")
+        ready = diff_remote_listing(self.session, self.wf_id, growing, 10, now=now + timedelta(seconds=3))
+        self.assertEqual(ready, [])
+
+    def test_recent_mlsd_modify_waits(self):
+        now = datetime(2026, 1, 1, 12, 0, 0)
+        listing = _listing(("live.mov", 500), modify="20260101115958")
+        ready = diff_remote_listing(self.session, self.wf_id, listing, 10, now=now)
+        self.assertEqual(ready, [])
+
+    def test_mtime_change_resets_quiet_period(self):
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        diff_remote_listing(self.session, self.wf_id, _listing(("a.mxf", 100), modify="20260101120000"), 10, now=t0)
+        ready = diff_remote_listing(
+            self.session, self.wf_id, _listing(("a.mxf", 100), modify="20260101120008"), 10,
+            now=t0 + timedelta(seconds=15),
+        )
+        self.assertEqual(ready, [])
+
+    def test_done_file_not_redetected_across_sessions(self):
+        diff_remote_listing(self.session, self.wf_id, _listing(("Clip.MXF", 100)))
+        mark_index_done(self.session, self.wf_id, "Clip.MXF", job_id=None)
+        self.session.close()
+
+        # Nuova sessione = riavvio del servizio
+        self.session = self.Session()
+        for _ in range(2):
+            ready = diff_remote_listing(self.session, self.wf_id, _listing(("Clip.MXF", 100)))
+            self.assertEqual(ready, [])
+        self.assertEqual(self._state("clip.mxf"), FTP_INDEX_DONE)
+
+    def test_existing_job_bootstraps_index(self):
+        self.session.add(TranscodeJob(
+            watchfolder_id=self.wf_id,
+            input_filename="OLD.mov",
+            input_path="/tmp/OLD.mov",
+            status=FileStatus.COMPLETED,
+        ))
+        self.session.commit()
+
+        diff_remote_listing(self.session, self.wf_id, _listing(("old.mov", 10)))
+        self.assertEqual(self._state("old.mov"), FTP_INDEX_DONE)
+
+    def test_vanished_pending_entry_removed(self):
+        diff_remote_listing(self.session, self.wf_id, _listing(("partial.mp4", 10)))
+        diff_remote_listing(self.session, self.wf_id, {})
+        self.assertIsNone(self._state("partial.mp4"))
+
+    def test_failed_job_without_local_file_releases_entry(self):
+        job = TranscodeJob(
+            watchfolder_id=self.wf_id,
+            input_filename="retry.mp4",
+            input_path="/tmp/__missing_retry.mp4",
+            status=FileStatus.FAILED,
+        )
+        self.session.add(job)
+        self.session.commit()
+        mark_index_done(self.session, self.wf_id, "retry.mp4", job_id=job.id)
+
+        diff_remote_listing(self.session, self.wf_id, _listing(("retry.mp4", 10)))
+        self.assertEqual(self._state("retry.mp4"), FTP_INDEX_PENDING)
+
+    def test_failed_acquisition_without_job_is_retried(self):
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        diff_remote_listing(self.session, self.wf_id, _listing(("drop.mxf", 100)), 10, now=t0)
+        t1 = t0 + timedelta(seconds=10)
+        ready = diff_remote_listing(self.session, self.wf_id, _listing(("drop.mxf", 100)), 10, now=t1)
+        self.assertEqual([f['name'] for f in ready], ["drop.mxf"])
+
+        # Download fallito prima di creare il job: nessun job attivo, la voce resta pending
+        self.assertIsNone(find_blocking_job_id(self.session, self.wf_id, "drop.mxf"))
+        defer_index_entry(self.session, self.wf_id, "drop.mxf", now=t1)
+        self.assertEqual(self._state("drop.mxf"), FTP_INDEX_PENDING)
+        ready = diff_remote_listing(
+            self.session, self.wf_id, _listing(("drop.mxf", 100)), 10, now=t1 + timedelta(seconds=5)
+        )
+        self.assertEqual(ready, [])
+        ready = diff_remote_listing(
+            self.session, self.wf_id, _listing(("drop.mxf", 100)), 10, now=t1 + timedelta(seconds=10)
+        )
+        self.assertEqual([f['name'] for f in ready], ["drop.mxf"])
+
+    def test_blocking_job_lookup_is_case_insensitive_and_indexed(self):
+        job = TranscodeJob(
+            watchfolder_id=self.wf_id, input_filename="Live.MXF", input_path="/tmp/Live.MXF",
+            status=FileStatus.PROCESSING,
+        )
+        self.session.add(job)
+        self.session.commit()
+        self.assertEqual(find_blocking_job_id(self.session, self.wf_id, "live.mxf"), job.id)
+        with self.engine.connect() as conn:
+            plan = conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE watchfolder_id = 1 AND lower(input_filename) IN ('a', 'b')"
+            )).fetchall()
+        self.assertIn('ix_jobs_watchfolder_filename_lower', ' '.join(str(row) for row in plan))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,7 @@ from ftputil.error import PermanentError
 
 
 class TestFTPWatcherErrors(unittest.TestCase):
-    @patch('ftp_watcher.ftputil.FTPHost')
+    @patch('remote_sources.ftputil.FTPHost')
     def test_login_error_sets_status_error(self, mock_ftp_host):
         mock_ftp_host.side_effect = PermanentError('530 Login incorrect.')
 
@@ -30,6 +30,17 @@ class TestFTPWatcherErrors(unittest.TestCase):
 
         self.assertFalse(hasattr(ftputil, 'FTPError'))
 
+    def test_parse_mlsd_modify(self):
+        from datetime import datetime
+        from ftp_utils import parse_mlsd_modify
+
+        self.assertEqual(parse_mlsd_modify('20260101120304'), datetime(2026, 1, 1, 12, 3, 4))
+        self.assertEqual(
+            parse_mlsd_modify('20260101120304.5'), datetime(2026, 1, 1, 12, 3, 4, 500000)
+        )
+        self.assertIsNone(parse_mlsd_modify(''))
+        self.assertIsNone(parse_mlsd_modify('garbage'))
+
     def test_video_extensions_include_m4v(self):
         from ftp_utils import VIDEO_EXTENSIONS
 
@@ -37,5 +48,28 @@ class TestFTPWatcherErrors(unittest.TestCase):
         self.assertIn('.mp4', VIDEO_EXTENSIONS)
 
 
+class TestAdaptivePollInterval(unittest.TestCase):
+    def test_idle_backoff_is_exponential_and_capped(self):
+        from ftp_watcher import AdaptivePollInterval
+
+        poll = AdaptivePollInterval(min_sec=2, idle_sec=10, max_sec=60)
+        self.assertEqual([poll.on_idle() for _ in range(5)], [10, 20, 40, 60, 60])
+
+    def test_activity_resets_to_min(self):
+        from ftp_watcher import AdaptivePollInterval
+
+        poll = AdaptivePollInterval(min_sec=2, idle_sec=10, max_sec=60)
+        poll.on_idle()
+        poll.on_idle()
+        self.assertEqual(poll.on_activity(), 2)
+        self.assertEqual(poll.on_idle(), 10)
+
+    def test_error_backoff(self):
+        from ftp_watcher import AdaptivePollInterval
+
+        poll = AdaptivePollInterval(min_sec=2, idle_sec=10, max_sec=30)
+        self.assertEqual([poll.on_error() for _ in range(3)], [10, 20, 30])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+"""Test staging sorgenti su scratch locale: prefetch, riuso, budget con eviction LRU."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from input_staging import InputStager
+
+
+class TestInputStager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nas = os.path.join(self.tmp, 'nas')
+        os.makedirs(self.nas)
+        self.scratch = os.path.join(self.tmp, 'scratch')
+        self.stager = InputStager(staging_dir=self.scratch, max_bytes=250, reserve_bytes=0)
+
+    def tearDown(self):
+        self.stager.shutdown()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _source(self, name, size=100, fill=b'x'):
+        path = os.path.join(self.nas, name)
+        with open(path, 'wb') as f:
+            f.write(fill * size)
+        return path
+
+    def _staged(self):
+        return sorted(n for n in os.listdir(self.scratch))
+
+    def test_acquire_copies_once_and_reuses(self):
+        source = self._source('a.mxf', fill=b'a')
+        local = self.stager.acquire(source)
+        self.assertNotEqual(local, source)
+        self.assertTrue(local.startswith(self.scratch))
+        with open(local, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 100)
+        self.stager.release(source)
+
+        with mock.patch.object(InputStager, '_copy') as copy:
+            self.assertEqual(self.stager.acquire(source), local)
+        copy.assert_not_called()
+
+    def test_changed_source_is_staged_again(self):
+        source = self._source('a.mxf', fill=b'a')
+        self.stager.acquire(source)
+        self.stager.release(source)
+        self._source('a.mxf', size=120, fill=b'b')
+        local = self.stager.acquire(source)
+        with open(local, 'rb') as f:
+            self.assertEqual(f.read(), b'b' * 120)
+
+    def test_lru_eviction_skips_inputs_in_use(self):
+        a, b, c, d = (self._source(n) for n in ('a.mxf', 'b.mxf', 'c.mxf', 'd.mxf'))
+        local_a = self.stager.acquire(a)  # resta in uso
+        self.stager.acquire(b)
+        self.stager.release(b)
+        # 300 > 250: esce b (a è in uso)
+        self.stager.acquire(c)
+        self.assertEqual(self.stager.used_bytes(), 200)
+        self.assertTrue(os.path.exists(local_a))
+        self.assertEqual(len(self._staged()), 2)
+        # a e c in uso: d non entra, si codifica dal NAS
+        self.assertEqual(self.stager.acquire(d), d)
+
+    def test_oversized_input_is_not_staged(self):
+        big = self._source('big.mxf', size=300)
+        self.assertEqual(self.stager.acquire(big), big)
+
+    def test_prefetch_then_acquire_waits_for_the_same_copy(self):
+        source = self._source('a.mxf')
+        real_copy = InputStager._copy
+        calls = []
+
+        def slow_copy(stager, entry, input_path):
+            calls.append(input_path)
+            time.sleep(0.2)
+            real_copy(stager, entry, input_path)
+
+        with mock.patch.object(InputStager, '_copy', autospec=True, side_effect=slow_copy):
+            self.stager.prefetch(source)
+            time.sleep(0.05)
+            local = self.stager.acquire(source)
+        self.assertEqual(calls, [source])
+        self.assertTrue(os.path.exists(local))
+
+    def test_previous_run_leftovers_are_removed(self):
+        os.makedirs(self.scratch)
+        old = time.time() - 7200
+        for name in ('0123456789ab-stale.mxf', '.xdpart-0123456789ab-stale.mxf', 'other.mxf'):
+            path = os.path.join(self.scratch, name)
+            with open(path, 'wb') as f:
+                f.write(b'old')
+            os.utime(path, (old, old))
+        with open(os.path.join(self.scratch, 'fedcba987654-recent.mxf'), 'wb') as f:
+            f.write(b'new')
+        self.stager.acquire(self._source('a.mxf'))
+        staged = self._staged()
+        self.assertNotIn('0123456789ab-stale.mxf', staged)
+        self.assertNotIn('.xdpart-0123456789ab-stale.mxf', staged)
+        # File altrui e copie recenti (altro processo sullo stesso scratch) restano
+        self.assertIn('other.mxf', staged)
+        self.assertIn('fedcba987654-recent.mxf', staged)
+
+    def test_disabled_returns_original_path(self):
+        stager = InputStager(staging_dir='')
+        source = self._source('a.mxf')
+        self.assertEqual(stager.acquire(source), source)
+        stager.prefetch(source)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Test inserimento job a blocchi."""
+
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, FileStatus, TranscodeJob
+from job_enqueue import DEDUPE_BY_FILENAME, enqueue_jobs
+
+
+class TestEnqueueJobs(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        session = self.Session()
+        session.add_all([
+            TranscodeJob(watchfolder_id=1, input_filename='a.mxf', input_path='/in/a.mxf',
+                         status=FileStatus.PROCESSING),
+            TranscodeJob(watchfolder_id=1, input_filename='b.mxf', input_path='/in/b.mxf',
+                         status=FileStatus.COMPLETED),
+        ])
+        session.commit()
+        session.close()
+        self.statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def _record(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    def _rows(self, names, watchfolder_id=1):
+        return [
+            {'watchfolder_id': watchfolder_id, 'input_filename': n, 'input_path': f'/in/{n}'}
+            for n in names
+        ]
+
+    def test_dedupes_and_inserts_in_one_statement(self):
+        names = ['a.mxf', 'b.mxf', 'c.mxf', 'c.mxf'] + [f'clip{i}.mxf' for i in range(600)]
+        session = self.Session()
+        try:
+            inserted, existing = enqueue_jobs(session, self._rows(names))
+        finally:
+            session.close()
+        self.assertEqual(existing, {'/in/a.mxf'})
+        self.assertEqual(len(inserted), 602)
+        inserts = [s for s in self.statements if s.startswith('INSERT')]
+        selects = [s for s in self.statements if s.startswith('SELECT')]
+        # 603 chiavi uniche: due IN a blocchi da 500, un solo INSERT executemany
+        self.assertEqual(len(selects), 2)
+        self.assertEqual(len(inserts), 1)
+
+        session = self.Session()
+        try:
+            pending = session.query(TranscodeJob).filter(TranscodeJob.status == FileStatus.PENDING).count()
+        finally:
+            session.close()
+        self.assertEqual(pending, 602)
+
+    def test_dedupe_by_filename_is_scoped_to_watchfolder(self):
+        session = self.Session()
+        try:
+            inserted, existing = enqueue_jobs(
+                session,
+                [{'watchfolder_id': 2, 'input_filename': 'a.mxf', 'input_path': '/tmp/a.mxf'}],
+                dedupe_by=DEDUPE_BY_FILENAME,
+                return_ids=True,
+            )
+            self.assertEqual(len(inserted), 1)
+            self.assertTrue(inserted[0]['id'])
+            inserted, existing = enqueue_jobs(
+                session,
+                [{'watchfolder_id': 1, 'input_filename': 'a.mxf', 'input_path': '/tmp/a.mxf'}],
+                dedupe_by=DEDUPE_BY_FILENAME,
+            )
+            self.assertEqual((inserted, existing), ([], {'a.mxf'}))
+        finally:
+            session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
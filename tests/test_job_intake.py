@@ -0,0 +1,85 @@
+"""Test creazione job a blocchi dal pool condiviso dei watchfolder locali."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, FileStatus, TranscodeJob, WatchFolder
+from job_intake import JobIntake
+from watchfolder_manager import WatchFolderHandler
+
+
+class TestJobIntake(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp, 'out')
+        self.input = os.path.join(self.tmp, 'in')
+        os.makedirs(self.input)
+        old = time.time() - 3600
+        for i in range(250):
+            path = os.path.join(self.input, f'clip_{i:03d}.mxf')
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            os.utime(path, (old, old))
+
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        session = self.Session()
+        session.add(WatchFolder(id=1, name='wf', path=self.input, output_path=self.output, active=1))
+        session.add(TranscodeJob(
+            watchfolder_id=1,
+            input_filename='clip_000.mxf',
+            input_path=os.path.join(self.input, 'clip_000.mxf'),
+            status=FileStatus.PENDING,
+        ))
+        session.commit()
+        session.close()
+
+        self.commits = 0
+
+        @event.listens_for(self.engine, 'commit')
+        def _count(conn):
+            self.commits += 1
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _jobs(self):
+        session = self.Session()
+        try:
+            return session.query(TranscodeJob).order_by(TranscodeJob.input_filename).all()
+        finally:
+            session.close()
+
+    def test_burst_is_inserted_in_batches(self):
+        intake = JobIntake(workers=1, batch_size=100)
+        handler = WatchFolderHandler(1, self.Session, quiet_period=5, path=self.input, intake=intake)
+        # clip_000 ha già un job pendente: la riconciliazione vede solo gli altri 249
+        self.assertEqual(handler.reconcile(), 249)
+        self.assertEqual(intake.pending(), 249)
+
+        while intake.drain_once(block=False):
+            pass
+
+        jobs = self._jobs()
+        self.assertEqual(len(jobs), 250)
+        self.assertEqual(self.commits, 3)
+        self.assertEqual(jobs[1].output_path, os.path.join(self.output, 'clip_001_default.mxf'))
+        self.assertTrue(os.path.isdir(self.output))
+
+    def test_active_job_is_not_duplicated(self):
+        handler = WatchFolderHandler(1, self.Session, path=self.input)
+        existing = os.path.join(self.input, 'clip_000.mxf')
+        acquired = handler.process_files([existing, existing, os.path.join(self.input, 'clip_001.mxf')])
+        self.assertEqual(acquired, {existing, os.path.join(self.input, 'clip_001.mxf')})
+        self.assertEqual(len(self._jobs()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
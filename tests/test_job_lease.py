@@ -0,0 +1,132 @@
+"""Test lease dei job: claim esclusivo tra processi, heartbeat, recupero lease scadute."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from job_lease import claim_job, renew_leases
+from job_recovery import recover_orphaned_jobs
+from models import Base, FileStatus, TranscodeJob, Worker
+from transcoder_worker import TranscoderWorker
+from worker_node import build_session_factory, register_worker
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLAIM_LOOP = textwrap.dedent('''
+    import sys
+    sys.path.insert(0, {root!r})
+    from job_lease import claim_job
+    from transcoder_worker import pick_next_pending_job
+    from worker_node import build_session_factory
+
+    Session = build_session_factory({db!r})
+    session = Session()
+    owner = sys.argv[1]
+    while True:
+        job = pick_next_pending_job(session)
+        if job is None:
+            break
+        if claim_job(session, job.id, owner):
+            print(job.id, flush=True)
+        session.expire_all()
+''')
+
+
+class TestJobLease(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.session = self.Session()
+        self.job = TranscodeJob(input_filename='a', input_path='/a', status=FileStatus.PENDING)
+        self.session.add(self.job)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_claim_is_exclusive(self):
+        self.assertTrue(claim_job(self.session, self.job.id, 'node-a:1'))
+        self.assertFalse(claim_job(self.session, self.job.id, 'node-b:1'))
+        self.session.refresh(self.job)
+        self.assertEqual((self.job.status, self.job.lease_owner), (FileStatus.PROCESSING, 'node-a:1'))
+
+    def test_expired_lease_is_reclaimed_and_heartbeat_keeps_it(self):
+        start = datetime(2024, 1, 1)
+        claim_job(self.session, self.job.id, 'node-a:1', ttl=60, now=start)
+
+        def reclaimed(seconds):
+            now = start + timedelta(seconds=seconds)
+            return recover_orphaned_jobs(self.session, 'node-b:1', now=now)['requeued']
+
+        self.assertEqual(reclaimed(50), [])
+        self.assertEqual(renew_leases(self.session, 'node-a:1', ttl=60, now=start + timedelta(seconds=50)), 1)
+        self.assertEqual(reclaimed(100), [])
+
+        # Nodo morto: nessun heartbeat oltre la scadenza
+        self.assertEqual(reclaimed(111), [self.job.id])
+        self.session.refresh(self.job)
+        self.assertEqual((self.job.status, self.job.lease_owner), (FileStatus.PENDING, None))
+        # Il nodo che torna non rinnova più nulla
+        self.assertEqual(renew_leases(self.session, 'node-a:1'), 0)
+
+    def test_worker_claim_records_lease(self):
+        worker = TranscoderWorker(self.Session)
+        job = worker._claim_next_job(self.session, worker_id=None)
+        self.assertEqual(job.lease_owner, worker.lease_owner)
+        self.assertIsNotNone(job.lease_expires_at)
+        self.assertIsNone(worker._claim_next_job(self.session, worker_id=None))
+
+
+class TestMultiProcessClaim(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'queue.db')
+        engine = create_engine(f'sqlite:///{self.db}')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add_all(
+            TranscodeJob(input_filename=f'{i}.mxf', input_path=f'/in/{i}.mxf', status=FileStatus.PENDING)
+            for i in range(60)
+        )
+        session.commit()
+        session.close()
+        engine.dispose()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_processes_never_claim_the_same_job(self):
+        script = CLAIM_LOOP.format(root=PROJECT_ROOT, db=self.db)
+        processes = [
+            subprocess.Popen([sys.executable, '-c', script, f'node-{n}'], stdout=subprocess.PIPE, text=True)
+            for n in range(3)
+        ]
+        claimed = []
+        for process in processes:
+            stdout, _ = process.communicate(timeout=120)
+            self.assertEqual(process.returncode, 0)
+            claimed.extend(int(line) for line in stdout.split())
+        self.assertEqual(len(claimed), 60)
+        self.assertEqual(len(set(claimed)), 60)
+
+    def test_register_worker_marks_headless_node(self):
+        Session = build_session_factory(self.db)
+        worker_id = register_worker(Session, 'encode-02', slots=3)
+        self.assertEqual(register_worker(Session, 'encode-02'), worker_id)
+        session = Session()
+        worker = session.get(Worker, worker_id)
+        self.assertEqual((worker.node_name, worker.max_concurrent_jobs), ('encode-02', 3))
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Test recupero job PROCESSING orfani: avvio, watchdog, job attivi intatti."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from job_recovery import recover_orphaned_jobs
+from models import Base, FileStatus, TranscodeJob, WatchFolder
+from output_publish import temp_output_path
+from transcoder_worker import TranscoderWorker
+
+NOW = datetime(2024, 1, 1, 12, 0)
+OWNER = 'node-a:100'
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class TestRecoverOrphanedJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = self.Session()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _job(self, name, lease_owner=None, expires_in=None, recovery_count=0, **kwargs):
+        job = TranscodeJob(
+            input_filename=name, input_path=f'/in/{name}',
+            output_path=os.path.join(self.tmp, f'{name}.mxf'),
+            status=FileStatus.PROCESSING, progress=40, started_at=NOW, worker_id=1,
+            lease_owner=lease_owner, recovery_count=recovery_count,
+            lease_expires_at=NOW + timedelta(seconds=expires_in) if expires_in is not None else None,
+            **kwargs
+        )
+        self.session.add(job)
+        self.session.commit()
+        return job
+
+    def test_orphans_are_requeued_and_live_work_is_untouched(self):
+        legacy = self._job('legacy')
+        expired = self._job('expired', 'node-b:7', expires_in=-1)
+        dead = self._job('dead', f'node-a:{_dead_pid()}', expires_in=60)
+        mine_lost = self._job('mine_lost', OWNER, expires_in=60)
+        mine_active = self._job('mine_active', OWNER, expires_in=60)
+        elsewhere = self._job('elsewhere', 'node-b:7', expires_in=60)
+        partial = temp_output_path(legacy.output_path, legacy.id)
+        with open(partial, 'wb') as f:
+            f.write(b'partial')
+
+        result = recover_orphaned_jobs(self.session, OWNER, active_job_ids={mine_active.id}, now=NOW)
+
+        self.assertEqual(sorted(result['requeued']), sorted([legacy.id, expired.id, dead.id, mine_lost.id]))
+        self.assertFalse(os.path.exists(partial))
+        self.session.expire_all()
+        self.assertEqual(
+            (legacy.status, legacy.worker_id, legacy.progress, legacy.recovery_count),
+            (FileStatus.PENDING, None, 0, 1),
+        )
+        self.assertEqual(mine_active.status, FileStatus.PROCESSING)
+        self.assertEqual(elsewhere.status, FileStatus.PROCESSING)
+
+    def test_fails_after_max_retries(self):
+        job = self._job('flaky', recovery_count=3)
+        result = recover_orphaned_jobs(self.session, OWNER, now=NOW, max_retries=3)
+        self.assertEqual(result, {'requeued': [], 'failed': [job.id]})
+        self.session.refresh(job)
+        self.assertEqual((job.status, job.recovery_count), (FileStatus.FAILED, 4))
+        self.assertIn('interrotta', job.error_message)
+
+    def test_worker_keeps_its_active_jobs(self):
+        worker = TranscoderWorker(self.Session)
+        running = self._job('running', worker.lease_owner, expires_in=10 ** 9)
+        stuck = self._job('stuck', worker.lease_owner, expires_in=10 ** 9)
+        worker._active_jobs.add(running.id)
+        self.assertEqual(worker.recover_orphaned_jobs()['requeued'], [stuck.id])
+
+    def test_download_only_jobs_fail_only_when_owner_is_gone(self):
+        watchfolder = WatchFolder(
+            name='ftp', path='/in', output_path=self.tmp, watch_type='ftp', operation_mode='download_only'
+        )
+        self.session.add(watchfolder)
+        self.session.commit()
+        # Download in corso nel processo web: non è in nessuno slot
+        downloading = self._job('downloading', OWNER, expires_in=60, watchfolder_id=watchfolder.id)
+        dead = self._job('dead', f'node-a:{_dead_pid()}', expires_in=60, watchfolder_id=watchfolder.id)
+        with open(dead.output_path, 'wb') as f:
+            f.write(b'partial')
+
+        result = recover_orphaned_jobs(self.session, OWNER, now=NOW)
+
+        self.assertEqual(result, {'requeued': [], 'failed': [dead.id]})
+        self.assertFalse(os.path.exists(dead.output_path))
+        self.session.expire_all()
+        self.assertEqual(downloading.status, FileStatus.PROCESSING)
+        # FAILED, non PENDING: nessuno slot esegue i download, il watcher FTP lo riscarica
+        self.assertEqual(dead.status, FileStatus.FAILED)
+        self.assertIn('Download interrotto', dead.error_message)
+
+    def test_status_lookup_uses_index(self):
+        with self.engine.connect() as conn:
+            plan = conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE status = 'PROCESSING'"
+            )).fetchall()
+        self.assertIn('ix_jobs_status_watchfolder_created', ' '.join(str(row) for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Test retry dei job: classificazione errori, backoff, politica per watchfolder/preset."""
+
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import job_retry
+from job_lease import claim_job
+from job_retry import PERMANENT, TRANSIENT, backoff_delay, classify_failure, fail_or_retry, retry_policy
+from models import Base, FileStatus, TranscodeJob, TranscodePreset, WatchFolder
+from transcoder_worker import pick_next_pending_job
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+class TestClassifyFailure(unittest.TestCase):
+    def test_patterns(self):
+        self.assertEqual(classify_failure(1, 'in.mxf: Invalid data found when processing input'), PERMANENT)
+        self.assertEqual(classify_failure(1, 'Unknown encoder libfoo'), PERMANENT)
+        self.assertEqual(classify_failure(1, '/mnt/nas/in.mxf: Input/output error'), TRANSIENT)
+        self.assertEqual(classify_failure(1, 'out.mxf: No space left on device'), TRANSIENT)
+
+    def test_permanent_pattern_wins(self):
+        self.assertEqual(classify_failure(1, 'Connection reset\nPermission denied'), PERMANENT)
+
+    def test_exit_code_without_known_pattern(self):
+        self.assertEqual(classify_failure(-9, ''), TRANSIENT)
+        self.assertEqual(classify_failure(0, ''), TRANSIENT)
+        self.assertEqual(classify_failure(1, 'Conversion failed!'), PERMANENT)
+
+
+class TestBackoff(unittest.TestCase):
+    def test_exponential_with_cap(self):
+        delays = [backoff_delay(n, 60, max_sec=300, jitter=0) for n in range(1, 5)]
+        self.assertEqual(delays, [60, 120, 240, 300])
+
+    def test_jitter_bounds(self):
+        for _ in range(50):
+            self.assertTrue(80 <= backoff_delay(1, 100, jitter=0.2) <= 120)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.preset = TranscodePreset(name='p', retry_max_attempts=5, retry_backoff_sec=30)
+        self.watchfolder = WatchFolder(name='wf', path='/in', output_path='/out', preset=self.preset)
+        self.session.add_all([self.preset, self.watchfolder])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def _job(self, **kwargs):
+        job = TranscodeJob(
+            input_filename='a.mxf', input_path='/in/a.mxf', status=FileStatus.PENDING,
+            watchfolder=self.watchfolder, preset=self.preset, **kwargs
+        )
+        self.session.add(job)
+        self.session.commit()
+        return job
+
+    def test_precedence(self):
+        job = self._job()
+        self.assertEqual(retry_policy(job), (5, 30))
+        self.watchfolder.retry_max_attempts = 2
+        self.assertEqual(retry_policy(job), (2, 30))
+        self.preset.retry_max_attempts = self.preset.retry_backoff_sec = None
+        self.watchfolder.retry_max_attempts = None
+        self.assertEqual(retry_policy(job), (job_retry.RETRY_MAX_ATTEMPTS, job_retry.RETRY_BACKOFF_SEC))
+
+    def test_transient_failure_is_retried_until_exhausted(self):
+        self.preset.retry_max_attempts = 2
+        job = self._job()
+        self.assertTrue(claim_job(self.session, job.id, 'node-a:1', now=NOW))
+        self.session.refresh(job)
+        self.assertEqual((job.attempt_count, job.first_attempt_at), (1, NOW))
+
+        self.assertTrue(fail_or_retry(job, 'NAS non raggiungibile', TRANSIENT, now=NOW))
+        self.session.commit()
+        self.assertEqual((job.status, job.worker_id, job.lease_owner), (FileStatus.PENDING, None, None))
+        self.assertGreater(job.next_attempt_at, NOW + timedelta(seconds=20))
+        self.assertIn('tentativo 1/2', job.error_message)
+
+        later = job.next_attempt_at + timedelta(seconds=1)
+        self.assertTrue(claim_job(self.session, job.id, 'node-a:1', now=later))
+        self.session.refresh(job)
+        self.assertEqual((job.attempt_count, job.first_attempt_at, job.next_attempt_at), (2, NOW, None))
+
+        self.assertFalse(fail_or_retry(job, 'NAS non raggiungibile', TRANSIENT, now=later))
+        self.assertEqual(job.status, FileStatus.FAILED)
+        self.assertIn('dopo 2 tentativi', job.error_message)
+
+    def test_permanent_failure_is_not_retried(self):
+        job = self._job(attempt_count=1)
+        self.assertFalse(fail_or_retry(job, 'File video corrotto', PERMANENT, now=NOW))
+        self.assertEqual(
+            (job.status, job.failure_class, job.error_message),
+            (FileStatus.FAILED, PERMANENT, 'File video corrotto'),
+        )
+
+    def test_job_in_backoff_is_not_picked(self):
+        waiting = self._job(next_attempt_at=datetime.utcnow() + timedelta(hours=1))
+        self.assertIsNone(pick_next_pending_job(self.session))
+        waiting.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        self.session.commit()
+        self.assertEqual(pick_next_pending_job(self.session).id, waiting.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
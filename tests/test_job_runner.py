@@ -0,0 +1,94 @@
+"""Test runner dei job: rusage da wait4, rlimit, niceness, sotto-gruppo cgroup."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from job_runner import JobRunner, niceness_for_priority
+
+# Il figlio attende una riga su stdin: i limiti vengono applicati dopo lo spawn
+CHILD = textwrap.dedent('''
+    import os, resource, sys
+    sys.stdin.readline()
+    print(resource.getrlimit(resource.RLIMIT_DATA)[0], os.getpriority(os.PRIO_PROCESS, 0))
+    if len(sys.argv) > 1:
+        bytearray(int(sys.argv[1]) * 1024 * 1024)
+    sum(range(3 * 10 ** 6))
+''')
+
+
+def _run(runner, *args, priority=None):
+    process = runner.start(
+        [sys.executable, '-c', CHILD, *args], 1, priority=priority,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    process.process.stdin.write('go\n')
+    process.process.stdin.close()
+    stdout, stderr = process.communicate()
+    return process, stdout, stderr
+
+
+class TestJobRunner(unittest.TestCase):
+    def test_rusage_from_wait4(self):
+        process, _, _ = _run(JobRunner(nice_by_priority=False), '64')
+        self.assertEqual(process.returncode, 0)
+        self.assertGreater(process.cpu_seconds, 0)
+        self.assertGreaterEqual(process.peak_rss_mb, 64)
+        self.assertIsNone(process.limit_exceeded())
+
+    def test_memory_rlimit_and_niceness(self):
+        runner = JobRunner(memory_limit_mb=256, cgroup_root='', nice_by_priority=True)
+        process, stdout, stderr = _run(runner, '1024', priority=10)
+        limit, nice = (int(value) for value in stdout.split())
+        self.assertEqual(limit, 256 * 1024 * 1024)
+        self.assertGreaterEqual(nice, niceness_for_priority(10)[0])
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn('MemoryError', stderr)
+
+    def test_niceness_mapping(self):
+        self.assertEqual(niceness_for_priority(1), (0, 0))
+        self.assertEqual(niceness_for_priority(10), (5, 2))
+        self.assertEqual(niceness_for_priority(100), (19, 7))
+
+
+class TestCgroupRunner(unittest.TestCase):
+    """Directory che imita un cgroup v2 delegato: verifica file scritti e lettura OOM."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'cgroup.controllers'), 'w') as f:
+            f.write('cpu memory pids')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _read(self, name):
+        with open(os.path.join(self.root, 'job-1', name)) as f:
+            return f.read()
+
+    def test_job_cgroup_limits_and_oom(self):
+        runner = JobRunner(memory_limit_mb=512, cpu_limit=1.5, cgroup_root=self.root, nice_by_priority=False)
+        process = runner.start(
+            [sys.executable, '-c', 'import sys; sys.stdin.read()'], 1,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        self.assertEqual(self._read('memory.max'), str(512 * 1024 * 1024))
+        self.assertEqual(self._read('cpu.max'), '150000 100000')
+        self.assertEqual(self._read('cgroup.procs'), str(process.pid))
+        with open(os.path.join(self.root, 'job-1', 'memory.events'), 'w') as f:
+            f.write('low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n')
+        process.process.stdin.close()
+        process.communicate()
+        self.assertIn('Limite memoria superato', process.limit_exceeded())
+
+    def test_unusable_root_falls_back_to_rlimit(self):
+        runner = JobRunner(memory_limit_mb=512, cgroup_root=os.path.join(self.root, 'missing'))
+        self.assertIsNone(runner.cgroup_root)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""Test pausa con SIGSTOP/SIGCONT: slot liberato, ripresa, processo morto, checkpoint."""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import job_suspend
+from job_actions import cancel_job, resume_job
+from job_runner import JobRunner
+from job_suspend import EncodeRun, checkpoint_for, head_segment_path, release_abandoned_suspensions, seek_input
+from models import Base, FileStatus, TranscodeJob
+from output_publish import temp_output_path
+from transcoder_worker import TranscoderWorker, pick_next_pending_job
+
+# Finto FFmpeg: attende, scrive l'output e un progresso su stderr
+FAKE_FFMPEG = textwrap.dedent('''
+    import sys, time
+    time.sleep(1)
+    with open(sys.argv[1], 'wb') as f:
+        f.write(b'encoded')
+    sys.stderr.write('frame=1 time=00:00:40.00 bitrate=1\\n')
+''')
+
+
+def _process_state(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()[0]
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class TestSuspendResume(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{os.path.join(self.tmp, 'jobs.db')}")
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.session = self.Session()
+        source = os.path.join(self.tmp, 'clip.mxf')
+        with open(source, 'wb') as f:
+            f.write(b'source')
+        # Pausa chiesta dall'utente mentre FFmpeg codifica
+        self.job = TranscodeJob(
+            input_filename='clip.mxf', input_path=source, input_duration=60,
+            output_path=os.path.join(self.tmp, 'clip_out.mxf'), status=FileStatus.PAUSED, progress=60,
+        )
+        self.session.add(self.job)
+        self.session.commit()
+        self.patches = [
+            mock.patch('output_publish.OUTPUT_SCRATCH_DIR', ''),
+            mock.patch.object(TranscoderWorker, '_get_mediainfo', return_value=None),
+            mock.patch.object(TranscoderWorker, '_get_video_duration', return_value=None),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.worker = TranscoderWorker(self.Session)
+        self.temp_path = temp_output_path(self.job.output_path, self.job.id)
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        for encode in self.worker._suspended.values():
+            encode.process.kill()
+            encode.process.communicate()
+        self.session.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _park(self):
+        process = JobRunner(nice_by_priority=False).start(
+            [sys.executable, '-c', FAKE_FFMPEG, self.temp_path], self.job.id,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        encode = EncodeRun(process, self.temp_path)
+        encode.progress_sec = 30
+        self.worker._run_encode(self.job.id, encode)
+        self.session.expire_all()
+        return process
+
+    def test_suspended_process_frees_slot_and_continues(self):
+        process = self._park()
+        self.assertIn(self.job.id, self.worker._suspended)
+        self.assertEqual(_process_state(process.pid), 'T')
+        self.assertEqual(
+            (self.job.suspended_pid, self.job.checkpoint_sec, self.job.lease_owner),
+            (process.pid, 25, self.worker.lease_owner),
+        )
+
+        resume_job(self.job)
+        self.session.commit()
+        # Nessun altro slot o nodo può prenderlo: lo riprende il processo che lo tiene
+        self.assertIsNone(pick_next_pending_job(self.session))
+        resumed = self.worker._claim_resumed_job(self.session, None)
+        self.assertEqual(resumed[0], self.job.id)
+        self.assertIn(self.job.id, self.worker._active_jobs)
+        self.worker._resume_encode(*resumed)
+
+        self.session.expire_all()
+        self.assertEqual((self.job.status, self.job.suspended_pid), (FileStatus.COMPLETED, None))
+        with open(self.job.output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'encoded')
+        self.assertIsNotNone(self.job.cpu_seconds)
+
+    def test_process_died_while_suspended_keeps_checkpoint(self):
+        process = self._park()
+        process.kill()
+        # SIGKILL è asincrono: senza attendere l'uscita il controllo può vederlo ancora vivo
+        process.wait()
+        self.assertIsNone(self.worker._claim_resumed_job(self.session, None))
+        self.assertEqual(self.worker._suspended, {})
+        self.session.expire_all()
+        self.assertEqual(
+            (self.job.status, self.job.suspended_pid, self.job.lease_owner, self.job.checkpoint_sec),
+            (FileStatus.PAUSED, None, None, 25),
+        )
+        resume_job(self.job)
+        self.session.commit()
+        self.assertEqual(pick_next_pending_job(self.session).id, self.job.id)
+
+    def test_cancel_kills_suspended_process(self):
+        process = self._park()
+        cancel_job(self.job)
+        self.session.commit()
+        self.assertIsNone(self.worker._claim_resumed_job(self.session, None))
+        self.assertEqual(process.returncode, -9)
+        self.session.expire_all()
+        self.assertEqual((self.job.status, self.job.suspended_pid), (FileStatus.CANCELLED, None))
+
+    def test_checkpoint_restart_builds_head_segment(self):
+        self.job.checkpoint_sec = 25
+        with open(self.temp_path, 'wb') as f:
+            f.write(b'partial')
+
+        def fake_trim(source, destination, seconds):
+            with open(destination, 'wb') as f:
+                f.write(b'head')
+            return True
+
+        with mock.patch('job_suspend.trim_segment', side_effect=fake_trim), \
+                mock.patch.object(self.worker, '_get_video_duration', return_value=25.0):
+            self.assertEqual(self.worker._prepare_checkpoint_restart(self.job, self.temp_path), 25)
+        self.assertTrue(os.path.exists(head_segment_path(self.job.output_path, self.job.id)))
+        self.assertFalse(os.path.exists(self.temp_path))
+        self.assertIsNone(self.job.checkpoint_sec)
+
+        # Parziale più corto del checkpoint: si ricomincia da zero
+        self.job.checkpoint_sec = 60
+        with open(self.temp_path, 'wb') as f:
+            f.write(b'partial')
+        with mock.patch('job_suspend.trim_segment', side_effect=fake_trim), \
+                mock.patch.object(self.worker, '_get_video_duration', side_effect=[25.0, 10.0]):
+            self.assertIsNone(self.worker._prepare_checkpoint_restart(self.job, self.temp_path))
+        self.assertFalse(os.path.exists(head_segment_path(self.job.output_path, self.job.id)))
+
+
+class TestSuspendHelpers(unittest.TestCase):
+    def test_checkpoint_and_seek(self):
+        self.assertIsNone(checkpoint_for(None))
+        self.assertIsNone(checkpoint_for(3, margin=5))
+        self.assertEqual(checkpoint_for(65.5, margin=5), 60.5)
+        self.assertEqual(
+            seek_input(['ffmpeg', '-filter_threads', '2', '-i', 'in.mxf', 'out.mxf'], 60.5),
+            ['ffmpeg', '-filter_threads', '2', '-ss', '60.500', '-i', 'in.mxf', 'out.mxf'],
+        )
+
+    def test_abandoned_suspensions_are_released(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        now = datetime.utcnow()
+        stopped_pid = _dead_pid()
+        dead = TranscodeJob(
+            input_filename='a', input_path='/a', output_path='/out/a.mxf', status=FileStatus.PAUSED,
+            suspended_pid=stopped_pid,
+            lease_owner=f'node-a:{_dead_pid()}', lease_expires_at=now + timedelta(minutes=1), checkpoint_sec=10,
+        )
+        alive = TranscodeJob(
+            input_filename='b', input_path='/b', status=FileStatus.PAUSED, suspended_pid=1,
+            lease_owner='node-b:7', lease_expires_at=now + timedelta(minutes=1),
+        )
+        session.add_all([dead, alive])
+        session.commit()
+        with mock.patch('job_suspend.kill_stopped_ffmpeg') as kill:
+            self.assertEqual(release_abandoned_suspensions(session, 'node-a:1', now=now), [dead.id])
+        kill.assert_called_once_with(stopped_pid, temp_output_path('/out/a.mxf', dead.id))
+        session.expire_all()
+        self.assertEqual((dead.suspended_pid, dead.lease_owner, dead.checkpoint_sec), (None, None, 10))
+        self.assertEqual(alive.suspended_pid, 1)
+        session.close()
+
+    def test_kill_only_the_stopped_ffmpeg_of_the_job(self):
+        # argv[0] come quello di FFmpeg; il pid potrebbe essere stato riusato da un altro job
+        process = subprocess.Popen(
+            ['ffmpeg', '-c', 'import time; time.sleep(30)', '/out/.xdpart-7-clip.mxf'], executable=sys.executable
+        )
+        try:
+            self.assertFalse(job_suspend.kill_stopped_ffmpeg(process.pid, '/out/.xdpart-7-clip.mxf'))
+            os.kill(process.pid, signal.SIGSTOP)
+            for _ in range(100):
+                if _process_state(process.pid) == 'T':
+                    break
+                time.sleep(0.01)
+            self.assertFalse(job_suspend.kill_stopped_ffmpeg(process.pid, '/out/.xdpart-8-clip.mxf'))
+            self.assertTrue(job_suspend.kill_stopped_ffmpeg(process.pid, '/out/.xdpart-7-clip.mxf'))
+            self.assertEqual(process.wait(timeout=5), -signal.SIGKILL)
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_restart_mode_disables_suspend(self):
+        with mock.patch.object(job_suspend, 'JOB_PAUSE_MODE', 'restart'):
+            self.assertFalse(job_suspend.suspend_enabled())
+
+
+if __name__ == '__main__':
+    unittest.main()
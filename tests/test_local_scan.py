@@ -0,0 +1,82 @@
+"""Test scansione di riconciliazione watchfolder locali."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, TranscodeJob, FileStatus
+from local_scan import find_unknown_files, scan_video_files
+from watchfolder_manager import WatchFolderHandler
+
+
+class TestLocalScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp, 'sub.mxf'))
+        old = time.time() - 3600
+        # .xdpart-*: output in codifica di un altro job, mai un file da acquisire
+        for name in ('done.mxf', 'new.mxf', 'notes.txt', '.xdpart-4-encoding.mxf'):
+            path = os.path.join(self.tmp, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+            os.utime(path, (old, old))
+        with open(os.path.join(self.tmp, 'copying.mov'), 'wb') as f:
+            f.write(b'x' * 10)
+
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        session = self.Session()
+        session.add(TranscodeJob(
+            watchfolder_id=1,
+            input_filename='done.mxf',
+            input_path=os.path.join(self.tmp, 'done.mxf'),
+            status=FileStatus.COMPLETED,
+        ))
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_scan_lists_only_regular_video_files(self):
+        names = sorted(f[0] for f in scan_video_files(self.tmp))
+        self.assertEqual(names, ['copying.mov', 'done.mxf', 'new.mxf'])
+        self.assertEqual(scan_video_files(os.path.join(self.tmp, 'missing')), [])
+
+    def test_unknown_files_exclude_existing_jobs(self):
+        session = self.Session()
+        try:
+            names = sorted(f[0] for f in find_unknown_files(session, 1, self.tmp))
+        finally:
+            session.close()
+        self.assertEqual(names, ['copying.mov', 'new.mxf'])
+
+    def test_recursive_scan_compares_full_paths(self):
+        show = os.path.join(self.tmp, 'show_a')
+        os.makedirs(show)
+        with open(os.path.join(show, 'done.mxf'), 'wb') as f:
+            f.write(b'x')
+        session = self.Session()
+        try:
+            names = sorted(f[0] for f in find_unknown_files(session, 1, self.tmp, recursive=True))
+        finally:
+            session.close()
+        self.assertEqual(names, ['copying.mov', 'new.mxf', os.path.join('show_a', 'done.mxf')])
+
+    def test_reconcile_enqueues_old_files_and_tracks_recent_ones(self):
+        handler = WatchFolderHandler(1, self.Session, quiet_period=30, path=self.tmp)
+        handler.process_files = MagicMock(side_effect=lambda paths: set(paths))
+        self.assertEqual(handler.reconcile(), 2)
+        handler.process_files.assert_called_once_with([os.path.join(self.tmp, 'new.mxf')])
+        self.assertEqual(handler.stability.pending(), [os.path.join(self.tmp, 'copying.mov')])
+
+
+if __name__ == '__main__':
+    unittest.main()
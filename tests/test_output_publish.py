@@ -0,0 +1,244 @@
+"""Test pubblicazione atomica degli output e pulizia dei temporanei orfani."""
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from archiver import ArchiveMover
+from job_lease import NODE_NAME, process_owner
+from models import Base, FileStatus, TranscodeJob, TranscodePreset, WatchFolder
+from output_publish import cleanup_orphaned_temps, publish_output, temp_output_path
+from transcoder_worker import TranscoderWorker
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp, 'out', 'clip_xdcam.mxf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_temp_name_is_hidden_and_keeps_extension(self):
+        self.assertEqual(temp_output_path(self.output, 7, scratch_dir=''),
+                         os.path.join(self.tmp, 'out', '.xdpart-7-clip_xdcam.mxf'))
+        self.assertEqual(temp_output_path(self.output, 7, scratch_dir='/scratch'),
+                         '/scratch/.xdpart-7-clip_xdcam.mxf')
+
+    def test_same_device_replaces_without_touching_old_inode(self):
+        os.makedirs(os.path.dirname(self.output))
+        _write(self.output, b'old')
+        # L'output precedente è anche in cache (hardlink): non deve essere troncato
+        cached = os.path.join(self.tmp, 'cached.mxf')
+        os.link(self.output, cached)
+        temp = _write(temp_output_path(self.output, 1, scratch_dir=''), b'new')
+
+        self.assertTrue(publish_output(temp, self.output, mover=None))
+        self.assertEqual(_read(self.output), b'new')
+        self.assertEqual(_read(cached), b'old')
+        self.assertFalse(os.path.exists(temp))
+
+    def test_other_device_is_moved_in_background_and_overwrites(self):
+        scratch = os.path.join(self.tmp, 'scratch')
+        os.makedirs(scratch)
+        os.makedirs(os.path.dirname(self.output))
+        _write(self.output, b'old')
+        temp = _write(temp_output_path(self.output, 1, scratch_dir=scratch), b'encoded')
+        mover = ArchiveMover(retry_delay=0)
+        with mock.patch('output_publish.same_device', return_value=False), \
+                mock.patch('archiver.reflink', side_effect=OSError('EXDEV')):
+            self.assertFalse(publish_output(temp, self.output, mover))
+            mover.stop(wait=True)
+        self.assertEqual(_read(self.output), b'encoded')
+        self.assertEqual(os.listdir(os.path.dirname(self.output)), ['clip_xdcam.mxf'])
+        self.assertEqual(os.listdir(scratch), [])
+
+    def test_cleanup_orphaned_temps(self):
+        _write(os.path.join(self.tmp, '.xdpart-3-clip.mxf'), b'partial')
+        _write(os.path.join(self.tmp, '.xdpart-mv-99-clip.mxf'), b'partial')
+        _write(os.path.join(self.tmp, 'clip.mxf'), b'done')
+        self.assertEqual(cleanup_orphaned_temps([self.tmp, None, '/nonexistent']), 2)
+        self.assertEqual(os.listdir(self.tmp), ['clip.mxf'])
+
+    def test_cleanup_keeps_recent_temps_in_shared_folders(self):
+        # Copia in corso di un altro nodo: appena scritta
+        recent = _write(os.path.join(self.tmp, '.xdpart-mv-99-clip.mxf'), b'copying')
+        stale = _write(os.path.join(self.tmp, '.xdpart-3-clip.mxf'), b'partial')
+        os.utime(stale, (time.time() - 7200, time.time() - 7200))
+        self.assertEqual(cleanup_orphaned_temps([self.tmp], min_age_sec=3600), 1)
+        self.assertEqual(os.listdir(self.tmp), [os.path.basename(recent)])
+
+
+class TestWorkerPublish(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        session = self.Session()
+        preset = TranscodePreset(name='TEST', container='mxf')
+        session.add(preset)
+        session.commit()
+        job = TranscodeJob(
+            preset_id=preset.id,
+            input_filename='clip.mxf',
+            input_path=_write(os.path.join(self.tmp, 'clip.mxf'), b'source'),
+            output_path=os.path.join(self.tmp, 'clip_test.mxf'),
+            status=FileStatus.PROCESSING,
+            lease_owner=process_owner(),
+        )
+        session.add(job)
+        session.commit()
+        self.job_id = job.id
+        session.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_ffmpeg_writes_hidden_temp_then_publishes(self):
+        seen = []
+
+        def fake_ffmpeg(cmd, job_id, priority=None, **kwargs):
+            seen.append(cmd[-1])
+            # Durante la codifica il nome finale non esiste ancora
+            self.assertFalse(os.path.exists(os.path.join(self.tmp, 'clip_test.mxf')))
+            _write(cmd[-1], b'encoded')
+            process = mock.Mock(returncode=0, cpu_seconds=1.5, peak_rss_mb=40)
+            process.communicate.return_value = ('', '')
+            process.limit_exceeded.return_value = None
+            return process
+
+        worker = TranscoderWorker(self.Session)
+        with mock.patch.object(worker.job_runner, 'start', side_effect=fake_ffmpeg), \
+                mock.patch('transcoder_worker.OUTPUT_SCRATCH_DIR', ''), \
+                mock.patch('output_publish.OUTPUT_SCRATCH_DIR', ''), \
+                mock.patch.object(TranscoderWorker, '_monitor_progress', return_value=False), \
+                mock.patch.object(TranscoderWorker, '_get_mediainfo', return_value=None), \
+                mock.patch.object(TranscoderWorker, '_get_video_duration', return_value=None):
+            worker._process_job(self.job_id)
+
+        self.assertEqual(os.path.basename(seen[0]), f'.xdpart-{self.job_id}-clip_test.mxf')
+        self.assertEqual(_read(os.path.join(self.tmp, 'clip_test.mxf')), b'encoded')
+        self.assertFalse(os.path.exists(seen[0]))
+        session = self.Session()
+        try:
+            job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+            self.assertEqual(job.status, FileStatus.COMPLETED)
+            self.assertEqual(job.output_size, len(b'encoded'))
+            self.assertEqual((job.cpu_seconds, job.peak_rss_mb), (1.5, 40))
+        finally:
+            session.close()
+
+    def test_failed_publish_keeps_source_for_retry(self):
+        archive = os.path.join(self.tmp, 'archive')
+        session = self.Session()
+        watchfolder = WatchFolder(name='wf', path=self.tmp, output_path=self.tmp, archive_path=archive)
+        session.add(watchfolder)
+        session.commit()
+        job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+        job.watchfolder_id = watchfolder.id
+        session.commit()
+        session.close()
+        temps = []
+
+        def fake_ffmpeg(cmd, job_id, priority=None, **kwargs):
+            temps.append(_write(cmd[-1], b'encoded'))
+            process = mock.Mock(returncode=0, cpu_seconds=1.5, peak_rss_mb=40)
+            process.communicate.return_value = ('', '')
+            process.limit_exceeded.return_value = None
+            return process
+
+        worker = TranscoderWorker(self.Session)
+        with mock.patch.object(worker.job_runner, 'start', side_effect=fake_ffmpeg), \
+                mock.patch('transcoder_worker.OUTPUT_SCRATCH_DIR', ''), \
+                mock.patch('output_publish.OUTPUT_SCRATCH_DIR', ''), \
+                mock.patch('transcoder_worker.publish_output', side_effect=OSError(errno.ENOSPC, 'No space')), \
+                mock.patch.object(TranscoderWorker, '_monitor_progress', return_value=False), \
+                mock.patch.object(TranscoderWorker, '_get_mediainfo', return_value=None), \
+                mock.patch.object(TranscoderWorker, '_get_video_duration', return_value=None):
+            worker._process_job(self.job_id)
+
+        # Sorgente non archiviato, temporaneo rimosso, job di nuovo in coda
+        self.assertEqual(_read(os.path.join(self.tmp, 'clip.mxf')), b'source')
+        self.assertFalse(os.path.exists(archive))
+        self.assertFalse(os.path.exists(temps[0]))
+        session = self.Session()
+        try:
+            job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+            self.assertEqual(job.status, FileStatus.PENDING)
+        finally:
+            session.close()
+
+    def test_completed_output_left_in_scratch_is_moved_again(self):
+        scratch = os.path.join(self.tmp, 'scratch')
+        os.makedirs(scratch)
+        session = self.Session()
+        job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+        job.status = FileStatus.COMPLETED
+        session.commit()
+        session.close()
+        # Riavvio mentre il mover copiava l'output dallo scratch
+        temp = _write(temp_output_path(os.path.join(self.tmp, 'clip_test.mxf'), self.job_id, scratch), b'encoded')
+        orphan = _write(os.path.join(scratch, '.xdpart-999-other.mxf'), b'partial')
+
+        worker = TranscoderWorker(self.Session)
+        worker.publisher = mock.Mock()
+        with mock.patch('transcoder_worker.OUTPUT_SCRATCH_DIR', scratch), \
+                mock.patch('output_publish.OUTPUT_SCRATCH_DIR', scratch):
+            worker.cleanup_orphaned_outputs()
+
+        worker.publisher.submit.assert_called_once_with(temp, os.path.join(self.tmp, 'clip_test.mxf'), overwrite=True)
+        self.assertTrue(os.path.exists(temp))
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_archive_interrupted_by_restart_is_resubmitted(self):
+        archive = os.path.join(self.tmp, 'archive')
+        session = self.Session()
+        watchfolder = WatchFolder(name='wf', path=self.tmp, output_path=self.tmp, archive_path=archive)
+        session.add(watchfolder)
+        session.commit()
+        job = session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+        job.watchfolder_id = watchfolder.id
+        job.status = FileStatus.COMPLETED
+        job.completed_at = datetime.utcnow()
+        # Completato dal processo precedente di questo nodo, il cui mover è morto
+        job.lease_owner = f'{NODE_NAME}:1'
+        other = TranscodeJob(
+            preset_id=job.preset_id, watchfolder_id=watchfolder.id, input_filename='b.mxf',
+            input_path=_write(os.path.join(self.tmp, 'b.mxf'), b'other'),
+            output_path=os.path.join(self.tmp, 'b_test.mxf'), status=FileStatus.COMPLETED,
+            completed_at=datetime.utcnow(), lease_owner='other-node:1',
+        )
+        session.add(other)
+        session.commit()
+        session.close()
+
+        worker = TranscoderWorker(self.Session)
+        with mock.patch('transcoder_worker.archive_file', return_value=('dest', False)) as archive_file:
+            resubmitted = worker._resubmit_pending_archives()
+
+        self.assertEqual(resubmitted, [self.job_id])
+        archive_file.assert_called_once_with(os.path.join(self.tmp, 'clip.mxf'), archive, worker.archiver)
+
+
+if __name__ == '__main__':
+    unittest.main()
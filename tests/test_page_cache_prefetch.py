@@ -0,0 +1,96 @@
+"""Test prefetch page cache dei prossimi job: finestra K, budget, job partiti già consigliati."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, FileStatus, TranscodeJob, WatchFolder
+from page_cache_prefetch import MB, PageCachePrefetcher
+from transcoder_worker import next_pending_jobs, pick_next_pending_job
+
+
+class TestPageCachePrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.paths = []
+        for name in ('a.mxf', 'b.mxf', 'c.mxf'):
+            path = os.path.join(self.tmp, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 4096)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _advised(self, prefetcher, paths):
+        with mock.patch('page_cache_prefetch.os.posix_fadvise') as fadvise:
+            prefetcher.advise(paths)
+            prefetcher._executor.shutdown(wait=True)
+            prefetcher._executor = None
+        return [(c.args[1], c.args[2]) for c in fadvise.call_args_list]
+
+    def test_lookahead_and_budget(self):
+        prefetcher = PageCachePrefetcher(lookahead=2, budget_bytes=3 * MB, window_bytes=2 * MB)
+        calls = self._advised(prefetcher, self.paths)
+        # Solo i primi 2; il secondo riceve ciò che resta del budget
+        self.assertEqual(calls, [(0, 2 * MB), (0, 1 * MB)])
+        self.assertEqual(prefetcher.stats()['outstanding_bytes'], 3 * MB)
+
+        # Stessa coda: nessun fadvise ripetuto
+        with mock.patch('page_cache_prefetch.os.posix_fadvise') as fadvise:
+            prefetcher.advise(self.paths)
+        fadvise.assert_not_called()
+
+    def test_advised_before_start_per_watchfolder(self):
+        prefetcher = PageCachePrefetcher(lookahead=2, budget_bytes=8 * MB, window_bytes=MB)
+        self._advised(prefetcher, self.paths)
+        self.assertTrue(prefetcher.record_start(self.paths[0], 1))
+        self.assertFalse(prefetcher.record_start(self.paths[2], 2))
+        # Il budget del file partito è stato liberato: entra il terzo
+        calls = self._advised(prefetcher, self.paths[1:])
+        self.assertEqual(calls, [(0, MB)])
+
+        stats = prefetcher.stats()
+        self.assertEqual((stats['advised_before_start'], stats['not_advised'], stats['advised_rate']), (1, 1, 0.5))
+        self.assertEqual(stats['by_watchfolder'], {
+            '1': {'advised_before_start': 1, 'not_advised': 0},
+            '2': {'advised_before_start': 0, 'not_advised': 1},
+        })
+
+    def test_disabled(self):
+        prefetcher = PageCachePrefetcher(lookahead=0)
+        self.assertFalse(prefetcher.enabled)
+        prefetcher.advise(self.paths)
+        self.assertIsNone(prefetcher._executor)
+
+
+class TestNextPendingJobs(unittest.TestCase):
+    def test_same_order_as_pick_next_pending_job(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        now = datetime.utcnow()
+        session.add_all([
+            WatchFolder(id=1, name='low', path='/a', priority=20),
+            WatchFolder(id=2, name='high', path='/b', priority=1),
+        ])
+        for i, wf_id in enumerate((1, 2, 1, 2)):
+            session.add(TranscodeJob(
+                watchfolder_id=wf_id, input_filename=f'{i}.mxf', input_path=f'/{wf_id}/{i}.mxf',
+                status=FileStatus.PENDING, created_at=now + timedelta(seconds=i),
+            ))
+        session.commit()
+        jobs = next_pending_jobs(session, 3)
+        self.assertEqual([j.input_filename for j in jobs], ['1.mxf', '3.mxf', '0.mxf'])
+        self.assertEqual(pick_next_pending_job(session).id, jobs[0].id)
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+"""Test percorsi replicati per watchfolder ricorsivi."""
+
+import unittest
+
+from path_utils import mirrored_directory
+
+
+class TestMirroredDirectory(unittest.TestCase):
+    def test_mirrors_relative_subfolder(self):
+        self.assertEqual(
+            mirrored_directory('/out', '/in', '/in/show_a/day1/clip.mxf'),
+            '/out/show_a/day1',
+        )
+
+    def test_root_level_and_outside_files_use_base_dir(self):
+        self.assertEqual(mirrored_directory('/out', '/in', '/in/clip.mxf'), '/out')
+        self.assertEqual(mirrored_directory('/out', '/in', '/tmp/ftp/clip.mxf'), '/out')
+        self.assertEqual(mirrored_directory('/out', '', '/in/a/clip.mxf'), '/out')
+
+
+if __name__ == '__main__':
+    unittest.main()
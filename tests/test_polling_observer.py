@@ -0,0 +1,82 @@
+"""Test observer a polling (snapshot scandir e diff)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from watchdog.events import FileSystemEventHandler
+
+from polling_observer import ScandirPollingObserver, diff_snapshots, snapshot_directory
+
+
+class RecordingHandler(FileSystemEventHandler):
+    def __init__(self):
+        self.events = []
+
+    def on_any_event(self, event):
+        self.events.append((event.event_type, os.path.basename(event.src_path),
+                            os.path.basename(getattr(event, 'dest_path', '') or '')))
+
+
+class TestPollingObserver(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp, 'subdir'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _write(self, name, data=b'x'):
+        with open(os.path.join(self.tmp, name), 'ab') as f:
+            f.write(data)
+
+    def test_diff_snapshots(self):
+        old = {'a': (1, 10, 1.0), 'b': (2, 10, 1.0), 'c': (3, 10, 1.0)}
+        new = {'a': (1, 20, 2.0), 'b2': (2, 10, 1.0), 'd': (4, 1, 1.0)}
+        created, modified, moved, deleted = diff_snapshots(old, new)
+        self.assertEqual(created, ['d'])
+        self.assertEqual(modified, ['a'])
+        self.assertEqual(moved, [('b', 'b2')])
+        self.assertEqual(deleted, ['c'])
+
+    def test_snapshot_skips_directories(self):
+        self._write('clip.mxf')
+        self.assertEqual(list(snapshot_directory(self.tmp)), ['clip.mxf'])
+
+    def test_recursive_snapshot_detects_moves_between_subfolders(self):
+        self._write(os.path.join('subdir', 'clip.mxf'))
+        old = snapshot_directory(self.tmp, recursive=True)
+        self.assertEqual(list(old), [os.path.join('subdir', 'clip.mxf')])
+        os.makedirs(os.path.join(self.tmp, 'show'))
+        os.rename(os.path.join(self.tmp, 'subdir', 'clip.mxf'), os.path.join(self.tmp, 'show', 'clip.mxf'))
+        _, _, moved, _ = diff_snapshots(old, snapshot_directory(self.tmp, recursive=True))
+        self.assertEqual(moved, [(os.path.join('subdir', 'clip.mxf'), os.path.join('show', 'clip.mxf'))])
+
+    def test_poll_dispatches_events_to_handler(self):
+        self._write('existing.mxf')
+        self._write('clip.part')
+        handler = RecordingHandler()
+        observer = ScandirPollingObserver(interval=3600)
+        observer.schedule(handler, self.tmp)
+        observer.start()
+        try:
+            self._write('new.mxf')
+            self._write('existing.mxf', b'more')
+            os.rename(os.path.join(self.tmp, 'clip.part'), os.path.join(self.tmp, 'clip.mxf'))
+            observer.poll_once()
+        finally:
+            observer.stop()
+            observer.join()
+        self.assertEqual(
+            sorted(handler.events),
+            [
+                ('created', 'new.mxf', ''),
+                ('modified', 'existing.mxf', ''),
+                ('moved', 'clip.part', 'clip.mxf'),
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, TranscodeJob, FileStatus
+from progress_writer import CoalescingProgressWriter
+from ftp_utils import download_with_progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCoalescingProgressWriter(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.statements = []
+
+        @event.listens_for(self.engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+        session = self.Session()
+        job = TranscodeJob(
+            input_filename="a.mxf", input_path="/tmp/a.mxf", status=FileStatus.PROCESSING
+        )
+        session.add(job)
+        session.commit()
+        self.job_id = job.id
+        session.close()
+        self.statements.clear()
+
+        self.clock = FakeClock()
+        self.writer = CoalescingProgressWriter(self.Session, flush_interval=1.0, clock=self.clock)
+
+    def _job(self):
+        session = self.Session()
+        try:
+            return session.query(TranscodeJob).filter(TranscodeJob.id == self.job_id).first()
+        finally:
+            session.close()
+
+    def test_updates_within_interval_are_coalesced(self):
+        for percent in range(50):
+            self.writer.update(self.job_id, progress=percent, bytes_transferred=percent * 10)
+        self.assertEqual([s for s in self.statements if s.startswith("UPDATE")], [])
+
+        self.clock.now = 1.5
+        self.writer.update(self.job_id, progress=60, bytes_transferred=600)
+        updates = [s for s in self.statements if s.startswith("UPDATE")]
+        selects = [s for s in self.statements if s.startswith("SELECT")]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(selects, [])
+        job = self._job()
+        self.assertEqual(job.progress, 60)
+        self.assertEqual(job.bytes_transferred, 600)
+
+    def test_explicit_flush_writes_latest_value(self):
+        self.writer.update(self.job_id, progress=10)
+        self.writer.update(self.job_id, progress=20, transfer_rate=1000)
+        self.assertEqual(self.writer.flush(self.job_id), 1)
+        job = self._job()
+        self.assertEqual(job.progress, 20)
+        self.assertEqual(job.transfer_rate, 1000)
+        self.assertEqual(self.writer.flush(), 0)
+
+
+class TestDownloadProgressCallback(unittest.TestCase):
+    class FakeFTP:
+        def download(self, source, target, callback=None, **kwargs):
+            for _ in range(4):
+                callback(b"x" * 512 * 1024)
+
+    def test_unknown_size_reports_bytes_not_percent(self):
+        calls = []
+        download_with_progress(self.FakeFTP(), "a", "/dev/null", 0, lambda p, b: calls.append((p, b)))
+        self.assertEqual(calls[0], (None, 512 * 1024))
+        self.assertEqual(calls[-1], (100, 2 * 1024 * 1024))
+
+    def test_known_size_reports_percent(self):
+        calls = []
+        total = 2 * 1024 * 1024
+        download_with_progress(self.FakeFTP(), "a", "/dev/null", total, lambda p, b: calls.append((p, b)))
+        self.assertEqual([p for p, _ in calls], [25, 50, 75, 99, 100])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Test politiche di coda: aging, fair share, shortest-expected-job-first."""
+
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, FileStatus, TranscodeJob, TranscodePreset, WatchFolder
+from queue_policy import (
+    AgingPolicy,
+    FairSharePolicy,
+    PresetSpeed,
+    PresetSpeedModel,
+    QueueContext,
+    ShortestJobPolicy,
+    get_policy,
+)
+from transcoder_worker import next_pending_jobs, pick_next_pending_job
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def _job(job_id, wf_id, priority, waited=0, size=None, preset_id=1):
+    return SimpleNamespace(
+        id=job_id,
+        watchfolder_id=wf_id,
+        watchfolder=SimpleNamespace(priority=priority),
+        preset_id=preset_id,
+        input_duration=None,
+        input_size=size,
+        created_at=NOW - timedelta(seconds=waited),
+    )
+
+
+def _ids(jobs):
+    return [job.id for job in jobs]
+
+
+class TestPolicies(unittest.TestCase):
+    def test_aging_lets_old_low_priority_jobs_through(self):
+        jobs = [_job(1, 1, priority=20, waited=6000), _job(2, 2, priority=5, waited=60)]
+        context = QueueContext(NOW, {}, {})
+        # 20 - 6000/600 = 10 > 5: ancora dietro
+        self.assertEqual(_ids(AgingPolicy(aging_sec=600).order(jobs, context)), [2, 1])
+        # 20 - 6000/300 = 0 < 5: passa davanti
+        self.assertEqual(_ids(AgingPolicy(aging_sec=300).order(jobs, context)), [1, 2])
+
+    def test_fair_share_weights_by_priority_and_running_jobs(self):
+        jobs = [_job(i, 1, priority=1, waited=100 - i) for i in range(1, 5)]
+        jobs += [_job(10 + i, 2, priority=2, waited=100 - i) for i in range(1, 3)]
+        policy = FairSharePolicy()
+        # Peso 2:1 a favore della watchfolder 1 (a parità vince il job più vecchio)
+        self.assertEqual(_ids(policy.order(jobs, QueueContext(NOW, {}, {}))), [1, 11, 2, 3, 12, 4])
+        # Con 2 job già in esecuzione sulla watchfolder 1 tocca prima alla 2
+        self.assertEqual(_ids(policy.order(jobs, QueueContext(NOW, {1: 2}, {})))[:2], [11, 1])
+
+    def test_sjf_uses_preset_speed_and_caps_wait(self):
+        speeds = {1: PresetSpeed(None, 10.0), 2: PresetSpeed(None, 1000.0)}
+        jobs = [
+            _job(1, 1, 10, waited=10, size=1000, preset_id=1),   # 100 s
+            _job(2, 1, 10, waited=5, size=5000, preset_id=2),    # 5 s
+            _job(3, 1, 10, waited=1, size=200, preset_id=1),     # 20 s
+        ]
+        policy = ShortestJobPolicy(max_wait=3600)
+        self.assertEqual(_ids(policy.order(jobs, QueueContext(NOW, {}, speeds))), [2, 3, 1])
+        policy = ShortestJobPolicy(max_wait=8)
+        self.assertEqual(_ids(policy.order(jobs, QueueContext(NOW, {}, speeds))), [1, 2, 3])
+
+    def test_unknown_policy_falls_back_to_priority(self):
+        self.assertEqual(get_policy('nope').name, 'priority')
+
+
+class TestPolicyQueue(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.preset = TranscodePreset(name='P')
+        self.session.add_all([
+            self.preset,
+            WatchFolder(id=1, name='news', path='/a', priority=1),
+            WatchFolder(id=2, name='archive', path='/b', priority=20),
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def _add(self, wf_id, name, size, waited):
+        self.session.add(TranscodeJob(
+            watchfolder_id=wf_id, preset_id=self.preset.id, input_filename=name,
+            input_path=f'/{name}', input_size=size, status=FileStatus.PENDING,
+            created_at=datetime.utcnow() - timedelta(seconds=waited),
+        ))
+
+    def test_policies_reorder_pending_jobs(self):
+        self._add(2, 'master', 10 ** 10, 3600)
+        self._add(1, 'clip1', 10 ** 6, 120)
+        self._add(1, 'clip2', 10 ** 6, 60)
+        self.session.add(TranscodeJob(
+            watchfolder_id=1, preset_id=self.preset.id, input_filename='busy', input_path='/busy',
+            status=FileStatus.PROCESSING, created_at=NOW,
+        ))
+        self.session.commit()
+
+        names = lambda jobs: [job.input_filename for job in jobs]  # noqa: E731
+        self.assertEqual(pick_next_pending_job(self.session).input_filename, 'clip1')
+        self.assertEqual(names(next_pending_jobs(self.session, 3, get_policy('sjf'))), ['clip1', 'clip2', 'master'])
+        # 1 job in esecuzione su news: (1+1)*1 = 2 < (0+1)*20, news resta davanti
+        self.assertEqual(names(next_pending_jobs(self.session, 3, get_policy('fair_share'))), ['clip1', 'clip2', 'master'])
+        # 20 - 3600/60 < 1 - 120/60: il master in attesa da un'ora passa davanti
+        self.assertEqual(pick_next_pending_job(self.session, AgingPolicy(aging_sec=60)).input_filename, 'master')
+
+    def test_speed_model_learns_from_completed_jobs(self):
+        start = NOW - timedelta(hours=1)
+        for size, duration, wall in ((1000, 60, 10), (3000, 120, 20)):
+            self.session.add(TranscodeJob(
+                preset_id=self.preset.id, input_filename='x', input_path='/x',
+                input_size=size, input_duration=duration, status=FileStatus.COMPLETED,
+                started_at=start, completed_at=start + timedelta(seconds=wall),
+            ))
+        self.session.commit()
+        speeds = PresetSpeedModel().speeds(self.session)
+        self.assertEqual(speeds[self.preset.id], PresetSpeed(6.0, 125.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""Test sorgenti remote (interfaccia comune, download sequenziale e parallelo)."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from models import WATCH_TYPE_FTPS, WATCH_TYPE_SFTP
+from remote_sources import (
+    FTPSSource,
+    HostKeyError,
+    SFTPSource,
+    default_port_for,
+    host_key_fingerprint,
+    open_remote_source,
+    split_ranges,
+    verify_host_key,
+)
+
+
+class LocalSFTPFile:
+    """File compatibile con paramiko.SFTPFile per i metodi usati da SFTPSource."""
+
+    def __init__(self, path):
+        self._fh = open(path, 'rb')
+
+    def seek(self, offset):
+        self._fh.seek(offset)
+
+    def prefetch(self):
+        pass
+
+    def read(self, size):
+        return self._fh.read(size)
+
+    def readv(self, chunks):
+        for offset, size in chunks:
+            self._fh.seek(offset)
+            yield self._fh.read(size)
+
+    def close(self):
+        self._fh.close()
+
+
+class LocalSFTPClient:
+    """Client SFTP minimale su directory locale (stesso sottoinsieme di paramiko.SFTPClient)."""
+
+    def __init__(self, root):
+        self.root = root
+        self.cwd = root
+
+    def _path(self, name):
+        return os.path.join(self.cwd, name)
+
+    def chdir(self, path):
+        self.cwd = os.path.join(self.root, path.lstrip('/'))
+
+    def _attrs(self, name):
+        st = os.stat(self._path(name))
+        return SimpleNamespace(
+            filename=name, st_size=st.st_size, st_mtime=st.st_mtime, st_mode=st.st_mode
+        )
+
+    def listdir_attr(self, path='.'):
+        return [self._attrs(name) for name in sorted(os.listdir(self.cwd))]
+
+    def stat(self, name):
+        return self._attrs(name)
+
+    def open(self, name, mode='rb', bufsize=-1):
+        return LocalSFTPFile(self._path(name))
+
+    def close(self):
+        pass
+
+
+class TestRemoteSources(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.remote_dir = os.path.join(self.root, 'incoming')
+        os.makedirs(os.path.join(self.remote_dir, 'subdir'))
+        self.payload = os.urandom(3 * 64 * 1024 + 123)
+        with open(os.path.join(self.remote_dir, 'clip.mxf'), 'wb') as f:
+            f.write(self.payload)
+        self.target = os.path.join(self.root, 'out.mxf')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _source(self, **kwargs):
+        return SFTPSource(
+            'localhost',
+            'user',
+            remote_path='/incoming',
+            client_factory=lambda: LocalSFTPClient(self.root),
+            block_size=64 * 1024,
+            **kwargs,
+        )
+
+    def test_list_and_stat_only_regular_files(self):
+        with self._source() as source:
+            names = [f['name'] for f in source.list()]
+            self.assertEqual(names, ['clip.mxf'])
+            info = source.stat('clip.mxf')
+            self.assertEqual(info['size'], len(self.payload))
+            self.assertEqual(len(info['modify']), 14)
+            self.assertIsNone(source.stat('subdir'))
+            self.assertIsNone(source.stat('missing.mxf'))
+
+    def test_sequential_download(self):
+        received = []
+        with self._source() as source:
+            source.download('clip.mxf', self.target, callback=lambda c: received.append(len(c)))
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(sum(received), len(self.payload))
+
+    def test_parallel_download_by_ranges(self):
+        received = []
+        with self._source(parallel_streams=3, parallel_min_size=1) as source:
+            source.download(
+                'clip.mxf',
+                self.target,
+                callback=lambda c: received.append(len(c)),
+                total_size=len(self.payload),
+            )
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(sum(received), len(self.payload))
+
+    def test_split_ranges_covers_whole_file(self):
+        ranges = split_ranges(10, 3)
+        self.assertEqual(ranges, [(0, 4), (4, 3), (7, 3)])
+        self.assertEqual(split_ranges(2, 8), [(0, 1), (1, 1)])
+
+    def test_open_remote_source_by_watch_type(self):
+        wf = SimpleNamespace(
+            watch_type=WATCH_TYPE_FTPS,
+            ftp_host='ftp.example.com',
+            ftp_username='user',
+            ftp_password=None,
+            ftp_port=None,
+            ftp_remote_path=None,
+        )
+        source = open_remote_source(wf)
+        self.assertIsInstance(source, FTPSSource)
+        self.assertEqual(source.port, 21)
+        self.assertEqual(source.remote_path, '/')
+        self.assertEqual(default_port_for(WATCH_TYPE_SFTP), 22)
+
+
+class FakeKey:
+    def __init__(self, blob, name='ssh-ed25519'):
+        self.blob = blob
+        self.name = name
+
+    def asbytes(self):
+        return self.blob
+
+    def get_name(self):
+        return self.name
+
+
+class TestSFTPHostKey(unittest.TestCase):
+    def setUp(self):
+        self.key = FakeKey(b'server-key')
+        self.fingerprint = host_key_fingerprint(self.key)
+
+    def test_fingerprint_and_known_hosts(self):
+        verify_host_key('nas', self.key, fingerprint=self.fingerprint)
+        verify_host_key('nas', self.key, known_keys={'ssh-ed25519': b'server-key'})
+
+    def test_missing_or_mismatched_key_is_refused(self):
+        with self.assertRaises(HostKeyError):
+            verify_host_key('nas', self.key, fingerprint=host_key_fingerprint(FakeKey(b'other')))
+        with self.assertRaises(HostKeyError):
+            verify_host_key('nas', self.key, known_keys={})
+        with self.assertRaises(HostKeyError):
+            verify_host_key('nas', self.key, known_keys={'ssh-ed25519': b'other'})
+
+    def test_connect_refuses_mismatch_before_sending_credentials(self):
+        transport = mock.Mock()
+        transport.get_remote_server_key.return_value = FakeKey(b'attacker-key')
+        paramiko = mock.Mock()
+        paramiko.Transport.return_value = transport
+        source = SFTPSource('nas', 'user', 'secret', host_key=self.fingerprint)
+        with mock.patch.dict(sys.modules, {'paramiko': paramiko}):
+            with self.assertRaises(HostKeyError):
+                source.connect()
+        transport.auth_password.assert_not_called()
+        paramiko.SFTPClient.from_transport.assert_not_called()
+        transport.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
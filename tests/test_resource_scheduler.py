@@ -0,0 +1,123 @@
+"""Test scheduler risorse: costi per preset, ammissione nel budget, backfill."""
+
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, FileStatus, TranscodeJob, TranscodePreset
+from resource_scheduler import (
+    DEFAULT_CODEC_COSTS,
+    JobCost,
+    PresetCostModel,
+    ResourceScheduler,
+)
+from transcoder_worker import TranscoderWorker
+
+
+class FixedCosts:
+    def __init__(self, costs):
+        self.costs = costs
+
+    def estimate(self, preset):
+        return self.costs[preset.name]
+
+    def learned(self):
+        return {}
+
+
+def _job(job_id, preset, waited=0):
+    return SimpleNamespace(
+        id=job_id,
+        preset=SimpleNamespace(name=preset),
+        created_at=datetime.utcnow() - timedelta(seconds=waited),
+    )
+
+
+class TestPresetCostModel(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+
+    def test_learns_from_completed_jobs_and_falls_back_to_codec(self):
+        session = self.Session()
+        hevc = TranscodePreset(name='HEVC', video_codec='libx265')
+        proxy = TranscodePreset(name='PROXY', video_codec='libx264')
+        session.add_all([hevc, proxy])
+        session.commit()
+        start = datetime(2024, 1, 1)
+        for cpu, rss in ((600, 3000), (1200, 3500), (900, 2000)):
+            session.add(TranscodeJob(
+                preset_id=hevc.id, input_filename='x', input_path='/x',
+                status=FileStatus.COMPLETED, cpu_seconds=cpu, peak_rss_mb=rss,
+                started_at=start, completed_at=start + timedelta(seconds=100),
+            ))
+        session.commit()
+
+        model = PresetCostModel(self.Session)
+        self.assertEqual(model.estimate(hevc), JobCost(9.0, 4200))
+        self.assertEqual(model.estimate(proxy), DEFAULT_CODEC_COSTS['libx264'])
+        session.close()
+
+
+class TestResourceScheduler(unittest.TestCase):
+    def setUp(self):
+        costs = FixedCosts({'big': JobCost(8, 4096), 'small': JobCost(1, 512), 'huge': JobCost(64, 4096)})
+        self.scheduler = ResourceScheduler(costs, cpu_budget=10, ram_budget_mb=8192, head_max_wait=600, enabled=True)
+
+    def test_small_jobs_backfill_around_big_ones(self):
+        self.assertEqual(self.scheduler.admit([_job(1, 'big')]).id, 1)
+        # Il secondo big non entra (16 > 10): passa lo small dietro di lui
+        self.assertEqual(self.scheduler.admit([_job(2, 'big'), _job(3, 'small')]).id, 3)
+        self.assertEqual(self.scheduler.admit([_job(2, 'big'), _job(4, 'small')]).id, 4)
+        self.assertIsNone(self.scheduler.admit([_job(2, 'big'), _job(5, 'small')]))
+        self.assertEqual(self.scheduler.usage()['cpu_used'], 10)
+
+        self.scheduler.release(1)
+        self.assertEqual(self.scheduler.admit([_job(2, 'big')]).id, 2)
+
+    def test_head_waiting_too_long_stops_backfill(self):
+        self.scheduler.admit([_job(1, 'big')])
+        self.assertIsNone(self.scheduler.admit([_job(2, 'big', waited=900), _job(3, 'small')]))
+
+    def test_job_larger_than_budget_runs_alone(self):
+        self.assertEqual(self.scheduler.admit([_job(1, 'huge')]).id, 1)
+        self.assertIsNone(self.scheduler.admit([_job(2, 'small')]))
+
+
+class TestWorkerClaim(unittest.TestCase):
+    def test_claim_uses_scheduler_and_assigns_job(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        big = TranscodePreset(name='big')
+        small = TranscodePreset(name='small')
+        session.add_all([big, small])
+        session.commit()
+        now = datetime.utcnow()
+        session.add_all([
+            TranscodeJob(preset_id=big.id, input_filename='a', input_path='/a',
+                         status=FileStatus.PENDING, created_at=now),
+            TranscodeJob(preset_id=small.id, input_filename='b', input_path='/b',
+                         status=FileStatus.PENDING, created_at=now + timedelta(seconds=1)),
+        ])
+        session.commit()
+
+        costs = FixedCosts({'big': JobCost(8, 1024), 'small': JobCost(1, 256)})
+        scheduler = ResourceScheduler(costs, cpu_budget=8, ram_budget_mb=4096, enabled=True)
+        scheduler.admit([_job(99, 'small')])  # slot già occupato da un job piccolo
+        worker = TranscoderWorker(Session, scheduler=scheduler)
+
+        job = worker._claim_next_job(session, worker_id=1)
+        self.assertEqual(job.input_filename, 'b')
+        self.assertEqual((job.status, job.worker_id), (FileStatus.PROCESSING, 1))
+        self.assertIsNone(worker._claim_next_job(session, worker_id=1))
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
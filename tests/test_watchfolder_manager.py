@@ -0,0 +1,87 @@
+"""Test observer condiviso: watchfolder sullo stesso path, riavvio dopo stop_all."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import WATCH_BACKEND_POLLING, Base, WatchFolder
+from watchfolder_manager import WatchFolderManager
+
+
+class TestSharedObserver(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{os.path.join(self.tmp, 'jobs.db')}")
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.input = os.path.join(self.tmp, 'in')
+        os.makedirs(self.input)
+        session = self.Session()
+        # Stesso path e stesso recursive, preset diversi
+        session.add_all([
+            WatchFolder(id=1, name='a', path=self.input, output_path=os.path.join(self.tmp, 'a'), active=1),
+            WatchFolder(id=2, name='b', path=self.input, output_path=os.path.join(self.tmp, 'b'), active=1),
+            WatchFolder(
+                id=3, name='nas', path=self.input, output_path=os.path.join(self.tmp, 'c'), active=1,
+                watch_backend=WATCH_BACKEND_POLLING, poll_interval=1,
+            ),
+        ])
+        session.commit()
+        session.close()
+        self.manager = WatchFolderManager(self.Session)
+
+    def tearDown(self):
+        self.manager.stop_all()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_stopping_one_watchfolder_keeps_the_other_handler(self):
+        self.manager.start_watchfolder(1)
+        self.manager.start_watchfolder(2)
+        observer, watch = self.manager.watches[2]
+        remaining = self.manager.handlers[2]
+
+        self.manager.stop_watchfolder(1)
+
+        self.assertIn(watch, observer._handlers)
+        self.assertEqual(observer._handlers[watch], {remaining})
+        self.manager.stop_watchfolder(2)
+        self.assertNotIn(watch, observer._handlers)
+
+    def _status(self, watchfolder_id):
+        session = self.Session()
+        try:
+            return session.query(WatchFolder).filter(WatchFolder.id == watchfolder_id).first().status
+        finally:
+            session.close()
+
+    def test_polling_watchfolder_stops_and_restarts(self):
+        self.manager.start_watchfolder(3)
+        observer, watch = self.manager.watches[3]
+        self.assertIs(observer, self.manager._polling_observer)
+
+        self.manager.restart_watchfolder(3)
+        self.assertNotIn(watch, observer._watches)
+        self.assertEqual(len(observer._watches), 1)
+        self.assertEqual(self._status(3), 'monitoring')
+
+        self.manager.stop_watchfolder(3)
+        self.assertEqual(observer._watches, [])
+        self.assertEqual(self._status(3), 'idle')
+
+    def test_restart_after_stop_all_schedules_reconcile(self):
+        self.manager.start_watchfolder(1)
+        self.manager.stop_all()
+        with mock.patch('watchfolder_manager.WatchFolderHandler.reconcile') as reconcile:
+            self.manager.start_watchfolder(1)
+            self.manager._schedule_reconcile(1, self.manager.handlers[1])
+            self.manager._scan_pool.shutdown(wait=True)
+        reconcile.assert_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,45 @@
 import os
+import signal
 import subprocess
 import threading
 import time
-import shutil
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from models import TranscodeJob, Worker, WatchFolder, FileStatus
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import re
 import shlex
 import logging
-from path_utils import ensure_shared_directory, ensure_shared_file
+from path_utils import ensure_shared_directory, ensure_shared_file, mirrored_directory
+import content_fingerprint
+from encode_cache import EncodeCache, command_hash
+from archiver import ARCHIVE_RECOVERY_DAYS, ArchiveMover, archive_file
+from input_staging import InputStager
+from page_cache_prefetch import PageCachePrefetcher
+import cpu_affinity
+import job_lease
+import job_recovery
+import job_retry
+import job_suspend
+from job_runner import JobRunner
+from job_suspend import EncodeRun
+import queue_policy
+from queue_policy import FALLBACK_JOB_PRIORITY
+from resource_scheduler import SCHED_LOOKAHEAD, PresetCostModel, ResourceScheduler
+from output_publish import (
+    ORPHAN_TEMP_MIN_AGE_SEC,
+    OUTPUT_SCRATCH_DIR,
+    cleanup_orphaned_temps,
+    publish_output,
+    remove_quietly,
+    temp_job_id,
+    temp_output_path,
+)
 from fractions import Fraction
 
 logger = logging.getLogger("XDCAMTranscoder.Worker")
 
-FALLBACK_JOB_PRIORITY = 999
 PRORES_VIDEO_CODECS = frozenset({"prores", "prores_ks", "prores_aw"})
 _vvenc_available = None
 
@@ -51,8 +74,8 @@ def should_add_video_bitrate(video_codec, video_bitrate):
     return True
 
 
-def pick_next_pending_job(session):
-    """Seleziona il prossimo job PENDING rispettando priority watchfolder e FIFO."""
+def _pending_jobs_query(session):
+    """Job PENDING assegnabili (non in backoff di retry) in ordine di priority watchfolder e FIFO."""
     return (
         session.query(TranscodeJob)
         .outerjoin(WatchFolder, TranscodeJob.watchfolder_id == WatchFolder.id)
@@ -60,34 +83,110 @@ def pick_next_pending_job(session):
             TranscodeJob.status == FileStatus.PENDING,
             TranscodeJob.worker_id.is_(None),
             func.coalesce(WatchFolder.operation_mode, 'transcode') != 'download_only',
+            or_(TranscodeJob.next_attempt_at.is_(None), TranscodeJob.next_attempt_at <= datetime.utcnow()),
+            # Sospesi con SIGSTOP: li riprende solo il processo che li ha fermati
+            TranscodeJob.suspended_pid.is_(None),
         )
         .order_by(
             func.coalesce(WatchFolder.priority, FALLBACK_JOB_PRIORITY).asc(),
             TranscodeJob.created_at.asc(),
         )
-        .first()
     )
 
 
+def _policy_candidates(session, window):
+    """I `window` job PENDING più vecchi di ciascuna watchfolder con job in coda."""
+    base = _pending_jobs_query(session).order_by(None)
+    watchfolder_ids = [
+        wf_id for (wf_id,) in session.query(TranscodeJob.watchfolder_id)
+        .filter(TranscodeJob.status == FileStatus.PENDING, TranscodeJob.worker_id.is_(None))
+        .distinct()
+    ]
+    candidates = []
+    for wf_id in watchfolder_ids:
+        same_folder = (
+            TranscodeJob.watchfolder_id.is_(None) if wf_id is None
+            else TranscodeJob.watchfolder_id == wf_id
+        )
+        candidates.extend(
+            base.filter(same_folder).order_by(TranscodeJob.created_at.asc()).limit(window).all()
+        )
+    return candidates
+
+
+def next_pending_jobs(session, limit, policy=None):
+    """I prossimi `limit` job PENDING nell'ordine della politica di coda (QUEUE_POLICY)."""
+    policy = policy or queue_policy.default_policy()
+    if policy.name == queue_policy.PriorityPolicy.name:
+        return _pending_jobs_query(session).limit(limit).all()
+    candidates = _policy_candidates(session, queue_policy.QUEUE_POLICY_WINDOW)
+    if not candidates:
+        return []
+    return policy.order(candidates, queue_policy.build_context(session, policy))[:limit]
+
+
+def pick_next_pending_job(session, policy=None):
+    """Seleziona il prossimo job PENDING (default: priority watchfolder e FIFO)."""
+    jobs = next_pending_jobs(session, 1, policy)
+    return jobs[0] if jobs else None
+
+
 class TranscoderWorker:
-    def __init__(self, db_session_factory):
+    def __init__(
+        self,
+        db_session_factory,
+        encode_cache=None,
+        archiver=None,
+        publisher=None,
+        stager=None,
+        prefetcher=None,
+        scheduler=None,
+        job_runner=None,
+    ):
         self.db_session_factory = db_session_factory
-        self.worker_threads = {}  # worker_id -> thread
+        self.encode_cache = encode_cache or EncodeCache()
+        self.archiver = archiver or ArchiveMover()
+        # Output scritti su uno scratch di un altro device: spostamento in background
+        self.publisher = publisher or ArchiveMover()
+        # Copie locali dei sorgenti su NAS (INPUT_STAGING_DIR)
+        self.stager = stager or InputStager()
+        # fadvise(WILLNEED) sui sorgenti dei prossimi job in coda
+        self.prefetcher = prefetcher or PageCachePrefetcher()
+        # Ammissione per costo CPU/RAM stimato (RESOURCE_SCHEDULER=1)
+        self.scheduler = scheduler or ResourceScheduler(PresetCostModel(db_session_factory))
+        # Core disgiunti per i processi FFmpeg (FFMPEG_CPU_PINNING=1)
+        self.core_allocator = cpu_affinity.CoreAllocator() if cpu_affinity.FFMPEG_CPU_PINNING else None
+        # Limiti memoria/CPU e niceness per ogni FFmpeg (JOB_MEMORY_LIMIT_MB, JOB_CGROUP_ROOT, ...)
+        self.job_runner = job_runner or JobRunner()
+        self.worker_threads = {}  # worker_id -> [thread per slot]
         self.running = {}  # worker_id -> bool
+        # Più slot nello stesso processo: selezione e assegnazione di un job sono atomiche
+        self._claim_lock = threading.Lock()
+        # Tra processi/nodi diversi l'assegnazione è una lease nel database
+        self.lease_owner = job_lease.process_owner()
+        self.lease_keeper = job_lease.LeaseKeeper(
+            db_session_factory, self.lease_owner, recover=self._recover_orphaned_jobs
+        )
+        self._active_jobs = set()  # job in esecuzione negli slot di questo processo
+        self._suspended = {}  # job_id -> EncodeRun con FFmpeg fermo (SIGSTOP), slot liberato
         
     def start_worker(self, worker_id):
-        """Avvia worker thread"""
+        """Avvia un thread per ciascuno dei max_concurrent_jobs slot del worker"""
         if worker_id in self.worker_threads:
             return  # Già attivo
         
         self.running[worker_id] = True
-        thread = threading.Thread(target=self._worker_loop, args=(worker_id,), daemon=True)
-        thread.start()
-        self.worker_threads[worker_id] = thread
-        
+        self.lease_keeper.start()
         db_session = self.db_session_factory()
         try:
             worker = db_session.query(Worker).filter(Worker.id == worker_id).first()
+            slots = max(1, (worker.max_concurrent_jobs or 1) if worker else 1)
+            threads = []
+            for _ in range(slots):
+                thread = threading.Thread(target=self._worker_loop, args=(worker_id,), daemon=True)
+                thread.start()
+                threads.append(thread)
+            self.worker_threads[worker_id] = threads
             if worker:
                 worker.status = 'running'
                 db_session.commit()
@@ -110,26 +209,200 @@ class TranscoderWorker:
         finally:
             db_session.close()
     
+    def cleanup_orphaned_outputs(self):
+        """
+        All'avvio, prima dei worker: rimuove i temporanei di output e di spostamento
+        lasciati da un'esecuzione interrotta (cartelle output/archivio, scratch) e
+        riaffida al mover gli output completati rimasti nello scratch.
+        """
+        db_session = self.db_session_factory()
+        try:
+            directories = set()
+            for output_path, archive_path in db_session.query(WatchFolder.output_path, WatchFolder.archive_path):
+                directories.update((output_path, archive_path))
+            unfinished = db_session.query(TranscodeJob.output_path).filter(
+                TranscodeJob.status.in_((FileStatus.PENDING, FileStatus.PROCESSING, FileStatus.PAUSED))
+            )
+            directories.update(os.path.dirname(path) for (path,) in unfinished if path)
+            # Job in corso su altri nodi (lease valida): i loro temporanei restano
+            running_elsewhere = db_session.query(TranscodeJob.id, TranscodeJob.output_path).filter(
+                TranscodeJob.status == FileStatus.PROCESSING,
+                TranscodeJob.lease_owner != self.lease_owner,
+                TranscodeJob.lease_expires_at > datetime.utcnow(),
+            )
+            keep = [temp_output_path(path, job_id) for job_id, path in running_elsewhere if path]
+            # Parziali e segmenti da cui riprendere (job sospesi o con checkpoint)
+            resumable = db_session.query(TranscodeJob.id, TranscodeJob.output_path).filter(
+                or_(TranscodeJob.suspended_pid.isnot(None), TranscodeJob.checkpoint_sec.isnot(None))
+            )
+            for job_id, path in resumable:
+                if path:
+                    keep.extend((temp_output_path(path, job_id), job_suspend.head_segment_path(path, job_id)))
+            keep.extend(self._resubmit_scratch_outputs(db_session))
+        finally:
+            db_session.close()
+        # Scratch locale al nodo: tutto ciò che resta è di questo nodo. Nelle cartelle
+        # condivise solo i temporanei fermi da tempo (gli altri nodi possono scriverci)
+        removed = cleanup_orphaned_temps([OUTPUT_SCRATCH_DIR], keep=keep)
+        directories.discard(OUTPUT_SCRATCH_DIR)
+        return removed + cleanup_orphaned_temps(directories, keep=keep, min_age_sec=ORPHAN_TEMP_MIN_AGE_SEC)
+
+    def _resubmit_scratch_outputs(self, session):
+        """
+        Output di job COMPLETED ancora nello scratch: lo spostamento in background è
+        stato interrotto dal riavvio. Tornano al mover; ritorna i temporanei riaffidati.
+        """
+        if not OUTPUT_SCRATCH_DIR:
+            return []
+        temps = {}
+        try:
+            with os.scandir(OUTPUT_SCRATCH_DIR) as it:
+                for entry in it:
+                    job_id = temp_job_id(entry.name)
+                    if job_id is not None and entry.is_file(follow_symlinks=False):
+                        temps[job_id] = entry.path
+        except OSError:
+            return []
+        if not temps:
+            return []
+        resubmitted = []
+        completed = session.query(TranscodeJob.id, TranscodeJob.output_path).filter(
+            TranscodeJob.id.in_(list(temps)), TranscodeJob.status == FileStatus.COMPLETED
+        )
+        for job_id, output_path in completed:
+            temp_path = temps[job_id]
+            if not output_path or temp_path != temp_output_path(output_path, job_id) or os.path.exists(output_path):
+                continue
+            logger.warning("Output del job %s ancora nello scratch: nuovo spostamento in %s", job_id, output_path)
+            self.publisher.submit(temp_path, output_path, overwrite=True)
+            resubmitted.append(temp_path)
+        return resubmitted
+
+    def resubmit_pending_archives(self):
+        """
+        All'avvio: la coda del mover è in memoria, quindi gli spostamenti verso
+        l'archivio interrotti dal riavvio vanno ritrovati dal database. In background:
+        con la coda piena submit() attende e l'avvio non deve aspettare le copie.
+        """
+        thread = threading.Thread(target=self._resubmit_pending_archives, name='ArchiveRecovery', daemon=True)
+        thread.start()
+        return thread
+
+    def _resubmit_pending_archives(self):
+        """
+        Job COMPLETED di questo nodo negli ultimi ARCHIVE_RECOVERY_DAYS con archivio
+        configurato e sorgente ancora in input_path: l'archiviazione non è finita.
+        Quelli degli altri nodi restano ai loro mover; un file nuovo con lo stesso nome
+        (job più recente attivo o mtime successivo al completamento) non si tocca.
+        """
+        db_session = self.db_session_factory()
+        resubmitted = []
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_RECOVERY_DAYS)
+            jobs = (
+                db_session.query(TranscodeJob)
+                .join(WatchFolder, TranscodeJob.watchfolder_id == WatchFolder.id)
+                .filter(
+                    TranscodeJob.status == FileStatus.COMPLETED,
+                    TranscodeJob.completed_at >= cutoff,
+                    TranscodeJob.lease_owner.like(f'{job_lease.NODE_NAME}:%'),
+                    WatchFolder.archive_path.isnot(None),
+                    WatchFolder.archive_path != '',
+                )
+                .order_by(TranscodeJob.completed_at.desc())
+                .all()
+            )
+            seen = set()
+            for job in jobs:
+                if job.input_path in seen or job.lease_owner.rpartition(':')[0] != job_lease.NODE_NAME:
+                    continue
+                seen.add(job.input_path)
+                try:
+                    mtime = datetime.utcfromtimestamp(os.stat(job.input_path).st_mtime)
+                except OSError:
+                    continue
+                if mtime > job.completed_at:
+                    continue
+                newer = db_session.query(TranscodeJob.id).filter(
+                    TranscodeJob.input_path == job.input_path,
+                    TranscodeJob.id != job.id,
+                    TranscodeJob.status.in_((FileStatus.PENDING, FileStatus.PROCESSING, FileStatus.PAUSED)),
+                ).first()
+                if newer:
+                    continue
+                logger.warning("Sorgente del job %s non archiviato prima del riavvio: %s", job.id, job.input_path)
+                self._archive_original_file(job)
+                resubmitted.append(job.id)
+        except Exception as e:
+            logger.error("Ripresa archiviazioni interrotte fallita: %s", e)
+        finally:
+            db_session.close()
+        return resubmitted
+
     def _pick_next_pending_job(self, session):
         return pick_next_pending_job(session)
 
+    def _claim_next_job(self, session, worker_id):
+        """
+        Seleziona e assegna il prossimo job. Con lo scheduler attivo sceglie tra i
+        primi SCHED_LOOKAHEAD in coda il primo che entra nel budget CPU/RAM.
+        L'assegnazione è una lease: se un altro processo ha preso il job per primo
+        ritorna None e lo slot riprova al giro successivo.
+        """
+        with self._claim_lock:
+            if self.scheduler.enabled:
+                job = self.scheduler.admit(next_pending_jobs(session, SCHED_LOOKAHEAD))
+            else:
+                job = self._pick_next_pending_job(session)
+            if not job:
+                return None
+            try:
+                claimed = job_lease.claim_job(session, job.id, self.lease_owner, worker_id)
+            except Exception:
+                session.rollback()
+                self.scheduler.release(job.id)
+                raise
+            if not claimed:
+                self.scheduler.release(job.id)
+                return None
+            self._active_jobs.add(job.id)
+            session.refresh(job)
+            return job
+
+    def recover_orphaned_jobs(self):
+        """All'avvio, prima dei worker: job PROCESSING rimasti da un'esecuzione interrotta."""
+        db_session = self.db_session_factory()
+        try:
+            return self._recover_orphaned_jobs(db_session)
+        finally:
+            db_session.close()
+
+    def _recover_orphaned_jobs(self, session):
+        # Sotto _claim_lock: un job appena assegnato è già tra quelli attivi
+        with self._claim_lock:
+            job_suspend.release_abandoned_suspensions(session, self.lease_owner, set(self._suspended))
+            return job_recovery.recover_orphaned_jobs(session, self.lease_owner, set(self._active_jobs))
+
     def _worker_loop(self, worker_id):
-        """Loop principale worker"""
+        """Loop principale worker (uno per slot)"""
         while self.running.get(worker_id, False):
             try:
                 db_session = self.db_session_factory()
                 try:
-                    job = self._pick_next_pending_job(db_session)
+                    resumed = self._claim_resumed_job(db_session, worker_id)
+                    job = None if resumed else self._claim_next_job(db_session, worker_id)
                     
-                    if job:
-                        # Assegna job al worker
-                        job.worker_id = worker_id
-                        job.status = FileStatus.PROCESSING
-                        job.started_at = datetime.utcnow()
-                        db_session.commit()
-                        
+                    if resumed:
+                        self._resume_encode(*resumed)
+                    elif job:
                         # Processa job
-                        self._process_job(job.id)
+                        try:
+                            if self.prefetcher.enabled:
+                                self.prefetcher.record_start(job.input_path, job.watchfolder_id)
+                            self._process_job(job.id)
+                        finally:
+                            self.scheduler.release(job.id)
+                            self._active_jobs.discard(job.id)
                     
                 finally:
                     db_session.close()
@@ -143,6 +416,7 @@ class TranscoderWorker:
     def _process_job(self, job_id):
         """Processa job di transcodifica"""
         db_session = self.db_session_factory()
+        staged_source = None
         try:
             job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
             if not job:
@@ -155,25 +429,24 @@ class TranscoderWorker:
             if preset and preset.name == "H266_HQ" and (preset.video_codec or "").strip() == "libvvenc":
                 if not is_libvvenc_available():
                     logger.warning("Preset H266_HQ richiesto ma libvvenc non disponibile in ffmpeg")
-                    job.status = FileStatus.FAILED
-                    job.error_message = "Encoder libvvenc (H.266/VVC) non disponibile in FFmpeg"
-                    job.completed_at = datetime.utcnow()
+                    job_retry.fail_or_retry(
+                        job, "Encoder libvvenc (H.266/VVC) non disponibile in FFmpeg", job_retry.PERMANENT
+                    )
                     db_session.commit()
                     return
             
             # Verifica esistenza file
             if not os.path.exists(job.input_path):
-                job.status = FileStatus.FAILED
-                job.error_message = f"File input non trovato: {job.input_path}"
-                job.completed_at = datetime.utcnow()
+                # Share di rete non montata o file non ancora visibile: si riprova
+                job_retry.fail_or_retry(job, f"File input non trovato: {job.input_path}", job_retry.TRANSIENT)
                 db_session.commit()
                 return
             
             # Verifica permessi lettura file input
             if not os.access(job.input_path, os.R_OK):
-                job.status = FileStatus.FAILED
-                job.error_message = f"Permessi insufficienti per leggere il file: {job.input_path}"
-                job.completed_at = datetime.utcnow()
+                job_retry.fail_or_retry(
+                    job, f"Permessi insufficienti per leggere il file: {job.input_path}", job_retry.PERMANENT
+                )
                 db_session.commit()
                 return
             
@@ -183,65 +456,148 @@ class TranscoderWorker:
                 try:
                     ensure_shared_directory(output_dir)
                 except Exception as e:
-                    job.status = FileStatus.FAILED
-                    job.error_message = f"Impossibile creare directory output: {str(e)}"
-                    job.completed_at = datetime.utcnow()
+                    job_retry.fail_or_retry(
+                        job, f"Impossibile creare directory output: {str(e)}", job_retry.TRANSIENT
+                    )
                     db_session.commit()
                     return
             
             # Verifica permessi scrittura directory output
             if output_dir and not os.access(output_dir, os.W_OK):
-                job.status = FileStatus.FAILED
-                job.error_message = f"Permessi insufficienti per scrivere nella directory: {output_dir}"
-                job.completed_at = datetime.utcnow()
+                job_retry.fail_or_retry(
+                    job, f"Permessi insufficienti per scrivere nella directory: {output_dir}", job_retry.PERMANENT
+                )
                 db_session.commit()
                 return
             
+            # Stesso contenuto già transcodificato con questo preset: riusa l'output
+            if content_fingerprint.CONTENT_DEDUP_ENABLED and self._complete_from_duplicate(db_session, job):
+                return
+            
             # Mediainfo file in ingresso
             input_mediainfo = self._get_mediainfo(job.input_path)
             if input_mediainfo:
                 job.input_mediainfo = input_mediainfo
                 db_session.commit()
             
+            # FFmpeg scrive su un temporaneo nascosto, pubblicato con rename a fine job
+            temp_path = temp_output_path(job.output_path, job.id)
+            if OUTPUT_SCRATCH_DIR:
+                ensure_shared_directory(OUTPUT_SCRATCH_DIR)
+            
+            # FFmpeg sospeso e poi morto: si riparte dal checkpoint invece che da zero
+            seek_sec = None
+            if job.checkpoint_sec:
+                seek_sec = self._prepare_checkpoint_restart(job, temp_path)
+                db_session.commit()
+            
+            # Sorgente su scratch locale (già copiato dal prefetch o copiato ora)
+            encode_input = self.stager.acquire(job.input_path)
+            if encode_input != job.input_path:
+                staged_source = job.input_path
+            
             # Costruisci comando FFmpeg
-            ffmpeg_cmd = self._build_ffmpeg_command(job)
+            ffmpeg_cmd = self._build_ffmpeg_command(job, output_path=temp_path, input_path=encode_input)
+            
+            # Stesso sorgente e stesso comando effettivo già in cache: niente FFmpeg.
+            # Un output ricomposto da segmenti non entra in cache.
+            cache_key = None
+            if self.encode_cache.enabled and not seek_sec:
+                cache_key = command_hash(ffmpeg_cmd, encode_input, temp_path)
+                if self._complete_from_cache(db_session, job, cache_key):
+                    return
+            
+            # Thread per job dopo la chiave di cache: il numero di slot attivi non
+            # cambia il contenuto atteso dell'output
+            threads = None
+            if cpu_affinity.FFMPEG_THREAD_BUDGET:
+                threads = self._ffmpeg_thread_budget()
+                ffmpeg_cmd = cpu_affinity.apply_thread_budget(ffmpeg_cmd, threads, job.preset.video_codec)
+            if seek_sec:
+                ffmpeg_cmd = job_suspend.seek_input(ffmpeg_cmd, seek_sec)
             
-            # Esegui transcodifica
+            # Esegui transcodifica (processo con limiti di risorse e priorità della watchfolder)
+            priority = job.watchfolder.priority if job.watchfolder else FALLBACK_JOB_PRIORITY
             try:
-                process = subprocess.Popen(
+                process = self.job_runner.start(
                     ffmpeg_cmd,
+                    job.id,
+                    priority=priority,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     universal_newlines=True,
                     errors='replace'  # Gestisce errori di encoding
                 )
             except Exception as e:
-                job.status = FileStatus.FAILED
-                job.error_message = f"Errore avvio FFmpeg: {str(e)}"
-                job.completed_at = datetime.utcnow()
+                # Eseguibile assente: inutile riprovare; fork/risorse esaurite: sì
+                failure_class = job_retry.PERMANENT if isinstance(e, FileNotFoundError) else job_retry.TRANSIENT
+                job_retry.fail_or_retry(job, f"Errore avvio FFmpeg: {str(e)}", failure_class)
                 db_session.commit()
                 return
             
-            # Monitora progresso
-            self._monitor_progress(process, job_id)
+            encode = EncodeRun(
+                process, temp_path, cache_key=cache_key, staged_source=staged_source, threads=threads,
+                seek_sec=seek_sec, head_path=job_suspend.head_segment_path(job.output_path, job.id),
+            )
+            # Il sorgente in staging ora appartiene alla codifica (anche se sospesa)
+            staged_source = None
+            db_session.close()
+            self._run_encode(job_id, encode)
+            
+        except Exception as e:
+            db_session.rollback()
+            job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
+            if job:
+                failure_class = job_retry.TRANSIENT if isinstance(e, OSError) else job_retry.PERMANENT
+                job_retry.fail_or_retry(job, str(e), failure_class)
+                db_session.commit()
+        finally:
+            if staged_source:
+                self.stager.release(staged_source)
+            db_session.close()
+    
+    def _run_encode(self, job_id, encode, resumed=False):
+        """Segue FFmpeg fino alla fine (o alla sospensione) e registra l'esito del job."""
+        process = encode.process
+        temp_path = encode.temp_path
+        cache_key = encode.cache_key
+        db_session = None
+        parked = False
+        publish_stage = published = False
+        try:
+            if self.core_allocator:
+                encode.pinned_cores = self.core_allocator.allocate(encode.threads or self._ffmpeg_thread_budget())
+                cpu_affinity.pin_process(process.pid, encode.pinned_cores)
+            
+            if resumed:
+                process.send_signal(signal.SIGCONT)
+            else:
+                # Mentre FFmpeg codifica, prepara i sorgenti dei prossimi job
+                self._prefetch_upcoming_inputs()
+            
+            # Monitora progresso; in pausa FFmpeg resta fermo e lo slot si libera
+            if self._monitor_progress(process, job_id, encode):
+                parked = self._park_encode(job_id, encode)
+                if parked:
+                    return
             
-            # Attendi completamento
+            # Attendi completamento (wait4: CPU e picco RSS del processo FFmpeg)
             stdout, stderr = process.communicate()
             
             db_session = self.db_session_factory()
             job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
             if not job:
+                remove_quietly(temp_path)
                 return
+            job.cpu_seconds = process.cpu_seconds
+            job.peak_rss_mb = process.peak_rss_mb
 
             signalled = process.returncode is not None and process.returncode < 0
 
-            # Stati utente prima di valutare esito FFmpeg (evita race pause → failed)
+            # Stati utente prima di valutare esito FFmpeg (evita race pause → failed).
+            # Il file parziale è solo il temporaneo: output_path non è mai stato toccato.
             if job.status == FileStatus.PAUSED:
-                if job.output_path and os.path.exists(job.output_path):
-                    try:
-                        os.remove(job.output_path)
-                    except OSError as e:
-                        logger.warning("Rimozione file parziale fallita %s: %s", job.output_path, e)
+                remove_quietly(temp_path)
                 job.progress = 0
                 job.worker_id = None
                 job.completed_at = None
@@ -249,67 +605,366 @@ class TranscoderWorker:
                 return
 
             if job.status == FileStatus.CANCELLED:
-                if job.output_path and os.path.exists(job.output_path):
-                    try:
-                        os.remove(job.output_path)
-                    except OSError as e:
-                        logger.warning("Rimozione file parziale fallita %s: %s", job.output_path, e)
+                remove_quietly(temp_path)
                 if not job.completed_at:
                     job.completed_at = datetime.utcnow()
                 db_session.commit()
                 return
 
+            if job.lease_owner != self.lease_owner:
+                # Lease scaduta e job ripreso da un altro nodo: il risultato non è più nostro
+                logger.warning("Lease del job %s persa (ora: %s), output scartato", job_id, job.lease_owner)
+                remove_quietly(temp_path)
+                return
+
+            limit_error = process.limit_exceeded(stderr)
+            if limit_error:
+                # Stesso sorgente, stesso limite: riprovare non serve
+                logger.warning("Job %s: %s", job_id, limit_error)
+                remove_quietly(temp_path)
+                job_retry.fail_or_retry(job, limit_error, job_retry.PERMANENT)
+                db_session.commit()
+                return
+
             if signalled and job.status == FileStatus.PROCESSING:
                 job.status = FileStatus.PAUSED
-                if job.output_path and os.path.exists(job.output_path):
-                    try:
-                        os.remove(job.output_path)
-                    except OSError as e:
-                        logger.warning("Rimozione file parziale fallita %s: %s", job.output_path, e)
+                remove_quietly(temp_path)
                 job.progress = 0
                 job.worker_id = None
                 job.completed_at = None
                 db_session.commit()
                 return
 
-            if process.returncode == 0 and os.path.exists(job.output_path):
+            if encode.seek_sec and process.returncode == 0 and not self._join_head_segment(job, temp_path):
+                remove_quietly(temp_path)
+                job_retry.fail_or_retry(
+                    job, "Unione del segmento ripreso da checkpoint non riuscita", job_retry.TRANSIENT
+                )
+                db_session.commit()
+                return
+
+            if process.returncode == 0 and os.path.exists(temp_path):
                 job.status = FileStatus.COMPLETED
                 job.progress = 100
-                job.output_size = os.path.getsize(job.output_path) if os.path.exists(job.output_path) else None
-                job.output_duration = self._get_video_duration(job.output_path)
+                job.output_size = os.path.getsize(temp_path)
+                job.output_duration = self._get_video_duration(temp_path)
 
-                output_mediainfo = self._get_mediainfo(job.output_path)
+                output_mediainfo = self._get_mediainfo(temp_path)
                 if output_mediainfo:
                     job.output_mediainfo = output_mediainfo
 
+                if content_fingerprint.CONTENT_DEDUP_ENABLED or cache_key:
+                    # Prima dell'archiviazione: dopo il sorgente non è più in input_path
+                    self._record_content_hash(job)
+
+                ensure_shared_file(temp_path)
+
+                # In cache prima della pubblicazione: con scratch su altro device il
+                # temporaneo passa al mover in background
+                if cache_key and job.input_hash:
+                    try:
+                        self.encode_cache.store(
+                            db_session, job.input_fingerprint, job.input_hash, cache_key, temp_path
+                        )
+                    except Exception as e:
+                        db_session.rollback()
+                        logger.warning("Inserimento in cache fallito per job %s: %s", job_id, e)
+
+                publish_stage = True
+                publish_output(temp_path, job.output_path, self.publisher)
+                published = True
+                # Solo a output pubblicato (o affidato al mover): se la pubblicazione
+                # fallisce il retry ritrova il sorgente in input_path
                 if job.watchfolder and job.watchfolder.archive_path:
                     self._archive_original_file(job)
-                ensure_shared_file(job.output_path)
                 job.completed_at = datetime.utcnow()
             else:
-                job.status = FileStatus.FAILED
+                remove_quietly(temp_path)
                 error_msg = self._extract_error_message(stderr, process.returncode)
-                job.error_message = error_msg
-                job.completed_at = datetime.utcnow()
+                job_retry.fail_or_retry(
+                    job, error_msg, job_retry.classify_failure(process.returncode, stderr)
+                )
 
+            job_lease.release_lease(job)
             db_session.commit()
             
         except Exception as e:
+            if publish_stage and not published:
+                # Pubblicazione fallita (ENOSPC, EACCES): il retry ricodifica da capo
+                remove_quietly(temp_path)
+            if db_session is None:
+                db_session = self.db_session_factory()
             db_session.rollback()
             job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
             if job:
-                job.status = FileStatus.FAILED
-                job.error_message = str(e)
-                job.completed_at = datetime.utcnow()
+                failure_class = job_retry.TRANSIENT if isinstance(e, OSError) else job_retry.PERMANENT
+                job_retry.fail_or_retry(job, str(e), failure_class)
                 db_session.commit()
+        finally:
+            if encode.pinned_cores:
+                self.core_allocator.release(encode.pinned_cores)
+                encode.pinned_cores = None
+            if not parked:
+                if encode.staged_source:
+                    self.stager.release(encode.staged_source)
+                if encode.seek_sec:
+                    remove_quietly(encode.head_path)
+            if db_session is not None:
+                db_session.close()
+    
+    def _park_encode(self, job_id, encode):
+        """
+        FFmpeg appena fermato (SIGSTOP): registra la sospensione nel database e tiene il
+        processo. Se nel frattempo il job ha cambiato stato il processo riparte per
+        terminare come una pausa classica. Ritorna True se parcheggiato.
+        """
+        session = self.db_session_factory()
+        try:
+            # Sotto _claim_lock: il watchdog non deve vedere la sospensione prima del registro
+            with self._claim_lock:
+                parked = job_suspend.park_job(
+                    session, job_id, self.lease_owner, encode.process.pid,
+                    job_suspend.checkpoint_for(encode.progress_sec), job_lease.LEASE_TTL_SEC,
+                )
+                if parked:
+                    self._suspended[job_id] = encode
+        finally:
+            session.close()
+        if parked:
+            logger.info("Job %s sospeso (FFmpeg pid %s fermo), slot liberato", job_id, encode.process.pid)
+            return True
+        encode.process.send_signal(signal.SIGCONT)
+        encode.process.terminate()
+        return False
+
+    def _claim_resumed_job(self, session, worker_id):
+        """
+        Tra i job sospesi da questo processo: riprende il primo rimesso in coda
+        dall'utente, chiude quelli annullati o riaccodati da capo e rilascia quelli il
+        cui FFmpeg è morto (ripartiranno dal checkpoint). Ritorna (job_id, EncodeRun) o None.
+        """
+        if not self._suspended:
+            return None
+        with self._claim_lock:
+            session.expire_all()
+            for job_id, encode in list(self._suspended.items()):
+                job = session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
+                if job is None or job.status == FileStatus.CANCELLED or job.lease_owner != self.lease_owner:
+                    self._discard_suspended(session, job_id, kill=True)
+                    continue
+                if encode.process.poll() is not None:
+                    logger.warning("FFmpeg sospeso del job %s terminato (%s)", job_id, encode.process.returncode)
+                    self._discard_suspended(session, job_id)
+                    continue
+                if job.status != FileStatus.PENDING:
+                    continue
+                if self.scheduler.enabled and not self.scheduler.admit([job]):
+                    continue
+                if job_suspend.claim_resumed_job(
+                    session, job_id, self.lease_owner, encode.process.pid, worker_id, job_lease.LEASE_TTL_SEC
+                ):
+                    del self._suspended[job_id]
+                    self._active_jobs.add(job_id)
+                    return job_id, encode
+                self.scheduler.release(job_id)
+        return None
+
+    def _resume_encode(self, job_id, encode):
+        try:
+            logger.info("Job %s ripreso (SIGCONT a FFmpeg pid %s)", job_id, encode.process.pid)
+            self._run_encode(job_id, encode, resumed=True)
+        finally:
+            self.scheduler.release(job_id)
+            self._active_jobs.discard(job_id)
+
+    def _discard_suspended(self, session, job_id, kill=False):
+        encode = self._suspended.pop(job_id)
+        if kill:
+            # SIGKILL agisce anche su un processo fermo
+            encode.process.kill()
+        encode.process.communicate()
+        if encode.staged_source:
+            self.stager.release(encode.staged_source)
+        job_suspend.unpark_job(session, job_id, encode.process.pid)
+
+    def _prepare_checkpoint_restart(self, job, temp_path):
+        """
+        Parziale di un FFmpeg sospeso e poi terminato: la parte fino al checkpoint si
+        aggiunge al segmento iniziale e FFmpeg riparte da lì. Ritorna i secondi del
+        sorgente da saltare, None per ricominciare da zero.
+        """
+        checkpoint = job.checkpoint_sec
+        job.checkpoint_sec = None
+        head = job_suspend.head_segment_path(job.output_path, job.id)
+        if not os.path.exists(temp_path):
+            remove_quietly(head)
+            return None
+        # Il parziale inizia dove finisce il segmento iniziale di una ripresa precedente
+        offset = (self._get_video_duration(head) or 0) if os.path.exists(head) else 0
+        keep = checkpoint - offset
+        piece = temp_output_path(job.output_path, f'{job.id}-piece')
+        joined = temp_output_path(job.output_path, f'{job.id}-joined')
+        try:
+            if keep <= 0:
+                return offset or None
+            if not job_suspend.trim_segment(temp_path, piece, keep):
+                remove_quietly(head)
+                return None
+            if (self._get_video_duration(piece) or 0) < keep - job_suspend.SEGMENT_TOLERANCE_SEC:
+                # Il parziale non arriva al checkpoint: unendo resterebbe un buco
+                logger.warning("Parziale del job %s più corto del checkpoint, ripartenza da zero", job.id)
+                remove_quietly(head)
+                return None
+            if offset:
+                if not job_suspend.join_segments(head, piece, joined):
+                    remove_quietly(head)
+                    return None
+                os.replace(joined, head)
+            else:
+                os.replace(piece, head)
+            logger.info("Job %s riprende da checkpoint a %.1fs", job.id, checkpoint)
+            return checkpoint
+        finally:
+            for path in (temp_path, piece, joined):
+                remove_quietly(path)
+
+    def _join_head_segment(self, job, temp_path):
+        """Output completo = segmento iniziale + parte codificata dopo il checkpoint."""
+        head = job_suspend.head_segment_path(job.output_path, job.id)
+        joined = temp_output_path(job.output_path, f'{job.id}-joined')
+        if not job_suspend.join_segments(head, temp_path, joined):
+            remove_quietly(joined)
+            return False
+        os.replace(joined, temp_path)
+        remove_quietly(head)
+        return True
+
+    def _ffmpeg_thread_budget(self):
+        """Core disponibili divisi per gli slot dei worker attivi in questo processo."""
+        slots = sum(
+            len(threads) for worker_id, threads in self.worker_threads.items()
+            if self.running.get(worker_id)
+        )
+        return cpu_affinity.thread_budget(len(cpu_affinity.available_cores()), slots)
+
+    def _prefetch_upcoming_inputs(self):
+        """
+        Staging su scratch del sorgente del prossimo job PENDING e fadvise(WILLNEED)
+        sui prossimi K, nell'ordine della politica di coda.
+        """
+        limit = max(
+            1 if self.stager.enabled else 0,
+            self.prefetcher.lookahead if self.prefetcher.enabled else 0,
+        )
+        if not limit:
+            return
+        db_session = self.db_session_factory()
+        try:
+            paths = [job.input_path for job in next_pending_jobs(db_session, limit)]
+            if self.stager.enabled and paths and os.path.exists(paths[0]):
+                self.stager.prefetch(paths[0])
+            if self.prefetcher.enabled:
+                self.prefetcher.advise(paths)
+        except Exception as e:
+            logger.warning("Prefetch prossimo job non riuscito: %s", e)
         finally:
             db_session.close()
     
-    def _build_ffmpeg_command(self, job):
-        """Costruisce comando FFmpeg per transcodifica"""
+    def _complete_from_duplicate(self, db_session, job):
+        """
+        Completa il job collegando (hardlink o copia) l'output di un job già completato
+        con sorgente identico e stesso preset. Ritorna True se FFmpeg non serve.
+        """
+        try:
+            if not job.input_fingerprint:
+                job.input_fingerprint = content_fingerprint.sampled_fingerprint(job.input_path)
+                db_session.commit()
+            source_job, input_hash = content_fingerprint.find_duplicate_output(
+                db_session, job, job.input_fingerprint
+            )
+            if input_hash:
+                job.input_hash = input_hash
+            if not source_job:
+                db_session.commit()
+                return False
+            if os.path.abspath(source_job.output_path) != os.path.abspath(job.output_path):
+                content_fingerprint.link_or_copy(source_job.output_path, job.output_path)
+        except Exception as e:
+            db_session.rollback()
+            logger.warning("Dedup contenuto non applicabile al job %s: %s", job.id, e)
+            return False
+
+        logger.info(
+            "Job %s: sorgente identico al job %s, output riusato senza transcodifica",
+            job.id, source_job.id,
+        )
+        job.dedup_source_job_id = source_job.id
+        job.input_duration = job.input_duration or source_job.input_duration
+        self._complete_with_existing_output(
+            db_session, job, source_job.output_size, source_job.output_duration, source_job.output_mediainfo
+        )
+        return True
+
+    def _complete_from_cache(self, db_session, job, cache_key):
+        """Completa il job da una voce della cache codifiche. Ritorna True se FFmpeg non serve."""
+        try:
+            if not job.input_fingerprint:
+                job.input_fingerprint = content_fingerprint.sampled_fingerprint(job.input_path)
+            entry, source_hash = self.encode_cache.lookup(
+                db_session, job.input_fingerprint, cache_key, job.input_path, source_hash=job.input_hash
+            )
+            if source_hash:
+                job.input_hash = source_hash
+            db_session.commit()
+            if not entry or not self.encode_cache.materialize(db_session, entry, job.output_path):
+                return False
+        except Exception as e:
+            db_session.rollback()
+            logger.warning("Cache codifiche non applicabile al job %s: %s", job.id, e)
+            return False
+
+        logger.info("Job %s: output servito dalla cache codifiche (%s)", job.id, entry.cache_path)
+        self._complete_with_existing_output(
+            db_session,
+            job,
+            entry.size,
+            self._get_video_duration(job.output_path),
+            self._get_mediainfo(job.output_path),
+        )
+        return True
+
+    def _complete_with_existing_output(self, db_session, job, output_size, output_duration, output_mediainfo):
+        """Chiude come COMPLETED un job il cui output è stato riusato invece che codificato."""
+        job.status = FileStatus.COMPLETED
+        job.progress = 100
+        job.output_size = output_size
+        job.output_duration = output_duration
+        job.output_mediainfo = output_mediainfo
+        if job.watchfolder and job.watchfolder.archive_path:
+            self._archive_original_file(job)
+        ensure_shared_file(job.output_path)
+        job.completed_at = datetime.utcnow()
+        db_session.commit()
+
+    def _record_content_hash(self, job):
+        """Impronta e hash completo del sorgente, per riconoscere i duplicati futuri."""
+        try:
+            if not job.input_fingerprint:
+                job.input_fingerprint = content_fingerprint.sampled_fingerprint(job.input_path)
+            if not job.input_hash:
+                job.input_hash = content_fingerprint.full_hash(job.input_path)
+        except OSError as e:
+            logger.warning("Hash sorgente non calcolabile per %s: %s", job.input_path, e)
+
+    def _build_ffmpeg_command(self, job, output_path=None, input_path=None):
+        """
+        Costruisce comando FFmpeg per transcodifica. input_path/output_path
+        (copia su scratch, temporaneo) sostituiscono quelli del job.
+        """
         preset = job.preset
+        input_path = input_path or job.input_path
         
-        cmd = ['ffmpeg', '-i', job.input_path]
+        cmd = ['ffmpeg', '-i', input_path]
         
         # Video codec e bitrate
         cmd.extend(['-c:v', preset.video_codec])
@@ -344,7 +999,7 @@ class TranscoderWorker:
 
         # Preset speciali: burn-in timecode sorgente
         if preset_name in ("H264_LOWRES_TC", "H264_LOWRES_TC_WTMK"):
-            drawtext_tc = self._build_timecode_drawtext(job.input_path)
+            drawtext_tc = self._build_timecode_drawtext(input_path)
             extra_params = self._inject_drawtext_into_params(
                 extra_params,
                 drawtext_tc,
@@ -366,7 +1021,7 @@ class TranscoderWorker:
             cmd.extend(extra_params)
         
         # Output
-        cmd.extend(['-y', job.output_path])
+        cmd.extend(['-y', output_path or job.output_path])
         
         return cmd
 
@@ -600,8 +1255,11 @@ class TranscoderWorker:
         except Exception:
             return None
     
-    def _monitor_progress(self, process, job_id):
-        """Monitora progresso transcodifica"""
+    def _monitor_progress(self, process, job_id, encode=None):
+        """
+        Monitora progresso transcodifica. Ritorna True se FFmpeg è stato sospeso
+        (SIGSTOP) per una pausa: il processo resta vivo e fermo.
+        """
         db_session = self.db_session_factory()
         try:
             job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
@@ -617,14 +1275,23 @@ class TranscoderWorker:
             
             # Pattern per estrarre tempo da FFmpeg stderr
             time_pattern = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
+            # Ripresa da checkpoint: FFmpeg conta il tempo dal punto di -ss
+            offset = (encode.seek_sec or 0) if encode else 0
             
             while process.poll() is None:
                 # Verifica richiesta annullamento
                 db_session.expire_all()
                 job = db_session.query(TranscodeJob).filter(TranscodeJob.id == job_id).first()
+                if job and job.status == FileStatus.PAUSED and encode and job_suspend.suspend_enabled():
+                    process.send_signal(signal.SIGSTOP)
+                    return True
                 if job and job.status in (FileStatus.CANCELLED, FileStatus.PAUSED):
                     process.terminate()
                     break
+                if job and job.lease_owner != self.lease_owner:
+                    logger.warning("Lease del job %s persa, FFmpeg terminato", job_id)
+                    process.terminate()
+                    break
                 # Leggi stderr (FFmpeg usa stderr per output)
                 line = process.stderr.readline()
                 if not line:
@@ -633,12 +1300,15 @@ class TranscoderWorker:
                 
                 # Estrai tempo corrente
                 match = time_pattern.search(line)
-                if match and job.input_duration:
+                if match:
                     hours = int(match.group(1))
                     minutes = int(match.group(2))
                     seconds = float(match.group(3))
-                    current_time = hours * 3600 + minutes * 60 + seconds
-                    
+                    current_time = hours * 3600 + minutes * 60 + seconds + offset
+                    if encode:
+                        encode.progress_sec = current_time
+                
+                if match and job.input_duration:
                     progress = int((current_time / job.input_duration) * 100)
                     progress = min(100, max(0, progress))
                     
@@ -651,6 +1321,7 @@ class TranscoderWorker:
             print(f"Errore monitoraggio progresso: {str(e)}")
         finally:
             db_session.close()
+        return False
     
     def _get_mediainfo(self, file_path: str) -> str | None:
         """Esegue mediainfo sul file e restituisce output testuale (formato leggibile)."""
@@ -696,6 +1367,9 @@ class TranscoderWorker:
             archive_path = job.watchfolder.archive_path
             if not archive_path:
                 return
+            if job.watchfolder.recursive:
+                # Watchfolder ricorsivo: mantiene la sottocartella di origine
+                archive_path = mirrored_directory(archive_path, job.watchfolder.path, job.input_path)
             
             # Crea directory archivio se non esiste
             if not os.path.exists(archive_path):
@@ -711,19 +1385,12 @@ class TranscoderWorker:
                 print(f"File originale non trovato per archiviazione: {job.input_path}")
                 return
             
-            # Costruisci percorso destinazione
-            original_filename = os.path.basename(job.input_path)
-            destination_path = os.path.join(archive_path, original_filename)
-            
-            # Se file già esiste, aggiungi timestamp
-            if os.path.exists(destination_path):
-                base_name, ext = os.path.splitext(original_filename)
-                timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                destination_path = os.path.join(archive_path, f"{base_name}_{timestamp}{ext}")
-            
-            # Sposta file
-            shutil.move(job.input_path, destination_path)
-            print(f"File originale archiviato: {job.input_path} -> {destination_path}")
+            # Stesso filesystem: rename; altrimenti copia verificata in background
+            destination_path, moved = archive_file(job.input_path, archive_path, self.archiver)
+            if moved:
+                print(f"File originale archiviato: {job.input_path} -> {destination_path}")
+            else:
+                print(f"Archiviazione in background: {job.input_path} -> {destination_path}")
             
         except Exception as e:
             print(f"Errore archiviazione file originale {job.input_path}: {str(e)}")
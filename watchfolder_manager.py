@@ -1,117 +1,315 @@
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from sqlalchemy.orm import Session
-from models import WatchFolder, TranscodeJob, FileStatus
-from ftp_utils import VIDEO_EXTENSIONS
-from path_utils import ensure_shared_directory
+from models import WatchFolder, TranscodeJob, FileStatus, WATCH_BACKEND_POLLING
+from file_stability import DEFAULT_QUIET_PERIOD, STABILITY_CHECK_SEC, StabilityTracker
+from job_enqueue import build_output_filename, enqueue_jobs
+from job_intake import JobIntake
+from polling_observer import DEFAULT_POLL_INTERVAL, ScandirPollingObserver
+from local_scan import WATCH_RESCAN_SEC, WATCH_SCAN_WORKERS, batches, find_unknown_files
+from ftp_utils import VIDEO_EXTENSIONS, is_remote_watch_type
+from path_utils import PARTIAL_PREFIX, ensure_shared_directory, mirrored_directory
+from progress_writer import CoalescingProgressWriter
 from datetime import datetime
 
 class WatchFolderHandler(FileSystemEventHandler):
-    def __init__(self, watchfolder_id, db_session_factory):
+    def __init__(
+        self,
+        watchfolder_id,
+        db_session_factory,
+        quiet_period=DEFAULT_QUIET_PERIOD,
+        path=None,
+        rescan_interval=WATCH_RESCAN_SEC,
+        recursive=False,
+        intake=None,
+    ):
         self.watchfolder_id = watchfolder_id
         self.db_session_factory = db_session_factory
         self.allowed_extensions = list(VIDEO_EXTENSIONS)
-    
+        self.path = path
+        self.rescan_interval = rescan_interval
+        self.recursive = recursive
+        # Gli eventi watchdog registrano solo il candidato: i controlli size/mtime
+        # li esegue il WatchFolderManager (StabilityTracker.check), la creazione
+        # dei job il pool condiviso JobIntake (o direttamente acquire se assente)
+        self.stability = StabilityTracker(self._on_file_stable, quiet_period=quiet_period)
+        self.intake = intake
+        self._enqueued = {}  # path -> (size, mtime) dei file già acquisiti
+        self._enqueue_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_scan = None  # time.monotonic() dell'ultima riconciliazione
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def rescan_due(self, now):
+        """True se serve la riconciliazione iniziale o un rescan periodico."""
+        if not self.path or self.stopped:
+            return False
+        if self.last_scan is None:
+            return True
+        return bool(self.rescan_interval) and now - self.last_scan >= self.rescan_interval
+
+    def reconcile(self):
+        """
+        Acquisisce i file presenti nella cartella che non hanno ancora un job
+        (arrivati a servizio fermo o prima dell'attivazione). Ritorna i file trovati.
+        """
+        self.last_scan = time.monotonic()
+        db_session = self.db_session_factory()
+        try:
+            unknown = find_unknown_files(
+                db_session, self.watchfolder_id, self.path, self.allowed_extensions, self.recursive
+            )
+        finally:
+            db_session.close()
+
+        now = time.time()
+        for batch in batches(unknown):
+            if self.stopped:
+                break
+            ready = []
+            for _, file_path, size, mtime in batch:
+                if size and now - mtime >= self.stability.quiet_period:
+                    ready.append((file_path, size, mtime))
+                else:
+                    # Copia forse ancora in corso: decide il tracker
+                    self.stability.touch(file_path)
+            self._submit(ready)
+            # Cede il GIL agli altri watchfolder tra un batch e l'altro
+            time.sleep(0)
+        if unknown:
+            print(f"Watchfolder {self.watchfolder_id}: riconciliati {len(unknown)} file senza job")
+        return len(unknown)
+
+    def _is_video(self, file_path):
+        if os.path.basename(file_path).startswith(PARTIAL_PREFIX):
+            return False
+        return os.path.splitext(file_path)[1].lower() in self.allowed_extensions
+
+    def _track(self, file_path):
+        if self._is_video(file_path):
+            self.stability.touch(file_path)
+
     def on_created(self, event):
         if not event.is_directory:
-            file_path = event.src_path
-            file_ext = os.path.splitext(file_path)[1].lower()
-            
-            if file_ext in self.allowed_extensions:
-                self.process_file(file_path)
-    
-    def process_file(self, file_path):
-        """Crea job di transcodifica per il file rilevato"""
+            self._track(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._track(event.src_path)
+
+    def on_closed(self, event):
+        # Close-write (solo inotify): il quiet period riparte dalla chiusura
+        if not event.is_directory:
+            self._track(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self.stability.discard(event.src_path)
+        self._enqueued.pop(event.src_path, None)
+        self._track(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.stability.discard(event.src_path)
+            self._enqueued.pop(event.src_path, None)
+
+    def _on_file_stable(self, file_path, size, mtime):
+        self._submit([(file_path, size, mtime)])
+
+    def _submit(self, files):
+        # Eventi di soli metadati (chmod, touch senza scrittura) non riacquisiscono il file
+        with self._enqueue_lock:
+            files = [f for f in files if self._enqueued.get(f[0]) != (f[1], f[2])]
+        if not files:
+            return
+        if self.intake is not None:
+            self.intake.submit(self, files)
+        else:
+            self.acquire(files)
+
+    def acquire(self, files):
+        """Crea i job per [(path, size, mtime)] e registra i file acquisiti."""
+        if self.stopped:
+            return
+        acquired = self.process_files([path for path, _, _ in files])
+        with self._enqueue_lock:
+            for path, size, mtime in files:
+                if path in acquired:
+                    self._enqueued[path] = (size, mtime)
+
+    def process_files(self, file_paths):
+        """
+        Crea i job di transcodifica per i file rilevati (già stabili) in una sola
+        transazione. Ritorna l'insieme dei path acquisiti (job creato o già attivo).
+        """
+        acquired = set()
         db_session = self.db_session_factory()
         try:
-            # Verifica che il file esista e non sia in fase di scrittura
-            if not os.path.exists(file_path):
-                return
-            
-            # Attendi che il file sia completamente scritto
-            time.sleep(2)
-            
-            # Verifica dimensione file
-            try:
-                file_size = os.path.getsize(file_path)
-            except OSError as e:
-                print(f"Errore accesso file {file_path}: {str(e)}")
-                return
-            
-            if file_size == 0:
-                return
-            
-            # Verifica permessi lettura
-            if not os.access(file_path, os.R_OK):
-                print(f"Permessi insufficienti per file {file_path}")
-                return
-            
             # Recupera watchfolder
             watchfolder = db_session.query(WatchFolder).filter(
                 WatchFolder.id == self.watchfolder_id
             ).first()
             
             if not watchfolder or not watchfolder.active:
-                return
-            
-            # Verifica se job già esistente per questo file
-            existing = db_session.query(TranscodeJob).filter(
-                TranscodeJob.input_path == file_path,
-                TranscodeJob.status.in_([FileStatus.PENDING, FileStatus.PROCESSING, FileStatus.PAUSED])
-            ).first()
-            
-            if existing:
-                return
-            
-            # Crea output path
-            output_dir = watchfolder.output_path if watchfolder.output_path else os.path.dirname(file_path)
-            
-            # Verifica/crea directory output
-            if not os.path.exists(output_dir):
+                return acquired
+
+            output_dirs_ok = {}  # output_dir -> bool (verificata una volta per blocco)
+            rows = []
+
+            for file_path in dict.fromkeys(file_paths):
+                # Verifica dimensione file
                 try:
-                    ensure_shared_directory(output_dir)
+                    file_size = os.path.getsize(file_path)
                 except OSError as e:
-                    print(f"Errore creazione directory output {output_dir}: {str(e)}")
-                    return
-            
-            # Verifica permessi scrittura directory output
-            if not os.access(output_dir, os.W_OK):
-                print(f"Permessi insufficienti per scrivere in {output_dir}")
-                return
-            
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            container = watchfolder.preset.container if watchfolder.preset else 'mxf'
-            preset_name = watchfolder.preset.name.lower().replace(' ', '_') if watchfolder.preset else 'default'
-            output_filename = f"{base_name}_{preset_name}.{container}"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            # Crea job
-            job = TranscodeJob(
-                watchfolder_id=self.watchfolder_id,
-                preset_id=watchfolder.preset_id,
-                input_filename=os.path.basename(file_path),
-                input_path=file_path,
-                output_path=output_path,
-                status=FileStatus.PENDING,
-                input_size=file_size
-            )
-            
-            db_session.add(job)
-            db_session.commit()
+                    print(f"Errore accesso file {file_path}: {str(e)}")
+                    continue
+                
+                if file_size == 0:
+                    continue
+                
+                # Verifica permessi lettura
+                if not os.access(file_path, os.R_OK):
+                    print(f"Permessi insufficienti per file {file_path}")
+                    continue
+                
+                # Crea output path (watchfolder ricorsivo: stessa sottocartella sotto output_path)
+                if watchfolder.output_path:
+                    output_dir = watchfolder.output_path
+                    if watchfolder.recursive:
+                        output_dir = mirrored_directory(output_dir, watchfolder.path, file_path)
+                else:
+                    output_dir = os.path.dirname(file_path)
+
+                if output_dir not in output_dirs_ok:
+                    output_dirs_ok[output_dir] = self._prepare_output_dir(output_dir)
+                if not output_dirs_ok[output_dir]:
+                    continue
+                
+                input_filename = os.path.basename(file_path)
+                rows.append({
+                    'watchfolder_id': self.watchfolder_id,
+                    'preset_id': watchfolder.preset_id,
+                    'input_filename': input_filename,
+                    'input_path': file_path,
+                    'output_path': os.path.join(
+                        output_dir, build_output_filename(watchfolder.preset, input_filename)
+                    ),
+                    'input_size': file_size,
+                })
+
+            # Dedup contro i job attivi e inserimento in una sola transazione
+            inserted, existing = enqueue_jobs(db_session, rows)
+            acquired.update(existing)
+            acquired.update(row['input_path'] for row in inserted)
+            return acquired
             
         except Exception as e:
             db_session.rollback()
-            print(f"Errore processando file {file_path}: {str(e)}")
+            print(f"Errore creazione job watchfolder {self.watchfolder_id}: {str(e)}")
+            return set()
         finally:
             db_session.close()
 
+    def _prepare_output_dir(self, output_dir):
+        # Verifica/crea directory output
+        if not os.path.exists(output_dir):
+            try:
+                ensure_shared_directory(output_dir)
+            except OSError as e:
+                print(f"Errore creazione directory output {output_dir}: {str(e)}")
+                return False
+        
+        # Verifica permessi scrittura directory output
+        if not os.access(output_dir, os.W_OK):
+            print(f"Permessi insufficienti per scrivere in {output_dir}")
+            return False
+        return True
+
 class WatchFolderManager:
+    """
+    Un solo Observer watchdog (e un solo observer a polling) per tutti i watchfolder
+    locali, un thread di manutenzione per stabilità file e riconciliazioni, un pool
+    limitato (JobIntake) che crea i job a blocchi. I watchfolder FTP restano su FTPWatcher.
+    """
+
     def __init__(self, db_session_factory):
         self.db_session_factory = db_session_factory
-        self.observers = {}  # watchfolder_id -> Observer (per local)
+        self.watches = {}  # watchfolder_id -> (observer, watch) (per local)
+        self.handlers = {}  # watchfolder_id -> WatchFolderHandler (per local)
         self.ftp_watchers = {}  # watchfolder_id -> FTPWatcher (per FTP)
+        self.progress_writer = CoalescingProgressWriter(db_session_factory)
+        self.intake = JobIntake()
+        self._native_observer = None
+        self._polling_observer = None
+        self._scan_pool = None  # creato da _ensure_local_services, chiuso da stop_all
+        self._scanning = set()  # watchfolder_id con riconciliazione in corso
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._maintenance = None
+
+    def _ensure_local_services(self):
+        """Avvia (una volta) observer condivisi, pool job e thread di manutenzione."""
+        with self._lock:
+            if self._native_observer is None:
+                self._native_observer = Observer()
+                self._native_observer.start()
+            if self._polling_observer is None:
+                self._polling_observer = ScandirPollingObserver()
+                self._polling_observer.start()
+            if self._scan_pool is None:
+                self._scan_pool = ThreadPoolExecutor(max_workers=WATCH_SCAN_WORKERS, thread_name_prefix='WatchScan')
+            self.intake.start()
+            if self._maintenance is None:
+                self._stop.clear()
+                self._maintenance = threading.Thread(target=self._maintenance_loop, daemon=True)
+                self._maintenance.start()
+
+    def _maintenance_loop(self):
+        while not self._stop.wait(STABILITY_CHECK_SEC):
+            now = time.monotonic()
+            for watchfolder_id, handler in list(self.handlers.items()):
+                try:
+                    handler.stability.check()
+                except Exception as e:
+                    print(f"Errore controllo stabilità watchfolder {watchfolder_id}: {str(e)}")
+                if handler.rescan_due(now):
+                    self._schedule_reconcile(watchfolder_id, handler)
+
+    def _schedule_reconcile(self, watchfolder_id, handler):
+        with self._lock:
+            if watchfolder_id in self._scanning or self._scan_pool is None:
+                return
+            self._scanning.add(watchfolder_id)
+            # Segna subito la scansione per non riaccodarla al prossimo giro
+            handler.last_scan = time.monotonic()
+            scan_pool = self._scan_pool
+
+        def run():
+            try:
+                handler.reconcile()
+            except Exception as e:
+                print(f"Errore scansione watchfolder {watchfolder_id}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._scanning.discard(watchfolder_id)
+
+        try:
+            scan_pool.submit(run)
+        except RuntimeError:
+            # Pool chiuso da stop_all nel frattempo
+            with self._lock:
+                self._scanning.discard(watchfolder_id)
     
     def start_watchfolder(self, watchfolder_id):
         """Avvia monitoraggio watchfolder"""
@@ -126,13 +324,10 @@ class WatchFolderManager:
             
             watch_type = watchfolder.watch_type or 'local'
             
-            if watch_type == 'ftp':
-                # Ferma eventuale observer locale (es. switch da local a ftp)
-                if watchfolder_id in self.observers:
-                    observer = self.observers[watchfolder_id]
-                    observer.stop()
-                    observer.join()
-                    del self.observers[watchfolder_id]
+            if is_remote_watch_type(watch_type):
+                # Ferma eventuale observer locale (es. switch da local a ftp/sftp)
+                if watchfolder_id in self.watches:
+                    self._stop_local_watch(watchfolder_id)
                 # Avvia watcher FTP
                 if watchfolder_id in self.ftp_watchers:
                     return  # Già attivo
@@ -144,7 +339,9 @@ class WatchFolderManager:
                     return
                 
                 from ftp_watcher import FTPWatcher
-                ftp_watcher = FTPWatcher(watchfolder_id, self.db_session_factory)
+                ftp_watcher = FTPWatcher(
+                    watchfolder_id, self.db_session_factory, self.progress_writer
+                )
                 ftp_watcher.start()
                 self.ftp_watchers[watchfolder_id] = ftp_watcher
                 
@@ -155,7 +352,7 @@ class WatchFolderManager:
                     ftp_watcher.stop()
                     del self.ftp_watchers[watchfolder_id]
                 # Avvia watcher locale
-                if watchfolder_id in self.observers:
+                if watchfolder_id in self.watches:
                     return  # Già attivo
                 
                 if not os.path.exists(watchfolder.path):
@@ -163,13 +360,31 @@ class WatchFolderManager:
                     db_session.commit()
                     return
                 
-                # Crea handler e observer
-                handler = WatchFolderHandler(watchfolder_id, self.db_session_factory)
-                observer = Observer()
-                observer.schedule(handler, watchfolder.path, recursive=False)
-                observer.start()
+                self._ensure_local_services()
+                # Crea handler e watch sull'observer condiviso
+                handler = WatchFolderHandler(
+                    watchfolder_id,
+                    self.db_session_factory,
+                    quiet_period=watchfolder.quiet_period or DEFAULT_QUIET_PERIOD,
+                    path=watchfolder.path,
+                    recursive=bool(watchfolder.recursive),
+                    intake=self.intake,
+                )
+                recursive = bool(watchfolder.recursive)
+                if watchfolder.watch_backend == WATCH_BACKEND_POLLING:
+                    observer = self._polling_observer
+                    watch = observer.schedule(
+                        handler,
+                        watchfolder.path,
+                        recursive=recursive,
+                        interval=watchfolder.poll_interval or DEFAULT_POLL_INTERVAL,
+                    )
+                else:
+                    observer = self._native_observer
+                    watch = observer.schedule(handler, watchfolder.path, recursive=recursive)
                 
-                self.observers[watchfolder_id] = observer
+                self.watches[watchfolder_id] = (observer, watch)
+                self.handlers[watchfolder_id] = handler
                 watchfolder.status = 'monitoring'
                 db_session.commit()
             
@@ -181,14 +396,23 @@ class WatchFolderManager:
         finally:
             db_session.close()
     
+    def _stop_local_watch(self, watchfolder_id):
+        observer, watch = self.watches.pop(watchfolder_id)
+        handler = self.handlers.pop(watchfolder_id, None)
+        # Stesso path e recursive: watchdog condivide l'ObservedWatch tra watchfolder,
+        # si toglie solo questo handler e il watch cade con l'ultimo
+        if handler:
+            observer.remove_handler_for_watch(handler, watch)
+        if not any(other == (observer, watch) for other in self.watches.values()):
+            observer.unschedule(watch)
+        if handler:
+            handler.stop()
+
     def stop_watchfolder(self, watchfolder_id):
         """Ferma monitoraggio watchfolder"""
         # Ferma watcher locale se presente
-        if watchfolder_id in self.observers:
-            observer = self.observers[watchfolder_id]
-            observer.stop()
-            observer.join()
-            del self.observers[watchfolder_id]
+        if watchfolder_id in self.watches:
+            self._stop_local_watch(watchfolder_id)
         
         # Ferma watcher FTP se presente
         if watchfolder_id in self.ftp_watchers:
@@ -214,8 +438,22 @@ class WatchFolderManager:
 
     def stop_all(self):
         """Ferma tutti i watchfolder"""
-        for watchfolder_id in list(self.observers.keys()):
+        for watchfolder_id in list(self.watches.keys()):
             self.stop_watchfolder(watchfolder_id)
         for watchfolder_id in list(self.ftp_watchers.keys()):
             self.stop_watchfolder(watchfolder_id)
+        self._stop.set()
+        with self._lock:
+            for observer in (self._native_observer, self._polling_observer):
+                if observer is not None:
+                    observer.stop()
+                    observer.join()
+            self._native_observer = None
+            self._polling_observer = None
+            self._maintenance = None
+            scan_pool, self._scan_pool = self._scan_pool, None
+        self.intake.stop()
+        if scan_pool is not None:
+            scan_pool.shutdown(wait=False)
+        self.progress_writer.flush()
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Worker headless: esegue i job della coda condivisa senza interfaccia web né
+watchfolder, per aggiungere nodi di codifica allo stesso database (DB_PATH).
+I job sono assegnati con lease (job_lease): se il nodo muore la lease scade e
+un altro processo rimette in coda il job.
+
+Uso:
+  source .venv/bin/activate
+  python worker_node.py --name encode-02 --slots 2
+
+Il nodo usa (o crea) il Worker con il nome indicato; --slots ne imposta i job
+concorrenti. Primo SIGINT/SIGTERM: non prende nuovi job e attende quelli in
+corso; secondo: esce subito (le lease scadono e i job tornano in coda).
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from job_lease import NODE_NAME  # noqa: E402
+from models import Base, Worker  # noqa: E402
+from path_utils import configure_shared_umask  # noqa: E402
+from transcoder_worker import TranscoderWorker  # noqa: E402
+
+logger = logging.getLogger('XDCAMTranscoder.Node')
+
+DB_PATH = os.getenv('DB_PATH', 'xdcam_transcoder.db')
+# Più processi sullo stesso file SQLite: attesa del lock in scrittura invece dell'errore immediato
+DB_LOCK_TIMEOUT_SEC = 30
+
+
+def build_session_factory(db_path=DB_PATH):
+    engine = create_engine(
+        f'sqlite:///{db_path}', echo=False, connect_args={'timeout': DB_LOCK_TIMEOUT_SEC}
+    )
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def register_worker(session_factory, name, slots=None):
+    """Worker del nodo per nome, creato se assente. Ritorna l'id."""
+    session = session_factory()
+    try:
+        worker = session.query(Worker).filter(Worker.name == name).first()
+        if not worker:
+            worker = Worker(name=name, active=1, max_concurrent_jobs=slots or 1)
+            session.add(worker)
+        elif slots:
+            worker.max_concurrent_jobs = slots
+        # Il processo web non deve avviare questo worker
+        worker.node_name = name
+        session.commit()
+        return worker.id
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--name', default=NODE_NAME, help='Nome del Worker (default NODE_NAME/hostname)')
+    parser.add_argument('--slots', type=int, help='Job concorrenti del nodo')
+    parser.add_argument('--db', default=DB_PATH, help='Database condiviso (default DB_PATH)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    configure_shared_umask()
+
+    session_factory = build_session_factory(args.db)
+    worker_id = register_worker(session_factory, args.name, args.slots)
+    transcoder = TranscoderWorker(session_factory)
+    # Job di un'esecuzione precedente di questo nodo terminata durante la codifica
+    transcoder.recover_orphaned_jobs()
+    # Sorgenti che il mover di questo nodo non aveva finito di archiviare
+    transcoder.resubmit_pending_archives()
+
+    stopping = threading.Event()
+
+    def _on_signal(signum, frame):
+        if stopping.is_set():
+            logger.warning("Uscita immediata: i job in corso torneranno in coda alla scadenza delle lease")
+            os._exit(1)
+        logger.info("Arresto: nessun nuovo job, attendo quelli in corso (di nuovo per uscire subito)")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, _on_signal)
+    signal.signal(signal.SIGTERM, _on_signal)
+
+    transcoder.start_worker(worker_id)
+    logger.info("Nodo %s avviato (worker %s, lease %s)", args.name, worker_id, transcoder.lease_owner)
+    while not stopping.wait(1):
+        continue
+
+    transcoder.stop_worker(worker_id)
+    for thread in transcoder.worker_threads.get(worker_id, []):
+        thread.join()
+    transcoder.lease_keeper.stop()
+    # Spostamenti in background (archivio, output su altro device) completati prima di uscire
+    transcoder.archiver.stop(wait=True)
+    transcoder.publisher.stop(wait=True)
+    transcoder.stager.shutdown()
+    transcoder.prefetcher.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())